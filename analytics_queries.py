@@ -0,0 +1,363 @@
+"""
+Consultas de analytics servidas desde los acumulados.
+
+Los días cerrados se leen de daily_metrics, hourly_channel_metrics y
+product_sales_metrics. Solo el día en curso se agrega al vuelo desde
+orders/order_items. Las respuestas se cachean por (tenant, rango, bucket);
+al confirmarse un cambio en los acumulados de un restaurante (ver
+ROLLUPS_CHANGED_KEY en analytics_rollups) se descartan las suyas.
+"""
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from analytics_rollups import ROLLUP_ORDER_FILTER, ROLLUPS_CHANGED_KEY, hour_slot, metric_day, metric_hour
+from models.analytics_models import DailyMetric, HourlyChannelMetric, ProductSalesMetric
+from models.inventory_models import Product
+from models.sales_models import Order, OrderItem
+
+BUCKETS = ("hour", "day", "week", "month")
+
+# Rangos que incluyen hoy cambian con cada venta; los pasados casi nunca.
+CACHE_TTL_LIVE_SECONDS = 15
+CACHE_TTL_CLOSED_SECONDS = 300
+CACHE_MAX_ENTRIES = 512
+
+_cache_lock = threading.Lock()
+_cache = {}
+
+
+def _cache_get(key):
+    with _cache_lock:
+        hit = _cache.get(key)
+        if not hit:
+            return None
+        expires_at, payload = hit
+        if expires_at < time.monotonic():
+            _cache.pop(key, None)
+            return None
+        return payload
+
+
+def _cache_set(key, payload, ttl: float) -> None:
+    with _cache_lock:
+        if len(_cache) >= CACHE_MAX_ENTRIES:
+            oldest = min(_cache, key=lambda k: _cache[k][0])
+            _cache.pop(oldest, None)
+        _cache[key] = (time.monotonic() + ttl, payload)
+
+
+def clear_cache(restaurant_id: Optional[int] = None) -> None:
+    with _cache_lock:
+        if restaurant_id is None:
+            _cache.clear()
+            return
+        for key in [k for k in _cache if k[0] == restaurant_id]:
+            _cache.pop(key, None)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    # apply/revert_order_rollup y reaggregate anotan qué restaurantes tocaron
+    if session.in_nested_transaction():
+        return
+    for restaurant_id in session.info.pop(ROLLUPS_CHANGED_KEY, ()):
+        clear_cache(restaurant_id)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(ROLLUPS_CHANGED_KEY, None)
+
+
+def bucket_start(value: datetime, bucket: str) -> datetime:
+    if bucket == "hour":
+        return metric_hour(value)
+    day = metric_day(value)
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _money(value) -> float:
+    return round(float(value or 0), 2)
+
+
+class _Acc:
+    def __init__(self):
+        self.sales = Decimal("0")
+        self.orders = 0
+
+    def add(self, sales, orders) -> None:
+        self.sales += Decimal(str(sales or 0))
+        self.orders += int(orders or 0)
+
+    def as_dict(self) -> dict:
+        return {
+            "sales": _money(self.sales),
+            "orders": self.orders,
+            "average_ticket": _money(self.sales / self.orders) if self.orders else 0.0,
+        }
+
+
+# =========================
+# LECTURA DE ACUMULADOS
+# =========================
+
+def _read_rollups(db: Session, restaurant_id: int, start: datetime, end: datetime, bucket: str, data: dict) -> None:
+    if end <= start:
+        return
+
+    if bucket == "hour":
+        rows = (
+            db.query(
+                HourlyChannelMetric.metric_hour,
+                func.sum(HourlyChannelMetric.total_sales),
+                func.sum(HourlyChannelMetric.total_orders),
+            )
+            .filter(
+                HourlyChannelMetric.restaurant_id == restaurant_id,
+                HourlyChannelMetric.metric_hour >= start,
+                HourlyChannelMetric.metric_hour < end,
+            )
+            .group_by(HourlyChannelMetric.metric_hour)
+            .all()
+        )
+        for hour, sales, orders in rows:
+            data["series"][bucket_start(hour, bucket)].add(sales, orders)
+
+    daily_rows = (
+        db.query(DailyMetric.date, DailyMetric.total_sales, DailyMetric.total_orders)
+        .filter(
+            DailyMetric.restaurant_id == restaurant_id,
+            DailyMetric.date >= start,
+            DailyMetric.date < end,
+        )
+        .all()
+    )
+    for day, sales, orders in daily_rows:
+        data["totals"].add(sales, orders)
+        if bucket != "hour":
+            data["series"][bucket_start(day, bucket)].add(sales, orders)
+
+    # mezcla de canales y mapa día x hora salen de la misma pasada agrupada
+    slot_rows = (
+        db.query(
+            HourlyChannelMetric.weekday,
+            HourlyChannelMetric.hour_of_day,
+            HourlyChannelMetric.channel,
+            func.sum(HourlyChannelMetric.total_sales),
+            func.sum(HourlyChannelMetric.total_orders),
+        )
+        .filter(
+            HourlyChannelMetric.restaurant_id == restaurant_id,
+            HourlyChannelMetric.metric_hour >= start,
+            HourlyChannelMetric.metric_hour < end,
+        )
+        .group_by(HourlyChannelMetric.weekday, HourlyChannelMetric.hour_of_day, HourlyChannelMetric.channel)
+        .all()
+    )
+    for weekday, hour, channel, sales, orders in slot_rows:
+        data["channels"][channel or "local"].add(sales, orders)
+        data["heatmap"][(int(weekday or 0), int(hour or 0))].add(sales, orders)
+
+    product_rows = (
+        db.query(
+            ProductSalesMetric.product_id,
+            func.sum(ProductSalesMetric.quantity_sold),
+            func.sum(ProductSalesMetric.total_revenue),
+        )
+        .filter(
+            ProductSalesMetric.restaurant_id == restaurant_id,
+            ProductSalesMetric.metric_date >= start,
+            ProductSalesMetric.metric_date < end,
+        )
+        .group_by(ProductSalesMetric.product_id)
+        .all()
+    )
+    for product_id, qty, revenue in product_rows:
+        row = data["products"][product_id]
+        row["quantity"] += Decimal(str(qty or 0))
+        row["revenue"] += Decimal(str(revenue or 0))
+
+
+def _fill_product_names(db: Session, restaurant_id: int, rows: list) -> None:
+    # solo se resuelven los nombres de los productos que salen en la respuesta
+    missing = {r["product_id"] for r in rows if not r["name"]}
+    if not missing:
+        return
+
+    names = dict(
+        db.query(Product.id, Product.name)
+        .filter(Product.restaurant_id == restaurant_id, Product.id.in_(missing))
+        .all()
+    )
+    gone = missing - set(names)
+    if gone:
+        names.update(
+            db.query(ProductSalesMetric.product_id, func.max(ProductSalesMetric.product_name))
+            .filter(
+                ProductSalesMetric.restaurant_id == restaurant_id,
+                ProductSalesMetric.product_id.in_(gone),
+            )
+            .group_by(ProductSalesMetric.product_id)
+            .all()
+        )
+
+    for r in rows:
+        if not r["name"]:
+            r["name"] = names.get(r["product_id"]) or ""
+
+
+def _read_live_day(db: Session, restaurant_id: int, day: datetime, bucket: str, data: dict) -> None:
+    orders = (
+        db.query(Order.id, Order.channel, Order.total, Order.created_at)
+        .filter(
+            Order.restaurant_id == restaurant_id,
+            Order.created_at >= day,
+            Order.created_at < day + timedelta(days=1),
+            ROLLUP_ORDER_FILTER,
+        )
+        .all()
+    )
+    if not orders:
+        return
+
+    for _, channel, total, created_at in orders:
+        hour = metric_hour(created_at or day)
+        data["totals"].add(total, 1)
+        data["series"][bucket_start(hour, bucket)].add(total, 1)
+        data["channels"][(channel or "local").strip().lower()].add(total, 1)
+        slot = hour_slot(hour)
+        data["heatmap"][(slot["weekday"], slot["hour_of_day"])].add(total, 1)
+
+    items = (
+        db.query(
+            OrderItem.product_id,
+            func.max(OrderItem.product_name_snapshot),
+            func.sum(OrderItem.quantity),
+            func.sum(OrderItem.total_price),
+        )
+        .filter(
+            OrderItem.order_id.in_([o[0] for o in orders]),
+            OrderItem.voided == False,  # noqa: E712
+        )
+        .group_by(OrderItem.product_id)
+        .all()
+    )
+    for product_id, name, qty, revenue in items:
+        row = data["products"][product_id or 0]
+        row["name"] = row["name"] or (name or "")
+        row["quantity"] += Decimal(str(qty or 0))
+        row["revenue"] += Decimal(str(revenue or 0))
+
+
+# =========================
+# API
+# =========================
+
+def query_analytics(
+    db: Session,
+    restaurant_id: int,
+    date_from: date,
+    date_to: date,
+    bucket: str = "day",
+    top: int = 5,
+    now: Optional[datetime] = None,
+) -> dict:
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket inválido: {bucket}")
+
+    today = metric_day(now or datetime.utcnow())
+    start = datetime(date_from.year, date_from.month, date_from.day)
+    end = datetime(date_to.year, date_to.month, date_to.day) + timedelta(days=1)
+    includes_today = start <= today < end
+
+    cache_key = (restaurant_id, date_from.isoformat(), date_to.isoformat(), bucket, int(top))
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return dict(cached, cached=True)
+
+    t0 = time.perf_counter()
+    data = {
+        "totals": _Acc(),
+        "series": defaultdict(_Acc),
+        "channels": defaultdict(_Acc),
+        "heatmap": defaultdict(_Acc),
+        "products": defaultdict(lambda: {"name": "", "quantity": Decimal("0"), "revenue": Decimal("0")}),
+    }
+
+    rollup_end = min(end, today) if includes_today else end
+    _read_rollups(db, restaurant_id, start, rollup_end, bucket, data)
+    if includes_today:
+        _read_live_day(db, restaurant_id, today, bucket, data)
+
+    totals = data["totals"].as_dict()
+    total_sales = data["totals"].sales
+
+    channel_mix = []
+    for channel, acc in sorted(data["channels"].items(), key=lambda kv: kv[1].sales, reverse=True):
+        row = acc.as_dict()
+        row["channel"] = channel
+        row["share"] = round(float(acc.sales / total_sales), 4) if total_sales else 0.0
+        channel_mix.append(row)
+
+    products = [
+        {
+            "product_id": pid,
+            "name": row["name"],
+            "quantity": round(float(row["quantity"]), 2),
+            "revenue": _money(row["revenue"]),
+        }
+        for pid, row in data["products"].items()
+        if row["quantity"] > 0
+    ]
+    products.sort(key=lambda p: (p["revenue"], p["quantity"]), reverse=True)
+    top_products = products[:top]
+    bottom_products = list(reversed(products[-top:])) if top else []
+    _fill_product_names(db, restaurant_id, top_products + bottom_products)
+
+    sales_matrix = [[0.0] * 24 for _ in range(7)]
+    orders_matrix = [[0] * 24 for _ in range(7)]
+    for (weekday, hour), acc in data["heatmap"].items():
+        sales_matrix[weekday][hour] = _money(acc.sales)
+        orders_matrix[weekday][hour] = acc.orders
+
+    series = []
+    for start_at in sorted(data["series"]):
+        row = data["series"][start_at].as_dict()
+        row["bucket_start"] = start_at.isoformat()
+        series.append(row)
+
+    payload = {
+        "range": {"date_from": date_from.isoformat(), "date_to": date_to.isoformat()},
+        "bucket": bucket,
+        "totals": totals,
+        "series": series,
+        "channel_mix": channel_mix,
+        "top_products": top_products,
+        "bottom_products": bottom_products,
+        "heatmap": {
+            "weekdays": ["dom", "lun", "mar", "mié", "jue", "vie", "sáb"],
+            "hours": list(range(24)),
+            "sales": sales_matrix,
+            "orders": orders_matrix,
+        },
+        "source": {
+            "rollups_until": (rollup_end - timedelta(days=1)).date().isoformat() if rollup_end > start else None,
+            "live_day": today.date().isoformat() if includes_today else None,
+        },
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000.0, 2),
+    }
+
+    _cache_set(cache_key, payload, CACHE_TTL_LIVE_SECONDS if includes_today else CACHE_TTL_CLOSED_SECONDS)
+    return dict(payload, cached=False)
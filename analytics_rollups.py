@@ -0,0 +1,510 @@
+"""
+Acumulados de analytics (daily_metrics, hourly_channel_metrics,
+product_sales_metrics, user_sales_metrics, driver_metrics).
+
+- apply_order_rollup(): se llama dentro de la misma transacción que marca una
+  orden como pagada o cerrada. Suma la orden a los acumulados del día una sola
+  vez (analytics_order_rollups guarda qué órdenes ya se sumaron).
+- revert_order_rollup(): resta la orden si luego se anula.
+- reaggregate(): recalcula un rango de fechas desde orders/order_items en
+  lotes, de forma idempotente. Incluye las órdenes ya archivadas
+  (order_archive.py).
+
+Cada escritura anota el restaurante en session.info[ROLLUPS_CHANGED_KEY];
+analytics_queries limpia su caché de esos restaurantes al hacer commit.
+
+Uso por consola:
+    python analytics_rollups.py --from 2026-01-01 --to 2026-01-31 [--restaurant deaca]
+"""
+import argparse
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Optional
+
+from sqlalchemy import and_, case, func, insert, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models.analytics_models import (
+    AnalyticsOrderRollup,
+    DailyMetric,
+    DriverMetric,
+    HourlyChannelMetric,
+    ProductSalesMetric,
+    UserSalesMetric,
+)
+from models.sales_models import Order, OrderItem
+from order_archive import SOURCES, order_join
+
+DEFAULT_BATCH_SIZE = 1000
+
+ROLLUPS_CHANGED_KEY = "analytics_rollups_changed"
+
+
+def rollup_order_filter(orders=Order):
+    """Una orden entra a analytics cuando está pagada o cerrada, y no anulada."""
+    return and_(
+        orders.status != "cancelled",
+        or_(orders.payment_status == "paid", orders.status == "closed"),
+    )
+
+
+ROLLUP_ORDER_FILTER = rollup_order_filter()
+
+
+def is_order_rollup_ready(order: Order) -> bool:
+    status = (order.status or "").lower()
+    if status == "cancelled":
+        return False
+    return (order.payment_status or "").lower() == "paid" or status == "closed"
+
+
+def metric_day(value: Optional[datetime]) -> datetime:
+    value = value or datetime.utcnow()
+    return datetime(value.year, value.month, value.day)
+
+
+def metric_hour(value: Optional[datetime]) -> datetime:
+    value = value or datetime.utcnow()
+    return datetime(value.year, value.month, value.day, value.hour)
+
+
+def hour_slot(hour: datetime) -> Dict[str, int]:
+    # weekday con 0 = domingo (mismo criterio que extract('dow') de Postgres)
+    return {"weekday": (hour.weekday() + 1) % 7, "hour_of_day": hour.hour}
+
+
+def _notes_meta(notes: str) -> Dict[str, str]:
+    # mismo formato "clave: valor | clave: valor" que parse_pipe_notes_meta
+    data: Dict[str, str] = {}
+    for raw in (notes or "").split("|"):
+        chunk = (raw or "").strip()
+        if not chunk or ":" not in chunk:
+            continue
+        key, value = chunk.split(":", 1)
+        data[key.strip().lower()] = value.strip()
+    return data
+
+
+def _dec(value) -> Decimal:
+    try:
+        return Decimal(str(value or 0))
+    except Exception:
+        return Decimal("0")
+
+
+# =========================
+# DELTAS POR ORDEN
+# =========================
+
+def build_order_deltas(order: Order, items) -> dict:
+    total = _dec(order.total)
+
+    products = {}
+    for it in items:
+        if bool(getattr(it, "voided", False)):
+            continue
+        key = it.product_id or 0
+        row = products.setdefault(key, {
+            "product_name": it.product_name_snapshot or "",
+            "quantity": Decimal("0"),
+            "revenue": Decimal("0"),
+        })
+        row["quantity"] += _dec(it.quantity)
+        row["revenue"] += _dec(it.total_price)
+
+    meta = _notes_meta(order.notes or "")
+    operator = (meta.get("operador") or "").strip()
+    driver = (meta.get("repartidor") or "").strip()
+
+    return {
+        "restaurant_id": order.restaurant_id,
+        "metric_date": metric_day(order.created_at),
+        "metric_hour": metric_hour(order.created_at),
+        "channel": (order.channel or "local").strip().lower(),
+        "total": total,
+        "products": products,
+        "operator": operator,
+        "driver": driver if (order.channel or "") == "delivery" else "",
+    }
+
+
+def _bump(db: Session, model, key: dict, deltas: dict, extra: dict = None) -> None:
+    """
+    UPDATE col = col + delta sobre la fila del acumulado. Si no existe la fila
+    se inserta; si otra transacción la insertó primero se reintenta el UPDATE.
+    """
+    filters = [getattr(model, k) == v for k, v in key.items()]
+    values = {
+        getattr(model, col): func.coalesce(getattr(model, col), 0) + delta
+        for col, delta in deltas.items()
+    }
+
+    if db.query(model).filter(*filters).update(values, synchronize_session=False):
+        return
+
+    try:
+        with db.begin_nested():
+            db.add(model(**key, **deltas, **(extra or {})))
+    except IntegrityError:
+        db.query(model).filter(*filters).update(values, synchronize_session=False)
+
+
+def _refresh_average_ticket(db: Session, restaurant_id: int, day: datetime) -> None:
+    db.query(DailyMetric).filter(
+        DailyMetric.restaurant_id == restaurant_id,
+        DailyMetric.date == day,
+    ).update(
+        {
+            DailyMetric.average_ticket: case(
+                (DailyMetric.total_orders > 0, DailyMetric.total_sales / DailyMetric.total_orders),
+                else_=0,
+            )
+        },
+        synchronize_session=False,
+    )
+
+
+def _mark_changed(db: Session, restaurant_id: Optional[int]) -> None:
+    # None = todos los restaurantes (reaggregate sin --restaurant)
+    db.info.setdefault(ROLLUPS_CHANGED_KEY, set()).add(restaurant_id)
+
+
+def _apply_deltas(db: Session, deltas: dict, sign: int) -> None:
+    rid = deltas["restaurant_id"]
+    _mark_changed(db, rid)
+    day = deltas["metric_date"]
+    total = deltas["total"] * sign
+
+    _bump(
+        db,
+        DailyMetric,
+        {"restaurant_id": rid, "date": day},
+        {"total_sales": total, "total_orders": sign},
+    )
+    _refresh_average_ticket(db, rid, day)
+
+    _bump(
+        db,
+        HourlyChannelMetric,
+        {"restaurant_id": rid, "metric_hour": deltas["metric_hour"], "channel": deltas["channel"]},
+        {"total_sales": total, "total_orders": sign},
+        hour_slot(deltas["metric_hour"]),
+    )
+
+    for product_id, row in deltas["products"].items():
+        _bump(
+            db,
+            ProductSalesMetric,
+            {"restaurant_id": rid, "metric_date": day, "product_id": product_id},
+            {"quantity_sold": row["quantity"] * sign, "total_revenue": row["revenue"] * sign},
+            {"product_name": row["product_name"]},
+        )
+
+    if deltas["operator"]:
+        _bump(
+            db,
+            UserSalesMetric,
+            {"restaurant_id": rid, "metric_date": day, "user_name": deltas["operator"]},
+            {"orders_handled": sign, "total_sales": total},
+        )
+
+    if deltas["driver"]:
+        _bump(
+            db,
+            DriverMetric,
+            {"restaurant_id": rid, "metric_date": day, "driver_name": deltas["driver"]},
+            {"deliveries_completed": sign, "total_delivery_revenue": total},
+        )
+
+
+def apply_order_rollup(db: Session, order: Order) -> bool:
+    """
+    Suma la orden a los acumulados dentro de la transacción actual. No hace
+    commit. Devuelve False si la orden no aplica o ya estaba acumulada.
+    """
+    if not is_order_rollup_ready(order):
+        return False
+
+    try:
+        with db.begin_nested():
+            db.add(AnalyticsOrderRollup(
+                restaurant_id=order.restaurant_id,
+                order_id=order.id,
+                metric_date=metric_day(order.created_at),
+                total=_dec(order.total),
+            ))
+    except IntegrityError:
+        return False
+
+    items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
+    _apply_deltas(db, build_order_deltas(order, items), 1)
+    return True
+
+
+def revert_order_rollup(db: Session, order: Order) -> bool:
+    ledger = (
+        db.query(AnalyticsOrderRollup)
+        .filter(AnalyticsOrderRollup.order_id == order.id)
+        .first()
+    )
+    if not ledger:
+        return False
+
+    items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
+    deltas = build_order_deltas(order, items)
+    deltas["metric_date"] = ledger.metric_date
+    deltas["total"] = _dec(ledger.total)
+    _apply_deltas(db, deltas, -1)
+    db.delete(ledger)
+    return True
+
+
+# =========================
+# RE-AGREGACIÓN POR RANGO
+# =========================
+
+def _iter_order_batches(
+    db: Session,
+    restaurant_id: Optional[int],
+    start: datetime,
+    end: datetime,
+    batch_size: int,
+    orders_model=Order,
+):
+    last_id = 0
+    while True:
+        query = db.query(orders_model).filter(
+            orders_model.id > last_id,
+            orders_model.created_at >= start,
+            orders_model.created_at < end,
+            rollup_order_filter(orders_model),
+        )
+        if restaurant_id is not None:
+            query = query.filter(orders_model.restaurant_id == restaurant_id)
+
+        orders = query.order_by(orders_model.id.asc()).limit(batch_size).all()
+        if not orders:
+            return
+
+        last_id = orders[-1].id
+        yield orders
+        db.expunge_all()
+
+
+def _iter_orders_with_items(db: Session, restaurant_id: Optional[int], start: datetime, end: datetime, batch_size: int):
+    """Lotes de (orden, líneas) de las tablas calientes y del archivo."""
+    for orders_model, items_model, _ in SOURCES:
+        for orders in _iter_order_batches(db, restaurant_id, start, end, batch_size, orders_model):
+            items_by_order = defaultdict(list)
+            rows = (
+                db.query(items_model)
+                .join(orders_model, order_join(orders_model, items_model))
+                .filter(orders_model.id.in_([o.id for o in orders]))
+                .all()
+            )
+            for it in rows:
+                items_by_order[it.order_id].append(it)
+            yield [(order, items_by_order.get(order.id, [])) for order in orders]
+
+
+def _insert(db: Session, model, rows: list) -> None:
+    # insert() por session.execute pasa por do_orm_execute (ver sharding.FROZEN_KEY)
+    if rows:
+        db.execute(insert(model), rows)
+
+
+class _DayTotals:
+    """Acumulados de un solo día; se escriben y se vacían al cerrar el día."""
+
+    def __init__(self):
+        self.daily = defaultdict(lambda: {"sales": Decimal("0"), "orders": 0})
+        self.hourly = defaultdict(lambda: {"sales": Decimal("0"), "orders": 0})
+        self.products = defaultdict(lambda: {"name": "", "quantity": Decimal("0"), "revenue": Decimal("0")})
+        self.users = defaultdict(lambda: {"orders": 0, "sales": Decimal("0")})
+        self.drivers = defaultdict(lambda: {"deliveries": 0, "revenue": Decimal("0")})
+
+    def add(self, d: dict) -> None:
+        rid, day = d["restaurant_id"], d["metric_date"]
+
+        self.daily[(rid, day)]["sales"] += d["total"]
+        self.daily[(rid, day)]["orders"] += 1
+
+        self.hourly[(rid, d["metric_hour"], d["channel"])]["sales"] += d["total"]
+        self.hourly[(rid, d["metric_hour"], d["channel"])]["orders"] += 1
+
+        for pid, row in d["products"].items():
+            acc = self.products[(rid, day, pid)]
+            acc["name"] = acc["name"] or row["product_name"]
+            acc["quantity"] += row["quantity"]
+            acc["revenue"] += row["revenue"]
+
+        if d["operator"]:
+            self.users[(rid, day, d["operator"])]["orders"] += 1
+            self.users[(rid, day, d["operator"])]["sales"] += d["total"]
+
+        if d["driver"]:
+            self.drivers[(rid, day, d["driver"])]["deliveries"] += 1
+            self.drivers[(rid, day, d["driver"])]["revenue"] += d["total"]
+
+    def write(self, db: Session, counts: dict) -> None:
+        _insert(db, DailyMetric, [
+            {
+                "restaurant_id": rid,
+                "date": day,
+                "total_sales": v["sales"],
+                "total_orders": v["orders"],
+                "average_ticket": (v["sales"] / v["orders"]) if v["orders"] else Decimal("0"),
+            }
+            for (rid, day), v in self.daily.items()
+        ])
+        _insert(db, HourlyChannelMetric, [
+            {
+                "restaurant_id": rid,
+                "metric_hour": hour,
+                **hour_slot(hour),
+                "channel": channel,
+                "total_sales": v["sales"],
+                "total_orders": v["orders"],
+            }
+            for (rid, hour, channel), v in self.hourly.items()
+        ])
+        _insert(db, ProductSalesMetric, [
+            {
+                "restaurant_id": rid,
+                "metric_date": day,
+                "product_id": pid,
+                "product_name": v["name"],
+                "quantity_sold": v["quantity"],
+                "total_revenue": v["revenue"],
+            }
+            for (rid, day, pid), v in self.products.items()
+        ])
+        _insert(db, UserSalesMetric, [
+            {
+                "restaurant_id": rid,
+                "metric_date": day,
+                "user_name": name,
+                "orders_handled": v["orders"],
+                "total_sales": v["sales"],
+            }
+            for (rid, day, name), v in self.users.items()
+        ])
+        _insert(db, DriverMetric, [
+            {
+                "restaurant_id": rid,
+                "metric_date": day,
+                "driver_name": name,
+                "deliveries_completed": v["deliveries"],
+                "total_delivery_revenue": v["revenue"],
+            }
+            for (rid, day, name), v in self.drivers.items()
+        ])
+
+        counts["days"] += len(self.daily)
+        counts["hour_rows"] += len(self.hourly)
+        counts["product_rows"] += len(self.products)
+        counts["user_rows"] += len(self.users)
+        counts["driver_rows"] += len(self.drivers)
+
+
+def reaggregate(
+    db: Session,
+    date_from: date,
+    date_to: date,
+    restaurant_id: Optional[int] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> dict:
+    """
+    Recalcula los acumulados de [date_from, date_to] desde cero. Es
+    idempotente: borra los acumulados del rango y los vuelve a escribir en una
+    sola transacción. Se recorre día por día (todas las claves de los
+    acumulados incluyen el día) y las órdenes de cada día se leen por lotes de
+    `batch_size`, así en memoria queda como mucho un día de acumulados.
+    """
+    start = datetime(date_from.year, date_from.month, date_from.day)
+    end = datetime(date_to.year, date_to.month, date_to.day) + timedelta(days=1)
+
+    def scoped(model, date_col):
+        query = db.query(model).filter(date_col >= start, date_col < end)
+        if restaurant_id is not None:
+            query = query.filter(model.restaurant_id == restaurant_id)
+        return query
+
+    scoped(DailyMetric, DailyMetric.date).delete(synchronize_session=False)
+    scoped(HourlyChannelMetric, HourlyChannelMetric.metric_hour).delete(synchronize_session=False)
+    scoped(ProductSalesMetric, ProductSalesMetric.metric_date).delete(synchronize_session=False)
+    scoped(UserSalesMetric, UserSalesMetric.metric_date).delete(synchronize_session=False)
+    scoped(DriverMetric, DriverMetric.metric_date).delete(synchronize_session=False)
+    scoped(AnalyticsOrderRollup, AnalyticsOrderRollup.metric_date).delete(synchronize_session=False)
+    _mark_changed(db, restaurant_id)
+
+    counts = {"orders": 0, "days": 0, "hour_rows": 0, "product_rows": 0, "user_rows": 0, "driver_rows": 0}
+
+    day_start = start
+    while day_start < end:
+        day_end = day_start + timedelta(days=1)
+        totals = _DayTotals()
+
+        for batch in _iter_orders_with_items(db, restaurant_id, day_start, day_end, batch_size):
+            ledger_rows = []
+            for order, items in batch:
+                d = build_order_deltas(order, items)
+                totals.add(d)
+                ledger_rows.append({
+                    "restaurant_id": d["restaurant_id"],
+                    "order_id": order.id,
+                    "metric_date": d["metric_date"],
+                    "total": d["total"],
+                })
+            _insert(db, AnalyticsOrderRollup, ledger_rows)
+            counts["orders"] += len(ledger_rows)
+
+        totals.write(db, counts)
+        day_start = day_end
+
+    db.commit()
+    return counts
+
+
+def main(argv=None) -> int:
+    from db import Base, SessionLocal, engine
+    import models  # noqa: F401  registra todas las tablas
+    from models.core_models import Restaurant
+
+    parser = argparse.ArgumentParser(description="Re-agrega métricas de analytics por rango de fechas.")
+    parser.add_argument("--from", dest="date_from", required=True, help="YYYY-MM-DD")
+    parser.add_argument("--to", dest="date_to", required=True, help="YYYY-MM-DD")
+    parser.add_argument("--restaurant", default="", help="slug; vacío = todos")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    Base.metadata.create_all(bind=engine)
+
+    db = SessionLocal()
+    try:
+        restaurant_id = None
+        if args.restaurant:
+            rest = db.query(Restaurant).filter(Restaurant.slug == args.restaurant).first()
+            if not rest:
+                print(f"Restaurante no encontrado: {args.restaurant}")
+                return 1
+            restaurant_id = rest.id
+
+        result = reaggregate(
+            db,
+            date.fromisoformat(args.date_from),
+            date.fromisoformat(args.date_to),
+            restaurant_id=restaurant_id,
+            batch_size=args.batch_size,
+        )
+        print("Re-agregación lista:", result)
+    finally:
+        db.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
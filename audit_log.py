@@ -0,0 +1,358 @@
+"""
+Auditoría (activity_logs) fuera del camino del request.
+
+- audit(): encola el evento con su hora real y vuelve de inmediato. Un hilo
+  arma los diffs JSON y los inserta en lotes de hasta AUDIT_BATCH_SIZE.
+- Pagos y caja (DURABLE_PREFIXES) se pasan con db=: la fila se agrega a la
+  sesión del endpoint y se confirma en el mismo commit que el pago; si el
+  pago quedó escrito, su auditoría también.
+- El buffer está acotado (AUDIT_BUFFER_SIZE). Si está lleno, el request
+  espera hasta AUDIT_ENQUEUE_TIMEOUT_SECONDS y, si sigue lleno, escribe su
+  evento directamente: el productor baja a la velocidad de la base en vez
+  de perder eventos.
+
+La IP y el user agent del request los toma AuditContextMiddleware, así los
+endpoints no tienen que recibir Request. El usuario lo fija
+permissions.require_permission con set_request_user() una vez validada la
+sesión (X-Session-Id): un header con el id suelto se puede inventar.
+"""
+import contextvars
+import json
+import queue
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from models.security_models import ActivityLog
+
+AUDIT_BUFFER_SIZE = 10000
+AUDIT_BATCH_SIZE = 500
+AUDIT_FLUSH_INTERVAL_SECONDS = 1.0
+AUDIT_ENQUEUE_TIMEOUT_SECONDS = 0.05
+
+DURABLE_PREFIXES = ("payment.", "cash.")
+
+_request_context: contextvars.ContextVar = contextvars.ContextVar("audit_request_context", default=None)
+
+AUDIT_QUERY_INDEX_NAME = "ix_activity_logs_rest_created_action"
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _dump(value) -> Optional[str]:
+    if value is None:
+        return None
+    return json.dumps(value, ensure_ascii=False, default=_json_default, sort_keys=True)
+
+
+def diff(old: Optional[dict], new: Optional[dict]):
+    """
+    Solo las llaves que cambiaron. Sin old o sin new se guarda el otro
+    completo (alta o baja).
+    """
+    if not old or not new:
+        return old, new
+    keys = set(old) | set(new)
+    changed = [k for k in keys if old.get(k) != new.get(k)]
+    return {k: old.get(k) for k in changed}, {k: new.get(k) for k in changed}
+
+
+def _event(
+    restaurant_id: int,
+    module_code: str,
+    action_code: str,
+    entity_type: Optional[str],
+    entity_id,
+    description: Optional[str],
+    old: Optional[dict],
+    new: Optional[dict],
+    user_id: Optional[int],
+) -> dict:
+    ctx = _request_context.get() or {}
+    return {
+        "restaurant_id": restaurant_id,
+        "user_id": user_id if user_id is not None else ctx.get("user_id"),
+        "module_code": module_code,
+        "action_code": action_code,
+        "entity_type": entity_type,
+        "entity_id": str(entity_id) if entity_id is not None else None,
+        "description": description,
+        "old": old,
+        "new": new,
+        "ip_address": ctx.get("ip_address"),
+        "user_agent": ctx.get("user_agent"),
+        "created_at": datetime.utcnow(),
+    }
+
+
+def _to_row(event: dict) -> dict:
+    old, new = diff(event.pop("old"), event.pop("new"))
+    event["old_data_json"] = _dump(old)
+    event["new_data_json"] = _dump(new)
+    return event
+
+
+def is_durable(action_code: str) -> bool:
+    return action_code.startswith(DURABLE_PREFIXES)
+
+
+class AuditWriter:
+    def __init__(self, session_factory, buffer_size: int = AUDIT_BUFFER_SIZE):
+        self.session_factory = session_factory
+        self._queue: "queue.Queue[dict]" = queue.Queue(maxsize=buffer_size)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._write_lock = threading.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.inline_writes = 0
+        self.failed_batches = 0
+
+    def _insert(self, rows: List[dict]) -> None:
+        if not rows:
+            return
+        # session_factory(restaurant_id): cada restaurante escribe en su shard
+        by_restaurant: Dict[Optional[int], List[dict]] = {}
+        for row in rows:
+            by_restaurant.setdefault(row.get("restaurant_id"), []).append(row)
+        for restaurant_id, group in by_restaurant.items():
+            db = self.session_factory(restaurant_id)
+            try:
+                db.execute(ActivityLog.__table__.insert(), group)
+                db.commit()
+            finally:
+                db.close()
+            self.written += len(group)
+
+    def submit(self, event: dict) -> None:
+        try:
+            self._queue.put(event, timeout=AUDIT_ENQUEUE_TIMEOUT_SECONDS)
+            self.enqueued += 1
+        except queue.Full:
+            # backpressure: este request paga su propia escritura
+            self.inline_writes += 1
+            self._insert([_to_row(event)])
+
+    def drain(self, limit: int = AUDIT_BATCH_SIZE) -> int:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return 0
+
+        rows = [_to_row(e) for e in batch]
+        with self._write_lock:
+            try:
+                self._insert(rows)
+            except Exception:
+                self.failed_batches += 1
+                # reintento fila a fila para no perder el lote por una mala
+                for row in rows:
+                    try:
+                        self._insert([row])
+                    except Exception:
+                        # X-User-Id de un usuario inexistente viola la FK
+                        try:
+                            self._insert([dict(row, user_id=None)])
+                        except Exception as e:
+                            print("AUDIT WRITE ERROR:", e, row.get("action_code"))
+        return len(rows)
+
+    def flush(self) -> int:
+        total = 0
+        while True:
+            n = self.drain()
+            total += n
+            if n < AUDIT_BATCH_SIZE:
+                return total
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if self._queue.qsize() < AUDIT_BATCH_SIZE:
+                self._stop.wait(AUDIT_FLUSH_INTERVAL_SECONDS)
+            try:
+                self.flush()
+            except Exception as e:
+                print("AUDIT FLUSH ERROR:", e)
+
+    def start(self, engine=None) -> None:
+        if engine is not None:
+            # create_all no agrega índices a tablas que ya existían
+            for index in ActivityLog.__table__.indexes:
+                if index.name == AUDIT_QUERY_INDEX_NAME:
+                    index.create(bind=engine, checkfirst=True)
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=AUDIT_FLUSH_INTERVAL_SECONDS + 5)
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "buffered": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "inline_writes": self.inline_writes,
+            "failed_batches": self.failed_batches,
+        }
+
+    # =========================
+    # API PARA ENDPOINTS
+    # =========================
+
+    def audit(
+        self,
+        restaurant_id: int,
+        module_code: str,
+        action_code: str,
+        entity_type: Optional[str] = None,
+        entity_id=None,
+        description: Optional[str] = None,
+        old: Optional[dict] = None,
+        new: Optional[dict] = None,
+        user_id: Optional[int] = None,
+        db: Optional[Session] = None,
+    ) -> None:
+        """
+        Con db y un action_code durable (payment.*, cash.*) la fila va en la
+        transacción del endpoint; el resto se encola.
+        """
+        event = _event(restaurant_id, module_code, action_code, entity_type, entity_id, description, old, new, user_id)
+        if db is not None and is_durable(action_code):
+            db.add(ActivityLog(**_to_row(event)))
+            return
+        self.submit(event)
+
+
+# =========================
+# CONSULTA
+# =========================
+
+def query_activity(
+    db: Session,
+    restaurant_id: int,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    action_code: Optional[str] = None,
+    user_id: Optional[int] = None,
+    entity_type: Optional[str] = None,
+    entity_id: Optional[str] = None,
+    before: Optional[tuple] = None,
+    limit: int = 100,
+) -> Dict[str, Any]:
+    """
+    Más recientes primero, paginado por (created_at, id) para que el índice
+    (restaurant_id, created_at, action_code) sirva en todas las páginas.
+    """
+    query = db.query(ActivityLog).filter(ActivityLog.restaurant_id == restaurant_id)
+    if date_from is not None:
+        query = query.filter(ActivityLog.created_at >= date_from)
+    if date_to is not None:
+        query = query.filter(ActivityLog.created_at < date_to)
+    if action_code:
+        if action_code.endswith("*"):
+            query = query.filter(ActivityLog.action_code.like(action_code[:-1] + "%"))
+        else:
+            query = query.filter(ActivityLog.action_code == action_code)
+    if user_id is not None:
+        query = query.filter(ActivityLog.user_id == user_id)
+    if entity_type:
+        query = query.filter(ActivityLog.entity_type == entity_type)
+    if entity_id:
+        query = query.filter(ActivityLog.entity_id == str(entity_id))
+    if before is not None:
+        created_at, log_id = before
+        query = query.filter(or_(
+            ActivityLog.created_at < created_at,
+            and_(ActivityLog.created_at == created_at, ActivityLog.id < log_id),
+        ))
+
+    rows = query.order_by(ActivityLog.created_at.desc(), ActivityLog.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    def _load(raw):
+        try:
+            return json.loads(raw) if raw else None
+        except ValueError:
+            return raw
+
+    items = [
+        {
+            "id": r.id,
+            "created_at": r.created_at.isoformat() if r.created_at else None,
+            "user_id": r.user_id,
+            "module_code": r.module_code,
+            "action_code": r.action_code,
+            "entity_type": r.entity_type or "",
+            "entity_id": r.entity_id or "",
+            "description": r.description or "",
+            "old": _load(r.old_data_json),
+            "new": _load(r.new_data_json),
+            "ip_address": r.ip_address or "",
+        }
+        for r in rows
+    ]
+    cursor = None
+    if has_more and rows:
+        cursor = f"{rows[-1].created_at.isoformat()}|{rows[-1].id}"
+    return {"items": items, "next_cursor": cursor}
+
+
+def parse_cursor(value: Optional[str]) -> Optional[tuple]:
+    value = (value or "").strip()
+    if not value:
+        return None
+    created_at, _, log_id = value.rpartition("|")
+    return datetime.fromisoformat(created_at), int(log_id)
+
+
+# =========================
+# CONTEXTO DEL REQUEST
+# =========================
+
+def set_request_user(user_id: Optional[int]) -> None:
+    # el dict es el mismo en el hilo del handler: el cambio se ve en todo el request
+    ctx = _request_context.get()
+    if ctx is not None:
+        ctx["user_id"] = user_id
+
+
+class AuditContextMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        ctx = {"ip_address": (scope.get("client") or (None,))[0], "user_agent": None, "user_id": None}
+        for key, value in scope.get("headers") or ():
+            if key == b"user-agent":
+                ctx["user_agent"] = value.decode("latin-1")[:500]
+        token = _request_context.set(ctx)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_context.reset(token)
@@ -0,0 +1,142 @@
+"""
+Benchmark de /v2/api/analytics sobre un año de acumulados sintéticos.
+
+Uso:
+    python -m benchmarks.analytics_api
+    python -m benchmarks.analytics_api --days 365 --products 80 --iterations 50
+
+Llena daily_metrics, hourly_channel_metrics y product_sales_metrics de un
+SQLite temporal y mide la consulta en frío (sin caché) por bucket. Sale con
+código 1 si el p95 en frío supera --target-ms.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import summarize_latencies
+
+CHANNELS = ("local", "delivery", "pickup", "whatsapp")
+OPEN_HOURS = range(10, 23)
+
+
+def seed(db, restaurant_id: int, days: int, products: int) -> None:
+    from models import DailyMetric, HourlyChannelMetric, Product, ProductSalesMetric
+
+    rnd = random.Random(42)
+    first_day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+
+    daily, hourly, product_rows = [], [], []
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        day_sales, day_orders = 0.0, 0
+        for hour in OPEN_HOURS:
+            for channel in CHANNELS:
+                orders = rnd.randint(0, 8)
+                if not orders:
+                    continue
+                sales = round(orders * rnd.uniform(120, 450), 2)
+                day_sales += sales
+                day_orders += orders
+                hourly.append({
+                    "restaurant_id": restaurant_id,
+                    "metric_hour": day.replace(hour=hour),
+                    "weekday": (day.weekday() + 1) % 7,
+                    "hour_of_day": hour,
+                    "channel": channel,
+                    "total_sales": sales,
+                    "total_orders": orders,
+                })
+        daily.append({
+            "restaurant_id": restaurant_id,
+            "date": day,
+            "total_sales": round(day_sales, 2),
+            "total_orders": day_orders,
+            "average_ticket": round(day_sales / day_orders, 2) if day_orders else 0,
+        })
+        for pid in range(1, products + 1):
+            qty = rnd.randint(0, 30)
+            product_rows.append({
+                "restaurant_id": restaurant_id,
+                "metric_date": day,
+                "product_id": pid,
+                "product_name": f"Producto {pid}",
+                "quantity_sold": qty,
+                "total_revenue": round(qty * (40 + pid), 2),
+            })
+
+    db.bulk_insert_mappings(Product, [
+        {"id": pid, "restaurant_id": restaurant_id, "name": f"Producto {pid}", "price": 40 + pid}
+        for pid in range(1, products + 1)
+    ])
+    db.bulk_insert_mappings(DailyMetric, daily)
+    db.bulk_insert_mappings(HourlyChannelMetric, hourly)
+    db.bulk_insert_mappings(ProductSalesMetric, product_rows)
+    db.commit()
+
+
+def run(days: int, products: int, iterations: int) -> dict:
+    import analytics_queries
+    from db import Base, SessionLocal, engine
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        seed(db, 1, days, products)
+        date_to = datetime.utcnow().date() - timedelta(days=1)
+        ranges = {
+            "hour": date_to - timedelta(days=30),
+            "day": date_to - timedelta(days=days - 1),
+            "week": date_to - timedelta(days=days - 1),
+            "month": date_to - timedelta(days=days - 1),
+        }
+
+        results = {}
+        for bucket, date_from in ranges.items():
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(iterations):
+                analytics_queries.clear_cache()
+                t0 = time.perf_counter()
+                analytics_queries.query_analytics(db, 1, date_from, date_to, bucket=bucket)
+                latencies.append((time.perf_counter() - t0) * 1000.0)
+            results[f"{bucket}_cold"] = summarize_latencies(latencies, time.perf_counter() - started)
+
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            analytics_queries.query_analytics(db, 1, ranges["day"], date_to, bucket="day")
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+        results["day_cached"] = summarize_latencies(latencies, time.perf_counter() - started)
+        return results
+    finally:
+        db.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de la API de analytics.")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--products", type=int, default=60)
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--target-ms", type=float, default=50.0)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/analytics.db"
+        results = run(args.days, args.products, args.iterations)
+
+    print(json.dumps(results, indent=2, sort_keys=True))
+    slow = [name for name, row in results.items() if row["p95_ms"] > args.target_ms]
+    if slow:
+        print(f"p95 sobre {args.target_ms}ms: {', '.join(slow)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
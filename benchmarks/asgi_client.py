@@ -0,0 +1,82 @@
+import asyncio
+import json
+from urllib.parse import urlencode
+
+
+class AsgiClient:
+    """Cliente mínimo para llamar la app ASGI en proceso, sin red ni httpx."""
+
+    def __init__(self, app):
+        self.app = app
+        self.loop = asyncio.new_event_loop()
+
+    def startup(self):
+        self.loop.run_until_complete(self.app.router.startup())
+
+    def shutdown(self):
+        self.loop.run_until_complete(self.app.router.shutdown())
+        self.loop.close()
+
+    def request(self, method: str, path: str, params: dict = None, json_body=None, headers: dict = None):
+        return self.loop.run_until_complete(
+            self._call(method, path, params or {}, json_body, headers or {})
+        )
+
+    def get(self, path: str, params: dict = None, headers: dict = None):
+        return self.request("GET", path, params=params, headers=headers)
+
+    def post(self, path: str, params: dict = None, json_body=None, headers: dict = None):
+        return self.request("POST", path, params=params, json_body=json_body, headers=headers)
+
+    async def _call(self, method, path, params, json_body, extra_headers):
+        body = b""
+        headers = [(b"host", b"bench.local")]
+        if json_body is not None:
+            body = json.dumps(json_body, default=str).encode("utf-8")
+            headers.append((b"content-type", b"application/json"))
+        headers.append((b"content-length", str(len(body)).encode("ascii")))
+        for key, value in extra_headers.items():
+            headers.append((key.lower().encode("latin-1"), str(value).encode("latin-1")))
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method.upper(),
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode("utf-8"),
+            "query_string": urlencode(params, doseq=True).encode("ascii"),
+            "root_path": "",
+            "headers": headers,
+            "client": ("127.0.0.1", 50000),
+            "server": ("bench.local", 80),
+        }
+
+        request_sent = False
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return {"type": "http.disconnect"}
+
+        response = {"status": 0, "headers": [], "chunks": []}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                response["chunks"].append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+
+        raw = b"".join(response["chunks"])
+        try:
+            data = json.loads(raw) if raw else None
+        except ValueError:
+            data = raw.decode("utf-8", errors="replace")
+
+        return response["status"], data
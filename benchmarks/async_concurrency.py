@@ -0,0 +1,198 @@
+"""
+Concurrencia máxima por worker: camino async contra threadpool.
+
+Uso:
+    python -m benchmarks.async_concurrency
+    python -m benchmarks.async_concurrency --levels 10,50,100,200,400 --p95-budget-ms 250
+
+Corre la app en proceso contra un SQLite temporal (o BENCH_POSTGRES_URL) y
+dispara en un solo event loop, como un worker de uvicorn, rondas de N
+requests simultáneos a las lecturas calientes (detalle de ticket, pagos,
+floor y cocina). Cada modo corre en un proceso aparte porque db_async
+decide al importar:
+
+- threadpool: ASYNC_DB=0, los endpoints esperan a la base en el threadpool
+  de Starlette (40 hilos por defecto);
+- async: ASYNC_DB=1 con aiosqlite/asyncpg instalado; si falta el driver el
+  modo se reporta como omitido.
+
+max_concurrency es el N más alto sin errores y con p95 bajo el presupuesto.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import load_json, summarize_latencies, write_json
+
+DEFAULT_LEVELS = "10,50,100,200,400"
+DEFAULT_ROUNDS = int(os.getenv("BENCH_ROUNDS", "3"))
+DEFAULT_P95_BUDGET_MS = float(os.getenv("BENCH_P95_BUDGET_MS", "250"))
+TICKETS = 20
+
+MODES = {
+    "threadpool": "0",
+    "async": "1",
+}
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def setup_tickets(client, slug: str) -> list:
+    params = {"restaurant": slug}
+    status, products = client.get("/v2/api/products", params=params)
+    if status != 200 or not products.get("items"):
+        raise BenchmarkError(f"products: status={status} body={products}")
+    product_id = products["items"][0]["id"]
+
+    ticket_ids = []
+    for _ in range(TICKETS):
+        status, data = client.post("/v2/api/local/open-ticket", params=params, json_body={"service_mode": "quick"})
+        if status != 200:
+            raise BenchmarkError(f"open-ticket: status={status} body={data}")
+        ticket_id = data["ticket"]["id"]
+        client.post(
+            f"/v2/api/local/ticket/{ticket_id}/items/add",
+            params=params,
+            json_body={"items": [{"product_id": product_id, "quantity": 1}]},
+        )
+        ticket_ids.append(ticket_id)
+    return ticket_ids
+
+
+def request_mix(ticket_ids: list) -> list:
+    paths = []
+    for ticket_id in ticket_ids:
+        paths.append(f"/v2/api/local/ticket/{ticket_id}")
+        paths.append(f"/v2/api/local/ticket/{ticket_id}/payments")
+    paths.extend(["/v2/api/floor", "/v2/api/kitchen/orders"])
+    return paths
+
+
+async def fire_round(client, slug: str, paths: list, concurrency: int):
+    params = {"restaurant": slug}
+    latencies = []
+    errors = 0
+
+    async def one(i: int):
+        nonlocal errors
+        t0 = time.perf_counter()
+        status, _ = await client._call("GET", paths[i % len(paths)], params, None, {})
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+        if status != 200:
+            errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(concurrency)])
+    return latencies, errors, time.perf_counter() - started
+
+
+def run_worker(levels: list, rounds: int, output_path: str) -> None:
+    # Nunca mandar mensajes reales a Meta durante el benchmark.
+    os.environ["WHATSAPP_TOKEN"] = ""
+    os.environ["PHONE_NUMBER_ID"] = ""
+
+    from benchmarks.asgi_client import AsgiClient
+    import db_async
+    import main_v2
+
+    client = AsgiClient(main_v2.app)
+    client.startup()
+    try:
+        slug = main_v2.DEFAULT_RESTAURANT_SLUG
+        paths = request_mix(setup_tickets(client, slug))
+        client.loop.run_until_complete(fire_round(client, slug, paths, 10))
+
+        results = {}
+        for level in levels:
+            latencies, errors, elapsed = [], 0, 0.0
+            for _ in range(rounds):
+                lat, err, secs = client.loop.run_until_complete(fire_round(client, slug, paths, level))
+                latencies.extend(lat)
+                errors += err
+                elapsed += secs
+            stats = summarize_latencies(latencies, elapsed)
+            stats["errors"] = errors
+            results[str(level)] = stats
+    finally:
+        client.shutdown()
+
+    write_json(output_path, {"db_mode": db_async.mode(), "levels": results})
+
+
+def max_concurrency(levels: dict, p95_budget_ms: float) -> int:
+    best = 0
+    for level, stats in sorted(levels.items(), key=lambda x: int(x[0])):
+        if stats.get("errors") or float(stats.get("p95_ms") or 0) > p95_budget_ms:
+            break
+        best = int(level)
+    return best
+
+
+def run_mode(database_url: str, async_db: str, levels: list, rounds: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = os.path.join(tmp, "result.json")
+        env = dict(os.environ)
+        env["DATABASE_URL"] = database_url
+        env["ASYNC_DB"] = async_db
+
+        cmd = [
+            sys.executable, "-m", "benchmarks.async_concurrency",
+            "--worker", "--levels", ",".join(str(x) for x in levels),
+            "--rounds", str(rounds), "--output", output_path,
+        ]
+        proc = subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if proc.returncode != 0:
+            raise BenchmarkError(f"Worker falló (ASYNC_DB={async_db}):\n{proc.stderr[-4000:]}")
+
+        return load_json(output_path, {})
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Concurrencia por worker: endpoints async vs threadpool.")
+    parser.add_argument("--levels", default=DEFAULT_LEVELS, help="requests simultáneos, separados por coma")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    parser.add_argument("--p95-budget-ms", type=float, default=DEFAULT_P95_BUDGET_MS)
+    parser.add_argument("--json-out", default="")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--output", default="", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    levels = [int(x) for x in args.levels.split(",") if x.strip()]
+
+    if args.worker:
+        run_worker(levels, args.rounds, args.output)
+        return 0
+
+    modes = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = os.getenv("BENCH_POSTGRES_URL", "").strip() or f"sqlite:///{tmp}/bench.db"
+        for name, async_db in MODES.items():
+            result = run_mode(database_url, async_db, levels, args.rounds)
+            if result.get("db_mode") != name:
+                modes[name] = {"skipped": "driver async no instalado"}
+                continue
+            result["max_concurrency"] = max_concurrency(result["levels"], args.p95_budget_ms)
+            modes[name] = result
+
+    report = {
+        "rounds": args.rounds,
+        "p95_budget_ms": args.p95_budget_ms,
+        "results": modes,
+    }
+
+    if args.json_out:
+        write_json(args.json_out, report)
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
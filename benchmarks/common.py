@@ -0,0 +1,69 @@
+import json
+import os
+from typing import Dict, List
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * (pct / 100.0)
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def summarize_latencies(latencies_ms: List[float], elapsed_seconds: float) -> Dict:
+    count = len(latencies_ms)
+    return {
+        "count": count,
+        "elapsed_s": round(elapsed_seconds, 4),
+        "throughput_per_s": round(count / elapsed_seconds, 2) if elapsed_seconds > 0 else 0.0,
+        "mean_ms": round(sum(latencies_ms) / count, 3) if count else 0.0,
+        "p50_ms": round(percentile(latencies_ms, 50), 3),
+        "p90_ms": round(percentile(latencies_ms, 90), 3),
+        "p95_ms": round(percentile(latencies_ms, 95), 3),
+        "p99_ms": round(percentile(latencies_ms, 99), 3),
+        "max_ms": round(max(latencies_ms), 3) if latencies_ms else 0.0,
+    }
+
+
+def load_json(path: str, default=None):
+    if not path or not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def write_json(path: str, data) -> None:
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(data, fh, indent=2, sort_keys=True)
+        fh.write("\n")
+
+
+def compare_with_baseline(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Devuelve la lista de regresiones. Un escenario regresa si su p95 sube
+    o su throughput baja más que `threshold` (0.25 = 25%) contra la línea base.
+    """
+    regressions = []
+    for scenario, stats in (current or {}).items():
+        base = (baseline or {}).get(scenario)
+        if not base:
+            continue
+
+        base_p95 = float(base.get("p95_ms") or 0)
+        cur_p95 = float(stats.get("p95_ms") or 0)
+        if base_p95 > 0 and cur_p95 > base_p95 * (1 + threshold):
+            regressions.append(
+                f"{scenario}: p95 {cur_p95:.2f}ms > base {base_p95:.2f}ms (+{threshold:.0%})"
+            )
+
+        base_tp = float(base.get("throughput_per_s") or 0)
+        cur_tp = float(stats.get("throughput_per_s") or 0)
+        if base_tp > 0 and cur_tp < base_tp * (1 - threshold):
+            regressions.append(
+                f"{scenario}: throughput {cur_tp:.2f}/s < base {base_tp:.2f}/s (-{threshold:.0%})"
+            )
+
+    return regressions
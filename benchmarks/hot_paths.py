@@ -0,0 +1,324 @@
+"""
+Benchmark en proceso de las rutas calientes de main_v2.
+
+Uso:
+    python -m benchmarks.hot_paths
+    python -m benchmarks.hot_paths --iterations 200 --threshold 0.3
+    python -m benchmarks.hot_paths --update-baseline
+
+Corre siempre contra un SQLite temporal. Si BENCH_POSTGRES_URL está definido
+también corre contra esa base Postgres. Cada backend corre en un proceso
+aparte porque config.settings lee DATABASE_URL al importar.
+
+Sale con código 1 si algún escenario supera el umbral de regresión contra
+benchmarks/baseline.json.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from benchmarks.common import compare_with_baseline, load_json, summarize_latencies, write_json
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_THRESHOLD = float(os.getenv("BENCH_REGRESSION_THRESHOLD", "0.25"))
+DEFAULT_ITERATIONS = int(os.getenv("BENCH_ITERATIONS", "100"))
+WARMUP_ITERATIONS = 5
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def expect_ok(status, data, label: str):
+    if status != 200 or (isinstance(data, dict) and data.get("ok") is False):
+        raise BenchmarkError(f"{label}: status={status} body={data}")
+    return data
+
+
+# =========================
+# ESCENARIOS
+# =========================
+
+class HotPathScenarios:
+    def __init__(self, client, restaurant_slug: str, tables_count: int = 20):
+        self.client = client
+        self.slug = restaurant_slug
+        self.run_tag = uuid.uuid4().hex[:6]
+        self.table_ids = []
+        self.product_ids = []
+        self.whatsapp_product_id = None
+        self.tables_count = tables_count
+        self._table_cursor = 0
+        self._phone_cursor = 0
+
+    def params(self, **extra):
+        data = {"restaurant": self.slug}
+        data.update(extra)
+        return data
+
+    def setup(self):
+        status, data = self.client.post(
+            "/v2/api/zones",
+            params=self.params(),
+            json_body={"name": f"Bench {self.run_tag}", "sort_order": 99},
+        )
+        zone = expect_ok(status, data, "create zone")["item"]
+
+        for idx in range(self.tables_count):
+            status, data = self.client.post(
+                "/v2/api/tables",
+                params=self.params(),
+                json_body={
+                    "zone_id": zone["id"],
+                    "code": f"B{self.run_tag}-{idx}",
+                    "display_name": f"Bench {idx + 1}",
+                },
+            )
+            self.table_ids.append(expect_ok(status, data, "create table")["item"]["id"])
+
+        status, data = self.client.get("/v2/api/products", params=self.params())
+        items = expect_ok(status, data, "products")["items"]
+        if not items:
+            raise BenchmarkError("No hay productos para el benchmark.")
+        self.product_ids = [p["id"] for p in items]
+
+        for p in items:
+            if p["category"] == "Bebidas":
+                self.whatsapp_product_id = p["id"]
+                break
+        if not self.whatsapp_product_id:
+            raise BenchmarkError("No hay producto en la categoría Bebidas para el flujo WhatsApp.")
+
+    def next_table_id(self) -> int:
+        table_id = self.table_ids[self._table_cursor % len(self.table_ids)]
+        self._table_cursor += 1
+        return table_id
+
+    def ticket_flow(self):
+        status, data = self.client.post(
+            "/v2/api/local/open-ticket",
+            params=self.params(),
+            json_body={"service_mode": "table", "table_id": self.next_table_id()},
+        )
+        ticket = expect_ok(status, data, "open ticket")["ticket"]
+        order_id = ticket["id"]
+
+        status, data = self.client.post(
+            f"/v2/api/local/ticket/{order_id}/items/add",
+            params=self.params(),
+            json_body={
+                "items": [
+                    {"product_id": pid, "quantity": 1 + (i % 2)}
+                    for i, pid in enumerate(self.product_ids[:3])
+                ]
+            },
+        )
+        total = expect_ok(status, data, "add items")["ticket"]["total"]
+
+        status, data = self.client.post(
+            f"/v2/api/local/ticket/{order_id}/send-new-items",
+            params=self.params(),
+            json_body={},
+        )
+        expect_ok(status, data, "send to kitchen")
+
+        half = round(total / 2, 2)
+        status, data = self.client.post(
+            f"/v2/api/local/ticket/{order_id}/pay-split",
+            params=self.params(),
+            json_body={
+                "payments": [
+                    {"method": "cash", "amount": half},
+                    {"method": "card", "amount": round(total - half, 2), "card_last4": "4242"},
+                ]
+            },
+        )
+        expect_ok(status, data, "pay split")
+
+        status, data = self.client.post(
+            f"/v2/api/local/ticket/{order_id}/close",
+            params=self.params(),
+            json_body={"force_close": False},
+        )
+        expect_ok(status, data, "close ticket")
+
+    def floor_refresh(self):
+        status, data = self.client.get("/v2/api/floor", params=self.params())
+        expect_ok(status, data, "floor")
+
+    def kitchen_poll(self):
+        status, data = self.client.get("/v2/api/kitchen/orders", params=self.params())
+        expect_ok(status, data, "kitchen poll")
+
+    def catalog_load(self):
+        status, data = self.client.get("/v2/api/products", params=self.params())
+        expect_ok(status, data, "catalog")
+
+    def _webhook_message(self, phone: str, message: dict):
+        message = dict(message)
+        message["from"] = phone
+        payload = {
+            "entry": [{
+                "changes": [{
+                    "value": {
+                        "metadata": {"phone_number_id": ""},
+                        "contacts": [{"profile": {"name": "Bench"}}],
+                        "messages": [message],
+                    }
+                }]
+            }]
+        }
+        status, data = self.client.post("/webhook/whatsapp", json_body=payload)
+        return expect_ok(status, data, f"webhook {message.get('type')}")
+
+    def _reply(self, kind: str, reply_id: str, title: str) -> dict:
+        return {
+            "type": "interactive",
+            "interactive": {"type": kind, kind: {"id": reply_id, "title": title}},
+        }
+
+    def whatsapp_conversation(self):
+        self._phone_cursor += 1
+        phone = f"505{self.run_tag_digits()}{self._phone_cursor:06d}"
+        pid = self.whatsapp_product_id
+
+        self._webhook_message(phone, {"type": "text", "text": {"body": "hola"}})
+        self._webhook_message(phone, self._reply("list_reply", "main::menu", "Menú"))
+        self._webhook_message(phone, self._reply("list_reply", "cat::bebidas", "Bebidas"))
+        self._webhook_message(phone, self._reply("list_reply", f"prod::{pid}", "Producto"))
+        self._webhook_message(phone, self._reply("button_reply", f"add::{pid}", "Agregar"))
+        self._webhook_message(phone, self._reply("button_reply", "flow::pickup", "Retiro"))
+        data = self._webhook_message(phone, {"type": "text", "text": {"body": "confirmar"}})
+        if data.get("action") != "order_created":
+            raise BenchmarkError(f"Conversación WhatsApp no creó orden: {data}")
+
+    def run_tag_digits(self) -> str:
+        return str(int(self.run_tag, 16) % 10000).zfill(4)
+
+    def all(self):
+        return {
+            "pos_ticket_flow": self.ticket_flow,
+            "floor_refresh": self.floor_refresh,
+            "kitchen_poll": self.kitchen_poll,
+            "catalog_load": self.catalog_load,
+            "whatsapp_conversation": self.whatsapp_conversation,
+        }
+
+
+def time_scenario(fn, iterations: int) -> dict:
+    for _ in range(WARMUP_ITERATIONS):
+        fn()
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+    elapsed = time.perf_counter() - started
+
+    return summarize_latencies(latencies, elapsed)
+
+
+def run_worker(iterations: int, output_path: str, only=None) -> None:
+    # Nunca mandar mensajes reales a Meta durante el benchmark.
+    os.environ["WHATSAPP_TOKEN"] = ""
+    os.environ["PHONE_NUMBER_ID"] = ""
+
+    from benchmarks.asgi_client import AsgiClient
+    import main_v2
+
+    client = AsgiClient(main_v2.app)
+    client.startup()
+    try:
+        scenarios = HotPathScenarios(client, main_v2.DEFAULT_RESTAURANT_SLUG)
+        scenarios.setup()
+
+        results = {}
+        for name, fn in scenarios.all().items():
+            if only and name not in only:
+                continue
+            results[name] = time_scenario(fn, iterations)
+    finally:
+        client.shutdown()
+
+    write_json(output_path, results)
+
+
+def run_backend(database_url: str, iterations: int, only=None) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = os.path.join(tmp, "result.json")
+        env = dict(os.environ)
+        env["DATABASE_URL"] = database_url
+
+        cmd = [
+            sys.executable, "-m", "benchmarks.hot_paths",
+            "--worker", "--iterations", str(iterations), "--output", output_path,
+        ]
+        for name in only or []:
+            cmd.extend(["--only", name])
+
+        proc = subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if proc.returncode != 0:
+            raise BenchmarkError(f"Worker falló para {database_url}:\n{proc.stderr[-4000:]}")
+
+        return load_json(output_path, {})
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de rutas calientes POS / WhatsApp.")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--only", action="append", default=[])
+    parser.add_argument("--json-out", default="")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--output", default="", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        run_worker(args.iterations, args.output, args.only)
+        return 0
+
+    backends = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        backends["sqlite"] = run_backend(f"sqlite:///{tmp}/bench.db", args.iterations, args.only)
+
+    postgres_url = os.getenv("BENCH_POSTGRES_URL", "").strip()
+    if postgres_url:
+        backends["postgres"] = run_backend(postgres_url, args.iterations, args.only)
+
+    baseline = load_json(args.baseline, {}) or {}
+    regressions = []
+    for backend, results in backends.items():
+        for line in compare_with_baseline(results, baseline.get(backend, {}), args.threshold):
+            regressions.append(f"[{backend}] {line}")
+
+    report = {
+        "iterations": args.iterations,
+        "threshold": args.threshold,
+        "results": backends,
+        "regressions": regressions,
+    }
+
+    if args.json_out:
+        write_json(args.json_out, report)
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.update_baseline:
+        baseline.update(backends)
+        write_json(args.baseline, baseline)
+        return 0
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
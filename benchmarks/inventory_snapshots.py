@@ -0,0 +1,156 @@
+"""
+Benchmark de stock a fecha: kardex completo vs snapshot + movimientos.
+
+Uso:
+    python -m benchmarks.inventory_snapshots
+    python -m benchmarks.inventory_snapshots --movements 3000000 --items 80 --days 365
+
+Llena un SQLite temporal (o --database-url) con millones de movimientos,
+construye los snapshots diarios y mide stock_at() contra la suma del kardex.
+También mide la reconstrucción incremental después de un día más de ventas.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import summarize_latencies
+
+INSERT_CHUNK = 50000
+
+
+def seed(engine, restaurant_id: int, items: int, movements: int, days: int, start: datetime) -> None:
+    from sqlalchemy import text
+
+    rnd = random.Random(7)
+    seconds = days * 86400
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO restaurants (id, name, slug, is_active) VALUES (:id, 'Bench', 'bench-inv', 1)"),
+            {"id": restaurant_id},
+        )
+        conn.execute(
+            text("INSERT INTO inventory_items (id, restaurant_id, name, unit, current_stock, minimum_stock) VALUES (:id, :rid, :name, 'u', 0, 0)"),
+            [{"id": i, "rid": restaurant_id, "name": f"Insumo {i}"} for i in range(1, items + 1)],
+        )
+
+    offsets = sorted(rnd.randrange(seconds) for _ in range(movements))
+    done = 0
+    while done < movements:
+        chunk = offsets[done:done + INSERT_CHUNK]
+        rows = []
+        for offset in chunk:
+            qty = round(rnd.uniform(0.1, 2.0), 2)
+            kind = "entrada" if rnd.random() < 0.1 else "consumo"
+            rows.append({
+                "item_id": rnd.randint(1, items),
+                "movement_type": kind,
+                "quantity": qty * 12 if kind == "entrada" else -qty,
+                "reference_type": "bench",
+                "created_at": start + timedelta(seconds=offset),
+            })
+        with engine.begin() as conn:
+            conn.execute(
+                text("INSERT INTO inventory_movements (item_id, movement_type, quantity, reference_type, created_at) VALUES (:item_id, :movement_type, :quantity, :reference_type, :created_at)"),
+                rows,
+            )
+        done += len(chunk)
+
+    with engine.begin() as conn:
+        conn.execute(text(
+            "UPDATE inventory_items SET current_stock = "
+            "(SELECT COALESCE(SUM(quantity), 0) FROM inventory_movements WHERE item_id = inventory_items.id)"
+        ))
+
+
+def timed(fn, iterations: int):
+    latencies = []
+    started = time.perf_counter()
+    result = None
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        result = fn()
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+    return result, summarize_latencies(latencies, time.perf_counter() - started)
+
+
+def run(items: int, movements: int, days: int, iterations: int) -> dict:
+    import models  # noqa: F401
+    import inventory_snapshots
+    from db import Base, SessionLocal, engine
+
+    Base.metadata.create_all(bind=engine)
+    restaurant_id = 900
+    start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+
+    t0 = time.perf_counter()
+    seed(engine, restaurant_id, items, movements, days, start)
+    seed_s = time.perf_counter() - t0
+
+    db = SessionLocal()
+    try:
+        t0 = time.perf_counter()
+        first = inventory_snapshots.build_snapshots(db, restaurant_id, until=start + timedelta(days=days))
+        build_s = time.perf_counter() - t0
+
+        rnd = random.Random(11)
+        points = [start + timedelta(seconds=rnd.randrange(days * 86400)) for _ in range(iterations)]
+        cursor = {"i": 0}
+
+        def next_point():
+            at = points[cursor["i"] % len(points)]
+            cursor["i"] += 1
+            return at
+
+        _, kardex = timed(lambda: inventory_snapshots.stock_at_from_kardex(db, restaurant_id, next_point()), iterations)
+        cursor["i"] = 0
+        _, snap = timed(lambda: inventory_snapshots.stock_at(db, restaurant_id, next_point()), iterations)
+
+        mismatches = 0
+        for at in points[:5]:
+            a = inventory_snapshots.stock_at(db, restaurant_id, at)
+            b = inventory_snapshots.stock_at_from_kardex(db, restaurant_id, at)
+            mismatches += sum(1 for k in a if abs(a[k] - b[k]) > 0.001)
+
+        t0 = time.perf_counter()
+        incremental = inventory_snapshots.build_snapshots(db, restaurant_id, until=start + timedelta(days=days + 1))
+        incremental_s = time.perf_counter() - t0
+    finally:
+        db.close()
+
+    return {
+        "items": items,
+        "movements": movements,
+        "days": days,
+        "seed_s": round(seed_s, 2),
+        "initial_build": dict(first, elapsed_s=round(build_s, 3)),
+        "incremental_build": dict(incremental, elapsed_s=round(incremental_s, 3)),
+        "stock_at_kardex": kardex,
+        "stock_at_snapshot": snap,
+        "mismatches": mismatches,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de snapshots de inventario.")
+    parser.add_argument("--items", type=int, default=60)
+    parser.add_argument("--movements", type=int, default=2000000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--database-url", default="")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tmp}/inventory.db"
+        report = run(args.items, args.movements, args.days, args.iterations)
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+    return 1 if report["mismatches"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
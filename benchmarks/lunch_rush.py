@@ -0,0 +1,453 @@
+"""
+Prueba de carga "hora de almuerzo" contra un servidor corriendo.
+
+Simula en paralelo meseros, pantallas de cocina, cajeros y clientes de
+WhatsApp con el threadpool y el pool de conexiones por defecto, en etapas
+crecientes de carga, y reporta dónde se satura el throughput.
+
+Uso:
+    WHATSAPP_TOKEN= uvicorn main_v2:app --port 8000
+    python -m benchmarks.lunch_rush --base-url http://127.0.0.1:8000 --duration 60
+
+El servidor debe correr SIN WHATSAPP_TOKEN para no mandar mensajes reales.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import requests
+
+from benchmarks.common import percentile, write_json
+
+DEFAULT_MIX = {
+    "waiter": 15,
+    "kitchen": 4,
+    "cashier": 2,
+    "whatsapp": 200,
+}
+
+KITCHEN_POLL_SECONDS = 8.0
+
+
+# =========================
+# REGISTRO DE MÉTRICAS
+# =========================
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+
+    def add(self, route: str, latency_ms: float, error_kind: str = "") -> None:
+        with self._lock:
+            self.samples[route].append(latency_ms)
+            if error_kind:
+                self.errors[route][error_kind] += 1
+
+    def report(self, elapsed: float) -> dict:
+        with self._lock:
+            routes = {}
+            total = 0
+            total_errors = 0
+            errors_by_kind = defaultdict(int)
+            for route, values in self.samples.items():
+                route_errors = dict(self.errors.get(route, {}))
+                n_errors = sum(route_errors.values())
+                total += len(values)
+                total_errors += n_errors
+                for kind, n in route_errors.items():
+                    errors_by_kind[kind] += n
+                routes[route] = {
+                    "count": len(values),
+                    "errors": n_errors,
+                    "error_rate": round(n_errors / len(values), 4) if values else 0.0,
+                    "errors_by_kind": route_errors,
+                    "p50_ms": round(percentile(values, 50), 2),
+                    "p99_ms": round(percentile(values, 99), 2),
+                    "max_ms": round(max(values), 2) if values else 0.0,
+                }
+
+        return {
+            "requests": total,
+            "errors": total_errors,
+            "error_rate": round(total_errors / total, 4) if total else 0.0,
+            "errors_by_kind": dict(errors_by_kind),
+            "throughput_per_s": round(total / elapsed, 2) if elapsed > 0 else 0.0,
+            "routes": routes,
+        }
+
+
+def classify_error(status: int, data) -> str:
+    text = json.dumps(data, default=str).lower() if data is not None else ""
+    if "db_pool_timeout" in text or "queuepool limit" in text:
+        return "pool_timeout"
+    if "db_locked" in text or "database is locked" in text:
+        return "db_locked"
+    if status >= 500:
+        return "http_5xx"
+    if status >= 400:
+        return "http_4xx"
+    if isinstance(data, dict) and data.get("ok") is False:
+        return "app_error"
+    return ""
+
+
+class Api:
+    def __init__(self, base_url: str, restaurant: str, recorder: Recorder):
+        self.base_url = base_url.rstrip("/")
+        self.restaurant = restaurant
+        self.recorder = recorder
+        self.http = requests.Session()
+
+    def call(self, method: str, route: str, path: str, params: dict = None, json_body=None, tenant: bool = True):
+        query = dict(params or {})
+        if tenant:
+            query["restaurant"] = self.restaurant
+
+        t0 = time.perf_counter()
+        try:
+            resp = self.http.request(method, self.base_url + path, params=query, json=json_body, timeout=60)
+            try:
+                data = resp.json()
+            except ValueError:
+                data = resp.text
+            status = resp.status_code
+            error_kind = classify_error(status, data)
+        except requests.RequestException as e:
+            data = None
+            status = 0
+            error_kind = "timeout" if isinstance(e, requests.Timeout) else "connection"
+
+        self.recorder.add(f"{method} {route}", (time.perf_counter() - t0) * 1000.0, error_kind)
+        return status, data, error_kind
+
+
+# =========================
+# ACTORES
+# =========================
+
+class Actor(threading.Thread):
+    def __init__(self, api: Api, stop: threading.Event, think_scale: float):
+        super().__init__(daemon=True)
+        self.api = api
+        self.stop = stop
+        self.think_scale = think_scale
+
+    def think(self, low: float, high: float) -> None:
+        self.stop.wait(random.uniform(low, high) * self.think_scale)
+
+    def run(self):
+        while not self.stop.is_set():
+            try:
+                self.cycle()
+            except Exception as e:  # un actor nunca debe matar la prueba
+                self.api.recorder.add("actor_exception", 0.0, type(e).__name__)
+                self.think(0.5, 1.0)
+
+
+class Waiter(Actor):
+    def __init__(self, api, stop, think_scale, table_id: int, product_ids: list):
+        super().__init__(api, stop, think_scale)
+        self.table_id = table_id
+        self.product_ids = product_ids
+
+    def cycle(self):
+        self.api.call("GET", "/v2/api/floor", "/v2/api/floor")
+        self.think(0.5, 1.5)
+
+        status, data, err = self.api.call(
+            "POST", "/v2/api/local/open-ticket", "/v2/api/local/open-ticket",
+            json_body={"service_mode": "table", "table_id": self.table_id},
+        )
+        if err:
+            self.think(1.0, 2.0)
+            return
+        order_id = data["ticket"]["id"]
+        ticket_path = f"/v2/api/local/ticket/{order_id}"
+
+        for _ in range(random.randint(1, 3)):
+            self.think(1.0, 3.0)
+            picks = random.sample(self.product_ids, k=min(len(self.product_ids), random.randint(1, 3)))
+            self.api.call(
+                "POST", "/v2/api/local/ticket/{id}/items/add", ticket_path + "/items/add",
+                json_body={"items": [{"product_id": pid, "quantity": 1} for pid in picks]},
+            )
+            self.api.call(
+                "POST", "/v2/api/local/ticket/{id}/send-new-items", ticket_path + "/send-new-items",
+                json_body={},
+            )
+
+        self.think(2.0, 5.0)
+        status, data, err = self.api.call("GET", "/v2/api/local/ticket/{id}", ticket_path)
+        self.api.call("GET", "/v2/api/local/ticket/{id}/payments", ticket_path + "/payments")
+        if err:
+            return
+
+        total = float(data["ticket"]["total"] or 0)
+        half = round(total / 2, 2)
+        self.api.call(
+            "POST", "/v2/api/local/ticket/{id}/pay-split", ticket_path + "/pay-split",
+            json_body={"payments": [
+                {"method": "cash", "amount": half},
+                {"method": "card", "amount": round(total - half, 2)},
+            ]},
+        )
+        self.api.call(
+            "POST", "/v2/api/local/ticket/{id}/close", ticket_path + "/close",
+            json_body={"force_close": True},
+        )
+        self.think(1.0, 3.0)
+
+
+class KitchenScreen(Actor):
+    def cycle(self):
+        status, data, err = self.api.call("GET", "/v2/api/kitchen/orders", "/v2/api/kitchen/orders")
+        if not err and isinstance(data, dict):
+            preparing = [o for o in data.get("items", []) if o.get("status") == "preparing"]
+            if preparing:
+                order = random.choice(preparing)
+                self.api.call(
+                    "POST", "/v2/api/kitchen/orders/{id}/status",
+                    f"/v2/api/kitchen/orders/{order['id']}/status",
+                    params={"status": "ready"},
+                )
+        self.think(KITCHEN_POLL_SECONDS * 0.9, KITCHEN_POLL_SECONDS * 1.1)
+
+
+class Cashier(Actor):
+    def cycle(self):
+        self.api.call("GET", "/v2/api/orders", "/v2/api/orders")
+        self.api.call("GET", "/v2/api/delivery/pending", "/v2/api/delivery/pending")
+        self.api.call("GET", "/v2/api/summary", "/v2/api/summary")
+        self.think(2.0, 5.0)
+
+
+class WhatsAppCustomer(Actor):
+    def __init__(self, api, stop, think_scale, phone: str, product_id: int):
+        super().__init__(api, stop, think_scale)
+        self.phone = phone
+        self.product_id = product_id
+
+    def send(self, message: dict) -> None:
+        message = dict(message)
+        message["from"] = self.phone
+        payload = {"entry": [{"changes": [{"value": {
+            "metadata": {"phone_number_id": ""},
+            "contacts": [{"profile": {"name": "Carga"}}],
+            "messages": [message],
+        }}]}]}
+        self.api.call("POST", "/webhook/whatsapp", "/webhook/whatsapp", json_body=payload, tenant=False)
+        self.think(1.0, 4.0)
+
+    def reply(self, kind: str, reply_id: str, title: str) -> None:
+        self.send({"type": "interactive", "interactive": {"type": kind, kind: {"id": reply_id, "title": title}}})
+
+    def cycle(self):
+        pid = self.product_id
+        self.send({"type": "text", "text": {"body": "hola"}})
+        self.reply("list_reply", "main::menu", "Menú")
+        self.reply("list_reply", "cat::bebidas", "Bebidas")
+        self.reply("list_reply", f"prod::{pid}", "Producto")
+        self.reply("button_reply", f"add::{pid}", "Agregar")
+        self.reply("button_reply", "flow::pickup", "Retiro")
+        self.send({"type": "text", "text": {"body": "confirmar"}})
+        self.think(5.0, 15.0)
+
+
+# =========================
+# ETAPAS
+# =========================
+
+def prepare_fixtures(base_url: str, restaurant: str, waiters: int) -> dict:
+    api = Api(base_url, restaurant, Recorder())
+    tag = uuid.uuid4().hex[:6]
+
+    status, data, err = api.call(
+        "POST", "/v2/api/zones", "/v2/api/zones",
+        json_body={"name": f"Carga {tag}", "sort_order": 99},
+    )
+    if err:
+        raise RuntimeError(f"No se pudo crear zona de carga: {status} {data}")
+    zone_id = data["item"]["id"]
+
+    table_ids = []
+    for idx in range(waiters):
+        status, data, err = api.call(
+            "POST", "/v2/api/tables", "/v2/api/tables",
+            json_body={"zone_id": zone_id, "code": f"L{tag}-{idx}", "display_name": f"Carga {idx + 1}"},
+        )
+        if err:
+            raise RuntimeError(f"No se pudo crear mesa de carga: {status} {data}")
+        table_ids.append(data["item"]["id"])
+
+    status, data, err = api.call("GET", "/v2/api/products", "/v2/api/products")
+    products = data.get("items", []) if isinstance(data, dict) else []
+    if not products:
+        raise RuntimeError("El restaurante no tiene productos activos.")
+
+    whatsapp_product = next((p for p in products if p.get("category") == "Bebidas"), products[0])
+
+    return {
+        "tag": tag,
+        "table_ids": table_ids,
+        "product_ids": [p["id"] for p in products],
+        "whatsapp_product_id": whatsapp_product["id"],
+    }
+
+
+def fetch_db_metrics(base_url: str) -> dict:
+    try:
+        resp = requests.get(base_url.rstrip("/") + "/v2/api/diagnostics/db", timeout=10)
+        return resp.json().get("metrics", {})
+    except Exception:
+        return {}
+
+
+def metrics_delta(before: dict, after: dict) -> dict:
+    delta = {}
+    for key, value in after.items():
+        if isinstance(value, (int, float)) and isinstance(before.get(key), (int, float)):
+            delta[key] = round(value - before[key], 3)
+    delta["lock_wait_ms_max"] = after.get("lock_wait_ms_max", 0)
+    delta["pool_status"] = after.get("pool_status", "")
+    return delta
+
+
+def scale_mix(mix: dict, factor: float) -> dict:
+    return {k: max(1, int(round(v * factor))) if v else 0 for k, v in mix.items()}
+
+
+def run_stage(args, fixtures: dict, mix: dict) -> dict:
+    recorder = Recorder()
+    stop = threading.Event()
+    actors = []
+
+    def api():
+        return Api(args.base_url, args.restaurant, recorder)
+
+    table_ids = fixtures["table_ids"]
+    for i in range(mix["waiter"]):
+        actors.append(Waiter(api(), stop, args.think_scale, table_ids[i % len(table_ids)], fixtures["product_ids"]))
+    for _ in range(mix["kitchen"]):
+        actors.append(KitchenScreen(api(), stop, args.think_scale))
+    for _ in range(mix["cashier"]):
+        actors.append(Cashier(api(), stop, args.think_scale))
+    digits = str(int(fixtures["tag"], 16) % 1000).zfill(3)
+    for i in range(mix["whatsapp"]):
+        phone = f"5059{digits}{i:05d}"
+        actors.append(WhatsAppCustomer(api(), stop, args.think_scale, phone, fixtures["whatsapp_product_id"]))
+
+    before = fetch_db_metrics(args.base_url)
+    started = time.perf_counter()
+    random.shuffle(actors)
+    for actor in actors:
+        actor.start()
+        time.sleep(args.ramp_seconds / max(len(actors), 1))
+
+    stop.wait(args.duration)
+    stop.set()
+    for actor in actors:
+        actor.join(timeout=65)
+    elapsed = time.perf_counter() - started
+
+    result = recorder.report(elapsed)
+    result["mix"] = mix
+    result["elapsed_s"] = round(elapsed, 2)
+    result["db"] = metrics_delta(before, fetch_db_metrics(args.base_url))
+    return result
+
+
+def find_saturation(stages: list) -> dict:
+    """
+    La etapa de saturación es la primera donde subir la carga ya no sube el
+    throughput en proporción (menos de la mitad de lo esperado) o donde la
+    tasa de error pasa de 1%.
+    """
+    for prev, cur in zip(stages, stages[1:]):
+        load_gain = cur["factor"] / prev["factor"] if prev["factor"] else 0
+        prev_tp = prev["result"]["throughput_per_s"]
+        tp_gain = cur["result"]["throughput_per_s"] / prev_tp if prev_tp else 0
+        expected = 1 + (load_gain - 1) * 0.5
+        if tp_gain < expected or cur["result"]["error_rate"] > 0.01:
+            return {
+                "factor": cur["factor"],
+                "mix": cur["result"]["mix"],
+                "throughput_per_s": cur["result"]["throughput_per_s"],
+                "error_rate": cur["result"]["error_rate"],
+                "reason": "throughput_plateau" if tp_gain < expected else "error_rate",
+            }
+    return {}
+
+
+def print_report(report: dict) -> None:
+    print("")
+    print(f"{'factor':>6} {'actors':>7} {'req/s':>8} {'err%':>6} {'pool_to':>7} {'locked':>6} {'lockw':>6}  worst p99 route")
+    for stage in report["stages"]:
+        r = stage["result"]
+        worst = max(r["routes"].items(), key=lambda kv: kv[1]["p99_ms"], default=("-", {"p99_ms": 0}))
+        print(
+            f"{stage['factor']:>6.2f} {sum(r['mix'].values()):>7} {r['throughput_per_s']:>8.2f} "
+            f"{r['error_rate'] * 100:>5.1f}% {r['errors_by_kind'].get('pool_timeout', 0):>7} "
+            f"{r['errors_by_kind'].get('db_locked', 0):>6} {r['db'].get('lock_waits', 0):>6}  "
+            f"{worst[1]['p99_ms']:.0f}ms {worst[0]}"
+        )
+    sat = report.get("saturation") or {}
+    if sat:
+        print(f"\nSaturación en factor {sat['factor']} ({sat['reason']}), {sat['throughput_per_s']} req/s")
+    else:
+        print("\nNo se detectó saturación en las etapas probadas.")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Prueba de carga hora de almuerzo.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--restaurant", default="deaca")
+    parser.add_argument("--duration", type=float, default=60.0, help="segundos por etapa")
+    parser.add_argument("--stages", default="0.25,0.5,1.0,1.5")
+    parser.add_argument("--waiters", type=int, default=DEFAULT_MIX["waiter"])
+    parser.add_argument("--kitchens", type=int, default=DEFAULT_MIX["kitchen"])
+    parser.add_argument("--cashiers", type=int, default=DEFAULT_MIX["cashier"])
+    parser.add_argument("--customers", type=int, default=DEFAULT_MIX["whatsapp"])
+    parser.add_argument("--think-scale", type=float, default=1.0)
+    parser.add_argument("--ramp-seconds", type=float, default=5.0)
+    parser.add_argument("--json-out", default="")
+    args = parser.parse_args(argv)
+
+    base_mix = {
+        "waiter": args.waiters,
+        "kitchen": args.kitchens,
+        "cashier": args.cashiers,
+        "whatsapp": args.customers,
+    }
+    factors = [float(x) for x in args.stages.split(",") if x.strip()]
+
+    fixtures = prepare_fixtures(args.base_url, args.restaurant, scale_mix(base_mix, max(factors))["waiter"])
+
+    stages = []
+    for factor in factors:
+        mix = scale_mix(base_mix, factor)
+        print(f"Etapa x{factor}: {mix}", flush=True)
+        stages.append({"factor": factor, "result": run_stage(args, fixtures, mix)})
+
+    report = {
+        "base_url": args.base_url,
+        "duration_per_stage_s": args.duration,
+        "stages": stages,
+        "saturation": find_saturation(stages),
+    }
+
+    print_report(report)
+    if args.json_out:
+        write_json(args.json_out, report)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
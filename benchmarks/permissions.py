@@ -0,0 +1,157 @@
+"""
+Benchmark del resolvedor de permisos.
+
+Uso:
+    python -m benchmarks.permissions
+    python -m benchmarks.permissions --users 500 --iterations 2000
+
+Compara, para usuarios con rol y overrides:
+- naive_query: el chequeo con joins contra role_permissions/user_permissions
+  que haría cada request sin caché.
+- resolver_cold: compilar el bitset desde cero (caché invalidada).
+- resolver_warm: chequeo sobre el bitset cacheado.
+- request_*: POST /v2/api/orders/{id}/pay (orden inexistente, 404) con y sin
+  X-Session-Id, para ver el costo de la dependencia dentro de un request real.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.common import summarize_latencies
+
+ROLES = ("admin", "cashier", "staff")
+
+
+def seed(db, restaurant_id: int, users: int) -> list:
+    from models import Permission, RestaurantUser, UserPermission
+
+    rnd = random.Random(5)
+    permission_ids = [pid for (pid,) in db.query(Permission.id).all()]
+    rows = [
+        RestaurantUser(
+            restaurant_id=restaurant_id,
+            name=f"Usuario {i}",
+            pin_code=f"{i:04d}",
+            role_code=ROLES[i % len(ROLES)],
+        )
+        for i in range(users)
+    ]
+    db.add_all(rows)
+    db.flush()
+    for user in rows:
+        for pid in rnd.sample(permission_ids, 2):
+            db.add(UserPermission(user_id=user.id, permission_id=pid, is_allowed=rnd.random() < 0.5))
+    db.commit()
+    return [u.id for u in rows]
+
+
+def naive_has_permission(db, user_id: int, code: str) -> bool:
+    from models import Permission, RestaurantUser, RolePermission, UserPermission
+
+    override = (
+        db.query(UserPermission.is_allowed)
+        .join(Permission, Permission.id == UserPermission.permission_id)
+        .filter(UserPermission.user_id == user_id, Permission.code == code)
+        .scalar()
+    )
+    if override is not None:
+        return bool(override)
+    return (
+        db.query(RolePermission.id)
+        .join(Permission, Permission.id == RolePermission.permission_id)
+        .join(RestaurantUser, RestaurantUser.role_code == RolePermission.role_code)
+        .filter(RestaurantUser.id == user_id, RestaurantUser.is_active == True, Permission.code == code)  # noqa: E712
+        .first()
+        is not None
+    )
+
+
+def timed(fn, iterations: int) -> dict:
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+    return summarize_latencies(latencies, time.perf_counter() - started)
+
+
+def run(users: int, iterations: int) -> dict:
+    import main_v2
+    import permissions
+    from benchmarks.asgi_client import AsgiClient
+    from db import SessionLocal
+
+    client = AsgiClient(main_v2.app)
+    client.startup()
+
+    db = SessionLocal()
+    try:
+        user_ids = seed(db, 1, users)
+        code = "orders.pay"
+
+        mismatches = 0
+        for user_id in user_ids:
+            if permissions.has_permission(db, user_id, code) != naive_has_permission(db, user_id, code):
+                mismatches += 1
+
+        results = {
+            "naive_query": timed(lambda i: naive_has_permission(db, user_ids[i % users], code), iterations),
+        }
+
+        def cold(i):
+            permissions.invalidate()
+            permissions.has_permission(db, user_ids[i % users], code)
+
+        results["resolver_cold"] = timed(cold, iterations)
+        for user_id in user_ids:
+            permissions.resolve(db, user_id)
+        results["resolver_warm"] = timed(lambda i: permissions.has_permission(db, user_ids[i % users], code), iterations)
+    finally:
+        db.close()
+
+    admin_id = user_ids[0]  # rol admin: tiene orders.pay
+    params = {"restaurant": "deaca"}
+    status, started = client.post(
+        "/v2/api/sessions/start", params=params, json_body={"user_id": admin_id, "pin_code": "0000"},
+    )
+    if status != 200:
+        raise RuntimeError(f"sessions/start -> {status}: {started}")
+    results["request_without_user"] = timed(
+        lambda i: client.post("/v2/api/orders/999999/pay", params=params, json_body={"method": "cash", "amount": 1}),
+        iterations,
+    )
+    results["request_with_user"] = timed(
+        lambda i: client.post(
+            "/v2/api/orders/999999/pay",
+            params=params,
+            json_body={"method": "cash", "amount": 1},
+            headers={"X-Session-Id": str(started["session_id"])},
+        ),
+        iterations,
+    )
+    results["mismatches"] = mismatches
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark del resolvedor de permisos.")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/permissions.db"
+        os.environ.setdefault("WHATSAPP_TOKEN", "")
+        results = run(args.users, args.iterations)
+
+    print(json.dumps(results, indent=2, sort_keys=True))
+    return 1 if results["mismatches"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
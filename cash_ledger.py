@@ -0,0 +1,502 @@
+"""
+Libro de caja v2: cada pago y movimiento manual queda ligado a la sesión de
+caja abierta y suma en totales corridos por (tipo, método, moneda).
+
+- attach_payments(): se llama desde los endpoints de cobro dentro de su
+  transacción; fija OrderPayment.cash_session_id, agrega las entradas del
+  libro e incrementa cash_session_totals con UPDATE atómicos.
+- closing_preview(): lee la sesión y sus pocas filas de totales, sin
+  recorrer pagos ni movimientos.
+- reconcile_session(): vuelve a sumar las filas crudas (libro, pagos y
+  movimientos) y reporta o corrige diferencias con los totales guardados.
+
+CashSession.expected_amount se mantiene al día con el efectivo esperado en
+la moneda base del restaurante (setting "currency_default").
+
+Uso por consola:
+    python cash_ledger.py [--restaurant deaca] [--session 12] [--fix]
+"""
+import argparse
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, insert, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models.cash_models import CashLedgerEntry, CashMovement, CashSession, CashSessionTotal
+from models.core_models import RestaurantSetting
+from models.sales_models import OrderPayment
+from order_archive import SOURCES
+
+ENTRY_SALE = "sale"
+ENTRY_INCOME = "ingreso"
+ENTRY_WITHDRAWAL = "retiro"
+ENTRY_ADJUSTMENT = "ajuste"
+MANUAL_ENTRY_TYPES = (ENTRY_INCOME, ENTRY_WITHDRAWAL, ENTRY_ADJUSTMENT)
+
+METHOD_CASH = "cash"
+DEFAULT_CURRENCY = "NIO"
+
+TotalsKey = Tuple[str, str, str]
+
+
+class CashLedgerError(ValueError):
+    pass
+
+
+def _dec(value) -> Decimal:
+    return Decimal(str(value or 0))
+
+
+def base_currency(db: Session, restaurant_id: int) -> str:
+    raw = (
+        db.query(RestaurantSetting.setting_value)
+        .filter(
+            RestaurantSetting.restaurant_id == restaurant_id,
+            RestaurantSetting.setting_key == "currency_default",
+        )
+        .scalar()
+    )
+    return ((raw or "").strip().strip('"') or DEFAULT_CURRENCY).upper()
+
+
+def normalize_currency(value: Optional[str], default: str) -> str:
+    value = (value or "").strip().upper()
+    if not value:
+        return default
+    if len(value) != 3 or not value.isalpha():
+        raise CashLedgerError(f"Moneda inválida: {value}")
+    return value
+
+
+def payment_currency(db: Session, restaurant_id: int, value: Optional[str]) -> str:
+    """
+    Moneda de un cobro. El monto se aplica tal cual al saldo de la orden, que
+    está en la moneda base, y no hay tipo de cambio configurado: cualquier
+    otra moneda se rechaza.
+    """
+    currency_base = base_currency(db, restaurant_id)
+    currency = normalize_currency(value, currency_base)
+    if currency != currency_base:
+        raise CashLedgerError(f"Solo se aceptan cobros en {currency_base}: no hay tipo de cambio configurado.")
+    return currency
+
+
+def get_open_session(db: Session, restaurant_id: int) -> Optional[CashSession]:
+    return (
+        db.query(CashSession)
+        .filter(
+            CashSession.restaurant_id == restaurant_id,
+            CashSession.is_open == True,  # noqa: E712
+        )
+        .order_by(CashSession.id.desc())
+        .first()
+    )
+
+
+def ensure_schema(engine) -> None:
+    """
+    create_all no agrega columnas a order_payments ni índices a
+    cash_sessions si las tablas ya existían. Con dos cajas abiertas en un
+    mismo restaurante uq_cash_session_open no se puede crear y falla con
+    RuntimeError.
+    """
+    inspector = inspect(engine)
+    for table in ("order_payments", "order_payments_archive"):
+        if not inspector.has_table(table):
+            continue
+        columns = {c["name"] for c in inspector.get_columns(table)}
+        for name in ("tendered_amount", "change_amount"):
+            if name not in columns:
+                with engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} NUMERIC(10, 2)"))
+
+    if inspector.has_table("cash_sessions"):
+        indexes = {ix["name"] for ix in inspector.get_indexes("cash_sessions")}
+        if "uq_cash_session_open" not in indexes:
+            index = next(ix for ix in CashSession.__table__.indexes if ix.name == "uq_cash_session_open")
+            try:
+                index.create(bind=engine)
+            except IntegrityError:
+                # sin el índice nada impide abrir dos cajas: no se arranca
+                # hasta cerrar a mano las sobrantes
+                with engine.connect() as conn:
+                    duplicated = conn.execute(text(
+                        "SELECT restaurant_id FROM cash_sessions WHERE is_open "
+                        "GROUP BY restaurant_id HAVING COUNT(*) > 1"
+                    )).scalars().all()
+                raise RuntimeError(
+                    "No se pudo crear uq_cash_session_open: los restaurantes "
+                    f"{', '.join(str(r) for r in duplicated)} tienen más de una caja abierta. "
+                    "Cerrá las sobrantes y volvé a arrancar."
+                )
+
+
+# =========================
+# TOTALES CORRIDOS
+# =========================
+
+def _bump_total(db: Session, session_id: int, key: TotalsKey, amount: Decimal, count: int) -> None:
+    entry_type, method, currency = key
+    match = (
+        CashSessionTotal.session_id == session_id,
+        CashSessionTotal.entry_type == entry_type,
+        CashSessionTotal.method == method,
+        CashSessionTotal.currency == currency,
+    )
+    values = {
+        CashSessionTotal.amount: CashSessionTotal.amount + amount,
+        CashSessionTotal.entries_count: CashSessionTotal.entries_count + count,
+    }
+
+    updated = db.query(CashSessionTotal).filter(*match).update(values, synchronize_session=False)
+    if updated:
+        return
+
+    try:
+        with db.begin_nested():
+            db.add(CashSessionTotal(
+                session_id=session_id,
+                entry_type=entry_type,
+                method=method,
+                currency=currency,
+                amount=amount,
+                entries_count=count,
+            ))
+    except IntegrityError:
+        # otro proceso creó la fila entre el UPDATE y el INSERT
+        db.query(CashSessionTotal).filter(*match).update(values, synchronize_session=False)
+
+
+def _post_entries(db: Session, session: CashSession, entries: List[dict], currency_base: str) -> None:
+    if not entries:
+        return
+
+    db.execute(insert(CashLedgerEntry), entries)
+
+    grouped: Dict[TotalsKey, list] = defaultdict(lambda: [Decimal("0"), 0])
+    for e in entries:
+        acc = grouped[(e["entry_type"], e["method"], e["currency"])]
+        acc[0] += e["amount"]
+        acc[1] += 1
+
+    expected_delta = Decimal("0")
+    for key, (amount, count) in grouped.items():
+        _bump_total(db, session.id, key, amount, count)
+        if key[1] == METHOD_CASH and key[2] == currency_base:
+            expected_delta += amount
+
+    if expected_delta:
+        db.query(CashSession).filter(CashSession.id == session.id).update(
+            {CashSession.expected_amount: func.coalesce(CashSession.expected_amount, 0) + expected_delta},
+            synchronize_session=False,
+        )
+
+
+def attach_payments(
+    db: Session,
+    restaurant_id: int,
+    payments: Iterable[OrderPayment],
+    currencies: Optional[Dict[int, str]] = None,
+) -> Optional[int]:
+    """
+    Liga los pagos recién creados a la sesión abierta. currencies mapea
+    id(payment) -> moneda; los que no estén usan la moneda base. Sin sesión
+    abierta los pagos quedan sin sesión y no se bloquea el cobro.
+    """
+    payments = list(payments)
+    if not payments:
+        return None
+
+    session = get_open_session(db, restaurant_id)
+    if not session:
+        return None
+
+    for p in payments:
+        p.cash_session_id = session.id
+    db.flush()
+
+    currency_base = base_currency(db, restaurant_id)
+    currencies = currencies or {}
+    entries = [
+        {
+            "session_id": session.id,
+            "restaurant_id": restaurant_id,
+            "entry_type": ENTRY_SALE,
+            "method": (p.method or "").lower(),
+            "currency": currencies.get(id(p)) or currency_base,
+            "amount": _dec(p.amount),
+            "payment_id": p.id,
+        }
+        for p in payments
+    ]
+    _post_entries(db, session, entries, currency_base)
+    return session.id
+
+
+# =========================
+# APERTURA / MOVIMIENTOS / CIERRE
+# =========================
+
+def open_session(db: Session, restaurant_id: int, opening_amount: Decimal, user_id: Optional[int] = None) -> CashSession:
+    if get_open_session(db, restaurant_id):
+        raise CashLedgerError("Ya hay una caja abierta.")
+    opening_amount = _dec(opening_amount)
+    if opening_amount < 0:
+        raise CashLedgerError("El fondo inicial no puede ser negativo.")
+
+    session = CashSession(
+        restaurant_id=restaurant_id,
+        opened_by_user_id=user_id,
+        opening_amount=opening_amount,
+        expected_amount=opening_amount,
+        is_open=True,
+    )
+    try:
+        # uq_cash_session_open frena la apertura que perdió la carrera
+        with db.begin_nested():
+            db.add(session)
+    except IntegrityError:
+        raise CashLedgerError("Ya hay una caja abierta.")
+    return session
+
+
+def record_movement(
+    db: Session,
+    session: CashSession,
+    movement_type: str,
+    amount: Decimal,
+    description: str = "",
+    currency: Optional[str] = None,
+    user_id: Optional[int] = None,
+) -> CashMovement:
+    if not session.is_open:
+        raise CashLedgerError("La caja está cerrada.")
+    movement_type = (movement_type or "").strip().lower()
+    if movement_type not in MANUAL_ENTRY_TYPES:
+        raise CashLedgerError(f"movement_type debe ser uno de: {', '.join(MANUAL_ENTRY_TYPES)}")
+
+    amount = _dec(amount)
+    if movement_type != ENTRY_ADJUSTMENT and amount <= 0:
+        raise CashLedgerError("El monto debe ser mayor que cero.")
+    if not amount:
+        raise CashLedgerError("El monto no puede ser cero.")
+
+    currency_base = base_currency(db, session.restaurant_id)
+    currency = normalize_currency(currency, currency_base)
+    signed = -amount if movement_type == ENTRY_WITHDRAWAL else amount
+
+    movement = CashMovement(
+        session_id=session.id,
+        movement_type=movement_type,
+        amount=amount,
+        description=description or "",
+        created_by_user_id=user_id,
+    )
+    db.add(movement)
+    db.flush()
+
+    _post_entries(db, session, [{
+        "session_id": session.id,
+        "restaurant_id": session.restaurant_id,
+        "entry_type": movement_type,
+        "method": METHOD_CASH,
+        "currency": currency,
+        "amount": signed,
+        "movement_id": movement.id,
+    }], currency_base)
+    return movement
+
+
+def closing_preview(db: Session, session: CashSession) -> dict:
+    rows = (
+        db.query(CashSessionTotal)
+        .filter(CashSessionTotal.session_id == session.id)
+        .all()
+    )
+    currency_base = base_currency(db, session.restaurant_id)
+
+    by_method: Dict[str, Dict[str, float]] = defaultdict(dict)
+    expected_cash: Dict[str, Decimal] = defaultdict(Decimal)
+    expected_cash[currency_base] += _dec(session.opening_amount)
+    manual: Dict[str, Dict[str, float]] = defaultdict(dict)
+    sales_count = 0
+
+    for r in rows:
+        amount = _dec(r.amount)
+        if r.entry_type == ENTRY_SALE:
+            by_method[r.method][r.currency] = float(amount)
+            sales_count += int(r.entries_count or 0)
+        else:
+            manual[r.entry_type][r.currency] = float(amount)
+        if r.method == METHOD_CASH:
+            expected_cash[r.currency] += amount
+
+    return {
+        "session_id": session.id,
+        "is_open": bool(session.is_open),
+        "currency_base": currency_base,
+        "opening_amount": float(session.opening_amount or 0),
+        "sales_by_method": dict(by_method),
+        "sales_count": sales_count,
+        "manual_movements": dict(manual),
+        "expected_cash": {k: float(v) for k, v in expected_cash.items()},
+        "expected_amount": float(session.expected_amount or 0),
+        "opened_at": str(session.opened_at or ""),
+    }
+
+
+def close_session(db: Session, session: CashSession, closing_amount: Decimal) -> dict:
+    if not session.is_open:
+        raise CashLedgerError("La caja ya está cerrada.")
+    closing_amount = _dec(closing_amount)
+    if closing_amount < 0:
+        raise CashLedgerError("El monto contado no puede ser negativo.")
+
+    db.refresh(session)
+    session.closing_amount = closing_amount
+    session.difference = closing_amount - _dec(session.expected_amount)
+    session.is_open = False
+    session.closed_at = datetime.utcnow()
+    db.flush()
+    return closing_preview(db, session)
+
+
+# =========================
+# CONCILIACIÓN
+# =========================
+
+def _money(value) -> Decimal:
+    return _dec(value).quantize(Decimal("0.01"))
+
+
+def reconcile_session(db: Session, session_id: int, fix: bool = False) -> dict:
+    session = db.query(CashSession).filter(CashSession.id == session_id).first()
+    if not session:
+        raise CashLedgerError(f"Sesión no encontrada: {session_id}")
+
+    ledger = {
+        (t, m, c): (_money(a), int(n))
+        for t, m, c, a, n in db.query(
+            CashLedgerEntry.entry_type,
+            CashLedgerEntry.method,
+            CashLedgerEntry.currency,
+            func.sum(CashLedgerEntry.amount),
+            func.count(CashLedgerEntry.id),
+        )
+        .filter(CashLedgerEntry.session_id == session_id)
+        .group_by(CashLedgerEntry.entry_type, CashLedgerEntry.method, CashLedgerEntry.currency)
+        .all()
+    }
+    stored = {
+        (r.entry_type, r.method, r.currency): (_money(r.amount), int(r.entries_count or 0))
+        for r in db.query(CashSessionTotal).filter(CashSessionTotal.session_id == session_id).all()
+    }
+
+    issues = []
+    for key in sorted(set(ledger) | set(stored)):
+        want = ledger.get(key, (Decimal("0.00"), 0))
+        have = stored.get(key, (Decimal("0.00"), 0))
+        if want != have:
+            issues.append({"check": "totals", "key": list(key), "ledger": [float(want[0]), want[1]], "stored": [float(have[0]), have[1]]})
+
+    # pagos crudos vs entradas de venta del libro (por método)
+    # incluye los pagos ya archivados (order_archive.py)
+    payments: Dict[str, Decimal] = defaultdict(Decimal)
+    for _, _, payment_model in SOURCES:
+        for m, a in (
+            db.query(payment_model.method, func.sum(payment_model.amount))
+            .filter(payment_model.cash_session_id == session_id)
+            .group_by(payment_model.method)
+            .all()
+        ):
+            payments[(m or "").lower()] += _money(a)
+    ledger_sales: Dict[str, Decimal] = defaultdict(Decimal)
+    for (t, m, _c), (a, _n) in ledger.items():
+        if t == ENTRY_SALE:
+            ledger_sales[m] += a
+    for method in sorted(set(payments) | set(ledger_sales)):
+        if payments.get(method, Decimal("0.00")) != ledger_sales.get(method, Decimal("0.00")):
+            issues.append({"check": "payments", "method": method, "payments": float(payments.get(method, 0)), "ledger": float(ledger_sales.get(method, 0))})
+
+    # movimientos manuales crudos vs libro (por tipo, sin signo)
+    movements = {
+        t: _money(a)
+        for t, a in db.query(CashMovement.movement_type, func.sum(CashMovement.amount))
+        .filter(CashMovement.session_id == session_id)
+        .group_by(CashMovement.movement_type)
+        .all()
+    }
+    ledger_manual: Dict[str, Decimal] = defaultdict(Decimal)
+    for (t, _m, _c), (a, _n) in ledger.items():
+        if t in MANUAL_ENTRY_TYPES:
+            ledger_manual[t] += -a if t == ENTRY_WITHDRAWAL else a
+    for movement_type in sorted(set(movements) | set(ledger_manual)):
+        if movements.get(movement_type, Decimal("0.00")) != ledger_manual.get(movement_type, Decimal("0.00")):
+            issues.append({"check": "movements", "movement_type": movement_type, "movements": float(movements.get(movement_type, 0)), "ledger": float(ledger_manual.get(movement_type, 0))})
+
+    currency_base = base_currency(db, session.restaurant_id)
+    expected = _money(session.opening_amount) + sum(
+        (a for (t, m, c), (a, _n) in ledger.items() if m == METHOD_CASH and c == currency_base),
+        Decimal("0.00"),
+    )
+    if _money(session.expected_amount) != expected:
+        issues.append({"check": "expected_amount", "ledger": float(expected), "stored": float(session.expected_amount or 0)})
+
+    fixed = False
+    if fix and any(i["check"] in ("totals", "expected_amount") for i in issues):
+        db.query(CashSessionTotal).filter(CashSessionTotal.session_id == session_id).delete(synchronize_session=False)
+        totals = [
+            {"session_id": session_id, "entry_type": t, "method": m, "currency": c, "amount": a, "entries_count": n}
+            for (t, m, c), (a, n) in ledger.items()
+        ]
+        if totals:
+            db.execute(insert(CashSessionTotal), totals)
+        session.expected_amount = expected
+        if not session.is_open and session.closing_amount is not None:
+            session.difference = _money(session.closing_amount) - expected
+        db.commit()
+        fixed = True
+
+    return {"session_id": session_id, "balanced": not issues, "issues": issues, "fixed": fixed}
+
+
+def main(argv=None) -> int:
+    from db import Base, SessionLocal, engine
+    import models  # noqa: F401  registra todas las tablas
+    from models.core_models import Restaurant
+
+    parser = argparse.ArgumentParser(description="Concilia los totales de caja contra el libro, pagos y movimientos.")
+    parser.add_argument("--restaurant", default="", help="slug; vacío = todos")
+    parser.add_argument("--session", type=int, default=0, help="una sesión; vacío = las abiertas")
+    parser.add_argument("--fix", action="store_true", help="reescribe los totales desde el libro")
+    args = parser.parse_args(argv)
+
+    Base.metadata.create_all(bind=engine)
+
+    db = SessionLocal()
+    try:
+        query = db.query(CashSession.id)
+        if args.session:
+            query = query.filter(CashSession.id == args.session)
+        else:
+            query = query.filter(CashSession.is_open == True)  # noqa: E712
+        if args.restaurant:
+            query = query.join(Restaurant, Restaurant.id == CashSession.restaurant_id).filter(Restaurant.slug == args.restaurant)
+
+        failed = 0
+        for (session_id,) in query.order_by(CashSession.id).all():
+            result = reconcile_session(db, session_id, fix=args.fix)
+            failed += 0 if result["balanced"] else 1
+            print(result)
+    finally:
+        db.close()
+
+    return 1 if failed and not args.fix else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,219 @@
+"""
+Versión del catálogo por restaurante y sincronización por deltas.
+
+- catalog_versions guarda un contador por restaurante. record_changes() lo
+  sube una vez por transacción y anota en catalog_changes qué productos o
+  categorías tocó esa versión. Los endpoints que modifican productos lo
+  llaman antes del commit; product_categories lo llama en renombrar,
+  fusionar y crear categorías.
+- El UPDATE del contador bloquea la fila hasta el commit, así las versiones
+  se confirman en orden y un cliente que leyó la versión N no puede perderse
+  un cambio con versión <= N.
+- catalog_delta(since) devuelve solo los productos/categorías con cambios
+  posteriores a since: los que siguen activos van completos, el resto como
+  removidos. Sin since, con since fuera de rango o anterior a lo que ya se
+  podó, devuelve el snapshot completo.
+
+Formato compacto: cada producto es una lista en el orden de PRODUCT_FIELDS
+y cada categoría en el de CATEGORY_FIELDS. La disponibilidad (lista 86) no
+forma parte del catálogo; va por /v2/api/availability.
+"""
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models.inventory_models import CatalogChange, CatalogVersion, Product, ProductCategory
+
+PRODUCT_FIELDS = ["id", "name", "category_id", "price", "description", "image_url"]
+CATEGORY_FIELDS = ["id", "name", "sort_order", "whatsapp_visible"]
+
+ENTITY_PRODUCT = "product"
+ENTITY_CATEGORY = "category"
+
+# cada CHANGE_PRUNE_EVERY versiones se borran los cambios más viejos que
+# CHANGE_RETENTION_VERSIONS; un cliente tan atrasado recibe snapshot completo
+CHANGE_RETENTION_VERSIONS = 5000
+CHANGE_PRUNE_EVERY = 500
+
+_SESSION_KEY = "catalog_versions"
+
+_lock = threading.Lock()
+_snapshots: Dict[int, Tuple[int, dict]] = {}
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _after_transaction_end(session, transaction):
+    # after_commit también se dispara al liberar un SAVEPOINT; la versión
+    # vale hasta que termina la transacción de afuera
+    if transaction.parent is None:
+        session.info.pop(_SESSION_KEY, None)
+
+
+# =========================
+# ESCRITURA
+# =========================
+
+def _bump(db: Session, restaurant_id: int) -> int:
+    match = CatalogVersion.restaurant_id == restaurant_id
+    values = {CatalogVersion.version: CatalogVersion.version + 1}
+
+    updated = db.query(CatalogVersion).filter(match).update(values, synchronize_session=False)
+    if not updated:
+        try:
+            with db.begin_nested():
+                db.add(CatalogVersion(restaurant_id=restaurant_id, version=1, min_version=0))
+        except IntegrityError:
+            # otro proceso creó la fila entre el UPDATE y el INSERT
+            db.query(CatalogVersion).filter(match).update(values, synchronize_session=False)
+
+    return db.query(CatalogVersion.version).filter(match).scalar()
+
+
+def transaction_version(db: Session, restaurant_id: int) -> int:
+    versions = db.info.setdefault(_SESSION_KEY, {})
+    if restaurant_id not in versions:
+        versions[restaurant_id] = _bump(db, restaurant_id)
+    return versions[restaurant_id]
+
+
+def _prune(db: Session, restaurant_id: int, version: int) -> None:
+    floor = version - CHANGE_RETENTION_VERSIONS
+    if floor <= 0:
+        return
+    db.query(CatalogChange).filter(
+        CatalogChange.restaurant_id == restaurant_id,
+        CatalogChange.version <= floor,
+    ).delete(synchronize_session=False)
+    db.query(CatalogVersion).filter(CatalogVersion.restaurant_id == restaurant_id).update(
+        {CatalogVersion.min_version: floor}, synchronize_session=False,
+    )
+
+
+def record_changes(
+    db: Session,
+    restaurant_id: int,
+    product_ids: Iterable[int] = (),
+    category_ids: Iterable[int] = (),
+) -> int:
+    """
+    Anota los cambios en la transacción de db. El commit queda del lado del
+    que llama.
+    """
+    rows = [(ENTITY_PRODUCT, int(x)) for x in set(product_ids) if x is not None]
+    rows += [(ENTITY_CATEGORY, int(x)) for x in set(category_ids) if x is not None]
+
+    version = transaction_version(db, restaurant_id)
+    if rows:
+        db.execute(insert(CatalogChange), [
+            {"restaurant_id": restaurant_id, "version": version, "entity_type": t, "entity_id": i}
+            for t, i in rows
+        ])
+    if version % CHANGE_PRUNE_EVERY == 0:
+        _prune(db, restaurant_id, version)
+    return version
+
+
+# =========================
+# LECTURA
+# =========================
+
+def current_version(db: Session, restaurant_id: int) -> Tuple[int, int]:
+    row = (
+        db.query(CatalogVersion.version, CatalogVersion.min_version)
+        .filter(CatalogVersion.restaurant_id == restaurant_id)
+        .first()
+    )
+    return (int(row[0]), int(row[1] or 0)) if row else (0, 0)
+
+
+def _product_columns():
+    return (Product.id, Product.name, Product.category_id, Product.price, Product.description, Product.image_url)
+
+
+def _product_row(row) -> list:
+    pid, name, category_id, price, description, image_url = row
+    return [pid, name or "", category_id, float(price or 0), description or "", image_url or ""]
+
+
+def _category_row(c: ProductCategory) -> list:
+    return [c.id, c.name, int(c.sort_order or 0), bool(c.whatsapp_visible)]
+
+
+def _active_products(db: Session, restaurant_id: int, ids: Optional[List[int]] = None) -> List[list]:
+    query = db.query(*_product_columns()).filter(
+        Product.restaurant_id == restaurant_id,
+        Product.is_active == True,  # noqa: E712
+    )
+    if ids is not None:
+        query = query.filter(Product.id.in_(ids))
+    return [_product_row(r) for r in query.order_by(Product.id.asc()).all()]
+
+
+def _categories(db: Session, restaurant_id: int, ids: Optional[List[int]] = None) -> List[list]:
+    query = db.query(ProductCategory).filter(ProductCategory.restaurant_id == restaurant_id)
+    if ids is not None:
+        query = query.filter(ProductCategory.id.in_(ids))
+    return [_category_row(c) for c in query.order_by(ProductCategory.sort_order.asc(), ProductCategory.id.asc()).all()]
+
+
+def catalog_snapshot(db: Session, restaurant_id: int) -> dict:
+    version, _ = current_version(db, restaurant_id)
+    with _lock:
+        cached = _snapshots.get(restaurant_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    snapshot = {
+        "version": version,
+        "full": True,
+        "product_fields": PRODUCT_FIELDS,
+        "category_fields": CATEGORY_FIELDS,
+        "products": _active_products(db, restaurant_id),
+        "categories": _categories(db, restaurant_id),
+        "removed_products": [],
+        "removed_categories": [],
+    }
+    with _lock:
+        _snapshots[restaurant_id] = (version, snapshot)
+    return snapshot
+
+
+def catalog_delta(db: Session, restaurant_id: int, since: Optional[int]) -> dict:
+    version, min_version = current_version(db, restaurant_id)
+    if since is None or since <= 0 or since < min_version or since > version:
+        return catalog_snapshot(db, restaurant_id)
+
+    product_ids, category_ids = set(), set()
+    if since < version:
+        for entity_type, entity_id in (
+            db.query(CatalogChange.entity_type, CatalogChange.entity_id)
+            .filter(
+                CatalogChange.restaurant_id == restaurant_id,
+                CatalogChange.version > since,
+                CatalogChange.version <= version,
+            )
+            .distinct()
+        ):
+            (product_ids if entity_type == ENTITY_PRODUCT else category_ids).add(entity_id)
+
+    products = _active_products(db, restaurant_id, sorted(product_ids)) if product_ids else []
+    categories = _categories(db, restaurant_id, sorted(category_ids)) if category_ids else []
+
+    return {
+        "version": version,
+        "full": False,
+        "product_fields": PRODUCT_FIELDS,
+        "category_fields": CATEGORY_FIELDS,
+        "products": products,
+        "categories": categories,
+        "removed_products": sorted(product_ids - {p[0] for p in products}),
+        "removed_categories": sorted(category_ids - {c[0] for c in categories}),
+    }
+
+
+def reset() -> None:
+    with _lock:
+        _snapshots.clear()
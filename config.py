@@ -17,9 +17,36 @@ class Settings:
     database_url: str = _normalize_database_url(
         os.getenv("DATABASE_URL", "sqlite:///./local.db")
     )
+    # shards extra además de la default: "grande=postgresql://...,sur=sqlite:///./sur.db"
+    database_shards: str = os.getenv("DATABASE_SHARDS", "").strip()
+
+    # réplica de lectura opcional para reportes y listados; después de una
+    # escritura el mismo cliente lee del primario READ_YOUR_WRITES_SECONDS
+    replica_database_url: str = _normalize_database_url(os.getenv("DATABASE_REPLICA_URL", ""))
+    read_your_writes_seconds: float = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+    # pool de conexiones; sin pre_ping por defecto: pool_recycle ya descarta
+    # las conexiones viejas y el ping es un round trip más por checkout
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    db_max_overflow: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    db_pool_timeout: float = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+    db_pool_recycle: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    db_pool_pre_ping: bool = os.getenv("DB_POOL_PRE_PING", "0").strip() == "1"
+
+    # perfil SQLite: WAL + busy_timeout para que los escritores esperen en
+    # vez de fallar con "database is locked"
+    sqlite_busy_timeout_ms: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    sqlite_synchronous: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").strip().upper()
+    sqlite_mmap_size: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+    # "auto": async solo con Postgres; en SQLite local aiosqlite rinde
+    # menos que el threadpool (ver benchmarks/async_concurrency.py)
+    async_db: str = os.getenv("ASYNC_DB", "auto").strip().lower()
 
     admin_pin: str = os.getenv("ADMIN_PIN", "1234").strip()
-    admin_api_token: str = os.getenv("ADMIN_API_TOKEN", "1234").strip()
+    # token de plataforma (X-Admin-Token) para cambios que valen para todos
+    # los restaurantes; vacío los deja cerrados
+    admin_api_token: str = os.getenv("ADMIN_API_TOKEN", "").strip()
 
     secret_key: str = os.getenv("SECRET_KEY", "nicalia-dev-secret-key").strip()
 
@@ -28,6 +55,21 @@ class Settings:
         os.getenv("DEFAULT_IDLE_TIMEOUT_SECONDS", "300")
     )
 
+    export_dir: str = os.getenv("EXPORT_DIR", "./exports").strip()
+    export_workers: int = int(os.getenv("EXPORT_WORKERS", "2"))
+
+    # órdenes cerradas hace más de ORDER_ARCHIVE_DAYS pasan a las tablas
+    # *_archive (0 apaga el archivado); el hilo corre cada INTERVAL
+    order_archive_days: int = int(os.getenv("ORDER_ARCHIVE_DAYS", "90"))
+    order_archive_interval_seconds: float = float(os.getenv("ORDER_ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+    # sin X-Session-Id las rutas de operación pasan hasta que los POS manden
+    # sesión (las pantallas de main_v2 todavía no la mandan). Las de admin y
+    # la lectura de permisos piden sesión siempre; ver permissions.py. El
+    # corte por inactividad (session_activity) solo aplica a los requests que
+    # mandan X-Session-Id: con PERMISSIONS_ENFORCED=0 es opcional para el POS
+    permissions_enforced: bool = os.getenv("PERMISSIONS_ENFORCED", "0").strip() == "1"
+
     owner_role_code: str = "owner"
     admin_role_code: str = "admin"
 
@@ -35,6 +77,19 @@ class Settings:
     def is_sqlite(self) -> bool:
         return self.database_url.startswith("sqlite")
 
+    @property
+    def shard_urls(self) -> dict:
+        urls = {}
+        for part in self.database_shards.split(","):
+            name, sep, url = part.partition("=")
+            if sep and name.strip() and url.strip():
+                urls[name.strip()] = _normalize_database_url(url)
+        return urls
+
+    @property
+    def has_replica(self) -> bool:
+        return bool(self.replica_database_url)
+
     @property
     def is_production(self) -> bool:
         return self.app_env == "production"
@@ -1,19 +1,148 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+from typing import Optional
 
+from fastapi import Query
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+import db_metrics
 from config import settings
 
-connect_args = {}
+SQLITE_SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+# session.info[READ_REPLICA_KEY] = True manda las lecturas a la réplica
+READ_REPLICA_KEY = "read_replica"
+# session.info[READ_ONLY_KEY] = True: sus lecturas abren con BEGIN DEFERRED
+READ_ONLY_KEY = "read_only"
+SQLITE_BEGIN_OPTION = "sqlite_begin"
+
+
+def is_sqlite_memory(url: str) -> bool:
+    path = url.split("://", 1)[-1].strip("/")
+    return url.startswith("sqlite") and (not path or path.endswith(":memory:"))
+
+
+def engine_options(url: str, pool_class=QueuePool) -> dict:
+    """
+    Opciones de create_engine según settings. SQLite en memoria usa el pool
+    por hilo de SQLAlchemy y no acepta tamaños de pool.
+    """
+    options = {"pool_pre_ping": settings.db_pool_pre_ping}
+
+    if url.startswith("sqlite"):
+        options["connect_args"] = {
+            "check_same_thread": False,
+            "timeout": settings.sqlite_busy_timeout_ms / 1000.0,
+        }
+        if is_sqlite_memory(url):
+            return options
+
+    options.update(
+        poolclass=db_metrics.timed_pool(pool_class),
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+    )
+    return options
+
+
+# =========================
+# PERFIL SQLITE
+# =========================
+
+def install_sqlite_profile(engine) -> None:
+    """
+    Pragmas por conexión (WAL, busy_timeout, synchronous, mmap) y BEGIN
+    IMMEDIATE explícito. Con isolation_level=None el driver no abre
+    transacciones por su cuenta: el BEGIN lo emite SQLAlchemy al empezar
+    cada transacción, así que un begin_nested() es un SAVEPOINT de verdad
+    dentro de ella y su RELEASE no confirma nada. IMMEDIATE toma el lock de
+    escritura en ese BEGIN (esperando hasta busy_timeout si otro lo tiene):
+    la transacción ve un solo snapshot de principio a fin y no puede fallar
+    con SQLITE_BUSY_SNAPSHOT al escribir después de leer.
+
+    El costo es que dos transacciones abiertas no conviven aunque solo lean:
+    un request que ya leyó no debe abrir otra sesión contra la misma base
+    sin cerrar antes la suya. Las sesiones de solo lectura (READ_ONLY_KEY)
+    abren con BEGIN DEFERRED y no le quitan el lock a nadie.
+    """
+    synchronous = settings.sqlite_synchronous
+    if synchronous not in SQLITE_SYNCHRONOUS_MODES:
+        synchronous = "NORMAL"
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        try:
+            # WAL: los lectores no bloquean al escritor ni al revés
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+            # con WAL, NORMAL solo arriesga la última transacción si se cae
+            # el sistema operativo, no si se cae el proceso
+            cursor.execute(f"PRAGMA synchronous={synchronous}")
+            cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+        finally:
+            cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def _begin(conn):
+        mode = conn.get_execution_options().get(SQLITE_BEGIN_OPTION, "IMMEDIATE")
+        conn.exec_driver_sql(f"BEGIN {mode}")
+
+
+_deferred_engines = {}
+
+
+def deferred_engine(bind):
+    """El mismo engine (y pool) con BEGIN DEFERRED, para lecturas."""
+    deferred = _deferred_engines.get(bind)
+    if deferred is None:
+        deferred = _deferred_engines.setdefault(bind, bind.execution_options(**{SQLITE_BEGIN_OPTION: "DEFERRED"}))
+    return deferred
+
+
+engine = create_engine(settings.database_url, **engine_options(settings.database_url))
+
 if settings.is_sqlite:
-    connect_args = {"check_same_thread": False}
+    install_sqlite_profile(engine)
+
+db_metrics.install(engine)
+
+replica_engine = None
+if settings.has_replica:
+    replica_engine = create_engine(settings.replica_database_url, **engine_options(settings.replica_database_url))
+    if settings.replica_database_url.startswith("sqlite"):
+        install_sqlite_profile(replica_engine)
+    db_metrics.install(replica_engine)
+
+
+class RoutingSession(Session):
+    """
+    Sin réplica, o sin info[READ_REPLICA_KEY], todo va al primario. Con la
+    marca, las lecturas van a la réplica y los flush (cualquier escritura)
+    siguen yendo al primario. La réplica es solo del shard default. Con
+    info[READ_ONLY_KEY] las lecturas en SQLite abren con BEGIN DEFERRED.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if (
+            replica_engine is not None
+            and self.info.get(READ_REPLICA_KEY)
+            and self.bind is engine
+            and not self._flushing
+        ):
+            bind = replica_engine
+        else:
+            bind = super().get_bind(mapper=mapper, clause=clause, **kw)
+        if self.info.get(READ_ONLY_KEY) and not self._flushing and bind.dialect.name == "sqlite":
+            return deferred_engine(bind)
+        return bind
 
-engine = create_engine(
-    settings.database_url,
-    pool_pre_ping=True,
-    connect_args=connect_args,
-)
 
 SessionLocal = sessionmaker(
+    class_=RoutingSession,
     autocommit=False,
     autoflush=False,
     bind=engine,
@@ -22,9 +151,20 @@ SessionLocal = sessionmaker(
 Base = declarative_base()
 
 
-def get_db():
-    db = SessionLocal()
+def get_db(restaurant: Optional[str] = Query(None)):
+    # sharding importa los modelos, que importan este módulo
+    from sharding import tenant_session
+
+    db = tenant_session(restaurant)
     try:
         yield db
     finally:
         db.close()
+
+
+def read_session() -> Session:
+    """Sesión de solo lectura: va a la réplica si hay una configurada."""
+    db = SessionLocal()
+    db.info[READ_REPLICA_KEY] = True
+    db.info[READ_ONLY_KEY] = True
+    return db
@@ -0,0 +1,168 @@
+"""
+Camino async a la base para los endpoints de alta concurrencia.
+
+Los handlers sync corren en el threadpool de Starlette y su tope de hilos
+es el tope de requests simultáneos por worker. Los endpoints calientes
+(cocina, floor, lectura de ticket, crear orden) son async y hacen su
+trabajo con run_db(fn, *args):
+
+- con el driver async instalado (aiosqlite para SQLite, asyncpg para
+  Postgres) abre una AsyncSession y corre fn(session, *args) con
+  run_sync: la lógica ORM y los listeners de Session son los mismos del
+  camino sync, pero esperar a la base no ocupa un hilo;
+- sin driver, con ASYNC_DB=0, o con ASYNC_DB=auto (default) sobre
+  SQLite, corre lo mismo en el threadpool con SessionLocal, igual que un
+  handler sync. En SQLite local no hay red que esperar y el salto al hilo
+  de aiosqlite cuesta más de lo que libera.
+
+fn no debe bloquear fuera de la base (requests a la API de WhatsApp,
+esperas con threading): dentro de run_sync eso frena el event loop. Para
+eso está run_blocking, que siempre va al threadpool.
+
+Los dos reciben tenant=<slug> y abren la sesión en el shard de ese
+restaurante (ver sharding.py); cada shard decide su modo con su propia URL.
+
+get_async_db es la dependencia para handlers que quieran usar la
+AsyncSession directamente; sin driver responde 503.
+"""
+import importlib.util
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+import db_metrics
+import sharding
+from config import settings
+from db import engine_options, install_sqlite_profile
+
+ASYNC_DRIVERS = {
+    "sqlite": ("aiosqlite", "sqlite+aiosqlite"),
+    "postgresql": ("asyncpg", "postgresql+asyncpg"),
+}
+
+
+def async_database_url(url: str) -> Optional[str]:
+    """URL con el driver async, o None si no hay driver instalado."""
+    scheme, sep, rest = url.partition("://")
+    if not sep:
+        return None
+    dialect = scheme.split("+", 1)[0]
+    driver = ASYNC_DRIVERS.get(dialect)
+    if driver is None or importlib.util.find_spec(driver[0]) is None:
+        return None
+    return f"{driver[1]}://{rest}"
+
+
+def async_enabled(url: Optional[str] = None) -> bool:
+    url = url or settings.database_url
+    if settings.async_db == "auto":
+        return not url.startswith("sqlite")
+    return settings.async_db == "1"
+
+
+def _create_async_engine(url: str):
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+    eng = create_async_engine(url, **engine_options(url, AsyncAdaptedQueuePool))
+    if url.startswith("sqlite"):
+        install_sqlite_profile(eng.sync_engine)
+    db_metrics.install(eng.sync_engine)
+    return eng
+
+
+async_engine = None
+AsyncSessionLocal = None
+
+_async_url = async_database_url(settings.database_url) if async_enabled() else None
+if _async_url:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    async_engine = _create_async_engine(_async_url)
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine,
+        autoflush=False,
+    )
+
+ASYNC_DB_AVAILABLE = AsyncSessionLocal is not None
+
+# shard -> async_sessionmaker, o None si ese shard va por el threadpool
+_shard_factories: Dict[str, Any] = {sharding.DEFAULT_SHARD: AsyncSessionLocal}
+_shard_engines: List[Any] = []
+
+
+async def get_async_db() -> AsyncIterator[Any]:
+    if AsyncSessionLocal is None:
+        raise HTTPException(status_code=503, detail="Base de datos async no disponible")
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def _async_factory(shard: str):
+    if shard in _shard_factories:
+        return _shard_factories[shard]
+    url = sharding.shard_urls()[shard]
+    async_url = async_database_url(url) if async_enabled(url) else None
+    factory = None
+    if async_url:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        eng = _create_async_engine(async_url)
+        _shard_engines.append(eng)
+        factory = async_sessionmaker(eng, autoflush=False)
+    return _shard_factories.setdefault(shard, factory)
+
+
+def _with_session(opener: Callable[[], Any], fn: Callable[..., Any], *args, **kwargs) -> Any:
+    db = opener()
+    try:
+        return fn(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+async def run_blocking(
+    fn: Callable[..., Any],
+    *args,
+    tenant: Optional[str] = None,
+    opener: Optional[Callable[[], Any]] = None,
+    **kwargs,
+) -> Any:
+    """
+    fn(session, *args) en el threadpool con una sesión sync propia, en el
+    shard del restaurante tenant (slug). opener reemplaza esa resolución
+    cuando el tenant sale de otro lado (p. ej. el phone_number_id del
+    webhook).
+    """
+    if opener is None:
+        opener = partial(sharding.tenant_session, tenant)
+    return await run_in_threadpool(_with_session, opener, fn, *args, **kwargs)
+
+
+async def run_db(fn: Callable[..., Any], *args, tenant: Optional[str] = None, **kwargs) -> Any:
+    """fn(session, *args) con una sesión propia; el commit lo hace fn."""
+    if sharding.is_fresh():
+        shard, status = sharding.locate(slug=tenant)
+    else:
+        # recargar el directorio es una consulta sync
+        shard, status = await run_in_threadpool(sharding.locate, tenant)
+    factory = _async_factory(shard)
+    if factory is None:
+        return await run_blocking(fn, *args, tenant=tenant, **kwargs)
+    async with factory() as db:
+        if status == sharding.STATUS_MOVING:
+            db.sync_session.info[sharding.FROZEN_KEY] = True
+        return await db.run_sync(fn, *args, **kwargs)
+
+
+def mode() -> str:
+    return "async" if ASYNC_DB_AVAILABLE else "threadpool"
+
+
+async def dispose() -> None:
+    if async_engine is not None:
+        await async_engine.dispose()
+    for eng in _shard_engines:
+        await eng.dispose()
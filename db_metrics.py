@@ -0,0 +1,112 @@
+import threading
+import time
+
+from sqlalchemy import event
+
+# Statements de escritura que tarden más que esto se cuentan como espera de lock.
+LOCK_WAIT_THRESHOLD_MS = 50.0
+# Checkouts del pool que tarden más que esto: el pool se quedó corto.
+SLOW_CHECKOUT_MS = 50.0
+
+_WRITE_PREFIXES = ("insert", "update", "delete", "begin", "commit")
+
+_lock = threading.Lock()
+_counters = {
+    "pool_timeouts": 0,
+    "db_locked_errors": 0,
+    "lock_waits": 0,
+    "lock_wait_ms_total": 0.0,
+    "lock_wait_ms_max": 0.0,
+    "statements": 0,
+    "checkouts": 0,
+    "checkout_wait_ms_total": 0.0,
+    "checkout_wait_ms_max": 0.0,
+    "slow_checkouts": 0,
+}
+
+
+def incr(key: str, amount=1) -> None:
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def record_lock_wait(elapsed_ms: float) -> None:
+    with _lock:
+        _counters["lock_waits"] += 1
+        _counters["lock_wait_ms_total"] += elapsed_ms
+        if elapsed_ms > _counters["lock_wait_ms_max"]:
+            _counters["lock_wait_ms_max"] = elapsed_ms
+
+
+def record_checkout_wait(elapsed_ms: float) -> None:
+    with _lock:
+        _counters["checkouts"] += 1
+        _counters["checkout_wait_ms_total"] += elapsed_ms
+        if elapsed_ms > _counters["checkout_wait_ms_max"]:
+            _counters["checkout_wait_ms_max"] = elapsed_ms
+        if elapsed_ms >= SLOW_CHECKOUT_MS:
+            _counters["slow_checkouts"] += 1
+
+
+def timed_pool(pool_class):
+    """
+    Subclase de pool_class que mide cuánto espera cada checkout (incluye
+    abrir la conexión si el pool todavía no la tenía).
+    """
+
+    class TimedPool(pool_class):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                record_checkout_wait((time.perf_counter() - started) * 1000.0)
+
+    TimedPool.__name__ = f"Timed{pool_class.__name__}"
+    return TimedPool
+
+
+def snapshot(engine=None) -> dict:
+    with _lock:
+        data = dict(_counters)
+    data["lock_wait_ms_total"] = round(data["lock_wait_ms_total"], 3)
+    data["lock_wait_ms_max"] = round(data["lock_wait_ms_max"], 3)
+    data["checkout_wait_ms_avg"] = (
+        round(data["checkout_wait_ms_total"] / data["checkouts"], 3) if data["checkouts"] else 0.0
+    )
+    data["checkout_wait_ms_total"] = round(data["checkout_wait_ms_total"], 3)
+    data["checkout_wait_ms_max"] = round(data["checkout_wait_ms_max"], 3)
+    if engine is not None:
+        data["pool_status"] = engine.pool.status()
+    return data
+
+
+def reset() -> None:
+    with _lock:
+        for key in _counters:
+            _counters[key] = 0.0 if isinstance(_counters[key], float) else 0
+
+
+def is_db_locked_error(exc: Exception) -> bool:
+    return "database is locked" in str(exc).lower()
+
+
+def install(engine) -> None:
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_stmt_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("_stmt_started")
+        if not started:
+            return
+        elapsed_ms = (time.perf_counter() - started.pop()) * 1000.0
+        incr("statements")
+        if elapsed_ms >= LOCK_WAIT_THRESHOLD_MS and statement.lstrip()[:6].lower().startswith(_WRITE_PREFIXES):
+            record_lock_wait(elapsed_ms)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        if is_db_locked_error(context.original_exception):
+            incr("db_locked_errors")
@@ -0,0 +1,467 @@
+"""
+Exportaciones de ventas (órdenes, líneas y pagos) a CSV/JSONL comprimido.
+
+- create_export_job(): registra el trabajo en export_jobs (status=pending).
+- submit_export(): lo encola en el pool de hilos del proceso.
+- run_export(): reclama el job (pending -> running con un UPDATE
+  condicional, así dos workers o dos arranques no lo corren a la vez), lee
+  las filas en lotes y las escribe directo al .gz, sin cargar el rango
+  completo en memoria. El avance y el heartbeat quedan en la fila del job.
+
+En Postgres se usa un solo cursor del servidor (yield_per). En SQLite se lee
+por páginas de id para no retener el lock de lectura durante toda la
+exportación (bloquearía las escrituras del POS). Las órdenes archivadas
+(order_archive.py) salen primero, después las de las tablas calientes.
+
+Uso por consola:
+    python exports.py --job 12
+    python exports.py --pending
+    python exports.py --pending --shard grande
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.orm import Session
+
+from config import settings
+from models.export_models import ExportJob
+from models.sales_models import Order, OrderItem, OrderPayment
+from order_archive import ARCHIVED, HOT, order_join
+
+EXPORT_BATCH_SIZE = 2000
+# un job "running" sin heartbeat en este lapso se da por abandonado
+EXPORT_STALE_SECONDS = 600
+EXPORT_FORMATS = ("csv", "jsonl")
+
+EXPORT_TYPES = ("orders", "order_items", "payments")
+
+
+def export_columns(export_type: str, orders=Order, items=OrderItem, payments=OrderPayment) -> tuple:
+    """Columnas de cada tipo; con los modelos *Archive sirven para el archivo."""
+    if export_type == "orders":
+        return (
+            orders.id,
+            orders.created_at,
+            orders.closed_at,
+            orders.channel,
+            orders.service_mode,
+            orders.status,
+            orders.payment_status,
+            orders.customer_name,
+            orders.customer_phone,
+            orders.table_number,
+            orders.subtotal,
+            orders.tax,
+            orders.total,
+            orders.notes,
+        )
+    if export_type == "order_items":
+        return (
+            items.id,
+            items.order_id,
+            orders.created_at.label("order_created_at"),
+            orders.channel,
+            items.product_id,
+            items.product_name_snapshot.label("product_name"),
+            items.quantity,
+            items.unit_price,
+            items.total_price,
+            items.kitchen_status,
+            items.voided,
+            items.notes,
+        )
+    if export_type == "payments":
+        return (
+            payments.id,
+            payments.order_id,
+            payments.created_at,
+            orders.channel,
+            payments.method,
+            payments.status,
+            payments.amount,
+            payments.reference,
+            payments.bank_name,
+            payments.card_brand,
+            payments.card_last4,
+            payments.authorization_code,
+            payments.cash_session_id,
+        )
+    return ()
+
+_executor_lock = threading.Lock()
+_executor = None
+
+
+class ExportError(Exception):
+    pass
+
+
+def _parse_day(value: Optional[str]) -> Optional[datetime]:
+    value = (value or "").strip()
+    if not value:
+        return None
+    d = date.fromisoformat(value)
+    return datetime(d.year, d.month, d.day)
+
+
+def build_export_statement(job: ExportJob, source=HOT):
+    orders, items, payments = source
+    columns = export_columns(job.export_type, orders, items, payments)
+    if not columns:
+        raise ExportError(f"Tipo de exportación inválido: {job.export_type}")
+
+    if job.export_type == "orders":
+        key_col, date_col = orders.id, orders.created_at
+        stmt = select(*columns)
+    elif job.export_type == "order_items":
+        key_col, date_col = items.id, orders.created_at
+        stmt = select(*columns).join(orders, order_join(orders, items))
+    else:
+        key_col, date_col = payments.id, payments.created_at
+        stmt = select(*columns).join(orders, order_join(orders, payments))
+
+    stmt = stmt.where(orders.restaurant_id == job.restaurant_id)
+
+    start = _parse_day(job.date_from)
+    end = _parse_day(job.date_to)
+    if start:
+        stmt = stmt.where(date_col >= start)
+    if end:
+        stmt = stmt.where(date_col < end + timedelta(days=1))
+
+    return stmt, key_col
+
+
+def build_export_statements(job: ExportJob) -> list:
+    """Primero el archivo (lo más viejo) y después las tablas calientes."""
+    return [build_export_statement(job, source) for source in (ARCHIVED, HOT)]
+
+
+def _iter_batches(db: Session, stmt, key_col, batch_size: int):
+    # el motor real de la sesión: con réplica o shards puede no ser el de DATABASE_URL
+    if db.get_bind().dialect.name == "sqlite":
+        last_id = 0
+        while True:
+            rows = db.execute(stmt.where(key_col > last_id).order_by(key_col).limit(batch_size)).all()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1][0]
+        return
+
+    result = db.execute(stmt.order_by(key_col).execution_options(yield_per=batch_size))
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return value
+
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def export_file_path(job: ExportJob) -> str:
+    span = f"{job.date_from or 'inicio'}_{job.date_to or 'hoy'}"
+    name = f"{job.id}-{job.export_type}-{span}.{job.file_format}.gz"
+    return os.path.join(settings.export_dir, str(job.restaurant_id), name)
+
+
+def create_export_job(
+    db: Session,
+    restaurant_id: int,
+    export_type: str,
+    file_format: str = "csv",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    user_id: Optional[int] = None,
+) -> ExportJob:
+    if export_type not in EXPORT_TYPES:
+        raise ExportError(f"export_type debe ser uno de: {', '.join(EXPORT_TYPES)}")
+    if file_format not in EXPORT_FORMATS:
+        raise ExportError(f"file_format debe ser uno de: {', '.join(EXPORT_FORMATS)}")
+
+    start = _parse_day(date_from)
+    end = _parse_day(date_to)
+    if start and end and start > end:
+        raise ExportError("date_from no puede ser mayor que date_to")
+
+    job = ExportJob(
+        restaurant_id=restaurant_id,
+        user_id=user_id,
+        module_code="sales",
+        export_type=export_type,
+        date_from=start.date().isoformat() if start else None,
+        date_to=end.date().isoformat() if end else None,
+        file_format=file_format,
+        status="pending",
+        rows_written=0,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def ensure_schema(engine) -> None:
+    """create_all no agrega heartbeat_at a export_jobs si ya existía."""
+    inspector = inspect(engine)
+    if not inspector.has_table("export_jobs"):
+        return
+    columns = {c["name"] for c in inspector.get_columns("export_jobs")}
+    if "heartbeat_at" not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE export_jobs ADD COLUMN heartbeat_at TIMESTAMP"))
+
+
+def _claim_job(progress_db: Session, job_id: int) -> bool:
+    """pending -> running en un solo UPDATE; solo uno de los que compiten gana."""
+    now = datetime.utcnow()
+    claimed = (
+        progress_db.query(ExportJob)
+        .filter(ExportJob.id == job_id, ExportJob.status == "pending")
+        .update(
+            {
+                "status": "running",
+                "started_at": now,
+                "heartbeat_at": now,
+                "rows_written": 0,
+                "error": None,
+            },
+            synchronize_session=False,
+        )
+    )
+    progress_db.commit()
+    return claimed == 1
+
+
+def _set_progress(progress_db: Session, job_id: int, **values) -> None:
+    progress_db.query(ExportJob).filter(ExportJob.id == job_id).update(values, synchronize_session=False)
+    progress_db.commit()
+
+
+def _open_sessions(shard: str):
+    from db import READ_ONLY_KEY, SessionLocal, read_session
+    from sharding import DEFAULT_SHARD, shard_sessionmaker
+
+    if shard == DEFAULT_SHARD:
+        return read_session(), SessionLocal()
+    factory = shard_sessionmaker(shard)
+    # el lector no toma el lock de escritura que necesita progress_db
+    reader = factory()
+    reader.info[READ_ONLY_KEY] = True
+    return reader, factory()
+
+
+def run_export(job_id: int, batch_size: int = EXPORT_BATCH_SIZE, shard: str = "default") -> dict:
+    """
+    Ejecuta un job. Usa dos sesiones: una solo lee las filas (de la réplica
+    si hay) y la otra registra el avance en el primario, para que los
+    commits de progreso no cierren el cursor. Los ids de job son por shard:
+    shard es el del restaurante que lo pidió.
+    """
+    db, progress_db = _open_sessions(shard)
+    tmp_path = None
+    claimed = False
+    try:
+        job = progress_db.query(ExportJob).filter(ExportJob.id == job_id).first()
+        if not job:
+            raise ExportError(f"Export {job_id} no existe")
+        if not _claim_job(progress_db, job.id):
+            # ya terminó, falló o lo está corriendo otro worker
+            progress_db.refresh(job)
+            return {"job_id": job.id, "status": job.status, "rows": job.rows_written, "skipped": True}
+        claimed = True
+
+        statements = build_export_statements(job)
+        total = sum(
+            db.execute(select(func.count()).select_from(stmt.subquery())).scalar() or 0
+            for stmt, _ in statements
+        )
+
+        path = export_file_path(job)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+
+        _set_progress(progress_db, job.id, rows_total=total, heartbeat_at=datetime.utcnow())
+
+        headers = [c.key for c in statements[0][0].selected_columns]
+        written = 0
+        with gzip.open(tmp_path, "wt", encoding="utf-8", newline="") as fh:
+            writer = None
+            if job.file_format == "csv":
+                writer = csv.writer(fh)
+                writer.writerow(headers)
+
+            batches = (
+                rows
+                for stmt, key_col in statements
+                for rows in _iter_batches(db, stmt, key_col, batch_size)
+            )
+            for rows in batches:
+                if writer is not None:
+                    writer.writerows([_cell(v) for v in row] for row in rows)
+                else:
+                    for row in rows:
+                        fh.write(json.dumps(
+                            {k: _json_value(v) for k, v in zip(headers, row)},
+                            ensure_ascii=False,
+                        ))
+                        fh.write("\n")
+                written += len(rows)
+                _set_progress(progress_db, job.id, rows_written=written, heartbeat_at=datetime.utcnow())
+
+        os.replace(tmp_path, path)
+        tmp_path = None
+
+        _set_progress(
+            progress_db, job.id,
+            status="done", rows_written=written, file_path=path,
+            file_size=os.path.getsize(path), finished_at=datetime.utcnow(),
+        )
+        return {"job_id": job.id, "status": "done", "rows": written, "file_path": path}
+    except Exception as exc:
+        progress_db.rollback()
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if claimed:
+            _set_progress(progress_db, job_id, status="failed", error=str(exc)[:2000], finished_at=datetime.utcnow())
+        print("EXPORT_ERROR", job_id, repr(exc))
+        return {"job_id": job_id, "status": "failed", "error": str(exc)}
+    finally:
+        db.close()
+        progress_db.close()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, settings.export_workers),
+                thread_name_prefix="export",
+            )
+        return _executor
+
+
+def submit_export(job_id: int, shard: str = "default"):
+    return _get_executor().submit(run_export, job_id, shard=shard)
+
+
+def requeue_stale_exports(db: Session) -> int:
+    """
+    Vuelve a pending los jobs "running" cuyo worker murió (sin heartbeat en
+    EXPORT_STALE_SECONDS). Los que siguen avanzando en otro proceso no se tocan.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=EXPORT_STALE_SECONDS)
+    count = (
+        db.query(ExportJob)
+        .filter(
+            ExportJob.status == "running",
+            func.coalesce(ExportJob.heartbeat_at, ExportJob.started_at, ExportJob.created_at) < cutoff,
+        )
+        .update({"status": "pending"}, synchronize_session=False)
+    )
+    db.commit()
+    return count
+
+
+def resume_pending_exports(db: Session, shard: str = "default") -> int:
+    # run_export reclama cada job; si otro proceso lo tomó primero, lo salta
+    requeue_stale_exports(db)
+
+    ids = [row[0] for row in db.query(ExportJob.id).filter(ExportJob.status == "pending").order_by(ExportJob.id).all()]
+    for job_id in ids:
+        submit_export(job_id, shard=shard)
+    return len(ids)
+
+
+def serialize_export_job(job: ExportJob) -> dict:
+    total = job.rows_total or 0
+    return {
+        "id": job.id,
+        "export_type": job.export_type,
+        "file_format": job.file_format,
+        "date_from": job.date_from or "",
+        "date_to": job.date_to or "",
+        "status": job.status,
+        "rows_total": job.rows_total,
+        "rows_written": job.rows_written or 0,
+        "progress": round((job.rows_written or 0) / total, 4) if total else (1.0 if job.status == "done" else 0.0),
+        "file_size": job.file_size,
+        "error": job.error or "",
+        "created_at": str(job.created_at or ""),
+        "started_at": str(job.started_at or ""),
+        "finished_at": str(job.finished_at or ""),
+    }
+
+
+def main(argv=None) -> int:
+    from db import Base, engine
+    import models  # noqa: F401  registra todas las tablas
+
+    parser = argparse.ArgumentParser(description="Ejecuta exportaciones pendientes.")
+    parser.add_argument("--job", type=int, default=0)
+    parser.add_argument("--pending", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--shard", default="default", help="shard donde está el job (ver sharding.py)")
+    args = parser.parse_args(argv)
+
+    Base.metadata.create_all(bind=engine)
+    ensure_schema(engine)
+
+    if args.job:
+        # --job vuelve a correr uno que falló; uno en curso se respeta
+        db = _open_sessions(args.shard)[1]
+        try:
+            db.query(ExportJob).filter(ExportJob.id == args.job, ExportJob.status == "failed").update(
+                {"status": "pending"}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+        print(run_export(args.job, batch_size=args.batch_size, shard=args.shard))
+        return 0
+
+    if args.pending:
+        db = _open_sessions(args.shard)[1]
+        try:
+            requeue_stale_exports(db)
+            ids = [row[0] for row in db.query(ExportJob.id).filter(ExportJob.status == "pending").order_by(ExportJob.id).all()]
+        finally:
+            db.close()
+        for job_id in ids:
+            print(run_export(job_id, batch_size=args.batch_size, shard=args.shard))
+        return 0
+
+    parser.print_help()
+    return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,300 @@
+"""
+Idempotency-Key para los POST que crean órdenes y cobran.
+
+El cliente manda un header Idempotency-Key por intento lógico y lo repite en
+cada reintento. Con la misma llave:
+- si la primera ejecución ya terminó, se devuelve su respuesta guardada sin
+  volver a ejecutar (header Idempotent-Replayed: true);
+- si todavía está en curso en este proceso, el duplicado espera a que
+  termine (single-flight) y devuelve lo mismo;
+- si está en curso en otro worker, la fila reservada en idempotency_keys
+  hace que el INSERT del duplicado espere al commit del primero; al fallar
+  por la llave única lee la respuesta ya confirmada.
+
+La fila se reserva al empezar y la respuesta se guarda en la misma
+transacción que la orden o el pago: o quedan las dos cosas o ninguna. Si el
+endpoint falla (400, 404, ...) no queda nada y un reintento se ejecuta de
+nuevo. La misma llave con otro endpoint u otro body responde 422.
+
+Las respuestas viven IDEMPOTENCY_TTL_SECONDS; las más recientes también en
+memoria para no ir a la base en cada reintento.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models.sales_models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAY_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_TTL_SECONDS = 24 * 3600
+IDEMPOTENCY_WAIT_SECONDS = 30.0
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+MEMORY_MAX_ENTRIES = 5000
+PURGE_EVERY_CLAIMS = 500
+
+
+def request_hash(scope: str, payload) -> str:
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{scope}\n{body}".encode("utf-8")).hexdigest()
+
+
+class IdempotencyClaim:
+    """
+    Resultado de begin(). Con replay el endpoint devuelve eso y no hace
+    nada más; si no, ejecuta, llama a save() antes del commit y al final
+    release() (lo hace el with). begin_async() devuelve el claim con el
+    turno tomado pero sin fila: falta reserve(db).
+    """
+
+    def __init__(self, store: "IdempotencyStore", slot: Optional[Tuple[int, str]], fingerprint: str = "", scope: str = ""):
+        self.store = store
+        self.slot = slot
+        self.fingerprint = fingerprint
+        self.scope = scope
+        self.row: Optional[IdempotencyKey] = None
+        self.replay: Optional[JSONResponse] = None
+        self._response = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release(succeeded=exc_type is None)
+        return False
+
+    def reserve(self, db: Session) -> "IdempotencyClaim":
+        """Reserva la fila en la transacción de db (begin() ya lo hace)."""
+        if self.slot is None or self.replay is not None or self.row is not None:
+            return self
+        return self.store._reserve(db, self)
+
+    def save(self, response: dict) -> dict:
+        if self.row is not None:
+            self._response = jsonable_encoder(response)
+            self.row.response_json = json.dumps(self._response, ensure_ascii=False)
+        return response
+
+    def release(self, succeeded: bool = True) -> None:
+        if self.slot is None or self.replay is not None:
+            return
+        self.store._finish(self.slot, self.fingerprint, self._response if succeeded else None)
+        self.slot = None
+
+
+class IdempotencyStore:
+    def __init__(self, ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._results: "OrderedDict[Tuple[int, str], Tuple[float, str, dict]]" = OrderedDict()
+        self._inflight: Dict[Tuple[int, str], threading.Event] = {}
+        self._claims = 0
+        self.executed = 0
+        self.replayed = 0
+        self.waited = 0
+
+    # =========================
+    # MEMORIA
+    # =========================
+
+    def _cached(self, slot: Tuple[int, str]) -> Optional[Tuple[str, dict]]:
+        entry = self._results.get(slot)
+        if entry is None:
+            return None
+        expires, fingerprint, response = entry
+        if expires < time.monotonic():
+            del self._results[slot]
+            return None
+        return fingerprint, response
+
+    def _remember(self, slot: Tuple[int, str], fingerprint: str, response: dict) -> None:
+        self._results[slot] = (time.monotonic() + self.ttl_seconds, fingerprint, response)
+        self._results.move_to_end(slot)
+        while len(self._results) > MEMORY_MAX_ENTRIES:
+            self._results.popitem(last=False)
+
+    def _finish(self, slot: Tuple[int, str], fingerprint: str, response: Optional[dict]) -> None:
+        with self._lock:
+            if response is not None:
+                self._remember(slot, fingerprint, response)
+            event = self._inflight.pop(slot, None)
+        if event is not None:
+            event.set()
+
+    # =========================
+    # RESERVA
+    # =========================
+
+    def _replay(self, claim: IdempotencyClaim, fingerprint: str, response: dict) -> IdempotencyClaim:
+        if fingerprint != claim.fingerprint:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key ya usada con otro endpoint o contenido.",
+            )
+        self.replayed += 1
+        claim.replay = JSONResponse(response, headers={REPLAY_HEADER: "true"})
+        return claim
+
+    def _load_row(self, db: Session, slot: Tuple[int, str]) -> Optional[IdempotencyKey]:
+        restaurant_id, key = slot
+        return (
+            db.query(IdempotencyKey)
+            .filter(
+                IdempotencyKey.restaurant_id == restaurant_id,
+                IdempotencyKey.idempotency_key == key,
+            )
+            .first()
+        )
+
+    def _take_turn(self, claim: IdempotencyClaim) -> Optional[threading.Event]:
+        """
+        None si claim ya tiene su turno (o su replay); si no, el evento de
+        la otra ejecución de este proceso con la misma llave.
+        """
+        with self._lock:
+            cached = self._cached(claim.slot)
+            if cached is not None:
+                self._replay(claim, *cached)
+                return None
+            event = self._inflight.get(claim.slot)
+            if event is None:
+                self._inflight[claim.slot] = threading.Event()
+                return None
+        self.waited += 1
+        return event
+
+    def _turn_timeout(self) -> HTTPException:
+        return HTTPException(
+            status_code=409,
+            detail="Una solicitud con esta Idempotency-Key sigue en proceso.",
+        )
+
+    def _wait_turn(self, claim: IdempotencyClaim) -> None:
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            event = self._take_turn(claim)
+            if event is None:
+                return
+            if not event.wait(max(0.0, deadline - time.monotonic())):
+                raise self._turn_timeout()
+
+    async def _wait_turn_async(self, claim: IdempotencyClaim) -> None:
+        # la espera va a un hilo: en el event loop bloquearía al que ejecuta
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            event = self._take_turn(claim)
+            if event is None:
+                return
+            if not await run_in_threadpool(event.wait, max(0.0, deadline - time.monotonic())):
+                raise self._turn_timeout()
+
+    def claim(self, restaurant_id: int, key: Optional[str], scope: str, payload) -> IdempotencyClaim:
+        """Claim sin turno ni fila; sin llave no hace nada."""
+        key = (key or "").strip()
+        if not key:
+            return IdempotencyClaim(self, None)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(status_code=400, detail="Idempotency-Key demasiado larga.")
+        return IdempotencyClaim(self, (restaurant_id, key), request_hash(scope, payload), scope)
+
+    def begin(self, db: Session, restaurant_id: int, key: Optional[str], scope: str, payload) -> IdempotencyClaim:
+        claim = self.claim(restaurant_id, key, scope, payload)
+        if claim.slot is not None:
+            self._wait_turn(claim)
+            claim.reserve(db)
+        return claim
+
+    async def begin_async(self, restaurant_id: int, key: Optional[str], scope: str, payload) -> IdempotencyClaim:
+        """
+        Como begin() pero sin sesión: espera el turno sin bloquear el event
+        loop. El endpoint llama a claim.reserve(db) ya dentro de run_db.
+        """
+        claim = self.claim(restaurant_id, key, scope, payload)
+        if claim.slot is not None:
+            await self._wait_turn_async(claim)
+        return claim
+
+    def _reserve(self, db: Session, claim: IdempotencyClaim) -> IdempotencyClaim:
+        restaurant_id, key = claim.slot
+        try:
+            now = datetime.utcnow()
+            row = self._load_row(db, claim.slot)
+            if row is not None and row.expires_at < now:
+                db.delete(row)
+                db.flush()
+                row = None
+            if row is not None and row.response_json:
+                return self._adopt(claim, row)
+
+            claim.row = IdempotencyKey(
+                restaurant_id=restaurant_id,
+                idempotency_key=key,
+                scope=claim.scope,
+                request_hash=claim.fingerprint,
+                expires_at=now + timedelta(seconds=self.ttl_seconds),
+            )
+            try:
+                # en otro worker con la misma llave el INSERT espera a su
+                # commit y falla por la llave única. El SAVEPOINT vive dentro
+                # de la transacción de db (en SQLite el BEGIN lo emite
+                # db.install_sqlite_profile): si el endpoint falla, el
+                # rollback se lleva también la fila reservada
+                with db.begin_nested():
+                    db.add(claim.row)
+            except IntegrityError:
+                claim.row = None
+                row = self._load_row(db, claim.slot)
+                if row is None or not row.response_json:
+                    raise self._turn_timeout()
+                return self._adopt(claim, row)
+        except Exception:
+            claim.release(succeeded=False)
+            raise
+
+        self.executed += 1
+        self._claims += 1
+        if self._claims % PURGE_EVERY_CLAIMS == 0:
+            self.purge_expired(db)
+        return claim
+
+    def _adopt(self, claim: IdempotencyClaim, row: IdempotencyKey) -> IdempotencyClaim:
+        response = json.loads(row.response_json)
+        self._finish(claim.slot, row.request_hash, response)
+        claim.slot = None
+        return self._replay(claim, row.request_hash, response)
+
+    def purge_expired(self, db: Session) -> int:
+        return (
+            db.query(IdempotencyKey)
+            .filter(IdempotencyKey.expires_at < datetime.utcnow())
+            .delete(synchronize_session=False)
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "replayed": self.replayed,
+                "waited": self.waited,
+                "in_flight": len(self._inflight),
+                "cached": len(self._results),
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._results.clear()
+            self._inflight.clear()
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,172 @@
+"""
+Consumo de inventario por receta.
+
+- consume_order_items(): expande las recetas de las líneas indicadas en una
+  sola consulta, inserta los movimientos de kardex en bloque y descuenta
+  inventory_items.current_stock con un único UPDATE.
+- reverse_order_items() / reverse_order_consumption(): devuelven al stock lo
+  que esas líneas consumieron, leyendo el kardex (no la receta actual, que
+  pudo cambiar desde la venta).
+
+Los movimientos se guardan por línea de orden (reference_type="order_item")
+y quantity lleva el signo del efecto sobre current_stock: consumo negativo,
+reverso positivo. Una línea nunca se consume ni se revierte dos veces.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, List
+
+from sqlalchemy import and_, case, exists, func, insert
+from sqlalchemy.orm import Session, aliased
+
+from models.inventory_models import InventoryItem, InventoryMovement, Recipe
+from models.sales_models import OrderItem
+from product_availability import mark_stock_changed
+
+MOVEMENT_CONSUME = "consumo"
+MOVEMENT_REVERSE = "reverso"
+REFERENCE_ORDER_ITEM = "order_item"
+
+
+def _apply_stock_deltas(db: Session, deltas: Dict[int, Decimal]) -> None:
+    deltas = {item_id: delta for item_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    db.query(InventoryItem).filter(InventoryItem.id.in_(list(deltas))).update(
+        {
+            InventoryItem.current_stock: func.coalesce(InventoryItem.current_stock, 0)
+            + case(deltas, value=InventoryItem.id, else_=0)
+        },
+        synchronize_session=False,
+    )
+    mark_stock_changed(db, deltas)
+
+
+def consume_order_items(db: Session, restaurant_id: int, item_ids: Iterable[int], order_id: int = None) -> dict:
+    """
+    Descuenta del stock lo que consumen las líneas item_ids según sus recetas.
+    No hace commit: corre dentro de la transacción del endpoint que vende.
+    """
+    item_ids = [int(x) for x in item_ids if x]
+    if not item_ids:
+        return {"movements": 0, "items": {}}
+
+    already = aliased(InventoryMovement)
+    rows = (
+        db.query(
+            OrderItem.id,
+            Recipe.inventory_item_id,
+            OrderItem.quantity * Recipe.quantity_required,
+        )
+        .join(Recipe, Recipe.product_id == OrderItem.product_id)
+        .join(
+            InventoryItem,
+            and_(
+                InventoryItem.id == Recipe.inventory_item_id,
+                InventoryItem.restaurant_id == restaurant_id,
+            ),
+        )
+        .filter(
+            OrderItem.id.in_(item_ids),
+            OrderItem.voided == False,  # noqa: E712
+            ~exists().where(
+                and_(
+                    already.reference_type == REFERENCE_ORDER_ITEM,
+                    already.reference_id == OrderItem.id,
+                    already.movement_type == MOVEMENT_CONSUME,
+                )
+            ),
+        )
+        .all()
+    )
+    if not rows:
+        return {"movements": 0, "items": {}}
+
+    note = f"order:{order_id}" if order_id else None
+    movements = []
+    deltas: Dict[int, Decimal] = defaultdict(Decimal)
+    for order_item_id, inventory_item_id, qty in rows:
+        qty = Decimal(str(qty or 0))
+        if qty <= 0:
+            continue
+        movements.append({
+            "item_id": inventory_item_id,
+            "movement_type": MOVEMENT_CONSUME,
+            "quantity": -qty,
+            "reference_type": REFERENCE_ORDER_ITEM,
+            "reference_id": order_item_id,
+            "notes": note,
+        })
+        deltas[inventory_item_id] -= qty
+
+    if movements:
+        db.execute(insert(InventoryMovement), movements)
+    _apply_stock_deltas(db, deltas)
+
+    return {"movements": len(movements), "items": {k: float(v) for k, v in deltas.items()}}
+
+
+def reverse_order_items(db: Session, item_ids: Iterable[int], order_id: int = None) -> dict:
+    """
+    Revierte el consumo registrado para item_ids. Las líneas sin consumo (o
+    ya revertidas) se ignoran.
+    """
+    item_ids = [int(x) for x in item_ids if x]
+    if not item_ids:
+        return {"movements": 0, "items": {}}
+
+    reversed_mv = aliased(InventoryMovement)
+    rows = (
+        db.query(
+            InventoryMovement.reference_id,
+            InventoryMovement.item_id,
+            func.sum(InventoryMovement.quantity),
+        )
+        .filter(
+            InventoryMovement.reference_type == REFERENCE_ORDER_ITEM,
+            InventoryMovement.reference_id.in_(item_ids),
+            InventoryMovement.movement_type == MOVEMENT_CONSUME,
+            ~exists().where(
+                and_(
+                    reversed_mv.reference_type == REFERENCE_ORDER_ITEM,
+                    reversed_mv.reference_id == InventoryMovement.reference_id,
+                    reversed_mv.movement_type == MOVEMENT_REVERSE,
+                )
+            ),
+        )
+        .group_by(InventoryMovement.reference_id, InventoryMovement.item_id)
+        .all()
+    )
+    if not rows:
+        return {"movements": 0, "items": {}}
+
+    note = f"order:{order_id}" if order_id else None
+    movements = []
+    deltas: Dict[int, Decimal] = defaultdict(Decimal)
+    for order_item_id, inventory_item_id, consumed in rows:
+        qty = -Decimal(str(consumed or 0))
+        if qty <= 0:
+            continue
+        movements.append({
+            "item_id": inventory_item_id,
+            "movement_type": MOVEMENT_REVERSE,
+            "quantity": qty,
+            "reference_type": REFERENCE_ORDER_ITEM,
+            "reference_id": order_item_id,
+            "notes": note,
+        })
+        deltas[inventory_item_id] += qty
+
+    if movements:
+        db.execute(insert(InventoryMovement), movements)
+    _apply_stock_deltas(db, deltas)
+
+    return {"movements": len(movements), "items": {k: float(v) for k, v in deltas.items()}}
+
+
+def reverse_order_consumption(db: Session, order_id: int) -> dict:
+    item_ids: List[int] = [
+        row[0] for row in db.query(OrderItem.id).filter(OrderItem.order_id == order_id).all()
+    ]
+    return reverse_order_items(db, item_ids, order_id=order_id)
@@ -0,0 +1,256 @@
+"""
+Snapshots periódicos de stock (inventory_snapshots).
+
+Cada snapshot guarda, por insumo, el stock con todos los movimientos de
+kardex anteriores a snapshot_at. El stock a una fecha se calcula como el
+último snapshot <= fecha + movimientos desde ese snapshot, en vez de sumar
+el kardex completo.
+
+- build_snapshots(): agrega los cortes que falten hasta `until`, partiendo
+  del último corte existente (incremental). El primer corte de un insumo se
+  ancla en current_stock menos los movimientos posteriores al corte.
+- stock_at(): stock por insumo a una fecha.
+
+Uso por consola (pensado para cron):
+    python inventory_snapshots.py [--restaurant deaca] [--period day|week|month] [--until 2026-01-31]
+"""
+import argparse
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from models.inventory_models import InventoryItem, InventoryMovement, InventorySnapshot
+
+PERIODS = ("day", "week", "month")
+DEFAULT_PERIOD = "day"
+
+
+def floor_period(value: datetime, period: str) -> datetime:
+    day = datetime(value.year, value.month, value.day)
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+
+def next_period(value: datetime, period: str) -> datetime:
+    if period == "week":
+        return value + timedelta(days=7)
+    if period == "month":
+        return (value.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return value + timedelta(days=1)
+
+
+def _dec(value) -> Decimal:
+    return Decimal(str(value or 0))
+
+
+def _movement_sums(db: Session, item_ids: List[int], start: Optional[datetime], end: Optional[datetime]) -> Dict[int, Decimal]:
+    if not item_ids:
+        return {}
+
+    query = db.query(InventoryMovement.item_id, func.sum(InventoryMovement.quantity)).filter(
+        InventoryMovement.item_id.in_(item_ids)
+    )
+    if start is not None:
+        query = query.filter(InventoryMovement.created_at >= start)
+    if end is not None:
+        query = query.filter(InventoryMovement.created_at < end)
+
+    return {item_id: _dec(total) for item_id, total in query.group_by(InventoryMovement.item_id).all()}
+
+
+def _anchor_from_current(db: Session, restaurant_id: int, item_ids: List[int], at: datetime) -> Dict[int, Decimal]:
+    """
+    Stock en `at` para insumos sin snapshot previo: current_stock menos lo que
+    se movió desde entonces.
+    """
+    if not item_ids:
+        return {}
+
+    current = dict(
+        db.query(InventoryItem.id, InventoryItem.current_stock)
+        .filter(InventoryItem.restaurant_id == restaurant_id, InventoryItem.id.in_(item_ids))
+        .all()
+    )
+    since = _movement_sums(db, item_ids, at, None)
+    return {item_id: _dec(current.get(item_id)) - since.get(item_id, Decimal("0")) for item_id in item_ids}
+
+
+def _latest_snapshots(db: Session, restaurant_id: int, at: datetime, item_ids: Optional[Iterable[int]] = None):
+    """
+    Último snapshot <= at por insumo: {item_id: (snapshot_at, stock)}.
+    """
+    latest = (
+        db.query(
+            InventorySnapshot.item_id.label("item_id"),
+            func.max(InventorySnapshot.snapshot_at).label("snapshot_at"),
+        )
+        .filter(
+            InventorySnapshot.restaurant_id == restaurant_id,
+            InventorySnapshot.snapshot_at <= at,
+        )
+    )
+    if item_ids is not None:
+        latest = latest.filter(InventorySnapshot.item_id.in_(list(item_ids)))
+    latest = latest.group_by(InventorySnapshot.item_id).subquery()
+
+    rows = (
+        db.query(InventorySnapshot.item_id, InventorySnapshot.snapshot_at, InventorySnapshot.stock)
+        .join(
+            latest,
+            (latest.c.item_id == InventorySnapshot.item_id)
+            & (latest.c.snapshot_at == InventorySnapshot.snapshot_at),
+        )
+        .all()
+    )
+    return {item_id: (snapshot_at, _dec(stock)) for item_id, snapshot_at, stock in rows}
+
+
+def stock_at(db: Session, restaurant_id: int, at: datetime, item_ids: Optional[Iterable[int]] = None) -> Dict[int, Decimal]:
+    if item_ids is None:
+        item_ids = [row[0] for row in db.query(InventoryItem.id).filter(InventoryItem.restaurant_id == restaurant_id).all()]
+    item_ids = [int(x) for x in item_ids]
+    if not item_ids:
+        return {}
+
+    snapshots = _latest_snapshots(db, restaurant_id, at, item_ids)
+
+    # los cortes se escriben para todo el restaurante a la vez, así que
+    # normalmente hay un único snapshot_at y una sola consulta de movimientos
+    by_checkpoint = defaultdict(list)
+    for item_id, (snapshot_at, _) in snapshots.items():
+        by_checkpoint[snapshot_at].append(item_id)
+
+    result: Dict[int, Decimal] = {}
+    for snapshot_at, ids in by_checkpoint.items():
+        moved = _movement_sums(db, ids, snapshot_at, at)
+        for item_id in ids:
+            result[item_id] = snapshots[item_id][1] + moved.get(item_id, Decimal("0"))
+
+    missing = [item_id for item_id in item_ids if item_id not in result]
+    result.update(_anchor_from_current(db, restaurant_id, missing, at))
+    return result
+
+
+def stock_at_from_kardex(db: Session, restaurant_id: int, at: datetime, item_ids: Optional[Iterable[int]] = None) -> Dict[int, Decimal]:
+    """
+    Mismo resultado que stock_at() pero recorriendo todo el kardex posterior
+    a `at`. Solo para comparar en el benchmark.
+    """
+    if item_ids is None:
+        item_ids = [row[0] for row in db.query(InventoryItem.id).filter(InventoryItem.restaurant_id == restaurant_id).all()]
+    return _anchor_from_current(db, restaurant_id, [int(x) for x in item_ids], at)
+
+
+def build_snapshots(
+    db: Session,
+    restaurant_id: int,
+    until: Optional[datetime] = None,
+    period: str = DEFAULT_PERIOD,
+) -> dict:
+    if period not in PERIODS:
+        raise ValueError(f"period inválido: {period}")
+
+    until = floor_period(until or datetime.utcnow(), period)
+
+    item_ids = [row[0] for row in db.query(InventoryItem.id).filter(InventoryItem.restaurant_id == restaurant_id).all()]
+    if not item_ids:
+        return {"restaurant_id": restaurant_id, "checkpoints": 0, "rows": 0}
+
+    last_at = (
+        db.query(func.max(InventorySnapshot.snapshot_at))
+        .filter(InventorySnapshot.restaurant_id == restaurant_id)
+        .scalar()
+    )
+
+    if last_at is not None:
+        boundary = next_period(last_at, period)
+        stock = {item_id: stock for item_id, (_, stock) in _latest_snapshots(db, restaurant_id, last_at, item_ids).items()}
+        prev = last_at
+    else:
+        first_movement = (
+            db.query(func.min(InventoryMovement.created_at))
+            .filter(InventoryMovement.item_id.in_(item_ids))
+            .scalar()
+        )
+        boundary = next_period(floor_period(first_movement, period), period) if first_movement else until
+        boundary = min(boundary, until)
+        stock = {}
+        prev = None
+
+    checkpoints = 0
+    rows = 0
+    while boundary <= until:
+        new_items = [item_id for item_id in item_ids if item_id not in stock]
+        stock.update(_anchor_from_current(db, restaurant_id, new_items, boundary))
+
+        carried = [item_id for item_id in item_ids if item_id not in new_items]
+        if prev is not None and carried:
+            for item_id, delta in _movement_sums(db, carried, prev, boundary).items():
+                stock[item_id] += delta
+
+        snapshots = [
+            {
+                "restaurant_id": restaurant_id,
+                "item_id": item_id,
+                "snapshot_at": boundary,
+                "stock": stock[item_id],
+            }
+            for item_id in item_ids
+        ]
+        if snapshots:
+            db.execute(insert(InventorySnapshot), snapshots)
+        db.commit()
+
+        checkpoints += 1
+        rows += len(item_ids)
+        prev = boundary
+        boundary = next_period(boundary, period)
+
+    return {"restaurant_id": restaurant_id, "checkpoints": checkpoints, "rows": rows, "until": until.isoformat()}
+
+
+def main(argv=None) -> int:
+    from db import Base, SessionLocal, engine
+    import models  # noqa: F401  registra todas las tablas
+    from models.core_models import Restaurant
+
+    parser = argparse.ArgumentParser(description="Agrega los snapshots de stock que falten.")
+    parser.add_argument("--restaurant", default="", help="slug; vacío = todos")
+    parser.add_argument("--period", choices=PERIODS, default=DEFAULT_PERIOD)
+    parser.add_argument("--until", default="", help="YYYY-MM-DD; vacío = hoy")
+    args = parser.parse_args(argv)
+
+    Base.metadata.create_all(bind=engine)
+
+    until = None
+    if args.until:
+        d = date.fromisoformat(args.until)
+        until = datetime(d.year, d.month, d.day)
+
+    db = SessionLocal()
+    try:
+        query = db.query(Restaurant.id, Restaurant.slug)
+        if args.restaurant:
+            query = query.filter(Restaurant.slug == args.restaurant)
+        restaurants = query.all()
+        if args.restaurant and not restaurants:
+            print(f"Restaurante no encontrado: {args.restaurant}")
+            return 1
+
+        for restaurant_id, slug in restaurants:
+            print(slug, build_snapshots(db, restaurant_id, until=until, period=args.period))
+    finally:
+        db.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,18 +1,77 @@
 import os
 import json
+import hashlib
 import requests
 import re
-from typing import Optional, List, Dict
+from typing import Any, Optional, List, Dict
 from decimal import Decimal
-from pydantic import BaseModel, Field
-from datetime import datetime
-
-from fastapi import FastAPI, Depends, HTTPException, Query, Request
-from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field, ValidationError
+from datetime import date, datetime, timedelta, timezone
+
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import Session
 
+import db_metrics
+from analytics_rollups import apply_order_rollup, revert_order_rollup
+from analytics_queries import BUCKETS as ANALYTICS_BUCKETS, query_analytics
+from inventory_depletion import consume_order_items, reverse_order_consumption, reverse_order_items
+from inventory_snapshots import stock_at
+from product_availability import get_unavailable, is_product_available
+from product_search import invalidate as invalidate_product_search, search as search_products
+from catalog_versions import catalog_delta, record_changes as record_catalog_changes
+from idempotency import IDEMPOTENCY_HEADER, IdempotencyClaim, idempotency_store
+from read_coalescing import coalesced_read_async, read_coalescer
+from read_replica import ReadYourWritesMiddleware, get_read_db
+from menu_engineering import UNIT_COSTS_SETTING_KEY, read_menu_engineering, run_menu_engineering
+from product_categories import (
+    assign_category,
+    delete_category,
+    ensure_schema as ensure_category_schema,
+    find_category,
+    hidden_whatsapp_category_ids,
+    list_categories,
+    merge_categories,
+    migrate_free_text_categories,
+    rename_category,
+)
+from permissions import (
+    CompiledPermissions, current_user, invalidate as invalidate_permissions, permission_bit, permission_codes,
+    require_permission, require_platform_admin,
+)
+from session_activity import SessionActivityMiddleware, SessionActivityTracker, idle_timeout_for
+from audit_log import AuditContextMiddleware, AuditWriter, parse_cursor, query_activity
+from cash_ledger import (
+    CashLedgerError,
+    attach_payments,
+    close_session as close_cash_session,
+    closing_preview as cash_closing_preview,
+    ensure_schema as ensure_cash_schema,
+    get_open_session as get_open_cash_session,
+    open_session as open_cash_session,
+    payment_currency,
+    reconcile_session as reconcile_cash_session,
+    record_movement as record_cash_movement,
+)
+from exports import (
+    ExportError, create_export_job, ensure_schema as ensure_export_schema, resume_pending_exports,
+    serialize_export_job, submit_export,
+)
+from order_archive import (
+    OrderArchiver, count_orders, ensure_schema as ensure_archive_schema, find_order, items_for_order,
+    latest_orders, payments_for_order,
+)
 from config import settings
-from db import Base, engine, SessionLocal, get_db
+from db import Base, engine, replica_engine, SessionLocal, get_db
+from db_async import dispose as dispose_async_db, mode as async_db_mode, run_blocking, run_db
+from sharding import (
+    DEFAULT_SHARD, directory as shard_directory, ensure_shard_schemas, for_each_shard, is_sharded,
+    locate as locate_shard, owns as shard_owns, restaurant_session, shard_names, shard_sessionmaker,
+    whatsapp_session,
+)
 
 # Importar modelos NUEVOS para registrar tablas
 from models.core_models import Restaurant, RestaurantModule, RestaurantSetting
@@ -24,9 +83,9 @@ from models.security_models import (
     UserSession,
     ActivityLog,
 )
-from models.sales_models import Order, OrderItem, OrderPayment, RestaurantZone, RestaurantTable
+from models.sales_models import Order, OrderItem, OrderPayment, PosSyncOperation, RestaurantZone, RestaurantTable
 from models.cash_models import CashSession, CashMovement
-from models.inventory_models import Product, InventoryItem, Recipe, InventoryMovement
+from models.inventory_models import Product, ProductCategory, InventoryItem, Recipe, InventoryMovement
 from models.hr_models import (
     Employee,
     EmployeeAttendance,
@@ -40,9 +99,19 @@ from models.analytics_models import (
     UserSalesMetric,
     DriverMetric,
 )
+from models.export_models import ExportJob
 
 app = FastAPI(title="NICALIA POS SUITE Demo V1")
 
+session_tracker = SessionActivityTracker(SessionLocal)
+app.add_middleware(SessionActivityMiddleware, tracker=session_tracker)
+
+audit_writer = AuditWriter(restaurant_session)
+order_archiver = OrderArchiver()
+app.add_middleware(AuditContextMiddleware)
+
+app.add_middleware(ReadYourWritesMiddleware)
+
 
 # =========================
 # CONFIG / SEED
@@ -86,6 +155,16 @@ DEFAULT_PERMISSIONS = [
     ("analytics.view", "Ver analytics", "analytics"),
 ]
 
+# grants iniciales; owner tiene todo sin necesidad de filas
+DEFAULT_ROLE_PERMISSIONS = {
+    "admin": [code for code, _, _ in DEFAULT_PERMISSIONS],
+    "cashier": [
+        "pos.local.access", "pos.delivery.access", "cash.access",
+        "cash.open", "cash.move", "cash.close", "orders.create", "orders.pay",
+    ],
+    "staff": ["pos.local.access", "kitchen.access", "orders.create"],
+}
+
 
 def seed_permissions(db: Session) -> None:
     for code, name, module_code in DEFAULT_PERMISSIONS:
@@ -100,6 +179,16 @@ def seed_permissions(db: Session) -> None:
             )
     db.commit()
 
+    ids = {code: pid for pid, code in db.query(Permission.id, Permission.code).all()}
+    for role_code, codes in DEFAULT_ROLE_PERMISSIONS.items():
+        # solo roles sin grants: no pisar lo que el admin haya quitado
+        exists = db.query(RolePermission.id).filter(RolePermission.role_code == role_code).first()
+        if exists:
+            continue
+        for code in codes:
+            db.add(RolePermission(role_code=role_code, permission_id=ids[code]))
+    db.commit()
+
 
 def seed_restaurant_and_owner(db: Session) -> Restaurant:
     restaurant = (
@@ -162,7 +251,7 @@ def seed_restaurant_and_owner(db: Session) -> Restaurant:
                 RestaurantSetting(
                     restaurant_id=restaurant.id,
                     setting_key=key,
-                    setting_value=raw,
+                    setting_value=value,
                 )
             )
 
@@ -228,18 +317,51 @@ def seed_demo_products(db: Session, restaurant: Restaurant) -> None:
     db.commit()
 
 
+def ensure_schema(bind) -> None:
+    # create_all no agrega columnas ni particiones a tablas existentes
+    ensure_category_schema(bind)
+    ensure_archive_schema(bind)
+    ensure_cash_schema(bind)
+    ensure_export_schema(bind)
+
+
 @app.on_event("startup")
 def startup_event():
     Base.metadata.create_all(bind=engine)
+    ensure_schema(engine)
 
     db = SessionLocal()
     try:
         seed_permissions(db)
         restaurant = seed_restaurant_and_owner(db)
         seed_demo_products(db, restaurant)
+        migrate_free_text_categories(db)
+        resume_pending_exports(db)
     finally:
         db.close()
 
+    ensure_shard_schemas(ensure_schema)
+    for shard in shard_names():
+        if shard == DEFAULT_SHARD:
+            continue
+        shard_db = shard_sessionmaker(shard)()
+        try:
+            resume_pending_exports(shard_db, shard=shard)
+        finally:
+            shard_db.close()
+
+    session_tracker.start()
+    audit_writer.start(engine)
+    order_archiver.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    session_tracker.stop()
+    audit_writer.stop()
+    order_archiver.stop()
+    await dispose_async_db()
+
 
 # =========================
 # HELPERS
@@ -275,12 +397,6 @@ def to_decimal(value) -> Decimal:
     except Exception:
         return Decimal("0")
 
-def get_restaurant_or_404(
-    db: Session,
-    restaurant_slug: Optional[str],
-) -> Restaurant:
-    restaurant = None
-
 def get_restaurant_by_phone_number_id(db: Session, phone_number_id: str):
     if not phone_number_id:
         return None
@@ -291,6 +407,18 @@ def get_restaurant_by_phone_number_id(db: Session, phone_number_id: str):
         .first()
     )
 
+
+def get_restaurant_or_404(
+    db: Session,
+    restaurant_slug: Optional[str],
+) -> Restaurant:
+    # un request que arma varias secciones (bootstrap) resuelve el tenant una vez
+    resolved = db.info.setdefault("restaurants_by_slug", {})
+    if restaurant_slug in resolved:
+        return resolved[restaurant_slug]
+
+    restaurant = None
+
     if restaurant_slug:
         restaurant = (
             db.query(Restaurant)
@@ -312,6 +440,7 @@ def get_restaurant_by_phone_number_id(db: Session, phone_number_id: str):
     if not restaurant:
         raise HTTPException(status_code=404, detail="No hay restaurantes configurados.")
 
+    resolved[restaurant_slug] = restaurant
     return restaurant
 
 
@@ -477,6 +606,194 @@ def html_shell(title: str, body: str) -> HTMLResponse:
 """
     )
 
+# Catálogo en caché y cola de operaciones del POS. Se inyecta en las
+# pantallas de ticket y delivery con el marcador __POS_OFFLINE_SCRIPT__.
+# Las operaciones se guardan en localStorage con client_op_id generado en el
+# navegador y se envían en bloque a /v2/api/local/sync; reenviar la misma
+# operación no la duplica. Los pagos no se encolan: cobrar requiere conexión,
+# pero postIdempotent() reintenta el POST con el mismo Idempotency-Key si la
+# red se cae en el medio, sin riesgo de cobrar dos veces.
+POS_OFFLINE_SCRIPT = """
+<script>
+function createPosOffline(slug) {
+  const queueKey = `pos_sync_queue:${slug}`;
+  const catalogKey = `pos_catalog:${slug}`;
+  const maxBatch = 200;
+  let flushing = null;
+
+  function uid() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return Date.now().toString(36) + Math.random().toString(36).slice(2, 12);
+  }
+
+  function read(key, fallback) {
+    try {
+      const raw = localStorage.getItem(key);
+      return raw ? JSON.parse(raw) : fallback;
+    } catch (e) {
+      return fallback;
+    }
+  }
+
+  function write(key, value) {
+    try {
+      localStorage.setItem(key, JSON.stringify(value));
+    } catch (e) {
+      console.error("No se pudo guardar en localStorage", e);
+    }
+  }
+
+  function deviceId() {
+    let id = localStorage.getItem("pos_device_id");
+    if (!id) {
+      id = uid();
+      localStorage.setItem("pos_device_id", id);
+    }
+    return id;
+  }
+
+  function applyCatalog(cache, delta) {
+    const products = new Map(delta.full ? [] : (cache.products || []).map(r => [r[0], r]));
+    const categories = new Map(delta.full ? [] : (cache.categories || []).map(r => [r[0], r]));
+    (delta.products || []).forEach(r => products.set(r[0], r));
+    (delta.categories || []).forEach(r => categories.set(r[0], r));
+    (delta.removed_products || []).forEach(id => products.delete(id));
+    (delta.removed_categories || []).forEach(id => categories.delete(id));
+    return { version: delta.version, products: [...products.values()], categories: [...categories.values()] };
+  }
+
+  function toProducts(cache) {
+    const categories = new Map((cache.categories || []).map(c => [c[0], c]));
+    return (cache.products || [])
+      .map(([id, name, categoryId, price, description, imageUrl]) => {
+        const category = categories.get(categoryId) || [categoryId, "General", 0];
+        return {
+          id, name, price, description,
+          image_url: imageUrl,
+          category_id: categoryId,
+          category: category[1] || "General",
+          category_order: Number(category[2] || 0)
+        };
+      })
+      .sort((a, b) => a.category_order - b.category_order || a.name.localeCompare(b.name));
+  }
+
+  function catalogVersion() {
+    const cache = read(catalogKey, null);
+    return cache ? cache.version : 0;
+  }
+
+  async function loadCatalog(delta) {
+    // delta: el que ya vino en un bootstrap; sin él se pide a /v2/api/catalog
+    let cache = read(catalogKey, null);
+    try {
+      if (!delta) {
+        const res = await fetch(`/v2/api/catalog?restaurant=${slug}&since=${catalogVersion()}`);
+        delta = res.ok ? await res.json() : null;
+      }
+      if (delta) {
+        cache = applyCatalog(cache || {}, delta);
+        write(catalogKey, cache);
+      }
+    } catch (e) {
+      // sin conexión: se usa lo último guardado
+    }
+    return cache ? toProducts(cache) : [];
+  }
+
+  function pending() {
+    return read(queueKey, []);
+  }
+
+  function enqueue(type, payload, extra) {
+    const op = Object.assign({ client_op_id: uid(), type, payload: payload || {} }, extra || {});
+    const ops = pending();
+    ops.push(op);
+    write(queueKey, ops);
+    return op;
+  }
+
+  async function send() {
+    const ops = pending().slice(0, maxBatch);
+    if (!ops.length) return { results: [], tickets: [], ticket_ids: {} };
+
+    const res = await fetch(`/v2/api/local/sync?restaurant=${slug}`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ device_id: deviceId(), operations: ops })
+    });
+    const data = await res.json();
+    if (!res.ok) throw new Error(data.detail || "No se pudo sincronizar.");
+
+    // las que el servidor ya contestó (aplicadas, duplicadas o en conflicto)
+    // salen de la cola; lo encolado mientras tanto se queda
+    const done = new Set((data.results || []).map(r => r.client_op_id));
+    write(queueKey, pending().filter(op => !done.has(op.client_op_id)));
+    return data;
+  }
+
+  async function flush() {
+    if (!flushing) {
+      flushing = send().finally(() => { flushing = null; });
+    }
+    return flushing;
+  }
+
+  async function postIdempotent(url, body, attempts) {
+    const key = uid();
+    const tries = attempts || 3;
+    for (let i = 1; ; i++) {
+      try {
+        return await fetch(url, {
+          method: "POST",
+          headers: { "Content-Type": "application/json", "Idempotency-Key": key },
+          body: JSON.stringify(body)
+        });
+      } catch (e) {
+        if (i >= tries) throw e;
+        await new Promise(resolve => setTimeout(resolve, 500 * i));
+      }
+    }
+  }
+
+  return { uid, deviceId, catalogVersion, loadCatalog, pending, enqueue, flush, postIdempotent };
+}
+</script>
+"""
+
+# Carga de /v2/api/bootstrap/*: manda las versiones de secciones que ya tiene
+# en localStorage y reusa las que el servidor marca como unchanged.
+SCREEN_BOOTSTRAP_SCRIPT = """
+<script>
+async function loadScreenBootstrap(url, cacheKey) {
+  let cache = {};
+  try {
+    cache = JSON.parse(localStorage.getItem(cacheKey) || "{}");
+  } catch (e) {
+    cache = {};
+  }
+  const known = Object.entries(cache).map(([name, section]) => `${name}:${section.version}`).join(",");
+  const sep = url.includes("?") ? "&" : "?";
+
+  const res = await fetch(`${url}${sep}known=${encodeURIComponent(known)}`);
+  const data = await res.json();
+  if (!res.ok) throw new Error(data.detail || "No se pudo cargar la pantalla.");
+
+  const sections = {};
+  for (const [name, section] of Object.entries(data.sections || {})) {
+    if (!section.unchanged) cache[name] = section;
+    sections[name] = (cache[name] || {}).data;
+  }
+  try {
+    localStorage.setItem(cacheKey, JSON.stringify(cache));
+  } catch (e) {
+    console.error("No se pudo guardar en localStorage", e);
+  }
+  return Object.assign({}, data, { sections });
+}
+</script>
+"""
+
 def parse_pipe_notes_meta(notes: str) -> Dict[str, str]:
     data: Dict[str, str] = {}
     for raw in (notes or "").split("|"):
@@ -506,6 +823,7 @@ class CreateOrderInput(BaseModel):
 class PayOrderInput(BaseModel):
     method: str
     amount: Decimal
+    currency: str = ""
     reference: str = ""
     bank_name: str = ""
     terminal_id: str = ""
@@ -539,6 +857,16 @@ class CategoryDeleteInput(BaseModel):
     name: str
     replacement: str = "General"
 
+
+class CategoryUpdateInput(BaseModel):
+    sort_order: Optional[int] = None
+    whatsapp_visible: Optional[bool] = None
+
+
+class CategoryMergeInput(BaseModel):
+    source_id: int
+    target_id: int
+
 class ZoneCreateInput(BaseModel):
     name: str
     sort_order: int = 0
@@ -592,6 +920,24 @@ class SendNewItemsInput(BaseModel):
     item_ids: Optional[List[int]] = None
 
 
+class PosSyncOperationInput(BaseModel):
+    client_op_id: str
+    type: str  # open_ticket | add_items | send_to_kitchen | create_order
+    order_id: Optional[int] = None
+    # client_op_id del open_ticket que creó el ticket en el dispositivo
+    client_ticket_id: Optional[str] = None
+    payload: Dict[str, Any] = Field(default_factory=dict)
+
+
+class PosSyncInput(BaseModel):
+    device_id: str
+    operations: List[PosSyncOperationInput]
+
+
+class VoidTicketItemInput(BaseModel):
+    reason: Optional[str] = None
+
+
 class SplitItemLineInput(BaseModel):
     order_item_id: int
     quantity: Decimal = Field(default=Decimal("1"))
@@ -604,6 +950,7 @@ class SplitItemsInput(BaseModel):
 class SplitPaymentLineInput(BaseModel):
     method: str
     amount: Decimal
+    currency: str = ""
     reference: str = ""
     bank_name: str = ""
     terminal_id: str = ""
@@ -641,6 +988,62 @@ def v2_health():
     }
 
 
+@app.get("/v2/api/diagnostics/db")
+def v2_api_diagnostics_db():
+    return {
+        "ok": True,
+        "metrics": db_metrics.snapshot(engine),
+        "replica_pool_status": replica_engine.pool.status() if replica_engine is not None else None,
+        "order_archive": order_archiver.stats(),
+    }
+
+
+def shard_stats(db: Session, shard: str) -> dict:
+    restaurant_ids = [row[0] for row in db.query(Restaurant.id).all()]
+    owned = [rid for rid in restaurant_ids if shard_owns(shard, rid)]
+    orders = db.query(func.count(Order.id)).filter(Order.restaurant_id.in_(owned)).scalar() if owned else 0
+    return {
+        "restaurants": len(owned),
+        "stale_copies": len(restaurant_ids) - len(owned),
+        "orders": int(orders or 0),
+        "pool_status": db.get_bind().pool.status(),
+    }
+
+
+@app.get("/v2/api/diagnostics/shards")
+def v2_api_diagnostics_shards():
+    results, errors = for_each_shard(shard_stats)
+    return {
+        "ok": not errors,
+        "shards": results,
+        "errors": errors,
+        "directory": shard_directory(),
+    }
+
+
+@app.exception_handler(PoolTimeoutError)
+def db_pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    db_metrics.incr("pool_timeouts")
+    return JSONResponse(
+        {"ok": False, "error": "db_pool_timeout", "detail": "Base de datos ocupada, reintentá."},
+        status_code=503,
+    )
+
+
+@app.exception_handler(OperationalError)
+def db_operational_error_handler(request: Request, exc: OperationalError):
+    if db_metrics.is_db_locked_error(exc):
+        return JSONResponse(
+            {"ok": False, "error": "db_locked", "detail": "Base de datos ocupada, reintentá."},
+            status_code=503,
+        )
+    print("DB_ERROR", str(exc))
+    return JSONResponse(
+        {"ok": False, "error": "db_error", "detail": "Error de base de datos."},
+        status_code=500,
+    )
+
+
 @app.get("/v2/menu", response_class=HTMLResponse)
 def v2_menu(
     restaurant: Optional[str] = Query(None),
@@ -1428,9 +1831,12 @@ def v2_pos_local_ticket(
       </div>
     </div>
 
+    __POS_OFFLINE_SCRIPT__
+    __SCREEN_BOOTSTRAP_SCRIPT__
     <script>
       const ticketRestaurantSlug = "__REST_SLUG__";
       const currentOrderId = Number("__ORDER_ID__");
+      const posOffline = createPosOffline(ticketRestaurantSlug);
 
       let ticketData = null;
       let paymentsData = null;
@@ -1438,6 +1844,11 @@ def v2_pos_local_ticket(
       let products = [];
       let categories = [];
       let activeCategory = "Todas";
+      let searchIds = null;
+      let searchSeq = 0;
+      let searchTimer = null;
+      let syncTimer = null;
+      let syncOffline = false;
 
       function money(v) {{
         return `C$${{Number(v || 0).toFixed(2)}}`;
@@ -1455,21 +1866,22 @@ def v2_pos_local_ticket(
         return map[status] || status || "Abierta";
       }}
 
-      async function loadTicket() {{
-        const res = await fetch(`/v2/api/local/ticket/${{currentOrderId}}?restaurant=${{ticketRestaurantSlug}}`);
-        const data = await res.json();
-        if (!res.ok) {{
-          alert(data.detail || "No se pudo cargar el ticket.");
-          return;
+      async function loadTicket(preloaded) {{
+        let data = preloaded;
+        if (!data) {{
+          const res = await fetch(`/v2/api/local/ticket/${{currentOrderId}}?restaurant=${{ticketRestaurantSlug}}`);
+          data = await res.json();
+          if (!res.ok) {{
+            alert(data.detail || "No se pudo cargar el ticket.");
+            return;
+          }}
         }}
         ticketData = data.ticket;
         renderTicket();
       }}
 
-      async function loadProducts() {{
-        const res = await fetch(`/v2/api/products?restaurant=${{ticketRestaurantSlug}}`);
-        const data = await res.json();
-        products = data.items || [];
+      async function loadProducts(catalogDelta) {{
+        products = await posOffline.loadCatalog(catalogDelta);
 
         categories = ["Todas", ...new Set(products.map(p => (p.category || "General").trim() || "General"))];
         renderCategories();
@@ -1497,6 +1909,30 @@ def v2_pos_local_ticket(
         renderProducts();
       }}
 
+      function queueProductSearch() {{
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(runProductSearch, 120);
+      }}
+
+      async function runProductSearch() {{
+        const q = (document.getElementById("searchProduct").value || "").trim();
+        const seq = ++searchSeq;
+        if (!q) {{
+          searchIds = null;
+          renderProducts();
+          return;
+        }}
+        try {{
+          const res = await fetch(`/v2/api/products/search?restaurant=${{ticketRestaurantSlug}}&limit=100&q=${{encodeURIComponent(q)}}`);
+          const data = await res.json();
+          if (seq !== searchSeq) return;
+          searchIds = res.ok ? (data.items || []).map(x => x.id) : null;
+        }} catch (e) {{
+          searchIds = null;
+        }}
+        renderProducts();
+      }}
+
       function renderProducts() {{
         const q = (document.getElementById("searchProduct").value || "").trim().toLowerCase();
         const grid = document.getElementById("productsGrid");
@@ -1505,7 +1941,10 @@ def v2_pos_local_ticket(
         if (activeCategory !== "Todas") {{
           filtered = filtered.filter(p => (((p.category || "General").trim()) || "General") === activeCategory);
         }}
-        if (q) {{
+        if (q && searchIds) {{
+          const byId = new Map(filtered.map(p => [p.id, p]));
+          filtered = searchIds.map(id => byId.get(id)).filter(Boolean);
+        }} else if (q) {{
           filtered = filtered.filter(p =>
             (p.name || "").toLowerCase().includes(q) ||
             (((p.category || "General").trim()) || "General").toLowerCase().includes(q)
@@ -1535,6 +1974,7 @@ def v2_pos_local_ticket(
           <div class="pill">Mesa: ${{tableLabel}}</div>
           <div class="pill">Pendientes: ${{ticketData.counts?.unsent || 0}}</div>
           <div class="pill">Enviados: ${{ticketData.counts?.sent || 0}}</div>
+          ${{syncPill()}}
         `;
 
         const items = (ticketData.items || []).filter(it => Number(it.pending_quantity || 0) > 0);
@@ -1560,30 +2000,74 @@ def v2_pos_local_ticket(
         renderSplitItems();
       }}
 
-      async function addProductToTicket(productId) {{
-        const res = await fetch(`/v2/api/local/ticket/${{currentOrderId}}/items/add?restaurant=${{ticketRestaurantSlug}}`, {{
-          method: "POST",
-          headers: {{ "Content-Type": "application/json" }},
-          body: JSON.stringify({{
-            items: [
-              {{
-                product_id: Number(productId),
-                quantity: 1,
-                notes: ""
-              }}
-            ]
-          }})
-        }});
+      function syncPill() {{
+        const waiting = posOffline.pending().length;
+        if (!waiting && !syncOffline) return "";
+        const label = syncOffline ? "Sin conexión" : "Sincronizando";
+        return `<div class="pill">${{label}} · ${{waiting}} en cola</div>`;
+      }}
 
-        const data = await res.json();
-        if (!res.ok) {{
-          alert(data.detail || "No se pudo agregar el producto.");
-          return;
+      function scheduleSync(delay) {{
+        clearTimeout(syncTimer);
+        syncTimer = setTimeout(syncQueue, delay);
+      }}
+
+      async function syncQueue() {{
+        if (!posOffline.pending().length) return null;
+        let data;
+        try {{
+          data = await posOffline.flush();
+          syncOffline = false;
+        }} catch (e) {{
+          syncOffline = true;
+          if (ticketData) renderTicket();
+          return null;
         }}
 
-        ticketData = data.ticket;
-        renderTicket();
+        const ticket = (data.tickets || []).find(t => t.id === currentOrderId);
+        if (ticket) ticketData = ticket;
+        if (ticketData) renderTicket();
+
+        const conflicts = (data.results || []).filter(r => r.status === "conflict" || r.status === "rejected");
+        if (conflicts.length) {{
+          await loadTicket();
+          alert(`No se aplicaron ${{conflicts.length}} operaciones:\\n` + conflicts.map(r => `- ${{r.detail}}`).join("\\n"));
+        }}
+        if (posOffline.pending().length) scheduleSync(0);
         loadPayments();
+        return data;
+      }}
+
+      function addOptimisticLine(product) {{
+        const price = Number(product.price || 0);
+        ticketData.items = [...(ticketData.items || []), {{
+          product_id: product.id,
+          product_name_snapshot: product.name,
+          quantity: 1,
+          pending_quantity: 1,
+          unit_price: price,
+          total_price: price,
+          notes: "",
+          sent_to_kitchen: false
+        }}];
+        ticketData.counts = Object.assign({{}}, ticketData.counts, {{ unsent: Number(ticketData.counts?.unsent || 0) + 1 }});
+        ticketData.subtotal = Number(ticketData.subtotal || 0) + price;
+        ticketData.total = Number(ticketData.total || 0) + price;
+      }}
+
+      function addProductToTicket(productId) {{
+        // se encola y se manda en bloque: varios toques seguidos van en un
+        // solo request y sin conexión el ticket sigue funcionando
+        posOffline.enqueue("add_items", {{
+          items: [{{ product_id: Number(productId), quantity: 1, notes: "" }}]
+        }}, {{ order_id: currentOrderId }});
+
+        const product = products.find(p => p.id === Number(productId));
+        if (ticketData && product) {{
+          addOptimisticLine(product);
+          renderTicket();
+        }}
+        scheduleSync(400);
       }}
 
       async function openBarFromTicket() {{
@@ -1629,31 +2113,30 @@ def v2_pos_local_ticket(
       }}
 
       async function sendNewItems() {{
-        const res = await fetch(`/v2/api/local/ticket/${{currentOrderId}}/send-new-items?restaurant=${{ticketRestaurantSlug}}`, {{
-          method: "POST",
-          headers: {{ "Content-Type": "application/json" }},
-          body: JSON.stringify({{}})
-        }});
-
-        const data = await res.json();
-        if (!res.ok) {{
-          alert(data.detail || "No se pudo enviar a cocina.");
+        const op = posOffline.enqueue("send_to_kitchen", {{}}, {{ order_id: currentOrderId }});
+        clearTimeout(syncTimer);
+        const data = await syncQueue();
+        if (!data) {{
+          alert("Sin conexión: los productos se enviarán a cocina al reconectar.");
           return;
         }}
 
-        ticketData = data.ticket;
-        renderTicket();
-        loadPayments();
-        alert(`Se enviaron ${{data.sent_count || 0}} productos nuevos a cocina.`);
+        const result = (data.results || []).find(r => r.client_op_id === op.client_op_id);
+        if (result && result.status !== "conflict" && result.status !== "rejected") {{
+          alert(`Se enviaron ${{result.sent_count || 0}} productos nuevos a cocina.`);
+        }}
       }}
       
-      async function loadPayments() {{
-        const res = await fetch(`/v2/api/local/ticket/${{currentOrderId}}/payments?restaurant=${{ticketRestaurantSlug}}`);
-        const data = await res.json();
-
-        if (!res.ok) {{
-          console.error(data.detail || "No se pudieron cargar los pagos.");
-          return;
+      async function loadPayments(preloaded) {{
+        let data = preloaded;
+        if (!data) {{
+          const res = await fetch(`/v2/api/local/ticket/${{currentOrderId}}/payments?restaurant=${{ticketRestaurantSlug}}`);
+          data = await res.json();
+
+          if (!res.ok) {{
+            console.error(data.detail || "No se pudieron cargar los pagos.");
+            return;
+          }}
         }}
 
         paymentsData = data;
@@ -1704,11 +2187,13 @@ def v2_pos_local_ticket(
           ]
         }};
 
-        const res = await fetch(`/v2/api/local/ticket/${{currentOrderId}}/pay-split?restaurant=${{ticketRestaurantSlug}}`, {{
-          method: "POST",
-          headers: {{ "Content-Type": "application/json" }},
-          body: JSON.stringify(payload)
-        }});
+        let res;
+        try {{
+          res = await posOffline.postIdempotent(`/v2/api/local/ticket/${{currentOrderId}}/pay-split?restaurant=${{ticketRestaurantSlug}}`, payload);
+        }} catch (e) {{
+          alert("Sin conexión: el pago no se aplicó.");
+          return;
+        }}
 
         const data = await res.json();
         if (!res.ok) {{
@@ -1861,19 +2346,46 @@ def v2_pos_local_ticket(
         alert(`Selección pagada. Saldo pendiente: ${{money(data.balance_due || 0)}}`);
       }}
 
-       document.getElementById("searchProduct").addEventListener("input", renderProducts);
+       document.getElementById("searchProduct").addEventListener("input", () => {{
+         searchIds = null;
+         renderProducts();
+         queueProductSearch();
+       }});
        document.getElementById("categorySelect").addEventListener("change", (e) => {{
         activeCategory = e.target.value;
         renderCategories();
         renderProducts();
       }});
 
-      loadProducts();
-      loadTicket();
-      loadPayments();
+      window.addEventListener("online", () => scheduleSync(0));
+      setInterval(syncQueue, 15000);
+
+      async function bootTicket() {{
+        // ticket, pagos y delta del catálogo en un solo request
+        let boot = null;
+        try {{
+          boot = await loadScreenBootstrap(
+            `/v2/api/bootstrap/ticket/${{currentOrderId}}?restaurant=${{ticketRestaurantSlug}}&catalog_since=${{posOffline.catalogVersion()}}`,
+            `pos_boot_ticket:${{ticketRestaurantSlug}}`
+          );
+        }} catch (e) {{
+          boot = null;
+        }}
+
+        await Promise.all([
+          loadProducts(boot ? boot.catalog : null),
+          loadTicket(boot ? boot.sections.ticket : null).catch(() => null),
+          loadPayments(boot ? boot.sections.payments : null).catch(() => null)
+        ]);
+        syncQueue();
+      }}
+
+      bootTicket();
     </script>
     """
 
+    body = body.replace("__POS_OFFLINE_SCRIPT__", POS_OFFLINE_SCRIPT)
+    body = body.replace("__SCREEN_BOOTSTRAP_SCRIPT__", SCREEN_BOOTSTRAP_SCRIPT)
     body = body.replace("__REST_SLUG__", str(rest.slug or ""))
     body = body.replace("__ORDER_ID__", str(order.id))
     return html_shell("POS Local Ticket", body)
@@ -2119,7 +2631,7 @@ def v2_pos_delivery(restaurant: Optional[str] = Query(None), db: Session = Depen
         <div class="field-row">
           <div class="field">
             <label>Buscar producto</label>
-            <input id="search_product" placeholder="Buscar por nombre..." oninput="renderProducts()">
+            <input id="search_product" placeholder="Buscar por nombre..." oninput="searchIds = null; renderProducts(); queueProductSearch()">
           </div>
           <div class="field">
             <label>Categoría activa</label>
@@ -2205,8 +2717,10 @@ def v2_pos_delivery(restaurant: Optional[str] = Query(None), db: Session = Depen
       </div>
     </div>
 
+    __POS_OFFLINE_SCRIPT__
     <script>
       const restaurantSlug = "__REST_SLUG__";
+      const posOffline = createPosOffline(restaurantSlug);
 
       let products = [];
       let categories = [];
@@ -2219,6 +2733,9 @@ def v2_pos_delivery(restaurant: Optional[str] = Query(None), db: Session = Depen
       let pendingOrders = [];
       let selectedPromoCode = "";
       let selectedPromoDiscount = 0;
+      let searchIds = null;
+      let searchSeq = 0;
+      let searchTimer = null;
 
       function money(value) {
         return `C$${Number(value || 0).toFixed(2)}`;
@@ -2232,9 +2749,7 @@ def v2_pos_delivery(restaurant: Optional[str] = Query(None), db: Session = Depen
       }
 
       async function loadProducts() {
-        const res = await fetch(`/v2/api/products?restaurant=${restaurantSlug}`);
-        const data = await res.json();
-        products = data.items || [];
+        products = await posOffline.loadCatalog();
         categories = ["Todas", ...new Set(products.map(p => p.category || "General"))];
         renderCategories();
         renderProducts();
@@ -2279,6 +2794,30 @@ def v2_pos_delivery(restaurant: Optional[str] = Query(None), db: Session = Depen
         renderProducts();
       }
 
+      function queueProductSearch() {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(runProductSearch, 120);
+      }
+
+      async function runProductSearch() {
+        const q = (document.getElementById("search_product").value || "").trim();
+        const seq = ++searchSeq;
+        if (!q) {
+          searchIds = null;
+          renderProducts();
+          return;
+        }
+        try {
+          const res = await fetch(`/v2/api/products/search?restaurant=${restaurantSlug}&limit=100&q=${encodeURIComponent(q)}`);
+          const data = await res.json();
+          if (seq !== searchSeq) return;
+          searchIds = res.ok ? (data.items || []).map(x => x.id) : null;
+        } catch (e) {
+          searchIds = null;
+        }
+        renderProducts();
+      }
+
       function renderProducts() {
         const q = (document.getElementById("search_product").value || "").toLowerCase().trim();
         let filtered = [...products];
@@ -2286,7 +2825,10 @@ def v2_pos_delivery(restaurant: Optional[str] = Query(None), db: Session = Depen
         if (activeCategory !== "Todas") {
           filtered = filtered.filter(p => (p.category || "General") === activeCategory);
         }
-        if (q) {
+        if (q && searchIds) {
+          const byId = new Map(filtered.map(p => [p.id, p]));
+          filtered = searchIds.map(id => byId.get(id)).filter(Boolean);
+        } else if (q) {
           filtered = filtered.filter(p => (p.name || "").toLowerCase().includes(q));
         }
 
@@ -2537,11 +3079,13 @@ def v2_pos_delivery(restaurant: Optional[str] = Query(None), db: Session = Depen
         }
 
         const payload = buildManualPayload();
-        const res = await fetch(`/v2/api/orders/create?restaurant=${restaurantSlug}`, {
-          method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify(payload)
-        });
+        let res;
+        try {
+          res = await posOffline.postIdempotent(`/v2/api/orders/create?restaurant=${restaurantSlug}`, payload);
+        } catch (e) {
+          queueManualOrder(payload);
+          return;
+        }
         const data = await res.json();
 
         if (!res.ok) {
@@ -2564,6 +3108,37 @@ def v2_pos_delivery(restaurant: Optional[str] = Query(None), db: Session = Depen
         loadPendingOrders();
       }
 
+      function queueManualOrder(payload) {
+        posOffline.enqueue("create_order", payload);
+        document.getElementById("resultBox").innerHTML = `
+          <div style="padding:12px;border:1px solid #fde68a;background:#fffbeb;border-radius:12px;">
+            Sin conexión: la orden quedó en cola (${posOffline.pending().length} pendientes).<br>
+            Se creará al reconectar; el cobro necesita conexión.
+          </div>
+        `;
+      }
+
+      async function syncQueuedOrders() {
+        if (!posOffline.pending().length) return;
+        let data;
+        try {
+          data = await posOffline.flush();
+        } catch (e) {
+          return;
+        }
+        const created = (data.results || []).filter(r => r.status === "applied" && r.order);
+        const conflicts = (data.results || []).filter(r => r.status === "conflict" || r.status === "rejected");
+        if (created.length || conflicts.length) {
+          document.getElementById("resultBox").innerHTML = `
+            <div style="padding:12px;border:1px solid #bbf7d0;background:#f0fdf4;border-radius:12px;">
+              Órdenes sincronizadas: ${created.map(r => `#${r.order.id}`).join(", ") || "-"}<br>
+              ${conflicts.map(r => `No se pudo crear: ${r.detail}`).join("<br>")}
+            </div>
+          `;
+          loadPendingOrders();
+        }
+      }
+
       async function paySelectedOrder() {
         const targetId = currentOrderId || lastCreatedOrderId;
         if (!targetId) {
@@ -2577,11 +3152,13 @@ def v2_pos_delivery(restaurant: Optional[str] = Query(None), db: Session = Depen
           reference: document.getElementById("pay_reference").value || ""
         };
 
-        const res = await fetch(`/v2/api/orders/${targetId}/pay?restaurant=${restaurantSlug}`, {
-          method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify(payload)
-        });
+        let res;
+        try {
+          res = await posOffline.postIdempotent(`/v2/api/orders/${targetId}/pay?restaurant=${restaurantSlug}`, payload);
+        } catch (e) {
+          alert("Sin conexión: la orden no se cobró.");
+          return;
+        }
         const data = await res.json();
 
         if (!res.ok) {
@@ -2644,11 +3221,16 @@ def v2_pos_delivery(restaurant: Optional[str] = Query(None), db: Session = Depen
       document.getElementById("payment_method").addEventListener("change", renderCart);
       document.getElementById("driver_name").addEventListener("input", renderCart);
 
+      window.addEventListener("online", syncQueuedOrders);
+      setInterval(syncQueuedOrders, 15000);
+
       loadProducts();
       loadPendingOrders();
       renderCart();
+      syncQueuedOrders();
     </script>
     """
+    body = body.replace("__POS_OFFLINE_SCRIPT__", POS_OFFLINE_SCRIPT)
     body = body.replace("__REST_NAME__", str(rest.name or "")).replace("__REST_SLUG__", str(rest.slug or ""))
     return html_shell("POS Delivery Pro", body)
 
@@ -2952,12 +3534,27 @@ setInterval(loadKitchenOrders, 8000);
     return html_shell("Kitchen Display", body)
 
 @app.get("/v2/api/kitchen/orders")
-def v2_api_kitchen_orders(
+async def v2_api_kitchen_orders(
     restaurant: Optional[str] = Query(None),
     status: Optional[str] = Query(None),
     channel: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
 ):
+    rest = await run_db(find_kitchen_restaurant, restaurant, tenant=restaurant)
+
+    if not rest:
+        return JSONResponse(
+            {"ok": False, "error": "Restaurant not found"},
+            status_code=404
+        )
+
+    # los KDS refrescan todos a la vez: una sola consulta para los iguales
+    return await coalesced_read_async(
+        "kitchen.orders", rest.id, (status or "", channel or ""),
+        lambda: run_db(build_kitchen_orders, rest, status, channel, tenant=restaurant),
+    )
+
+
+def find_kitchen_restaurant(db: Session, restaurant: Optional[str]) -> Optional[Restaurant]:
     rest = None
 
     if restaurant:
@@ -2967,12 +3564,10 @@ def v2_api_kitchen_orders(
         print("⚠️ Kitchen fallback: restaurant not found for slug =", restaurant)
         rest = db.query(Restaurant).filter(Restaurant.slug == "deaca").first()
 
-    if not rest:
-        return JSONResponse(
-            {"ok": False, "error": "Restaurant not found"},
-            status_code=404
-        )
+    return rest
 
+
+def build_kitchen_orders(db: Session, rest, status: Optional[str], channel: Optional[str]) -> dict:
     query = db.query(Order).filter(Order.restaurant_id == rest.id)
 
     if status:
@@ -3065,37 +3660,518 @@ def v2_cash(restaurant: Optional[str] = Query(None), db: Session = Depends(get_d
     return placeholder_page(
         "Caja",
         rest.slug,
-        "Aquí conectaremos apertura, movimientos y cierre de caja en el Bloque 9.",
+        f"Los cobros v2 se ligan a la caja abierta. Apertura, movimientos y cierre en /v2/api/cash/current?restaurant={rest.slug}.",
     )
 
 
-@app.get("/v2/inventory", response_class=HTMLResponse)
-def v2_inventory(restaurant: Optional[str] = Query(None), db: Session = Depends(get_db)):
-    rest = get_restaurant_or_404(db, restaurant)
-    return placeholder_page(
-        "Inventario",
-        rest.slug,
-        "Aquí conectaremos productos, recetas y kardex en el Bloque 10.",
-    )
+class CashOpenInput(BaseModel):
+    opening_amount: Decimal = Decimal("0")
 
 
-@app.get("/v2/hr", response_class=HTMLResponse)
-def v2_hr(restaurant: Optional[str] = Query(None), db: Session = Depends(get_db)):
-    rest = get_restaurant_or_404(db, restaurant)
-    return placeholder_page(
-        "RRHH",
-        rest.slug,
-        "Aquí conectaremos empleados, asistencia, vacaciones y liquidaciones en el Bloque 11.",
-    )
+class CashMovementInput(BaseModel):
+    movement_type: str
+    amount: Decimal
+    currency: str = ""
+    description: str = ""
 
 
-@app.get("/v2/analytics", response_class=HTMLResponse)
-def v2_analytics(restaurant: Optional[str] = Query(None), db: Session = Depends(get_db)):
-    rest = get_restaurant_or_404(db, restaurant)
-    return placeholder_page(
-        "Analytics",
-        rest.slug,
-        "Aquí conectaremos dashboards y métricas en el Bloque 12.",
+class CashCloseInput(BaseModel):
+    closing_amount: Decimal
+
+
+def get_open_cash_session_or_400(db: Session, rest_id: int) -> CashSession:
+    session = get_open_cash_session(db, rest_id)
+    if not session:
+        raise HTTPException(status_code=400, detail="No hay caja abierta.")
+    return session
+
+
+@app.get("/v2/api/cash/current")
+def v2_api_cash_current(
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    session = get_open_cash_session(db, rest.id)
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        "session": cash_closing_preview(db, session) if session else None,
+    }
+
+
+# caja: el usuario del libro y de la auditoría es el que se identificó, no uno del body
+@app.post("/v2/api/cash/open")
+def v2_api_cash_open(
+    payload: CashOpenInput,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+    me: CompiledPermissions = Depends(require_permission("cash.open", strict=True)),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    try:
+        session = open_cash_session(db, rest.id, payload.opening_amount, me.user_id)
+    except CashLedgerError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    audit_writer.audit(
+        rest.id, "cash", "cash.open", "cash_session", session.id,
+        new={"opening_amount": payload.opening_amount}, user_id=me.user_id, db=db,
+    )
+    db.commit()
+    db.refresh(session)
+    return {"ok": True, "restaurant": rest.slug, "session": cash_closing_preview(db, session)}
+
+
+@app.post("/v2/api/cash/movements")
+def v2_api_cash_movement(
+    payload: CashMovementInput,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+    me: CompiledPermissions = Depends(require_permission("cash.move", strict=True)),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    session = get_open_cash_session_or_400(db, rest.id)
+    try:
+        movement = record_cash_movement(
+            db,
+            session,
+            payload.movement_type,
+            payload.amount,
+            description=(payload.description or "").strip(),
+            currency=payload.currency,
+            user_id=me.user_id,
+        )
+    except CashLedgerError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    audit_writer.audit(
+        rest.id, "cash", "cash.movement", "cash_movement", movement.id,
+        description=movement.description or None,
+        new={
+            "session_id": session.id,
+            "movement_type": movement.movement_type,
+            "amount": movement.amount,
+            "currency": payload.currency or None,
+        },
+        user_id=me.user_id,
+        db=db,
+    )
+    db.commit()
+    db.refresh(session)
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        "movement_id": movement.id,
+        "session": cash_closing_preview(db, session),
+    }
+
+
+@app.post("/v2/api/cash/close")
+def v2_api_cash_close(
+    payload: CashCloseInput,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+    me: CompiledPermissions = Depends(require_permission("cash.close", strict=True)),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    session = get_open_cash_session_or_400(db, rest.id)
+    try:
+        preview = close_cash_session(db, session, payload.closing_amount)
+    except CashLedgerError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    audit_writer.audit(
+        rest.id, "cash", "cash.close", "cash_session", session.id,
+        new={
+            "closing_amount": session.closing_amount,
+            "expected_amount": session.expected_amount,
+            "difference": session.difference,
+        },
+        user_id=me.user_id,
+        db=db,
+    )
+    db.commit()
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        "session": preview,
+        "closing_amount": float(session.closing_amount or 0),
+        "difference": float(session.difference or 0),
+        "closed_at": str(session.closed_at or ""),
+    }
+
+
+@app.post("/v2/api/cash/{session_id}/reconcile", dependencies=[Depends(require_permission("cash.close"))])
+def v2_api_cash_reconcile(
+    session_id: int,
+    restaurant: Optional[str] = Query(None),
+    fix: bool = Query(False),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    exists = (
+        db.query(CashSession.id)
+        .filter(CashSession.id == session_id, CashSession.restaurant_id == rest.id)
+        .first()
+    )
+    if not exists:
+        raise HTTPException(status_code=404, detail="Sesión de caja no encontrada")
+    result = reconcile_cash_session(db, session_id, fix=fix)
+    return {"ok": True, "restaurant": rest.slug, **result}
+
+
+@app.get("/v2/inventory", response_class=HTMLResponse)
+def v2_inventory(restaurant: Optional[str] = Query(None), db: Session = Depends(get_db)):
+    rest = get_restaurant_or_404(db, restaurant)
+    return placeholder_page(
+        "Inventario",
+        rest.slug,
+        f"El stock se descuenta por receta al enviar a cocina o crear la orden. Datos en /v2/api/inventory?restaurant={rest.slug}.",
+    )
+
+
+def serialize_inventory_item_row(it: InventoryItem) -> dict:
+    current = Decimal(str(it.current_stock or 0))
+    minimum = Decimal(str(it.minimum_stock or 0))
+    return {
+        "id": it.id,
+        "name": it.name,
+        "unit": it.unit or "",
+        "current_stock": float(current),
+        "minimum_stock": float(minimum),
+        "is_low": current <= minimum,
+    }
+
+
+@app.get("/v2/api/inventory")
+def v2_api_inventory(
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+
+    rows = (
+        db.query(InventoryItem)
+        .filter(InventoryItem.restaurant_id == rest.id)
+        .order_by(InventoryItem.name.asc())
+        .all()
+    )
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        "items": [serialize_inventory_item_row(it) for it in rows],
+    }
+
+
+@app.get("/v2/api/inventory/stock-at")
+def v2_api_inventory_stock_at(
+    at: str = Query(...),
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_read_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+
+    try:
+        at_dt = datetime.fromisoformat(at.strip())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="at debe tener formato AAAA-MM-DD o AAAA-MM-DDTHH:MM")
+    if at_dt.tzinfo is not None:
+        at_dt = at_dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+    rows = (
+        db.query(InventoryItem)
+        .filter(InventoryItem.restaurant_id == rest.id)
+        .order_by(InventoryItem.name.asc())
+        .all()
+    )
+    stock = stock_at(db, rest.id, at_dt, [it.id for it in rows])
+
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        "at": at_dt.isoformat(),
+        "items": [
+            {
+                "id": it.id,
+                "name": it.name,
+                "unit": it.unit or "",
+                "stock": float(stock.get(it.id, 0)),
+            }
+            for it in rows
+        ],
+    }
+
+
+class InventoryCostsInput(BaseModel):
+    costs: Dict[str, float] = {}
+
+
+@app.get("/v2/api/inventory/costs")
+def v2_api_inventory_costs(
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    costs = get_restaurant_setting_value(db, rest.id, UNIT_COSTS_SETTING_KEY, {}) or {}
+    return {"ok": True, "restaurant": rest.slug, "costs": costs}
+
+
+@app.post("/v2/api/inventory/costs", dependencies=[Depends(require_permission("inventory.adjust"))])
+def v2_api_inventory_costs_update(
+    payload: InventoryCostsInput,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+
+    item_ids = {
+        row[0]
+        for row in db.query(InventoryItem.id).filter(InventoryItem.restaurant_id == rest.id).all()
+    }
+    costs = dict(get_restaurant_setting_value(db, rest.id, UNIT_COSTS_SETTING_KEY, {}) or {})
+    old_costs = dict(costs)
+    for key, value in (payload.costs or {}).items():
+        try:
+            item_id = int(key)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"Insumo inválido: {key}")
+        if item_id not in item_ids:
+            raise HTTPException(status_code=404, detail=f"Insumo no encontrado: {key}")
+        if value < 0:
+            raise HTTPException(status_code=400, detail="El costo no puede ser negativo")
+        costs[str(item_id)] = value
+
+    set_restaurant_setting_value(db, rest.id, UNIT_COSTS_SETTING_KEY, costs)
+    db.commit()
+
+    audit_writer.audit(rest.id, "inventory", "inventory.costs", "restaurant", rest.id, old=old_costs, new=costs)
+    return {"ok": True, "restaurant": rest.slug, "costs": costs}
+
+
+@app.get("/v2/api/inventory/{item_id}/movements")
+def v2_api_inventory_movements(
+    item_id: int,
+    restaurant: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=500),
+    db: Session = Depends(get_read_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+
+    item = (
+        db.query(InventoryItem)
+        .filter(
+            InventoryItem.id == item_id,
+            InventoryItem.restaurant_id == rest.id,
+        )
+        .first()
+    )
+    if not item:
+        raise HTTPException(status_code=404, detail="Insumo no encontrado")
+
+    rows = (
+        db.query(InventoryMovement)
+        .filter(InventoryMovement.item_id == item.id)
+        .order_by(InventoryMovement.id.desc())
+        .limit(limit)
+        .all()
+    )
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        "item": serialize_inventory_item_row(item),
+        "movements": [
+            {
+                "id": m.id,
+                "movement_type": m.movement_type or "",
+                "quantity": float(m.quantity or 0),
+                "reference_type": m.reference_type or "",
+                "reference_id": m.reference_id,
+                "notes": m.notes or "",
+                "created_at": str(m.created_at or ""),
+            }
+            for m in rows
+        ],
+    }
+
+
+@app.get("/v2/hr", response_class=HTMLResponse)
+def v2_hr(restaurant: Optional[str] = Query(None), db: Session = Depends(get_db)):
+    rest = get_restaurant_or_404(db, restaurant)
+    return placeholder_page(
+        "RRHH",
+        rest.slug,
+        "Aquí conectaremos empleados, asistencia, vacaciones y liquidaciones en el Bloque 11.",
+    )
+
+
+@app.get("/v2/analytics", response_class=HTMLResponse)
+def v2_analytics(restaurant: Optional[str] = Query(None), db: Session = Depends(get_db)):
+    rest = get_restaurant_or_404(db, restaurant)
+    return placeholder_page(
+        "Analytics",
+        rest.slug,
+        f"Los dashboards leerán de /v2/api/analytics?restaurant={rest.slug} (ventas, canales, productos y mapa de horas).",
+    )
+
+
+def parse_analytics_date(value: Optional[str], field: str) -> Optional[date]:
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{field} debe tener formato AAAA-MM-DD")
+
+
+@app.get("/v2/api/analytics")
+def v2_api_analytics(
+    restaurant: Optional[str] = Query(None),
+    date_from: Optional[str] = Query(None),
+    date_to: Optional[str] = Query(None),
+    bucket: str = Query("day"),
+    top: int = Query(5, ge=0, le=50),
+    db: Session = Depends(get_read_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+
+    bucket = (bucket or "day").strip().lower()
+    if bucket not in ANALYTICS_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket debe ser uno de: {', '.join(ANALYTICS_BUCKETS)}")
+
+    end = parse_analytics_date(date_to, "date_to") or datetime.utcnow().date()
+    start = parse_analytics_date(date_from, "date_from") or (end - timedelta(days=29))
+    if start > end:
+        raise HTTPException(status_code=400, detail="date_from no puede ser mayor que date_to")
+    if (end - start).days > 366 * 3:
+        raise HTTPException(status_code=400, detail="El rango máximo es de 3 años")
+    if bucket == "hour" and (end - start).days > 92:
+        raise HTTPException(status_code=400, detail="bucket=hour admite rangos de hasta 92 días")
+
+    data = query_analytics(db, rest.id, start, end, bucket=bucket, top=top)
+    return {"ok": True, "restaurant": rest.slug, **data}
+
+
+@app.get("/v2/api/menu-engineering")
+def v2_api_menu_engineering(
+    restaurant: Optional[str] = Query(None),
+    period: Optional[str] = Query(None),
+    db: Session = Depends(get_read_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+
+    period_dt = None
+    if period:
+        try:
+            period_dt = datetime.strptime(period.strip(), "%Y-%m")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="period debe tener formato AAAA-MM")
+
+    data = read_menu_engineering(db, rest.id, period_dt)
+    return {"ok": True, "restaurant": rest.slug, **data}
+
+
+@app.post("/v2/api/menu-engineering/run")
+def v2_api_menu_engineering_run(
+    restaurant: Optional[str] = Query(None),
+    full: bool = Query(False),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    result = run_menu_engineering(db, rest.id, full=full)
+    return {"ok": True, "restaurant": rest.slug, **result}
+
+
+class ExportCreateInput(BaseModel):
+    export_type: str = "orders"
+    file_format: str = "csv"
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+
+
+def get_export_job_or_404(db: Session, restaurant_id: int, job_id: int) -> ExportJob:
+    job = (
+        db.query(ExportJob)
+        .filter(
+            ExportJob.id == job_id,
+            ExportJob.restaurant_id == restaurant_id,
+        )
+        .first()
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Exportación no encontrada")
+    return job
+
+
+@app.post("/v2/api/exports", dependencies=[Depends(require_permission("analytics.view", strict=True))])
+def v2_api_create_export(
+    payload: ExportCreateInput,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+
+    try:
+        job = create_export_job(
+            db,
+            rest.id,
+            (payload.export_type or "").strip().lower(),
+            file_format=(payload.file_format or "csv").strip().lower(),
+            date_from=payload.date_from,
+            date_to=payload.date_to,
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Las fechas deben tener formato AAAA-MM-DD")
+    except ExportError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    submit_export(job.id, shard=locate_shard(slug=rest.slug)[0])
+    return {"ok": True, "restaurant": rest.slug, "item": serialize_export_job(job)}
+
+
+@app.get("/v2/api/exports", dependencies=[Depends(require_permission("analytics.view", strict=True))])
+def v2_api_exports(
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_read_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+
+    rows = (
+        db.query(ExportJob)
+        .filter(ExportJob.restaurant_id == rest.id)
+        .order_by(ExportJob.id.desc())
+        .limit(50)
+        .all()
+    )
+    return {"ok": True, "restaurant": rest.slug, "items": [serialize_export_job(j) for j in rows]}
+
+
+@app.get("/v2/api/exports/{job_id}", dependencies=[Depends(require_permission("analytics.view", strict=True))])
+def v2_api_export_status(
+    job_id: int,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_read_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    job = get_export_job_or_404(db, rest.id, job_id)
+    return {"ok": True, "restaurant": rest.slug, "item": serialize_export_job(job)}
+
+
+@app.get("/v2/api/exports/{job_id}/download", dependencies=[Depends(require_permission("analytics.view", strict=True))])
+def v2_api_export_download(
+    job_id: int,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    job = get_export_job_or_404(db, rest.id, job_id)
+
+    if job.status != "done" or not job.file_path or not os.path.exists(job.file_path):
+        raise HTTPException(status_code=409, detail="La exportación todavía no está lista")
+
+    # FileResponse atiende Range / If-Range, así que las descargas grandes se pueden reanudar
+    return FileResponse(
+        job.file_path,
+        media_type="application/gzip",
+        filename=os.path.basename(job.file_path),
     )
 
 DEFAULT_TENANT_CONFIG = {
@@ -3209,6 +4285,287 @@ def set_restaurant_setting_value(
     return row
 
 
+class SessionStartInput(BaseModel):
+    user_id: int
+    pin_code: str
+    module_code: str = "pos_local"
+
+
+@app.post("/v2/api/sessions/start")
+def v2_api_session_start(
+    payload: SessionStartInput,
+    request: Request,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    user = get_restaurant_user_or_404(db, rest.id, payload.user_id)
+    if not user.is_active or (user.pin_code or "") != (payload.pin_code or "").strip():
+        raise HTTPException(status_code=401, detail="Usuario o PIN inválido")
+
+    module_code = (payload.module_code or "").strip().lower()
+    if module_code not in MODULE_CODES:
+        raise HTTPException(status_code=400, detail="Módulo inválido")
+
+    now = datetime.utcnow()
+    timeout = idle_timeout_for(db, rest.id, user)
+    row = UserSession(
+        restaurant_id=rest.id,
+        user_id=user.id,
+        module_code=module_code,
+        started_at=now,
+        last_activity_at=now,
+        expires_at=now + timedelta(seconds=timeout) if timeout else None,
+        ip_address=request.client.host if request.client else None,
+        user_agent=request.headers.get("user-agent"),
+    )
+    user.last_login_at = now
+    db.add(row)
+    db.commit()
+    db.refresh(row)
+
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        "session_id": row.id,
+        "user_id": user.id,
+        "idle_timeout_seconds": timeout,
+        "warning_seconds": settings.session_warning_seconds,
+    }
+
+
+def get_user_session_or_404(db: Session, rest_id: int, session_id: int) -> UserSession:
+    row = (
+        db.query(UserSession)
+        .filter(
+            UserSession.id == session_id,
+            UserSession.restaurant_id == rest_id,
+        )
+        .first()
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada")
+    return row
+
+
+@app.get("/v2/api/sessions/{session_id}")
+def v2_api_session_status(
+    session_id: int,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    get_user_session_or_404(db, rest.id, session_id)
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        "session_id": session_id,
+        "warning_seconds": settings.session_warning_seconds,
+        **session_tracker.status(session_id),
+    }
+
+
+@app.post("/v2/api/sessions/{session_id}/touch")
+def v2_api_session_touch(
+    session_id: int,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    # "seguir conectado" desde el aviso de inactividad
+    rest = get_restaurant_or_404(db, restaurant)
+    get_user_session_or_404(db, rest.id, session_id)
+    result = session_tracker.check(session_id)
+    if not result["ok"]:
+        raise HTTPException(status_code=401, detail="Sesión terminada o expirada por inactividad")
+    return {"ok": True, "restaurant": rest.slug, "session_id": session_id, **session_tracker.status(session_id)}
+
+
+@app.post("/v2/api/sessions/{session_id}/end")
+def v2_api_session_end(
+    session_id: int,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    row = get_user_session_or_404(db, rest.id, session_id)
+    if row.is_active:
+        row.is_active = False
+        row.ended_at = datetime.utcnow()
+        db.commit()
+    session_tracker.forget(session_id)
+    return {"ok": True, "restaurant": rest.slug, "session_id": session_id, "ended_at": str(row.ended_at or "")}
+
+
+class RolePermissionsInput(BaseModel):
+    permissions: List[str] = []
+
+
+class UserPermissionsInput(BaseModel):
+    # code -> True (conceder), False (negar) o None (volver a lo del rol)
+    overrides: Dict[str, Optional[bool]] = {}
+
+
+def get_permission_ids_or_400(db: Session, codes) -> Dict[str, int]:
+    codes = {str(c).strip() for c in codes if str(c).strip()}
+    if not codes:
+        return {}
+    ids = {
+        code: pid
+        for pid, code in db.query(Permission.id, Permission.code).filter(Permission.code.in_(codes)).all()
+    }
+    missing = sorted(codes - set(ids))
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Permisos inválidos: {', '.join(missing)}")
+    return ids
+
+
+def get_restaurant_user_or_404(db: Session, rest_id: int, user_id: int) -> RestaurantUser:
+    user = (
+        db.query(RestaurantUser)
+        .filter(
+            RestaurantUser.id == user_id,
+            RestaurantUser.restaurant_id == rest_id,
+        )
+        .first()
+    )
+    if not user:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    return user
+
+
+@app.get("/v2/api/users/{user_id}/permissions")
+def v2_api_user_permissions(
+    user_id: int,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+    me: CompiledPermissions = Depends(current_user),
+):
+    # cada usuario ve los suyos; los de otros solo con admin.access
+    admin_bit = permission_bit(db, "admin.access")
+    if me.user_id != user_id and (admin_bit is None or not me.has(admin_bit)):
+        raise HTTPException(status_code=403, detail="Permiso requerido: admin.access")
+
+    rest = get_restaurant_or_404(db, restaurant)
+    user = get_restaurant_user_or_404(db, rest.id, user_id)
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        "user_id": user.id,
+        "role_code": user.role_code or "",
+        "permissions": permission_codes(db, user.id),
+    }
+
+
+# role_permissions no tiene restaurant_id: un cambio vale para todos los restaurantes
+@app.post("/v2/api/roles/{role_code}/permissions", dependencies=[Depends(require_platform_admin)])
+def v2_api_role_permissions_update(
+    role_code: str,
+    payload: RolePermissionsInput,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    role_code = (role_code or "").strip().lower()
+    if not role_code or role_code == settings.owner_role_code:
+        raise HTTPException(status_code=400, detail="Rol inválido")
+
+    ids = get_permission_ids_or_400(db, payload.permissions)
+    db.query(RolePermission).filter(RolePermission.role_code == role_code).delete(synchronize_session=False)
+    for pid in ids.values():
+        db.add(RolePermission(role_code=role_code, permission_id=pid))
+    db.commit()
+    # el DELETE masivo no pasa por el flush que invalida la caché
+    invalidate_permissions()
+
+    audit_writer.audit(
+        rest.id, "admin", "security.role_permissions", "role", role_code,
+        new={"permissions": sorted(ids)},
+    )
+
+    return {"ok": True, "restaurant": rest.slug, "role_code": role_code, "permissions": sorted(ids)}
+
+
+@app.post("/v2/api/users/{user_id}/permissions", dependencies=[Depends(require_permission("admin.access", strict=True))])
+def v2_api_user_permissions_update(
+    user_id: int,
+    payload: UserPermissionsInput,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    user = get_restaurant_user_or_404(db, rest.id, user_id)
+    ids = get_permission_ids_or_400(db, payload.overrides.keys())
+
+    current = {
+        row.permission_id: row
+        for row in db.query(UserPermission).filter(UserPermission.user_id == user.id).all()
+    }
+    old_permissions = permission_codes(db, user.id)
+    for code, allowed in payload.overrides.items():
+        pid = ids.get(code.strip())
+        if pid is None:
+            continue
+        row = current.get(pid)
+        if allowed is None:
+            if row:
+                db.delete(row)
+        elif row:
+            row.is_allowed = bool(allowed)
+        else:
+            db.add(UserPermission(user_id=user.id, permission_id=pid, is_allowed=bool(allowed)))
+    db.commit()
+
+    new_permissions = permission_codes(db, user.id)
+    audit_writer.audit(
+        rest.id, "admin", "security.user_permissions", "restaurant_user", user.id,
+        old={"permissions": old_permissions}, new={"permissions": new_permissions},
+    )
+
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        "user_id": user.id,
+        "permissions": new_permissions,
+    }
+
+
+@app.get("/v2/api/audit", dependencies=[Depends(require_permission("admin.access", strict=True))])
+def v2_api_audit(
+    restaurant: Optional[str] = Query(None),
+    date_from: Optional[str] = Query(None),
+    date_to: Optional[str] = Query(None),
+    action_code: Optional[str] = Query(None),
+    user_id: Optional[int] = Query(None),
+    entity_type: Optional[str] = Query(None),
+    entity_id: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=500),
+    db: Session = Depends(get_read_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+
+    start = parse_analytics_date(date_from, "date_from")
+    end = parse_analytics_date(date_to, "date_to")
+    try:
+        before = parse_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="cursor inválido")
+
+    data = query_activity(
+        db,
+        rest.id,
+        date_from=datetime(start.year, start.month, start.day) if start else None,
+        date_to=datetime(end.year, end.month, end.day) + timedelta(days=1) if end else None,
+        action_code=(action_code or "").strip() or None,
+        user_id=user_id,
+        entity_type=(entity_type or "").strip() or None,
+        entity_id=(entity_id or "").strip() or None,
+        before=before,
+        limit=limit,
+    )
+    return {"ok": True, "restaurant": rest.slug, "writer": audit_writer.stats(), **data}
+
+
 class TenantConfigInput(BaseModel):
     payment_methods: Dict = {}
     service_modes: Dict = {}
@@ -3308,6 +4665,20 @@ def v2_api_admin_config_save(
 
     db.commit()
 
+    audit_writer.audit(
+        rest.id, "admin", "config.update", "restaurant", rest.id,
+        old={
+            "payment_methods": current_payment_methods,
+            "service_modes": current_service_modes,
+            "whatsapp": current_whatsapp,
+        },
+        new={
+            "payment_methods": merged_payment_methods,
+            "service_modes": merged_service_modes,
+            "whatsapp": merged_whatsapp,
+        },
+    )
+
     return {
         "ok": True,
         "restaurant": rest.slug,
@@ -3520,6 +4891,9 @@ def add_product_to_whatsapp_cart(
     if not is_product_visible_in_whatsapp(visibility_map, product.id):
         raise HTTPException(status_code=400, detail="Producto no visible en WhatsApp.")
 
+    if not is_product_available(db, rest.id, product.id):
+        raise HTTPException(status_code=400, detail=f"{product.name} está agotado.")
+
     cart = get_whatsapp_cart(db, rest.id, phone)
     items = cart.get("items", [])
 
@@ -3771,11 +5145,7 @@ def create_real_order_from_whatsapp_cart(
         ]
     )
 
-    result = v2_api_create_order(
-        payload=temp_payload,
-        restaurant=rest.slug,
-        db=db,
-    )
+    result = create_order_response(db, rest.slug, temp_payload)
 
     order_id = result["order"]["id"]
 
@@ -3810,14 +5180,17 @@ def is_product_visible_in_whatsapp(visibility_map: dict, product_id: int) -> boo
 
 def build_whatsapp_catalog_data(db: Session, rest) -> dict:
     visibility_map = get_whatsapp_catalog_visibility_map(db, rest.id)
+    unavailable = get_unavailable(db, rest.id)
+    hidden_categories = hidden_whatsapp_category_ids(db, rest.id)
 
     rows = (
         db.query(Product)
+        .outerjoin(ProductCategory, ProductCategory.id == Product.category_id)
         .filter(
             Product.restaurant_id == rest.id,
             Product.is_active == True,  # noqa: E712
         )
-        .order_by(Product.category.asc(), Product.name.asc())
+        .order_by(ProductCategory.sort_order.asc(), Product.category.asc(), Product.name.asc())
         .all()
     )
 
@@ -3825,8 +5198,12 @@ def build_whatsapp_catalog_data(db: Session, rest) -> dict:
     visible_rows = []
 
     for p in rows:
+        if p.category_id in hidden_categories:
+            continue
         if not is_product_visible_in_whatsapp(visibility_map, p.id):
             continue
+        if unavailable.is_unavailable(p.id):
+            continue
 
         visible_rows.append(p)
         category = (p.category or "General").strip() or "General"
@@ -3887,9 +5264,26 @@ def get_enabled_category_menu_items(db: Session, rest_id: int) -> list:
     return [x for x in (wa.get("category_menu") or []) if x.get("enabled")]
 
 
-def normalize_text_key(value: str) -> str:
-    raw = (value or "").strip().lower()
-    return raw
+def normalize_text_key(value: str) -> str:
+    raw = (value or "").strip().lower()
+    return raw
+
+
+def parse_product_command(text: str):
+    # "12", "#12", "12 x2", "12*3" -> producto 12 con cantidad opcional
+    raw = normalize_text_key(text)
+    match = re.match(r"^#?(\d+)(?:\s*[x*]\s*(\d+(?:[.,]\d+)?))?$", raw)
+    if not match:
+        return None
+
+    quantity = Decimal(str(match.group(2) or "1").replace(",", "."))
+    if quantity <= 0:
+        return None
+
+    return {
+        "product_id": int(match.group(1)),
+        "quantity": quantity,
+    }
 
 
 def build_whatsapp_main_menu_text(db: Session, rest) -> str:
@@ -3996,23 +5390,35 @@ def resolve_category_selection(db: Session, rest_id: int, text: str):
     return None
 
 
-def build_products_for_category_text(db: Session, rest, category_title: str) -> str:
-    wa = get_tenant_whatsapp_config(db, rest.id)
-    msgs = wa.get("messages") or {}
-    visibility_map = get_whatsapp_catalog_visibility_map(db, rest.id)
+def get_whatsapp_category_products(db: Session, rest, category_title: str):
+    category = find_category(db, rest.id, category_title)
+    if category is None or not category.whatsapp_visible:
+        return []
 
-    rows = (
+    return (
         db.query(Product)
         .filter(
             Product.restaurant_id == rest.id,
             Product.is_active == True,  # noqa: E712
-            Product.category == category_title,
+            Product.category_id == category.id,
         )
         .order_by(Product.name.asc())
         .all()
     )
 
-    visible_rows = [p for p in rows if is_product_visible_in_whatsapp(visibility_map, p.id)]
+
+def build_products_for_category_text(db: Session, rest, category_title: str) -> str:
+    wa = get_tenant_whatsapp_config(db, rest.id)
+    msgs = wa.get("messages") or {}
+    visibility_map = get_whatsapp_catalog_visibility_map(db, rest.id)
+
+    rows = get_whatsapp_category_products(db, rest, category_title)
+
+    unavailable = get_unavailable(db, rest.id)
+    visible_rows = [
+        p for p in rows
+        if is_product_visible_in_whatsapp(visibility_map, p.id) and not unavailable.is_unavailable(p.id)
+    ]
 
     title = (msgs.get("choose_product") or "Tocá para elegir").strip()
     lines = [f"🍽 {category_title} ({title})", ""]
@@ -4032,20 +5438,12 @@ def build_products_for_category_text(db: Session, rest, category_title: str) ->
 def get_visible_products_for_category(db: Session, rest, category_title: str):
     visibility_map = get_whatsapp_catalog_visibility_map(db, rest.id)
 
-    rows = (
-        db.query(Product)
-        .filter(
-            Product.restaurant_id == rest.id,
-            Product.is_active == True,  # noqa: E712
-            Product.category == category_title,
-        )
-        .order_by(Product.name.asc())
-        .all()
-    )
+    rows = get_whatsapp_category_products(db, rest, category_title)
 
+    unavailable = get_unavailable(db, rest.id)
     visible_rows = []
     for p in rows:
-        visible = is_product_visible_in_whatsapp(visibility_map, p.id)
+        visible = is_product_visible_in_whatsapp(visibility_map, p.id) and not unavailable.is_unavailable(p.id)
         print(
             "WA_PRODUCT_CHECK",
             {
@@ -4083,6 +5481,36 @@ def build_products_for_category_sections(db: Session, rest, category_title: str)
         "rows": rows
     }]
 
+def build_whatsapp_search_sections(db: Session, rest, text: str):
+    visibility_map = get_whatsapp_catalog_visibility_map(db, rest.id)
+    hidden_categories = hidden_whatsapp_category_ids(db, rest.id)
+    unavailable = get_unavailable(db, rest.id)
+
+    rows = []
+    for item in search_products(db, rest.id, text, limit=30):
+        if item["category_id"] in hidden_categories:
+            continue
+        if not is_product_visible_in_whatsapp(visibility_map, item["id"]):
+            continue
+        if unavailable.is_unavailable(item["id"]):
+            continue
+
+        rows.append({
+            "id": f"prod::{item['id']}",
+            "title": str(item["name"] or "Producto")[:24],
+            "description": f"C${item['price']:.2f} · {item['category']}"[:72],
+        })
+        if len(rows) == 10:
+            break
+
+    if not rows:
+        return []
+
+    return [{
+        "title": "Resultados",
+        "rows": rows
+    }]
+
 def build_product_caption(product: Product) -> str:
     name = product.name or "Producto"
     desc = product.description or ""
@@ -4638,9 +6066,27 @@ async def whatsapp_verify(request: Request):
 
 
 @app.post("/webhook/whatsapp")
-async def webhook(request: Request, db: Session = Depends(get_db)):
+async def webhook(request: Request):
     data = await request.json()
+    # las respuestas salen por la API de WhatsApp con requests (bloqueante):
+    # todo el manejo va al threadpool y el event loop queda libre
+    phone_number_id = webhook_phone_number_id(data)
+    return await run_blocking(
+        handle_whatsapp_webhook, data,
+        opener=lambda: whatsapp_session(phone_number_id),
+    )
+
 
+def webhook_phone_number_id(data: dict) -> str:
+    """El número que recibió el mensaje decide el restaurante (y su shard)."""
+    try:
+        value = (((data.get("entry") or [{}])[0].get("changes") or [{}])[0].get("value")) or {}
+        return str((value.get("metadata") or {}).get("phone_number_id") or "").strip()
+    except (AttributeError, IndexError):
+        return ""
+
+
+def handle_whatsapp_webhook(db: Session, data: dict):
     try:
         entry = (data.get("entry") or [])[0]
         change = (entry.get("changes") or [])[0]
@@ -4909,6 +6355,10 @@ async def webhook(request: Request, db: Session = Depends(get_db)):
                     .first()
                 )
 
+                if product and not is_product_available(db, rest.id, product.id):
+                    send_whatsapp_text(from_id, f"{product.name} está agotado por ahora. Escribí 'menu' para ver otras opciones.")
+                    return JSONResponse({"ok": True, "action": "product_unavailable"})
+
                 if product:
                     session_data = get_whatsapp_session(db, rest.id, from_id)
                     session_data["selected_product_id"] = product.id
@@ -5054,6 +6504,19 @@ async def webhook(request: Request, db: Session = Depends(get_db)):
 
             )
 
+        # ===== búsqueda por texto libre =====
+        if mtype == "text" and len(incoming) >= 3:
+            sections = build_whatsapp_search_sections(db, rest, incoming)
+            if sections:
+                send_whatsapp_list(
+                    from_id,
+                    (msgs.get("choose_product") or "Tocá para elegir").strip(),
+                    "Ver productos",
+                    sections,
+                    header_text="Resultados",
+                )
+                return JSONResponse({"ok": True, "action": "search_results"})
+
         # ===== fallback =====
         send_whatsapp_text(from_id, build_whatsapp_main_menu_text(db, rest))
         return JSONResponse({"ok": True, "action": "fallback_main_menu"})
@@ -5512,6 +6975,7 @@ def v2_admin(
   </div>
     
     <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+    __SCREEN_BOOTSTRAP_SCRIPT__
     <script>
       const adminRestaurantSlug = "__REST_SLUG__";
       let adminZones = [];
@@ -5526,10 +6990,10 @@ def v2_admin(
       let customerMarker = null;
       let waProConfig = null;
 
-      async function loadZones() {{
-        const res = await fetch(`/v2/api/zones?restaurant=${{adminRestaurantSlug}}`);
-        const data = await res.json();
-        if (!res.ok) {{
+      async function loadZones(preloaded) {{
+        const res = preloaded ? null : await fetch(`/v2/api/zones?restaurant=${{adminRestaurantSlug}}`);
+        const data = preloaded || await res.json();
+        if (res && !res.ok) {{
           alert(data.detail || "No se pudieron cargar las zonas.");
           return;
         }}
@@ -5538,10 +7002,10 @@ def v2_admin(
         fillZoneSelect();
       }}
 
-      async function loadTables() {{
-        const res = await fetch(`/v2/api/tables?restaurant=${{adminRestaurantSlug}}`);
-        const data = await res.json();
-        if (!res.ok) {{
+      async function loadTables(preloaded) {{
+        const res = preloaded ? null : await fetch(`/v2/api/tables?restaurant=${{adminRestaurantSlug}}`);
+        const data = preloaded || await res.json();
+        if (res && !res.ok) {{
           alert(data.detail || "No se pudieron cargar las mesas.");
           return;
         }}
@@ -5742,11 +7206,11 @@ def v2_admin(
         await loadTables();
       }}
 
-      async function loadTenantConfig() {{
-        const res = await fetch(`/v2/api/admin/config?restaurant=${{adminRestaurantSlug}}`);
-        const data = await res.json();
+      async function loadTenantConfig(preloaded) {{
+        const res = preloaded ? null : await fetch(`/v2/api/admin/config?restaurant=${{adminRestaurantSlug}}`);
+        const data = preloaded || await res.json();
 
-        if (!res.ok) {{
+        if (res && !res.ok) {{
           alert(data.detail || "No se pudo cargar la configuración.");
           return;
         }}
@@ -5936,7 +7400,6 @@ def v2_admin(
         document.getElementById("tenantConfigStatus").textContent = "Configuración guardada correctamente.";
       }}
      
-      async function previewWhatsAppMenu() {{
       async function previewWhatsAppMenu() {{
         const res = await fetch(`/v2/api/admin/config?restaurant=${{adminRestaurantSlug}}`);
         const data = await res.json();
@@ -5953,7 +7416,7 @@ def v2_admin(
         const menuText = (wa.main_menu || [])
           .filter(x => x.enabled)
           .map((x, idx) => `${{idx + 1}}) ${{x.title}}`)
-          .join("\n");
+          .join("\\n");
 
         const box = document.getElementById("whatsAppPreviewBox");
         if (!box) return;
@@ -5979,11 +7442,11 @@ def v2_admin(
         `;
       }}
 
-      async function loadWhatsAppProducts() {{
-        const res = await fetch(`/v2/api/admin/whatsapp-products?restaurant=${{adminRestaurantSlug}}`);
-        const data = await res.json();
+      async function loadWhatsAppProducts(preloaded) {{
+        const res = preloaded ? null : await fetch(`/v2/api/admin/whatsapp-products?restaurant=${{adminRestaurantSlug}}`);
+        const data = preloaded || await res.json();
 
-        if (!res.ok) {{
+        if (res && !res.ok) {{
           alert(data.detail || "No se pudo cargar el catálogo de WhatsApp.");
           return;
         }}
@@ -6351,11 +7814,11 @@ def v2_admin(
         }});
       }}
 
-      async function loadDeliveryConfig() {{
-        const res = await fetch(`/v2/api/admin/delivery-config?restaurant=${{adminRestaurantSlug}}`);
-        const data = await res.json();
+      async function loadDeliveryConfig(preloaded) {{
+        const res = preloaded ? null : await fetch(`/v2/api/admin/delivery-config?restaurant=${{adminRestaurantSlug}}`);
+        const data = preloaded || await res.json();
 
-        if (!res.ok) {{
+        if (res && !res.ok) {{
           console.error(data.detail || "No se pudo cargar delivery config.");
           initOriginMap();
           initCustomerMap();
@@ -6461,11 +7924,11 @@ def v2_admin(
         `).join("");
       }}
 
-      async function loadAdminCatalogProducts() {{
-        const res = await fetch(`/v2/api/admin/products?restaurant=${{adminRestaurantSlug}}`);
-        const data = await res.json();
+      async function loadAdminCatalogProducts(preloaded) {{
+        const res = preloaded ? null : await fetch(`/v2/api/admin/products?restaurant=${{adminRestaurantSlug}}`);
+        const data = preloaded || await res.json();
 
-        if (!res.ok) {{
+        if (res && !res.ok) {{
           alert(data.detail || "No se pudo cargar el catálogo.");
           return;
         }}
@@ -6625,12 +8088,24 @@ def v2_admin(
 
     (async function bootAdmin() {{
       try {{
-        await loadZones();
-        await loadTables();
-        await loadTenantConfig();
-        await loadWhatsAppProducts();
-        await loadDeliveryConfig();
-        await loadAdminCatalogProducts();
+        // las seis secciones en un request; las que no cambiaron salen del localStorage
+        let sections = {{}};
+        try {{
+          const boot = await loadScreenBootstrap(
+            `/v2/api/bootstrap/admin?restaurant=${{adminRestaurantSlug}}`,
+            `admin_boot:${{adminRestaurantSlug}}`
+          );
+          sections = boot.sections || {{}};
+        }} catch (e) {{
+          console.error("bootstrap admin:", e);
+        }}
+
+        await loadZones(sections.zones);
+        await loadTables(sections.tables);
+        await loadTenantConfig(sections.config);
+        await loadWhatsAppProducts(sections.whatsapp_products);
+        await loadDeliveryConfig(sections.delivery_config);
+        await loadAdminCatalogProducts(sections.products);
         setTimeout(previewWhatsAppMenu, 300);
       }} catch (e) {{
         console.error("bootAdmin error:", e);
@@ -6639,6 +8114,7 @@ def v2_admin(
     </script>
     """
 
+    body = body.replace("__SCREEN_BOOTSTRAP_SCRIPT__", SCREEN_BOOTSTRAP_SCRIPT)
     body = body.replace("__REST_SLUG__", str(rest.slug or ""))
     return html_shell("Admin", body)
 
@@ -6662,23 +8138,45 @@ def normalize_category_name(value: str) -> str:
     name = (value or "").strip()
     return name if name else "General"
 
+
+def get_product_category_or_404(db: Session, restaurant_id: int, category_id: int) -> ProductCategory:
+    category = (
+        db.query(ProductCategory)
+        .filter(
+            ProductCategory.id == category_id,
+            ProductCategory.restaurant_id == restaurant_id,
+        )
+        .first()
+    )
+    if not category:
+        raise HTTPException(status_code=404, detail="Categoría no encontrada.")
+    return category
+
+def list_shard_restaurants(db: Session, shard: str) -> List[dict]:
+    rows = db.query(Restaurant).order_by(Restaurant.id.asc()).all()
+    return [
+        {
+            "id": r.id,
+            "name": r.name,
+            "slug": r.slug,
+            "brand_name": r.brand_name,
+            "tagline": r.tagline,
+            "is_active": r.is_active,
+        }
+        for r in rows
+        # un shard origen puede conservar la copia de un tenant ya movido
+        if not is_sharded() or shard_owns(shard, r.id)
+    ]
+
+
 @app.get("/v2/api/restaurants")
 def v2_api_restaurants(db: Session = Depends(get_db)):
-    rows = db.query(Restaurant).order_by(Restaurant.id.asc()).all()
-    return {
-        "ok": True,
-        "items": [
-            {
-                "id": r.id,
-                "name": r.name,
-                "slug": r.slug,
-                "brand_name": r.brand_name,
-                "tagline": r.tagline,
-                "is_active": r.is_active,
-            }
-            for r in rows
-        ],
-    }
+    if not is_sharded():
+        return {"ok": True, "items": list_shard_restaurants(db, DEFAULT_SHARD)}
+
+    results, errors = for_each_shard(list_shard_restaurants)
+    items = sorted((r for rows in results.values() for r in rows), key=lambda r: r["id"])
+    return {"ok": not errors, "items": items, "shard_errors": errors}
 
 
 @app.get("/v2/api/modules")
@@ -6725,6 +8223,7 @@ def v2_api_products(
         .order_by(Product.category.asc(), Product.name.asc())
         .all()
     )
+    unavailable = get_unavailable(db, rest.id)
 
     return {
         "ok": True,
@@ -6737,11 +8236,68 @@ def v2_api_products(
                 "price": float(p.price or 0),
                 "description": p.description or "",
                 "image_url": p.image_url or "",
+                "available": unavailable.is_available(p.id),
             }
             for p in rows
         ],
     }
 
+@app.get("/v2/api/catalog")
+def v2_api_catalog(
+    since: Optional[int] = Query(None, ge=0),
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        **catalog_delta(db, rest.id, since),
+    }
+
+@app.get("/v2/api/products/search")
+def v2_api_products_search(
+    q: str = Query(""),
+    limit: int = Query(20, ge=1, le=100),
+    category_id: Optional[int] = Query(None),
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    items = search_products(db, rest.id, q, limit=limit, category_id=category_id)
+    unavailable = get_unavailable(db, rest.id)
+
+    for item in items:
+        item["available"] = unavailable.is_available(item["id"])
+
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        "query": q,
+        "items": items,
+    }
+
+@app.get("/v2/api/availability")
+def v2_api_availability(
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+
+    sold_out_ids = get_unavailable(db, rest.id).ids()
+    rows = (
+        db.query(Product.id, Product.name)
+        .filter(Product.restaurant_id == rest.id, Product.id.in_(sold_out_ids))
+        .order_by(Product.name.asc())
+        .all()
+    ) if sold_out_ids else []
+
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        "unavailable": [{"id": pid, "name": name} for pid, name in rows],
+    }
+
 @app.get("/v2/api/admin/products")
 def v2_api_admin_products(
     restaurant: Optional[str] = Query(None),
@@ -6792,14 +8348,16 @@ def v2_api_create_product(
     product = Product(
         restaurant_id=rest.id,
         name=name,
-        category=(payload.category or "").strip(),
         price=Decimal(payload.price or 0),
         description=(payload.description or "").strip(),
         image_url=(payload.image_url or "").strip(),
         is_active=bool(payload.is_active),
     )
+    assign_category(db, product, payload.category)
 
     db.add(product)
+    db.flush()
+    record_catalog_changes(db, rest.id, product_ids=[product.id])
     db.commit()
     db.refresh(product)
 
@@ -6851,7 +8409,7 @@ def v2_api_update_product(
         product.name = new_name
 
     if payload.category is not None:
-        product.category = payload.category.strip()
+        assign_category(db, product, payload.category)
 
     if payload.price is not None:
         if Decimal(payload.price) < 0:
@@ -6867,6 +8425,7 @@ def v2_api_update_product(
     if payload.is_active is not None:
         product.is_active = bool(payload.is_active)
 
+    record_catalog_changes(db, rest.id, product_ids=[product.id])
     db.commit()
     db.refresh(product)
 
@@ -6898,6 +8457,7 @@ def v2_api_toggle_product(
         raise HTTPException(status_code=404, detail="Producto no encontrado.")
 
     product.is_active = not bool(product.is_active)
+    record_catalog_changes(db, rest.id, product_ids=[product.id])
     db.commit()
     db.refresh(product)
 
@@ -6934,6 +8494,8 @@ def v2_api_delete_product(
         .first()
     )
 
+    record_catalog_changes(db, rest.id, product_ids=[product.id])
+
     if used_in_orders:
         product.is_active = False
         db.commit()
@@ -6960,20 +8522,13 @@ def v2_api_categories(
     db: Session = Depends(get_db),
 ):
     rest = get_restaurant_or_404(db, restaurant)
-
-    rows = (
-        db.query(Product.category)
-        .filter(Product.restaurant_id == rest.id)
-        .all()
-    )
-
-    raw_names = [normalize_category_name(r[0] if isinstance(r, tuple) else r.category) for r in rows]
-    unique_names = sorted(set(raw_names), key=lambda x: x.lower())
+    categories = list_categories(db, rest.id)
 
     return {
         "ok": True,
         "restaurant": rest.slug,
-        "items": unique_names,
+        "items": [c["name"] for c in categories],
+        "categories": categories,
     }
 
 
@@ -6991,25 +8546,20 @@ def v2_api_rename_category(
     if not new_name:
         raise HTTPException(status_code=400, detail="La nueva categoría es obligatoria.")
 
-    rows = (
-        db.query(Product)
-        .filter(Product.restaurant_id == rest.id)
-        .all()
-    )
-
-    updated = 0
-    for p in rows:
-        current = normalize_category_name(p.category)
-        if current.lower() == old_name.lower():
-            p.category = new_name
-            updated += 1
-
+    updated, merged = rename_category(db, rest.id, old_name, new_name)
     db.commit()
+    invalidate_product_search(rest.id)
+
+    audit_writer.audit(
+        rest.id, "inventory", "category.rename", "product_category", None,
+        old={"name": old_name}, new={"name": new_name, "merged": merged, "updated": updated},
+    )
 
     return {
         "ok": True,
         "message": f"Categoría actualizada en {updated} producto(s).",
         "updated": updated,
+        "merged": merged,
         "old_name": old_name,
         "new_name": new_name,
     }
@@ -7026,20 +8576,14 @@ def v2_api_delete_category(
     target_name = normalize_category_name(payload.name)
     replacement = normalize_category_name(payload.replacement)
 
-    rows = (
-        db.query(Product)
-        .filter(Product.restaurant_id == rest.id)
-        .all()
-    )
-
-    updated = 0
-    for p in rows:
-        current = normalize_category_name(p.category)
-        if current.lower() == target_name.lower():
-            p.category = replacement
-            updated += 1
-
+    updated = delete_category(db, rest.id, target_name, replacement)
     db.commit()
+    invalidate_product_search(rest.id)
+
+    audit_writer.audit(
+        rest.id, "inventory", "category.delete", "product_category", None,
+        old={"name": target_name}, new={"replacement": replacement, "updated": updated},
+    )
 
     return {
         "ok": True,
@@ -7049,14 +8593,92 @@ def v2_api_delete_category(
         "replacement": replacement,
     }
 
-@app.post("/v2/api/orders/create")
-def v2_api_create_order(
-    payload: CreateOrderInput,
+
+@app.post("/v2/api/categories/merge")
+def v2_api_merge_categories(
+    payload: CategoryMergeInput,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+
+    source = get_product_category_or_404(db, rest.id, payload.source_id)
+    target = get_product_category_or_404(db, rest.id, payload.target_id)
+    if source.id == target.id:
+        raise HTTPException(status_code=400, detail="No se puede fusionar una categoría consigo misma.")
+
+    source_name, target_name = source.name, target.name
+    updated = merge_categories(db, rest.id, source, target)
+    db.commit()
+    invalidate_product_search(rest.id)
+
+    audit_writer.audit(
+        rest.id, "inventory", "category.merge", "product_category", payload.target_id,
+        old={"name": source_name, "id": payload.source_id}, new={"name": target_name, "updated": updated},
+    )
+
+    return {
+        "ok": True,
+        "message": f"Categoría fusionada en {updated} producto(s).",
+        "updated": updated,
+        "source": source_name,
+        "target": target_name,
+    }
+
+
+@app.patch("/v2/api/categories/{category_id}")
+def v2_api_update_category(
+    category_id: int,
+    payload: CategoryUpdateInput,
     restaurant: Optional[str] = Query(None),
     db: Session = Depends(get_db),
 ):
     rest = get_restaurant_or_404(db, restaurant)
+    category = get_product_category_or_404(db, rest.id, category_id)
+
+    old = {"sort_order": category.sort_order, "whatsapp_visible": bool(category.whatsapp_visible)}
+    if payload.sort_order is not None:
+        category.sort_order = int(payload.sort_order)
+    if payload.whatsapp_visible is not None:
+        category.whatsapp_visible = bool(payload.whatsapp_visible)
+    new = {"sort_order": category.sort_order, "whatsapp_visible": bool(category.whatsapp_visible)}
+    record_catalog_changes(db, rest.id, category_ids=[category_id])
+    db.commit()
+
+    audit_writer.audit(rest.id, "inventory", "category.update", "product_category", category_id, old=old, new=new)
+
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        "category": {"id": category_id, "name": category.name, **new},
+    }
+
+def ensure_products_available(db: Session, rest_id: int, products) -> None:
+    unavailable = get_unavailable(db, rest_id)
+    sold_out = [p.name for p in products if unavailable.is_unavailable(p.id)]
+    if sold_out:
+        raise HTTPException(status_code=400, detail=f"Producto agotado: {', '.join(sold_out)}")
+
+
+def serialize_created_order(order: Order, discount_percent: Decimal, discount_amount: Decimal) -> dict:
+    return {
+        "id": order.id,
+        "channel": order.channel,
+        "status": order.status,
+        "subtotal": float(order.subtotal or 0),
+        "tax": float(order.tax or 0),
+        "total": float(order.total or 0),
+        "payment_status": order.payment_status or "",
+        "discount_percent": float(discount_percent),
+        "discount_amount": float(discount_amount),
+    }
+
 
+def create_order_from_input(db: Session, rest, payload: CreateOrderInput):
+    """
+    Crea la orden con sus items y descuenta stock, sin commit. Devuelve
+    (orden, discount_percent, discount_amount).
+    """
     if not payload.items:
         raise HTTPException(status_code=400, detail="No hay items en la orden.")
 
@@ -7071,6 +8693,8 @@ def v2_api_create_order(
     if len(product_map) != len(set(ids)):
         raise HTTPException(status_code=400, detail="Hay productos inválidos o que no pertenecen al restaurante.")
 
+    ensure_products_available(db, rest.id, product_map.values())
+
     base_subtotal = Decimal("0")
     line_items = []
 
@@ -7126,8 +8750,9 @@ def v2_api_create_order(
     db.add(order)
     db.flush()
 
+    order_items = []
     for li in line_items:
-        db.add(
+        order_items.append(
             OrderItem(
                 order_id=order.id,
                 product_id=li["product"].id,
@@ -7138,24 +8763,58 @@ def v2_api_create_order(
                 notes=None
             )
         )
+    db.add_all(order_items)
+    db.flush()
 
-    db.commit()
+    # estas órdenes no pasan por "enviar a cocina": el stock se descuenta al crearlas
+    consume_order_items(db, rest.id, [it.id for it in order_items], order_id=order.id)
+
+    return order, discount_percent, discount_amount
+
+
+@app.post("/v2/api/orders/create", dependencies=[Depends(require_permission("orders.create"))])
+async def v2_api_create_order(
+    payload: CreateOrderInput,
+    restaurant: Optional[str] = Query(None),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
+):
+    rest = await run_db(get_restaurant_or_404, restaurant, tenant=restaurant)
+
+    claim = await idempotency_store.begin_async(rest.id, idempotency_key, "orders.create", payload)
+    with claim:
+        if claim.replay is not None:
+            return claim.replay
+        return await run_db(create_order_response, restaurant, payload, claim, tenant=restaurant)
+
+
+def create_order_response(
+    db: Session,
+    restaurant: Optional[str],
+    payload: CreateOrderInput,
+    claim: Optional[IdempotencyClaim] = None,
+):
+    """
+    Crea la orden y hace commit. Con claim reserva la llave en la misma
+    transacción y guarda la respuesta para los reintentos.
+    """
+    rest = get_restaurant_or_404(db, restaurant)
+
+    if claim is not None:
+        claim.reserve(db)
+        if claim.replay is not None:
+            return claim.replay
+
+    order, discount_percent, discount_amount = create_order_from_input(db, rest, payload)
     db.refresh(order)
 
-    return {
+    response = {
         "ok": True,
-        "order": {
-            "id": order.id,
-            "channel": order.channel,
-            "status": order.status,
-            "subtotal": float(order.subtotal or 0),
-            "tax": float(order.tax or 0),
-            "total": float(order.total or 0),
-            "payment_status": order.payment_status or "",
-            "discount_percent": float(discount_percent),
-            "discount_amount": float(discount_amount),
-        },
+        "order": serialize_created_order(order, discount_percent, discount_amount),
     }
+    if claim is not None:
+        claim.save(response)
+    db.commit()
+    return response
 
 def serialize_zone_row(z: RestaurantZone) -> dict:
     return {
@@ -7594,13 +9253,17 @@ def v2_api_delete_table(
 
 
 @app.get("/v2/api/floor")
-def v2_api_floor(
+async def v2_api_floor(
     restaurant: Optional[str] = Query(None),
     zone_id: Optional[int] = Query(None),
-    db: Session = Depends(get_db),
 ):
-    rest = get_restaurant_or_404(db, restaurant)
+    rest = await run_db(get_restaurant_or_404, restaurant, tenant=restaurant)
+    return await coalesced_read_async(
+        "floor", rest.id, (zone_id,), lambda: run_db(build_floor, rest, zone_id, tenant=restaurant),
+    )
 
+
+def build_floor(db: Session, rest, zone_id: Optional[int]) -> dict:
     zone_query = db.query(RestaurantZone).filter(RestaurantZone.restaurant_id == rest.id)
     if zone_id is not None:
         zone_query = zone_query.filter(RestaurantZone.id == zone_id)
@@ -7687,14 +9350,16 @@ def v2_api_floor(
     }
 
 
-@app.post("/v2/api/local/open-ticket")
-def v2_api_open_local_ticket(
-    payload: OpenLocalTicketInput,
-    restaurant: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
-):
-    rest = get_restaurant_or_404(db, restaurant)
+@app.get("/v2/api/read-coalescing/stats")
+def v2_api_read_coalescing_stats():
+    return {"ok": True, "db_mode": async_db_mode(), "stats": read_coalescer.stats()}
 
+
+def open_local_ticket(db: Session, rest, payload: OpenLocalTicketInput):
+    """
+    Devuelve (orden, existing). Si la mesa o la barra ya tienen un ticket
+    abierto se devuelve ese. Sin commit.
+    """
     service_mode = (payload.service_mode or "").strip().lower()
     if service_mode not in {"table", "bar", "quick"}:
         raise HTTPException(status_code=400, detail="Modo de servicio inválido.")
@@ -7729,11 +9394,7 @@ def v2_api_open_local_ticket(
             .first()
         )
         if existing_open:
-            return {
-                "ok": True,
-                "existing": True,
-                "ticket": serialize_local_order_row(existing_open, db),
-            }
+            return existing_open, True
 
     if service_mode == "bar":
         existing_bar = (
@@ -7748,11 +9409,7 @@ def v2_api_open_local_ticket(
             .first()
         )
         if existing_bar:
-            return {
-                "ok": True,
-                "existing": True,
-                "ticket": serialize_local_order_row(existing_bar, db),
-            }
+            return existing_bar, True
 
     order = Order(
         restaurant_id=rest.id,
@@ -7772,22 +9429,38 @@ def v2_api_open_local_ticket(
         notes=(payload.notes or "").strip(),
     )
     db.add(order)
-    db.commit()
-    db.refresh(order)
+    db.flush()
+    return order, False
+
+
+@app.post("/v2/api/local/open-ticket")
+def v2_api_open_local_ticket(
+    payload: OpenLocalTicketInput,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    order, existing = open_local_ticket(db, rest, payload)
+    if not existing:
+        db.commit()
+        db.refresh(order)
 
     return {
         "ok": True,
-        "existing": False,
+        "existing": existing,
         "ticket": serialize_local_order_row(order, db),
     }
 
 
 @app.get("/v2/api/local/ticket/{order_id}")
-def v2_api_local_ticket_detail(
+async def v2_api_local_ticket_detail(
     order_id: int,
     restaurant: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
 ):
+    return await run_db(local_ticket_detail, order_id, restaurant, tenant=restaurant)
+
+
+def local_ticket_detail(db: Session, order_id: int, restaurant: Optional[str]) -> dict:
     rest = get_restaurant_or_404(db, restaurant)
 
     order = (
@@ -7844,15 +9517,7 @@ def v2_api_table_active_ticket(
     }
 
 
-@app.post("/v2/api/local/ticket/{order_id}/items/add")
-def v2_api_add_items_to_open_ticket(
-    order_id: int,
-    payload: AddItemsToOpenTicketInput,
-    restaurant: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
-):
-    rest = get_restaurant_or_404(db, restaurant)
-
+def add_items_to_open_ticket(db: Session, rest, order_id: int, payload: AddItemsToOpenTicketInput) -> Order:
     order = (
         db.query(Order)
         .filter(
@@ -7883,6 +9548,8 @@ def v2_api_add_items_to_open_ticket(
     if len(product_map) != len(set(ids)):
         raise HTTPException(status_code=400, detail="Hay productos inválidos o inactivos.")
 
+    ensure_products_available(db, rest.id, product_map.values())
+
     running_subtotal = Decimal(str(order.subtotal or 0))
 
     for it in payload.items:
@@ -7924,6 +9591,20 @@ def v2_api_add_items_to_open_ticket(
     if not order.payment_status:
         order.payment_status = "pending"
 
+    db.flush()
+    return order
+
+
+@app.post("/v2/api/local/ticket/{order_id}/items/add")
+def v2_api_add_items_to_open_ticket(
+    order_id: int,
+    payload: AddItemsToOpenTicketInput,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    order = add_items_to_open_ticket(db, rest, order_id, payload)
+
     db.commit()
     db.refresh(order)
 
@@ -7933,15 +9614,8 @@ def v2_api_add_items_to_open_ticket(
     }
 
 
-@app.post("/v2/api/local/ticket/{order_id}/send-new-items")
-def v2_api_send_new_items_to_kitchen(
-    order_id: int,
-    payload: SendNewItemsInput,
-    restaurant: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
-):
-    rest = get_restaurant_or_404(db, restaurant)
-
+def send_new_items_to_kitchen(db: Session, rest, order_id: int, payload: SendNewItemsInput):
+    """Devuelve (orden, cantidad de líneas enviadas). Sin commit."""
     order = (
         db.query(Order)
         .filter(
@@ -7977,29 +9651,374 @@ def v2_api_send_new_items_to_kitchen(
     if order.status in ("open", "pending", ""):
         order.status = "preparing"
 
+    consume_order_items(db, rest.id, [row.id for row in rows], order_id=order.id)
+
+    db.flush()
+    return order, len(rows)
+
+
+@app.post("/v2/api/local/ticket/{order_id}/send-new-items")
+def v2_api_send_new_items_to_kitchen(
+    order_id: int,
+    payload: SendNewItemsInput,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    order, sent_count = send_new_items_to_kitchen(db, rest, order_id, payload)
+
     db.commit()
     db.refresh(order)
 
     return {
         "ok": True,
-        "sent_count": len(rows),
+        "sent_count": sent_count,
         "ticket": serialize_local_order_row(order, db),
     }
 
-@app.get("/v2/api/orders")
-def v2_api_orders(
+
+# =========================
+# BOOTSTRAP POR PANTALLA
+# =========================
+
+def parse_known_versions(raw: Optional[str]) -> Dict[str, str]:
+    """known=ticket:ab12,payments:cd34 -> {"ticket": "ab12", "payments": "cd34"}"""
+    known = {}
+    for chunk in (raw or "").split(","):
+        name, _, version = chunk.strip().partition(":")
+        if name and version:
+            known[name] = version
+    return known
+
+
+def bootstrap_section(known: Dict[str, str], name: str, data: dict) -> dict:
+    """
+    La versión es un hash del contenido: si el cliente ya la tiene, la
+    sección va sin datos y el cliente usa lo que guardó.
+    """
+    data = jsonable_encoder(data)
+    raw = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    version = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+    if known.get(name) == version:
+        return {"version": version, "unchanged": True}
+    return {"version": version, "data": data}
+
+
+@app.get("/v2/api/bootstrap/ticket/{order_id}")
+def v2_api_bootstrap_ticket(
+    order_id: int,
     restaurant: Optional[str] = Query(None),
-    channel: Optional[str] = Query(None),
+    known: Optional[str] = Query(None),
+    catalog_since: Optional[int] = Query(None, ge=0),
     db: Session = Depends(get_db),
 ):
+    """
+    Todo lo que pide la pantalla de ticket al abrir, en una sesión. El
+    catálogo va como delta de /v2/api/catalog desde catalog_since.
+    """
     rest = get_restaurant_or_404(db, restaurant)
+    versions = parse_known_versions(known)
 
-    query = db.query(Order).filter(Order.restaurant_id == rest.id)
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        "sections": {
+            "ticket": bootstrap_section(
+                versions, "ticket", local_ticket_detail(db, order_id, restaurant),
+            ),
+            "payments": bootstrap_section(
+                versions, "payments", local_ticket_payments(db, order_id, restaurant),
+            ),
+        },
+        "catalog": catalog_delta(db, rest.id, catalog_since),
+    }
 
-    if channel:
-        query = query.filter(Order.channel == channel)
 
-    rows = query.order_by(Order.id.desc()).limit(100).all()
+@app.get("/v2/api/bootstrap/admin")
+def v2_api_bootstrap_admin(
+    restaurant: Optional[str] = Query(None),
+    known: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+    versions = parse_known_versions(known)
+
+    builders = {
+        "zones": lambda: v2_api_zones(restaurant=restaurant, db=db),
+        "tables": lambda: v2_api_tables(restaurant=restaurant, zone_id=None, active_only=False, db=db),
+        "config": lambda: v2_api_admin_config(restaurant=restaurant, db=db),
+        "whatsapp_products": lambda: v2_api_admin_whatsapp_products(restaurant=restaurant, db=db),
+        "delivery_config": lambda: get_delivery_config(restaurant=restaurant, db=db),
+        "products": lambda: v2_api_admin_products(restaurant=restaurant, db=db),
+    }
+
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        "sections": {name: bootstrap_section(versions, name, build()) for name, build in builders.items()},
+    }
+
+
+# =========================
+# SINCRONIZACIÓN POS (OFFLINE)
+# =========================
+
+POS_SYNC_MAX_OPERATIONS = 200
+POS_SYNC_OPERATION_TYPES = ("open_ticket", "add_items", "send_to_kitchen", "create_order")
+
+
+def resolve_sync_order_id(db: Session, rest, device_id: str, op: PosSyncOperationInput, tickets: Dict[str, int]) -> int:
+    if op.order_id:
+        return int(op.order_id)
+
+    ref = (op.client_ticket_id or "").strip()
+    if ref in tickets:
+        return tickets[ref]
+    if ref:
+        order_id = (
+            db.query(PosSyncOperation.order_id)
+            .filter(
+                PosSyncOperation.restaurant_id == rest.id,
+                # client_op_id es único solo por dispositivo
+                PosSyncOperation.device_id == device_id,
+                PosSyncOperation.op_type == "open_ticket",
+                PosSyncOperation.client_op_id == ref,
+            )
+            .scalar()
+        )
+        if order_id:
+            tickets[ref] = order_id
+            return order_id
+    raise HTTPException(status_code=409, detail="El ticket de esta operación todavía no está sincronizado.")
+
+
+def apply_pos_sync_operation(db: Session, rest, device_id: str, op: PosSyncOperationInput, tickets: Dict[str, int]) -> dict:
+    op_type = (op.type or "").strip().lower()
+    result = {"client_op_id": op.client_op_id, "type": op_type, "status": "applied"}
+
+    if op_type not in POS_SYNC_OPERATION_TYPES:
+        raise ValueError(f"Operación no soportada: {op.type}")
+
+    if op_type == "open_ticket":
+        order, existing = open_local_ticket(db, rest, OpenLocalTicketInput(**op.payload))
+        tickets[op.client_op_id] = order.id
+        result["order_id"] = order.id
+        if existing:
+            result["warnings"] = ["Ya había un ticket abierto; se usó el existente."]
+        return result
+
+    if op_type == "add_items":
+        order_id = resolve_sync_order_id(db, rest, device_id, op, tickets)
+        order = add_items_to_open_ticket(db, rest, order_id, AddItemsToOpenTicketInput(**op.payload))
+        result["order_id"] = order.id
+        return result
+
+    if op_type == "send_to_kitchen":
+        order_id = resolve_sync_order_id(db, rest, device_id, op, tickets)
+        order, sent_count = send_new_items_to_kitchen(db, rest, order_id, SendNewItemsInput(**op.payload))
+        result["order_id"] = order.id
+        result["sent_count"] = sent_count
+        return result
+
+    if op_type == "create_order":
+        order, discount_percent, discount_amount = create_order_from_input(db, rest, CreateOrderInput(**op.payload))
+        result["order_id"] = order.id
+        result["order"] = serialize_created_order(order, discount_percent, discount_amount)
+        return result
+
+
+@app.post("/v2/api/local/sync", dependencies=[Depends(require_permission("orders.create"))])
+def v2_api_local_sync(
+    payload: PosSyncInput,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Aplica en orden las operaciones encoladas por un POS sin conexión, en una
+    sola transacción. Cada operación va en su SAVEPOINT: si choca (ticket ya
+    cerrado, producto agotado o inactivo) se revierte solo esa y se reporta
+    como conflict. Las ya aplicadas en un envío anterior (mismo device_id y
+    client_op_id) se devuelven como duplicate sin volver a aplicarse. Un
+    error inesperado a mitad del envío revierte todo: no queda ninguna
+    aplicada y el POS puede reenviar el lote completo.
+    """
+    rest = get_restaurant_or_404(db, restaurant)
+
+    device_id = (payload.device_id or "").strip()[:64]
+    if not device_id:
+        raise HTTPException(status_code=400, detail="device_id es obligatorio.")
+    if len(payload.operations) > POS_SYNC_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"Máximo {POS_SYNC_MAX_OPERATIONS} operaciones por envío.")
+
+    for op in payload.operations:
+        op.client_op_id = (op.client_op_id or "").strip()[:64]
+        if not op.client_op_id:
+            raise HTTPException(status_code=400, detail="Cada operación necesita client_op_id.")
+
+    previous = {
+        row.client_op_id: row
+        for row in db.query(PosSyncOperation).filter(
+            PosSyncOperation.restaurant_id == rest.id,
+            PosSyncOperation.device_id == device_id,
+            PosSyncOperation.client_op_id.in_([op.client_op_id for op in payload.operations]),
+        )
+    }
+
+    tickets: Dict[str, int] = {}
+    results = []
+    touched_tickets = set()
+
+    for op in payload.operations:
+        prev = previous.get(op.client_op_id)
+        if prev is not None:
+            result = json.loads(prev.result_json or "{}")
+            result["status"] = "duplicate"
+            if prev.op_type == "open_ticket" and prev.order_id:
+                tickets[op.client_op_id] = prev.order_id
+            results.append(result)
+            continue
+
+        try:
+            with db.begin_nested():
+                result = apply_pos_sync_operation(db, rest, device_id, op, tickets)
+                db.add(PosSyncOperation(
+                    restaurant_id=rest.id,
+                    device_id=device_id,
+                    client_op_id=op.client_op_id,
+                    op_type=result["type"],
+                    order_id=result.get("order_id"),
+                    result_json=json.dumps(result, ensure_ascii=False),
+                ))
+        except HTTPException as e:
+            result = {
+                "client_op_id": op.client_op_id,
+                "type": op.type,
+                "status": "conflict",
+                "detail": e.detail,
+                "http_status": e.status_code,
+            }
+        except ValidationError as e:
+            error = e.errors()[0]
+            field = ".".join(str(x) for x in error.get("loc", ()))
+            result = {
+                "client_op_id": op.client_op_id,
+                "type": op.type,
+                "status": "rejected",
+                "detail": f"Datos inválidos ({field}): {error.get('msg', '')}",
+            }
+        except ValueError as e:
+            result = {
+                "client_op_id": op.client_op_id,
+                "type": op.type,
+                "status": "rejected",
+                "detail": str(e),
+            }
+
+        if result["status"] == "applied" and result["type"] != "create_order":
+            touched_tickets.add(result["order_id"])
+        results.append(result)
+
+    db.commit()
+
+    tickets_out = []
+    if touched_tickets:
+        orders = db.query(Order).filter(Order.id.in_(touched_tickets)).order_by(Order.id.asc()).all()
+        tickets_out = [serialize_local_order_row(o, db) for o in orders]
+
+    return {
+        "ok": True,
+        "restaurant": rest.slug,
+        "applied": sum(1 for r in results if r["status"] == "applied"),
+        "conflicts": sum(1 for r in results if r["status"] in ("conflict", "rejected")),
+        "results": results,
+        "ticket_ids": tickets,
+        "tickets": tickets_out,
+    }
+
+
+@app.post("/v2/api/local/ticket/{order_id}/items/{item_id}/void", dependencies=[Depends(require_permission("orders.create"))])
+def v2_api_void_ticket_item(
+    order_id: int,
+    item_id: int,
+    payload: VoidTicketItemInput,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+
+    order = (
+        db.query(Order)
+        .filter(
+            Order.id == order_id,
+            Order.restaurant_id == rest.id,
+            Order.is_open == True,  # noqa: E712
+        )
+        .first()
+    )
+    if not order:
+        raise HTTPException(status_code=404, detail="Ticket abierto no encontrado.")
+
+    item = (
+        db.query(OrderItem)
+        .filter(
+            OrderItem.id == item_id,
+            OrderItem.order_id == order.id,
+            OrderItem.voided == False,  # noqa: E712
+        )
+        .first()
+    )
+    if not item:
+        raise HTTPException(status_code=404, detail="Producto no encontrado en el ticket.")
+
+    if Decimal(str(item.paid_quantity or 0)) > 0:
+        raise HTTPException(status_code=400, detail="No se puede anular un producto ya cobrado.")
+
+    old_total = Decimal(str(order.total or 0))
+    item.voided = True
+    item.kitchen_status = "voided"
+    reason = (payload.reason or "").strip()
+    if reason:
+        item.notes = f"{item.notes} | Anulado: {reason}" if item.notes else f"Anulado: {reason}"
+
+    subtotal = Decimal(str(order.subtotal or 0)) - Decimal(str(item.total_price or 0))
+    if subtotal < 0:
+        subtotal = Decimal("0")
+    order.subtotal = subtotal
+    tax_rate = get_tax_rate_decimal(db, rest.id)
+    tax = Decimal("0")
+    if tax_rate > 0:
+        tax = (subtotal * tax_rate) / Decimal("100")
+    order.tax = tax
+    order.total = subtotal + tax
+
+    reverse_order_items(db, [item.id], order_id=order.id)
+
+    db.commit()
+    db.refresh(order)
+
+    audit_writer.audit(
+        rest.id, "pos_local", "order.item_void", "order_item", item.id,
+        description=reason or None,
+        old={"voided": False, "order_total": float(old_total)},
+        new={"voided": True, "order_total": float(order.total or 0)},
+    )
+
+    return {
+        "ok": True,
+        "voided_item_id": item.id,
+        "ticket": serialize_local_order_row(order, db),
+    }
+
+@app.get("/v2/api/orders")
+def v2_api_orders(
+    restaurant: Optional[str] = Query(None),
+    channel: Optional[str] = Query(None),
+    db: Session = Depends(get_read_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+
+    filters = {"channel": channel} if channel else {}
+    rows = latest_orders(db, rest.id, limit=100, **filters)
 
     return {
         "ok": True,
@@ -8045,11 +10064,21 @@ def update_order_status(
     if status not in allowed:
         raise HTTPException(status_code=400, detail="Estado inválido")
 
+    old_status = order.status
     order.status = status
+    if status == "cancelled":
+        revert_order_rollup(db, order)
+        reverse_order_consumption(db, order.id)
 
     db.commit()
     db.refresh(order)
 
+    if old_status != status:
+        audit_writer.audit(
+            rest.id, "orders", "order.status", "order", order.id,
+            old={"status": old_status}, new={"status": status},
+        )
+
     return {
         "ok": True,
         "order_id": order.id,
@@ -8091,11 +10120,14 @@ def get_order_balance_due(db: Session, order: Order) -> Decimal:
 
 
 @app.get("/v2/api/local/ticket/{order_id}/payments")
-def v2_api_local_ticket_payments(
+async def v2_api_local_ticket_payments(
     order_id: int,
     restaurant: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
 ):
+    return await run_db(local_ticket_payments, order_id, restaurant, tenant=restaurant)
+
+
+def local_ticket_payments(db: Session, order_id: int, restaurant: Optional[str]) -> dict:
     rest = get_restaurant_or_404(db, restaurant)
 
     order = (
@@ -8182,15 +10214,8 @@ def allocate_payment_to_order_items(db: Session, order: Order, payment_amount: D
         current_paid = Decimal(str(getattr(it, "paid_quantity", 0) or 0))
         it.paid_quantity = current_paid + qty_to_apply
 
-@app.post("/v2/api/local/ticket/{order_id}/pay-split")
-def v2_api_local_ticket_pay_split(
-    order_id: int,
-    payload: SplitPaymentInput,
-    restaurant: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
-):
-    rest = get_restaurant_or_404(db, restaurant)
-
+def pay_ticket_split(db: Session, rest, order_id: int, payload: SplitPaymentInput) -> dict:
+    """Aplica uno o varios pagos parciales al ticket. Sin commit."""
     order = (
         db.query(Order)
         .filter(
@@ -8211,6 +10236,7 @@ def v2_api_local_ticket_pay_split(
 
     incoming_total = Decimal("0")
     created = []
+    currencies = {}
 
     for p in payload.payments:
         method = (p.method or "").strip().lower()
@@ -8219,6 +10245,10 @@ def v2_api_local_ticket_pay_split(
         amount = Decimal(str(p.amount or 0))
         if amount <= 0:
             raise HTTPException(status_code=400, detail="Cada pago debe ser mayor que cero.")
+        try:
+            currency = payment_currency(db, rest.id, p.currency)
+        except CashLedgerError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
         incoming_total += amount
 
@@ -8236,6 +10266,7 @@ def v2_api_local_ticket_pay_split(
         )
         db.add(row)
         created.append(row)
+        currencies[id(row)] = currency
 
     if incoming_total > balance_before:
         raise HTTPException(
@@ -8244,8 +10275,21 @@ def v2_api_local_ticket_pay_split(
         )
     
     allocate_payment_to_order_items(db, order, incoming_total)
+    cash_session_id = attach_payments(db, rest.id, created, currencies)
+    audit_writer.audit(
+        rest.id, "cash", "payment.split", "order", order.id,
+        new={
+            "payments": [
+                {"method": r.method, "amount": r.amount, "currency": currencies.get(id(r)) or None}
+                for r in created
+            ],
+            "balance_before": balance_before,
+            "cash_session_id": cash_session_id,
+        },
+        db=db,
+    )
 
-    db.commit()
+    db.flush()
 
     paid_amount = get_order_paid_amount(db, order.id)
     balance_due = get_order_balance_due(db, order)
@@ -8256,13 +10300,13 @@ def v2_api_local_ticket_pay_split(
         if getattr(order, "is_open", True):
             order.is_open = False
         order.closed_at = datetime.utcnow()
+        apply_order_rollup(db, order)
     else:
         order.payment_status = "partial"
         if order.status in ("", None, "open"):
             order.status = "open"
 
-    db.commit()
-    db.refresh(order)
+    db.flush()
 
     return {
         "ok": True,
@@ -8274,6 +10318,26 @@ def v2_api_local_ticket_pay_split(
         "closed_at": str(getattr(order, "closed_at", "") or ""),
     }
 
+
+@app.post("/v2/api/local/ticket/{order_id}/pay-split", dependencies=[Depends(require_permission("orders.pay"))])
+def v2_api_local_ticket_pay_split(
+    order_id: int,
+    payload: SplitPaymentInput,
+    restaurant: Optional[str] = Query(None),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
+    db: Session = Depends(get_db),
+):
+    rest = get_restaurant_or_404(db, restaurant)
+
+    with idempotency_store.begin(db, rest.id, idempotency_key, f"local.pay_split:{order_id}", payload) as claim:
+        if claim.replay is not None:
+            return claim.replay
+        response = claim.save(pay_ticket_split(db, rest, order_id, payload))
+        db.commit()
+
+    return response
+
+
 def get_order_item_pending_quantity(it: OrderItem) -> Decimal:
     qty = Decimal(str(it.quantity or 0))
     paid_qty = Decimal(str(getattr(it, "paid_quantity", 0) or 0))
@@ -8450,6 +10514,7 @@ def v2_api_local_ticket_pay_items(
 class SplitItemsPaymentInput(BaseModel):
     items: List[SplitItemLineInput]
     method: str
+    currency: str = ""
     reference: str = ""
     bank_name: str = ""
     terminal_id: str = ""
@@ -8458,7 +10523,7 @@ class SplitItemsPaymentInput(BaseModel):
     card_last4: str = ""
 
 
-@app.post("/v2/api/local/ticket/{order_id}/pay-selected-items")
+@app.post("/v2/api/local/ticket/{order_id}/pay-selected-items", dependencies=[Depends(require_permission("orders.pay"))])
 def v2_api_local_ticket_pay_selected_items(
     order_id: int,
     payload: SplitItemsPaymentInput,
@@ -8484,6 +10549,10 @@ def v2_api_local_ticket_pay_selected_items(
     method = (payload.method or "").strip().lower()
     if not method:
         raise HTTPException(status_code=400, detail="El método de pago es obligatorio.")
+    try:
+        currency = payment_currency(db, rest.id, payload.currency)
+    except CashLedgerError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     requested_ids = [int(x.order_item_id) for x in payload.items]
     rows = (
@@ -8552,6 +10621,19 @@ def v2_api_local_ticket_pay_selected_items(
         current_paid = Decimal(str(getattr(row, "paid_quantity", 0) or 0))
         row.paid_quantity = current_paid + a["requested_qty"]
 
+    cash_session_id = attach_payments(db, rest.id, [payment], {id(payment): currency})
+    audit_writer.audit(
+        rest.id, "cash", "payment.items", "order", order.id,
+        new={
+            "method": method,
+            "amount": split_total,
+            "currency": currency or None,
+            "items": {str(a["row"].id): a["requested_qty"] for a in applied},
+            "cash_session_id": cash_session_id,
+        },
+        db=db,
+    )
+
     db.commit()
 
     paid_amount = get_order_paid_amount(db, order.id)
@@ -8562,6 +10644,7 @@ def v2_api_local_ticket_pay_selected_items(
         order.status = "paid"
         order.is_open = False
         order.closed_at = datetime.utcnow()
+        apply_order_rollup(db, order)
     else:
         order.payment_status = "partial"
         if order.status in ("", None, "open"):
@@ -8624,6 +10707,7 @@ def v2_api_local_ticket_close(
         order.payment_status = order.payment_status or "pending"
         order.status = "closed"
     order.closed_at = datetime.utcnow()
+    apply_order_rollup(db, order)
 
     db.commit()
     db.refresh(order)
@@ -8636,16 +10720,9 @@ def v2_api_local_ticket_close(
         "closed_at": str(order.closed_at or ""),
     }
 
-@app.post("/v2/api/orders/{order_id}/pay")
-def v2_api_pay_order(
-    order_id: int,
-    payload: PayOrderInput,
-    restaurant: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
-):
-
-    rest = get_restaurant_or_404(db, restaurant)
 
+def pay_order(db: Session, rest, order_id: int, payload: PayOrderInput) -> dict:
+    """Registra el pago de la orden completa. Sin commit."""
     order = (
         db.query(Order)
         .filter(
@@ -8662,15 +10739,23 @@ def v2_api_pay_order(
         raise HTTPException(status_code=400, detail="La orden ya fue pagada.")
 
     method = (payload.method or "").strip().lower()
+    try:
+        currency = payment_currency(db, rest.id, payload.currency)
+    except CashLedgerError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     amount = Decimal(str(payload.amount or 0))
     order_total = Decimal(str(order.total or 0))
+    # el vuelto no entra a la caja: el pago y el libro llevan solo lo aplicado
+    applied = min(amount, max(get_order_balance_due(db, order), Decimal("0")))
 
     payment = OrderPayment(
         order_id=order.id,
         method=method,
         status="approved",
-        amount=amount,
+        amount=applied,
+        tendered_amount=amount,
+        change_amount=amount - applied,
         reference=(payload.reference or "").strip(),
         bank_name=(payload.bank_name or "").strip(),
         terminal_id=(payload.terminal_id or "").strip(),
@@ -8680,12 +10765,26 @@ def v2_api_pay_order(
     )
 
     db.add(payment)
+    cash_session_id = attach_payments(db, rest.id, [payment], {id(payment): currency})
+    audit_writer.audit(
+        rest.id, "cash", "payment.create", "order", order.id,
+        old={"payment_status": order.payment_status or ""},
+        new={
+            "payment_status": "paid",
+            "method": method,
+            "amount": applied,
+            "tendered_amount": amount,
+            "currency": currency or None,
+            "cash_session_id": cash_session_id,
+        },
+        db=db,
+    )
 
     order.payment_status = "paid"
     order.status = "paid"
+    apply_order_rollup(db, order)
 
-    db.commit()
-    db.refresh(payment)
+    db.flush()
 
     change = amount - order_total
 
@@ -8699,6 +10798,26 @@ def v2_api_pay_order(
         "payment_id": payment.id,
     }
 
+
+@app.post("/v2/api/orders/{order_id}/pay", dependencies=[Depends(require_permission("orders.pay"))])
+def v2_api_pay_order(
+    order_id: int,
+    payload: PayOrderInput,
+    restaurant: Optional[str] = Query(None),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
+    db: Session = Depends(get_db),
+):
+
+    rest = get_restaurant_or_404(db, restaurant)
+
+    with idempotency_store.begin(db, rest.id, idempotency_key, f"orders.pay:{order_id}", payload) as claim:
+        if claim.replay is not None:
+            return claim.replay
+        response = claim.save(pay_order(db, rest, order_id, payload))
+        db.commit()
+
+    return response
+
 @app.get("/v2/api/orders/{order_id}/payments")
 def v2_api_order_payments(
     order_id: int,
@@ -8707,20 +10826,11 @@ def v2_api_order_payments(
 ):
     rest = get_restaurant_or_404(db, restaurant)
 
-    order = (
-        db.query(Order)
-        .filter(Order.id == order_id, Order.restaurant_id == rest.id)
-        .first()
-    )
+    order = find_order(db, rest.id, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Orden no encontrada.")
 
-    rows = (
-        db.query(OrderPayment)
-        .filter(OrderPayment.order_id == order.id)
-        .order_by(OrderPayment.id.asc())
-        .all()
-    )
+    rows = payments_for_order(db, order)
 
     return {
         "ok": True,
@@ -8731,6 +10841,8 @@ def v2_api_order_payments(
                 "method": p.method,
                 "status": p.status,
                 "amount": float(p.amount or 0),
+                "tendered_amount": float(p.tendered_amount if p.tendered_amount is not None else p.amount or 0),
+                "change_amount": float(p.change_amount or 0),
                 "reference": p.reference or "",
                 "bank_name": p.bank_name or "",
                 "terminal_id": p.terminal_id or "",
@@ -8792,17 +10904,13 @@ def v2_api_order_detail(
 ):
     rest = get_restaurant_or_404(db, restaurant)
 
-    order = (
-        db.query(Order)
-        .filter(Order.id == order_id, Order.restaurant_id == rest.id)
-        .first()
-    )
+    order = find_order(db, rest.id, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Orden no encontrada.")
 
     meta = parse_pipe_notes_meta(order.notes or "")
 
-    order_items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
+    order_items = items_for_order(db, order)
     product_ids = [getattr(it, "product_id", None) for it in order_items if getattr(it, "product_id", None)]
     product_rows = db.query(Product).filter(Product.id.in_(product_ids)).all() if product_ids else []
     product_map = {p.id: p for p in product_rows}
@@ -8856,11 +10964,11 @@ def v2_api_order_detail(
 @app.get("/v2/api/summary")
 def v2_api_summary(
     restaurant: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     rest = get_restaurant_or_404(db, restaurant)
 
-    total_orders = db.query(Order).filter(Order.restaurant_id == rest.id).count()
+    total_orders = count_orders(db, rest.id)
     total_products = db.query(Product).filter(Product.restaurant_id == rest.id).count()
     total_inventory_items = db.query(InventoryItem).filter(InventoryItem.restaurant_id == rest.id).count()
     total_employees = db.query(Employee).filter(Employee.restaurant_id == rest.id).count()
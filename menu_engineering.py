@@ -0,0 +1,379 @@
+"""
+Ingeniería de menú por mes: costo de receta, margen de contribución, mezcla
+de ventas y clasificación star / plowhorse / puzzle / dog.
+
+- run_menu_engineering(): recalcula solo los meses cuya huella cambió (nuevas
+  órdenes acumuladas en analytics_order_rollups, órdenes revertidas o cambios
+  de recetas/costos) y guarda el resultado en menu_engineering_results.
+- Las líneas vendidas se recorren una sola vez para todos los meses sucios,
+  acumulando en arrays indexados por producto (sin una consulta por producto).
+
+Costos: el costo unitario de cada insumo se guarda en el setting
+"inventory_unit_costs" ({inventory_item_id: costo}).
+
+Clasificación (Kasavana & Smith):
+- popular si sales_mix >= 70% de la mezcla esperada (1 / productos vendidos)
+- rentable si el margen unitario >= margen promedio ponderado del mes
+
+Uso por consola:
+    python menu_engineering.py [--restaurant deaca] [--full]
+"""
+import argparse
+import hashlib
+import json
+from array import array
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Optional
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from analytics_rollups import metric_day, rollup_order_filter
+from models.analytics_models import AnalyticsOrderRollup, MenuEngineeringPeriod, MenuEngineeringResult
+from models.core_models import RestaurantSetting
+from models.inventory_models import InventoryItem, Product, Recipe
+from order_archive import SOURCES, order_join
+
+UNIT_COSTS_SETTING_KEY = "inventory_unit_costs"
+POPULARITY_FACTOR = 0.7
+STREAM_BATCH_SIZE = 2000
+
+CLASS_STAR = "star"
+CLASS_PLOWHORSE = "plowhorse"
+CLASS_PUZZLE = "puzzle"
+CLASS_DOG = "dog"
+
+
+def period_start(value: datetime) -> datetime:
+    return metric_day(value).replace(day=1)
+
+
+def next_period(value: datetime) -> datetime:
+    if value.month == 12:
+        return value.replace(year=value.year + 1, month=1)
+    return value.replace(month=value.month + 1)
+
+
+def get_unit_costs(db: Session, restaurant_id: int) -> Dict[int, Decimal]:
+    row = (
+        db.query(RestaurantSetting)
+        .filter(
+            RestaurantSetting.restaurant_id == restaurant_id,
+            RestaurantSetting.setting_key == UNIT_COSTS_SETTING_KEY,
+        )
+        .first()
+    )
+    if not row or not row.setting_value:
+        return {}
+    try:
+        raw = json.loads(row.setting_value)
+    except Exception:
+        return {}
+
+    costs = {}
+    for key, value in (raw or {}).items():
+        try:
+            costs[int(key)] = Decimal(str(value))
+        except Exception:
+            continue
+    return costs
+
+
+def _recipe_costs(db: Session, restaurant_id: int):
+    """
+    Costo de receta por producto y una firma de recetas + costos para saber
+    si hay que recalcular periodos ya guardados.
+    """
+    unit_costs = get_unit_costs(db, restaurant_id)
+    rows = (
+        db.query(Recipe.product_id, Recipe.inventory_item_id, Recipe.quantity_required)
+        .join(InventoryItem, InventoryItem.id == Recipe.inventory_item_id)
+        .filter(InventoryItem.restaurant_id == restaurant_id)
+        .order_by(Recipe.product_id, Recipe.inventory_item_id)
+        .all()
+    )
+
+    costs: Dict[int, Decimal] = defaultdict(Decimal)
+    digest = hashlib.sha1()
+    for product_id, item_id, qty in rows:
+        unit_cost = unit_costs.get(item_id, Decimal("0"))
+        costs[product_id] += Decimal(str(qty or 0)) * unit_cost
+        digest.update(f"{product_id}:{item_id}:{qty}:{unit_cost};".encode())
+
+    return costs, digest.hexdigest()
+
+
+def _period_fingerprints(db: Session, restaurant_id: int) -> Dict[datetime, tuple]:
+    rows = (
+        db.query(
+            AnalyticsOrderRollup.metric_date,
+            func.count(AnalyticsOrderRollup.id),
+            func.max(AnalyticsOrderRollup.id),
+        )
+        .filter(AnalyticsOrderRollup.restaurant_id == restaurant_id)
+        .group_by(AnalyticsOrderRollup.metric_date)
+        .all()
+    )
+    periods: Dict[datetime, list] = {}
+    for day, count, max_id in rows:
+        key = period_start(day)
+        acc = periods.setdefault(key, [0, 0])
+        acc[0] += int(count or 0)
+        acc[1] = max(acc[1], int(max_id or 0))
+    return {k: (v[0], v[1]) for k, v in periods.items()}
+
+
+def classify(mix: float, margin: float, popularity_threshold: float, average_margin: float) -> str:
+    popular = mix >= popularity_threshold
+    profitable = margin >= average_margin
+    if popular and profitable:
+        return CLASS_STAR
+    if popular:
+        return CLASS_PLOWHORSE
+    if profitable:
+        return CLASS_PUZZLE
+    return CLASS_DOG
+
+
+def _accumulate(db: Session, restaurant_id: int, periods: list, index: Dict[int, int]):
+    """
+    Una sola pasada por las líneas vendidas de todos los periodos pedidos.
+    Devuelve {period_start: (qty_array, revenue_array)}.
+    """
+    size = len(index)
+    acc = {p: (array("d", bytes(8 * size)), array("d", bytes(8 * size))) for p in periods}
+
+    start = min(periods)
+    end = next_period(max(periods))
+    # calientes y archivo (order_archive.py)
+    for orders, items, _ in SOURCES:
+        stmt = (
+            db.query(orders.created_at, items.product_id, items.quantity, items.total_price)
+            .join(orders, order_join(orders, items))
+            .filter(
+                orders.restaurant_id == restaurant_id,
+                orders.created_at >= start,
+                orders.created_at < end,
+                rollup_order_filter(orders),
+                items.voided == False,  # noqa: E712
+            )
+            .execution_options(yield_per=STREAM_BATCH_SIZE)
+        )
+
+        for created_at, product_id, qty, total_price in stmt:
+            bucket = acc.get(period_start(created_at))
+            slot = index.get(product_id)
+            if bucket is None or slot is None:
+                continue
+            bucket[0][slot] += float(qty or 0)
+            bucket[1][slot] += float(total_price or 0)
+
+    return acc
+
+
+def _store_period(
+    db: Session,
+    restaurant_id: int,
+    period: datetime,
+    qty: array,
+    revenue: array,
+    products: list,
+    recipe_costs: Dict[int, Decimal],
+    fingerprint: tuple,
+    cost_signature: str,
+) -> dict:
+    sold = [i for i in range(len(products)) if qty[i] > 0]
+    total_qty = sum(qty[i] for i in sold)
+
+    unit_cost = {i: float(recipe_costs.get(products[i][0], 0)) for i in sold}
+    margins = {i: (revenue[i] / qty[i]) - unit_cost[i] for i in sold}
+    total_margin = sum(margins[i] * qty[i] for i in sold)
+
+    average_margin = (total_margin / total_qty) if total_qty else 0.0
+    threshold = (POPULARITY_FACTOR / len(sold)) if sold else 0.0
+
+    db.query(MenuEngineeringResult).filter(
+        MenuEngineeringResult.restaurant_id == restaurant_id,
+        MenuEngineeringResult.period_start == period,
+    ).delete(synchronize_session=False)
+
+    rows = []
+    for i in sold:
+        mix = qty[i] / total_qty if total_qty else 0.0
+        rows.append({
+            "restaurant_id": restaurant_id,
+            "period_start": period,
+            "product_id": products[i][0],
+            "product_name": products[i][1],
+            "quantity_sold": round(qty[i], 2),
+            "revenue": round(revenue[i], 2),
+            "food_cost": round(unit_cost[i], 4),
+            "contribution_margin": round(margins[i], 4),
+            "total_margin": round(margins[i] * qty[i], 2),
+            "sales_mix": round(mix, 6),
+            "classification": classify(mix, margins[i], threshold, average_margin),
+        })
+    if rows:
+        db.execute(insert(MenuEngineeringResult), rows)
+
+    state = (
+        db.query(MenuEngineeringPeriod)
+        .filter(
+            MenuEngineeringPeriod.restaurant_id == restaurant_id,
+            MenuEngineeringPeriod.period_start == period,
+        )
+        .first()
+    )
+    if not state:
+        state = MenuEngineeringPeriod(restaurant_id=restaurant_id, period_start=period)
+        db.add(state)
+    state.orders_count = fingerprint[0]
+    state.last_rollup_id = fingerprint[1]
+    state.cost_signature = cost_signature
+    state.average_margin = round(average_margin, 4)
+    state.popularity_threshold = round(threshold, 6)
+    state.computed_at = datetime.utcnow()
+
+    return {"period": period.date().isoformat(), "products": len(rows)}
+
+
+def run_menu_engineering(db: Session, restaurant_id: int, full: bool = False) -> dict:
+    fingerprints = _period_fingerprints(db, restaurant_id)
+    recipe_costs, cost_signature = _recipe_costs(db, restaurant_id)
+
+    stored = {
+        row.period_start: row
+        for row in db.query(MenuEngineeringPeriod).filter(MenuEngineeringPeriod.restaurant_id == restaurant_id).all()
+    }
+
+    dirty = []
+    for period, fingerprint in fingerprints.items():
+        state = stored.get(period)
+        if (
+            full
+            or state is None
+            or (state.orders_count, state.last_rollup_id) != fingerprint
+            or state.cost_signature != cost_signature
+        ):
+            dirty.append(period)
+
+    # meses que quedaron sin ventas (todas sus órdenes revertidas)
+    emptied = [p for p in stored if p not in fingerprints]
+    for period in emptied:
+        db.query(MenuEngineeringResult).filter(
+            MenuEngineeringResult.restaurant_id == restaurant_id,
+            MenuEngineeringResult.period_start == period,
+        ).delete(synchronize_session=False)
+        db.delete(stored[period])
+
+    if not dirty:
+        db.commit()
+        return {"restaurant_id": restaurant_id, "recomputed": [], "removed": len(emptied)}
+
+    products = db.query(Product.id, Product.name).filter(Product.restaurant_id == restaurant_id).order_by(Product.id).all()
+    index = {pid: i for i, (pid, _) in enumerate(products)}
+
+    dirty.sort()
+    acc = _accumulate(db, restaurant_id, dirty, index)
+
+    recomputed = []
+    for period in dirty:
+        qty, revenue = acc[period]
+        recomputed.append(_store_period(
+            db, restaurant_id, period, qty, revenue, products,
+            recipe_costs, fingerprints[period], cost_signature,
+        ))
+    db.commit()
+
+    return {"restaurant_id": restaurant_id, "recomputed": recomputed, "removed": len(emptied)}
+
+
+def read_menu_engineering(db: Session, restaurant_id: int, period: Optional[datetime] = None) -> dict:
+    query = db.query(MenuEngineeringPeriod).filter(MenuEngineeringPeriod.restaurant_id == restaurant_id)
+    if period is not None:
+        state = query.filter(MenuEngineeringPeriod.period_start == period).first()
+    else:
+        state = query.order_by(MenuEngineeringPeriod.period_start.desc()).first()
+
+    periods = [
+        row[0].date().isoformat()
+        for row in db.query(MenuEngineeringPeriod.period_start)
+        .filter(MenuEngineeringPeriod.restaurant_id == restaurant_id)
+        .order_by(MenuEngineeringPeriod.period_start.desc())
+        .all()
+    ]
+    if not state:
+        return {"period": None, "periods": periods, "items": [], "summary": {}}
+
+    rows = (
+        db.query(MenuEngineeringResult)
+        .filter(
+            MenuEngineeringResult.restaurant_id == restaurant_id,
+            MenuEngineeringResult.period_start == state.period_start,
+        )
+        .order_by(MenuEngineeringResult.total_margin.desc())
+        .all()
+    )
+
+    summary = defaultdict(int)
+    for r in rows:
+        summary[r.classification] += 1
+
+    return {
+        "period": state.period_start.date().isoformat(),
+        "periods": periods,
+        "average_margin": float(state.average_margin or 0),
+        "popularity_threshold": float(state.popularity_threshold or 0),
+        "computed_at": str(state.computed_at or ""),
+        "summary": dict(summary),
+        "items": [
+            {
+                "product_id": r.product_id,
+                "name": r.product_name or "",
+                "quantity_sold": float(r.quantity_sold or 0),
+                "revenue": float(r.revenue or 0),
+                "food_cost": float(r.food_cost or 0),
+                "contribution_margin": float(r.contribution_margin or 0),
+                "total_margin": float(r.total_margin or 0),
+                "sales_mix": float(r.sales_mix or 0),
+                "classification": r.classification,
+            }
+            for r in rows
+        ],
+    }
+
+
+def main(argv=None) -> int:
+    from db import Base, SessionLocal, engine
+    import models  # noqa: F401  registra todas las tablas
+    from models.core_models import Restaurant
+
+    parser = argparse.ArgumentParser(description="Calcula la ingeniería de menú de los meses con ventas nuevas.")
+    parser.add_argument("--restaurant", default="", help="slug; vacío = todos")
+    parser.add_argument("--full", action="store_true", help="recalcula todos los meses")
+    args = parser.parse_args(argv)
+
+    Base.metadata.create_all(bind=engine)
+
+    db = SessionLocal()
+    try:
+        query = db.query(Restaurant.id, Restaurant.slug)
+        if args.restaurant:
+            query = query.filter(Restaurant.slug == args.restaurant)
+        restaurants = query.all()
+        if args.restaurant and not restaurants:
+            print(f"Restaurante no encontrado: {args.restaurant}")
+            return 1
+
+        for restaurant_id, slug in restaurants:
+            print(slug, run_menu_engineering(db, restaurant_id, full=args.full))
+    finally:
+        db.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
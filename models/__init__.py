@@ -1,4 +1,4 @@
-from .core_models import Restaurant, RestaurantModule, RestaurantSetting
+from .core_models import Restaurant, RestaurantModule, RestaurantSetting, TenantShard
 from .security_models import (
     RestaurantUser,
     Permission,
@@ -12,6 +12,7 @@ __all__ = [
     "Restaurant",
     "RestaurantModule",
     "RestaurantSetting",
+    "TenantShard",
     "RestaurantUser",
     "Permission",
     "RolePermission",
@@ -20,15 +21,28 @@ __all__ = [
     "ActivityLog",
 ]
 
-from .sales_models import Order, OrderItem, OrderPayment
+from .sales_models import (
+    Order,
+    OrderItem,
+    OrderPayment,
+    OrderArchive,
+    OrderItemArchive,
+    OrderPaymentArchive,
+    PosSyncOperation,
+    IdempotencyKey,
+)
 
-from .cash_models import CashSession, CashMovement
+from .cash_models import CashSession, CashMovement, CashLedgerEntry, CashSessionTotal
 
 from .inventory_models import (
     Product,
+    ProductCategory,
     InventoryItem,
     Recipe,
-    InventoryMovement
+    InventoryMovement,
+    InventorySnapshot,
+    CatalogVersion,
+    CatalogChange
 )
 
 from .hr_models import (
@@ -43,5 +57,11 @@ from .analytics_models import (
     DailyMetric,
     ProductSalesMetric,
     UserSalesMetric,
-    DriverMetric
+    DriverMetric,
+    HourlyChannelMetric,
+    AnalyticsOrderRollup,
+    MenuEngineeringResult,
+    MenuEngineeringPeriod
 )
+
+from .export_models import ExportJob
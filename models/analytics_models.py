@@ -4,7 +4,9 @@ from sqlalchemy import (
     String,
     ForeignKey,
     DateTime,
-    Numeric
+    Numeric,
+    Index,
+    UniqueConstraint
 )
 
 from sqlalchemy.sql import func
@@ -18,6 +20,9 @@ from db import Base
 
 class DailyMetric(Base):
     __tablename__ = "daily_metrics"
+    __table_args__ = (
+        UniqueConstraint("restaurant_id", "date", name="uq_daily_metric_day"),
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -40,6 +45,14 @@ class DailyMetric(Base):
 
 class ProductSalesMetric(Base):
     __tablename__ = "product_sales_metrics"
+    __table_args__ = (
+        UniqueConstraint("restaurant_id", "metric_date", "product_id", name="uq_product_sales_metric_day"),
+        # cubre el GROUP BY product_id de analytics sin leer la tabla
+        Index(
+            "ix_product_sales_metric_cover",
+            "restaurant_id", "metric_date", "product_id", "quantity_sold", "total_revenue",
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -64,6 +77,9 @@ class ProductSalesMetric(Base):
 
 class UserSalesMetric(Base):
     __tablename__ = "user_sales_metrics"
+    __table_args__ = (
+        UniqueConstraint("restaurant_id", "metric_date", "user_name", name="uq_user_sales_metric_day"),
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -88,6 +104,9 @@ class UserSalesMetric(Base):
 
 class DriverMetric(Base):
     __tablename__ = "driver_metrics"
+    __table_args__ = (
+        UniqueConstraint("restaurant_id", "metric_date", "driver_name", name="uq_driver_metric_day"),
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -104,3 +123,128 @@ class DriverMetric(Base):
     metric_date = Column(DateTime)
 
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# =========================
+# MÉTRICAS POR HORA Y CANAL
+# =========================
+
+class HourlyChannelMetric(Base):
+    __tablename__ = "hourly_channel_metrics"
+    __table_args__ = (
+        UniqueConstraint("restaurant_id", "metric_hour", "channel", name="uq_hourly_channel_metric"),
+        Index(
+            "ix_hourly_channel_metric_cover",
+            "restaurant_id", "metric_hour", "weekday", "hour_of_day", "channel", "total_sales", "total_orders",
+        ),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), index=True)
+
+    # inicio de la hora (minutos y segundos en cero)
+    metric_hour = Column(DateTime, index=True)
+
+    # 0 = domingo; para el mapa día x hora sin funciones de fecha del motor
+    weekday = Column(Integer)
+
+    hour_of_day = Column(Integer)
+
+    channel = Column(String(30))
+
+    total_sales = Column(Numeric(12,2))
+
+    total_orders = Column(Integer)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# =========================
+# ÓRDENES YA ACUMULADAS
+# =========================
+
+class AnalyticsOrderRollup(Base):
+    __tablename__ = "analytics_order_rollups"
+    __table_args__ = (
+        Index("ix_analytics_rollup_rest_date", "restaurant_id", "metric_date"),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), nullable=False)
+
+    # una orden se acumula una sola vez
+    order_id = Column(Integer, nullable=False, unique=True)
+
+    metric_date = Column(DateTime, nullable=False)
+
+    total = Column(Numeric(10,2))
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# =========================
+# INGENIERÍA DE MENÚ
+# =========================
+
+class MenuEngineeringResult(Base):
+    __tablename__ = "menu_engineering_results"
+    __table_args__ = (
+        UniqueConstraint("restaurant_id", "period_start", "product_id", name="uq_menu_engineering_product"),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), index=True)
+
+    # inicio del mes
+    period_start = Column(DateTime, nullable=False)
+
+    product_id = Column(Integer, nullable=False)
+
+    product_name = Column(String(200))
+
+    quantity_sold = Column(Numeric(12,2))
+
+    revenue = Column(Numeric(12,2))
+
+    # costo de receta por unidad vendida
+    food_cost = Column(Numeric(12,4))
+
+    contribution_margin = Column(Numeric(12,4))
+
+    total_margin = Column(Numeric(12,2))
+
+    sales_mix = Column(Numeric(8,6))
+
+    # star / plowhorse / puzzle / dog
+    classification = Column(String(20))
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class MenuEngineeringPeriod(Base):
+    __tablename__ = "menu_engineering_periods"
+    __table_args__ = (
+        UniqueConstraint("restaurant_id", "period_start", name="uq_menu_engineering_period"),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), index=True)
+
+    period_start = Column(DateTime, nullable=False)
+
+    # huella de las ventas y costos usados; si cambia, el periodo se recalcula
+    orders_count = Column(Integer)
+
+    last_rollup_id = Column(Integer)
+
+    cost_signature = Column(String(64))
+
+    average_margin = Column(Numeric(12,4))
+
+    popularity_threshold = Column(Numeric(8,6))
+
+    computed_at = Column(DateTime(timezone=True), server_default=func.now())
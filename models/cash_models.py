@@ -6,7 +6,10 @@ from sqlalchemy import (
     DateTime,
     Numeric,
     Boolean,
-    Text
+    Index,
+    Text,
+    UniqueConstraint,
+    text
 )
 
 from sqlalchemy.orm import relationship
@@ -21,6 +24,13 @@ from db import Base
 
 class CashSession(Base):
     __tablename__ = "cash_sessions"
+    __table_args__ = (
+        # una sola caja abierta por restaurante, aunque dos aperturas lleguen a la vez
+        Index(
+            "uq_cash_session_open", "restaurant_id", unique=True,
+            sqlite_where=text("is_open"), postgresql_where=text("is_open"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -68,3 +78,54 @@ class CashMovement(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     session = relationship("CashSession", back_populates="movements")
+
+
+# =========================
+# LIBRO DE CAJA
+# =========================
+
+class CashLedgerEntry(Base):
+    __tablename__ = "cash_ledger_entries"
+
+    id = Column(Integer, primary_key=True)
+
+    session_id = Column(Integer, ForeignKey("cash_sessions.id"), index=True, nullable=False)
+
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), index=True)
+
+    entry_type = Column(String(30), nullable=False)
+    # sale / ingreso / retiro / ajuste
+
+    method = Column(String(50), nullable=False)  # cash / card / transfer / credit
+
+    currency = Column(String(3), nullable=False)
+
+    # efecto sobre la caja: retiro negativo
+    amount = Column(Numeric(10, 2), nullable=False)
+
+    payment_id = Column(Integer, index=True)
+
+    movement_id = Column(Integer)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class CashSessionTotal(Base):
+    __tablename__ = "cash_session_totals"
+    __table_args__ = (
+        UniqueConstraint("session_id", "entry_type", "method", "currency", name="uq_cash_session_total"),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    session_id = Column(Integer, ForeignKey("cash_sessions.id"), index=True, nullable=False)
+
+    entry_type = Column(String(30), nullable=False)
+
+    method = Column(String(50), nullable=False)
+
+    currency = Column(String(3), nullable=False)
+
+    amount = Column(Numeric(12, 2), nullable=False, default=0)
+
+    entries_count = Column(Integer, nullable=False, default=0)
@@ -114,3 +114,29 @@ class RestaurantSetting(Base):
     )
 
     restaurant = relationship("Restaurant", back_populates="settings")
+
+
+class TenantShard(Base):
+    """
+    Directorio de shards: vive en la base default. Un restaurante sin fila
+    está en la default. Sin FK a restaurants: después de mover un tenant su
+    fila puede ya no estar en esta base.
+    """
+
+    __tablename__ = "tenant_shards"
+
+    id = Column(Integer, primary_key=True, index=True)
+    restaurant_id = Column(Integer, unique=True, nullable=False, index=True)
+    restaurant_slug = Column(String(120), unique=True, nullable=False, index=True)
+    whatsapp_phone_number_id = Column(String(80), nullable=True, index=True)
+
+    shard_name = Column(String(50), nullable=False, default="default", server_default="default")
+    # "moving": el tenant se está copiando y no acepta escrituras
+    status = Column(String(20), nullable=False, default="active", server_default="active")
+
+    updated_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+        nullable=False,
+    )
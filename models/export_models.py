@@ -0,0 +1,48 @@
+from sqlalchemy import (
+    Column,
+    Integer,
+    BigInteger,
+    String,
+    ForeignKey,
+    DateTime,
+    Text
+)
+
+from sqlalchemy.sql import func
+
+from db import Base
+
+
+# =========================
+# EXPORTACIONES
+# =========================
+
+class ExportJob(Base):
+    __tablename__ = "export_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("restaurant_users.id", ondelete="SET NULL"), nullable=True, index=True)
+
+    module_code = Column(String(50), nullable=False)
+    export_type = Column(String(50), nullable=False)  # orders / order_items / payments
+
+    date_from = Column(String(20), nullable=True)
+    date_to = Column(String(20), nullable=True)
+
+    file_format = Column(String(20), nullable=False)  # csv / jsonl (siempre gzip)
+    file_path = Column(Text, nullable=True)
+
+    status = Column(String(30), nullable=False, default="pending", server_default="pending")  # pending / running / done / failed
+
+    # progreso
+    rows_total = Column(Integer, nullable=True)
+    rows_written = Column(Integer, nullable=False, default=0, server_default="0")
+    file_size = Column(BigInteger, nullable=True)
+    error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)  # lo toca el worker en cada lote
+    finished_at = Column(DateTime(timezone=True), nullable=True)
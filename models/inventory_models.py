@@ -6,7 +6,9 @@ from sqlalchemy import (
     DateTime,
     Numeric,
     Boolean,
-    Text
+    Text,
+    Index,
+    UniqueConstraint
 )
 
 from sqlalchemy.orm import relationship
@@ -15,6 +17,32 @@ from sqlalchemy.sql import func
 from db import Base
 
 
+# =========================
+# CATEGORÍAS DE PRODUCTO
+# =========================
+
+class ProductCategory(Base):
+    __tablename__ = "product_categories"
+
+    __table_args__ = (
+        UniqueConstraint("restaurant_id", "normalized_key", name="uq_product_category_key"),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), index=True, nullable=False)
+
+    name = Column(String(100), nullable=False)
+
+    normalized_key = Column(String(100), nullable=False)
+
+    sort_order = Column(Integer, default=0)
+
+    whatsapp_visible = Column(Boolean, default=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 # =========================
 # PRODUCTOS (MENÚ)
 # =========================
@@ -30,6 +58,8 @@ class Product(Base):
 
     category = Column(String(100))
 
+    category_id = Column(Integer, ForeignKey("product_categories.id"), index=True)
+
     price = Column(Numeric(10, 2))
 
     description = Column(Text)
@@ -91,18 +121,22 @@ class Recipe(Base):
 
 class InventoryMovement(Base):
     __tablename__ = "inventory_movements"
+    __table_args__ = (
+        Index("ix_inventory_movement_reference", "reference_type", "reference_id"),
+        Index("ix_inventory_movement_item_created", "item_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True)
 
     item_id = Column(Integer, ForeignKey("inventory_items.id"), index=True)
 
     movement_type = Column(String(30))  
-    # entrada / salida / ajuste / consumo
+    # entrada / salida / ajuste / consumo / reverso
 
     quantity = Column(Numeric(10, 2))
 
     reference_type = Column(String(50))
-    # order / purchase / manual
+    # order / order_item / purchase / manual
 
     reference_id = Column(Integer)
 
@@ -111,3 +145,66 @@ class InventoryMovement(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     item = relationship("InventoryItem", back_populates="movements")
+
+
+# =========================
+# SNAPSHOTS DE STOCK
+# =========================
+
+class InventorySnapshot(Base):
+    __tablename__ = "inventory_snapshots"
+    __table_args__ = (
+        UniqueConstraint("item_id", "snapshot_at", name="uq_inventory_snapshot_item_at"),
+        Index("ix_inventory_snapshot_rest_at", "restaurant_id", "snapshot_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), index=True)
+
+    item_id = Column(Integer, ForeignKey("inventory_items.id"), index=True)
+
+    # stock con todos los movimientos con created_at < snapshot_at
+    snapshot_at = Column(DateTime, nullable=False)
+
+    stock = Column(Numeric(12, 2), nullable=False, default=0)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# =========================
+# VERSIONES DEL CATÁLOGO
+# =========================
+
+class CatalogVersion(Base):
+    __tablename__ = "catalog_versions"
+
+    id = Column(Integer, primary_key=True)
+
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), unique=True, nullable=False)
+
+    version = Column(Integer, nullable=False, default=0)
+
+    # los deltas desde una versión menor ya no están en catalog_changes
+    min_version = Column(Integer, nullable=False, default=0)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class CatalogChange(Base):
+    __tablename__ = "catalog_changes"
+    __table_args__ = (
+        Index("ix_catalog_change_rest_version", "restaurant_id", "version"),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), nullable=False)
+
+    version = Column(Integer, nullable=False)
+
+    entity_type = Column(String(20), nullable=False)  # product | category
+
+    entity_id = Column(Integer, nullable=False)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -6,7 +6,9 @@ from sqlalchemy import (
     DateTime,
     Numeric,
     Boolean,
-    Text
+    Text,
+    UniqueConstraint,
+    Index
 )
 
 from sqlalchemy.orm import relationship
@@ -132,7 +134,10 @@ class OrderPayment(Base):
     method = Column(String(50), nullable=False)  # cash / card / transfer / credit
     status = Column(String(30), nullable=False, default="approved")
 
+    # lo aplicado a la orden; lo que entregó el cliente y el vuelto van aparte
     amount = Column(Numeric(10, 2), nullable=False)
+    tendered_amount = Column(Numeric(10, 2), nullable=True)
+    change_amount = Column(Numeric(10, 2), nullable=True)
 
     reference = Column(String(120))
 
@@ -142,8 +147,151 @@ class OrderPayment(Base):
     card_brand = Column(String(50))
     card_last4 = Column(String(10))
 
-    cash_session_id = Column(Integer, nullable=True)
+    cash_session_id = Column(Integer, nullable=True, index=True)
 
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     order = relationship("Order", back_populates="payments")
+
+
+# =========================
+# ARCHIVO DE ÓRDENES CERRADAS
+# =========================
+# Mismas columnas que orders / order_items / order_payments (ver
+# order_archive.py). Las líneas y pagos llevan restaurant_id y la fecha de
+# su orden para filtrarse sin join. En Postgres se particionan por mes y la
+# llave primaria tiene que incluir la fecha de partición.
+
+class OrderArchive(Base):
+    __tablename__ = "orders_archive"
+    __table_args__ = (
+        Index("ix_orders_archive_rest_created", "restaurant_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    created_at = Column(DateTime(timezone=True), primary_key=True)
+
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), nullable=False)
+    channel = Column(String(30), nullable=False)
+    status = Column(String(30), nullable=False)
+    customer_name = Column(String(120))
+    customer_phone = Column(String(50))
+    table_number = Column(String(20))
+    service_mode = Column(String(20), nullable=False)
+    table_id = Column(Integer, nullable=True)
+    zone_id = Column(Integer, nullable=True)
+    is_open = Column(Boolean, nullable=False, default=False)
+    closed_at = Column(DateTime(timezone=True), nullable=True)
+    subtotal = Column(Numeric(10, 2), nullable=False, default=0)
+    tax = Column(Numeric(10, 2), nullable=False, default=0)
+    total = Column(Numeric(10, 2), nullable=False, default=0)
+    payment_status = Column(String(30), nullable=False)
+    notes = Column(Text)
+
+
+class OrderItemArchive(Base):
+    __tablename__ = "order_items_archive"
+    __table_args__ = (
+        Index("ix_order_items_archive_rest_created", "restaurant_id", "order_created_at"),
+        {"postgresql_partition_by": "RANGE (order_created_at)"},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    order_created_at = Column(DateTime(timezone=True), primary_key=True)
+
+    order_id = Column(Integer, nullable=False, index=True)
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), nullable=False)
+    product_id = Column(Integer, nullable=True)
+    product_name_snapshot = Column(String(200), nullable=False)
+    quantity = Column(Numeric(10, 2), nullable=False, default=1)
+    unit_price = Column(Numeric(10, 2), nullable=False, default=0)
+    total_price = Column(Numeric(10, 2), nullable=False, default=0)
+    sent_to_kitchen = Column(Boolean, nullable=False, default=False)
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+    kitchen_status = Column(String(20), nullable=False, default="draft")
+    voided = Column(Boolean, nullable=False, default=False)
+    paid_quantity = Column(Numeric(12, 2), nullable=False, default=0)
+    notes = Column(Text)
+
+
+class OrderPaymentArchive(Base):
+    __tablename__ = "order_payments_archive"
+    __table_args__ = (
+        Index("ix_order_payments_archive_cash_session", "cash_session_id"),
+        {"postgresql_partition_by": "RANGE (order_created_at)"},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    order_created_at = Column(DateTime(timezone=True), primary_key=True)
+
+    order_id = Column(Integer, nullable=False, index=True)
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), nullable=False)
+    method = Column(String(50), nullable=False)
+    status = Column(String(30), nullable=False)
+    amount = Column(Numeric(10, 2), nullable=False)
+    tendered_amount = Column(Numeric(10, 2), nullable=True)
+    change_amount = Column(Numeric(10, 2), nullable=True)
+    reference = Column(String(120))
+    bank_name = Column(String(120))
+    terminal_id = Column(String(120))
+    authorization_code = Column(String(120))
+    card_brand = Column(String(50))
+    card_last4 = Column(String(10))
+    cash_session_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True))
+
+
+# =========================
+# SINCRONIZACIÓN DEL POS
+# =========================
+
+class PosSyncOperation(Base):
+    __tablename__ = "pos_sync_operations"
+    __table_args__ = (
+        UniqueConstraint("restaurant_id", "device_id", "client_op_id", name="uq_pos_sync_operation"),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), nullable=False, index=True)
+
+    device_id = Column(String(64), nullable=False)
+
+    # id generado en el dispositivo; un reintento del mismo lote no se aplica dos veces
+    client_op_id = Column(String(64), nullable=False, index=True)
+
+    op_type = Column(String(30), nullable=False)
+
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=True)
+
+    result_json = Column(Text)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# =========================
+# IDEMPOTENCIA DE POST
+# =========================
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        UniqueConstraint("restaurant_id", "idempotency_key", name="uq_idempotency_key"),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), nullable=False, index=True)
+
+    # header Idempotency-Key que manda el cliente
+    idempotency_key = Column(String(128), nullable=False)
+
+    # endpoint + hash del body; la misma llave con otro contenido se rechaza
+    scope = Column(String(50), nullable=False)
+    request_hash = Column(String(64), nullable=False)
+
+    response_json = Column(Text)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime, nullable=False, index=True)
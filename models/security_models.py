@@ -3,6 +3,7 @@ from sqlalchemy import (
     Column,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     String,
     Text,
@@ -156,6 +157,9 @@ class UserSession(Base):
 
 class ActivityLog(Base):
     __tablename__ = "activity_logs"
+    __table_args__ = (
+        Index("ix_activity_logs_rest_created_action", "restaurant_id", "created_at", "action_code"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
 
@@ -0,0 +1,390 @@
+"""
+Archivo de órdenes cerradas (orders_archive, order_items_archive,
+order_payments_archive).
+
+Las consultas calientes (tickets abiertos, cocina, delivery pendiente)
+filtran por estado sobre orders / order_items, y esos índices son casi todo
+historia cerrada. OrderArchiver mueve cada ORDER_ARCHIVE_DAYS las órdenes
+terminadas (pagadas, cerradas o canceladas) y sus líneas y pagos a las
+tablas de archivo, por lotes de ARCHIVE_BATCH_SIZE órdenes y una
+transacción por lote: copia, desengancha pos_sync_operations y borra de las
+calientes. Conserva los ids.
+
+- En Postgres las tablas de archivo están particionadas por mes (rango
+  sobre created_at de la orden). Las particiones del mes se crean antes de
+  insertar; la partición DEFAULT queda vacía salvo error.
+- En SQLite son tablas comunes con índice por (restaurant_id, fecha).
+- Las tablas calientes no se particionan: order_items, order_payments y
+  pos_sync_operations tienen FK a orders.id, y en Postgres una tabla
+  particionada exige la fecha en la llave primaria.
+
+Lecturas que cruzan las dos: latest_orders (historial), count_orders,
+find_order / items_for_order / payments_for_order (detalle de una orden) y los
+pares SOURCES para los reportes que recorren un rango (exportaciones,
+re-agregación de analytics, ingeniería de menú, conciliación de caja). Los
+datos del día (analytics en vivo) siempre están en las calientes:
+MIN_ARCHIVE_DAYS lo garantiza.
+
+Uso por consola:
+    python order_archive.py --days 90 [--restaurant deaca] [--batch-size 500]
+"""
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import and_, func, or_, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import sharding
+from config import settings
+from models.core_models import Restaurant
+from models.sales_models import (
+    Order,
+    OrderArchive,
+    OrderItem,
+    OrderItemArchive,
+    OrderPayment,
+    OrderPaymentArchive,
+    PosSyncOperation,
+)
+
+ARCHIVE_BATCH_SIZE = 500
+MIN_ARCHIVE_DAYS = 2
+
+# (órdenes, líneas, pagos): primero las calientes, después el archivo
+HOT = (Order, OrderItem, OrderPayment)
+ARCHIVED = (OrderArchive, OrderItemArchive, OrderPaymentArchive)
+SOURCES = (HOT, ARCHIVED)
+
+PARTITIONED_TABLES = (
+    (OrderArchive.__table__, "created_at"),
+    (OrderItemArchive.__table__, "order_created_at"),
+    (OrderPaymentArchive.__table__, "order_created_at"),
+)
+
+_partitions_lock = threading.Lock()
+_partitions_ready: set = set()
+
+
+def _utc_naive(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _month_start(value: datetime) -> datetime:
+    value = _utc_naive(value)
+    return datetime(value.year, value.month, 1)
+
+
+def _next_month(month: datetime) -> datetime:
+    return datetime(month.year + (month.month == 12), month.month % 12 + 1, 1)
+
+
+# =========================
+# ESQUEMA
+# =========================
+
+def ensure_schema(engine) -> None:
+    """create_all ya creó las tablas; en Postgres falta la partición DEFAULT."""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        for table, _ in PARTITIONED_TABLES:
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {table.name}_default PARTITION OF {table.name} DEFAULT"
+            ))
+
+
+def ensure_partitions(db: Session, months: Iterable[datetime]) -> set:
+    """
+    Crea en la transacción de db las particiones mensuales que falten.
+    Devuelve las que hay que marcar listas con mark_partitions después del
+    commit: si la transacción se revierte, las particiones tampoco quedan.
+    """
+    bind = db.get_bind()
+    if bind.dialect.name != "postgresql":
+        return set()
+    url = str(bind.url)
+    created = set()
+    for month in sorted(set(months)):
+        if (url, month) in _partitions_ready:
+            continue
+        upper = _next_month(month)
+        for table, _ in PARTITIONED_TABLES:
+            db.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {table.name}_{month:%Y_%m} PARTITION OF {table.name} "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d} 00:00:00+00') TO ('{upper:%Y-%m-%d} 00:00:00+00')"
+            ))
+        created.add((url, month))
+    return created
+
+
+def mark_partitions(created: set) -> None:
+    with _partitions_lock:
+        _partitions_ready.update(created)
+
+
+# =========================
+# MOVER AL ARCHIVO
+# =========================
+
+def archivable_filter(cutoff: datetime):
+    return and_(
+        Order.created_at < cutoff,
+        or_(Order.closed_at.is_(None), Order.closed_at < cutoff),
+        or_(
+            Order.status == "cancelled",
+            Order.payment_status == "paid",
+            and_(Order.is_open == False, Order.status == "closed"),  # noqa: E712
+        ),
+    )
+
+
+def _children(db: Session, table, order_ids: List[int], orders: Dict[int, dict]) -> List[dict]:
+    rows = []
+    for r in db.execute(select(table).where(table.c.order_id.in_(order_ids))):
+        row = dict(r._mapping)
+        order = orders[row["order_id"]]
+        row["restaurant_id"] = order["restaurant_id"]
+        row["order_created_at"] = order["created_at"]
+        rows.append(row)
+    return rows
+
+
+def archive_batch(
+    db: Session,
+    cutoff: datetime,
+    restaurant_id: Optional[int] = None,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+) -> int:
+    """Mueve hasta batch_size órdenes en una transacción. Devuelve cuántas."""
+    query = select(Order.id).where(archivable_filter(cutoff))
+    if restaurant_id is not None:
+        query = query.where(Order.restaurant_id == restaurant_id)
+    ids = db.execute(query.order_by(Order.id.asc()).limit(batch_size)).scalars().all()
+    if not ids:
+        return 0
+
+    orders = {r.id: dict(r._mapping) for r in db.execute(select(Order.__table__).where(Order.id.in_(ids)))}
+    items = _children(db, OrderItem.__table__, ids, orders)
+    payments = _children(db, OrderPayment.__table__, ids, orders)
+
+    try:
+        partitions = ensure_partitions(db, [_month_start(o["created_at"]) for o in orders.values()])
+        db.execute(OrderArchive.__table__.insert(), list(orders.values()))
+        if items:
+            db.execute(OrderItemArchive.__table__.insert(), items)
+        if payments:
+            db.execute(OrderPaymentArchive.__table__.insert(), payments)
+
+        # la respuesta del lote sigue en result_json; solo se suelta la FK
+        db.execute(
+            PosSyncOperation.__table__.update()
+            .where(PosSyncOperation.order_id.in_(ids))
+            .values(order_id=None)
+        )
+        db.execute(OrderPayment.__table__.delete().where(OrderPayment.order_id.in_(ids)))
+        db.execute(OrderItem.__table__.delete().where(OrderItem.order_id.in_(ids)))
+        db.execute(Order.__table__.delete().where(Order.id.in_(ids)))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    mark_partitions(partitions)
+    return len(ids)
+
+
+def archive_closed_orders(
+    db: Session,
+    older_than_days: int,
+    restaurant_id: Optional[int] = None,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    now: Optional[datetime] = None,
+) -> int:
+    days = max(MIN_ARCHIVE_DAYS, int(older_than_days))
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+    total = 0
+    while True:
+        try:
+            n = archive_batch(db, cutoff, restaurant_id=restaurant_id, batch_size=batch_size)
+        except IntegrityError:
+            # otro worker archivó el mismo lote primero
+            return total
+        total += n
+        if n < batch_size:
+            return total
+
+
+class OrderArchiver:
+    def __init__(
+        self,
+        older_than_days: int = settings.order_archive_days,
+        interval: float = settings.order_archive_interval_seconds,
+        batch_size: int = ARCHIVE_BATCH_SIZE,
+    ):
+        self.older_than_days = older_than_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.rounds = 0
+        self.archived = 0
+        self.last_errors: Dict[str, str] = {}
+
+    def _archive_shard(self, db: Session, shard: str) -> int:
+        total = 0
+        for rid in db.execute(select(Restaurant.id).order_by(Restaurant.id)).scalars().all():
+            # un tenant que se está moviendo (o ya se movió) no se toca acá
+            owner, status = sharding.locate(restaurant_id=rid)
+            if owner != shard or status != sharding.STATUS_ACTIVE:
+                continue
+            total += archive_closed_orders(db, self.older_than_days, restaurant_id=rid, batch_size=self.batch_size)
+        return total
+
+    def run_once(self) -> int:
+        results, errors = sharding.for_each_shard(self._archive_shard)
+        n = sum(results.values())
+        self.rounds += 1
+        self.archived += n
+        self.last_errors = errors
+        for shard, error in errors.items():
+            print("ORDER ARCHIVE ERROR:", shard, error)
+        return n
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print("ORDER ARCHIVE ERROR:", e)
+
+    def start(self) -> None:
+        if self.older_than_days <= 0:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="order-archive", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.older_than_days > 0,
+            "older_than_days": self.older_than_days,
+            "rounds": self.rounds,
+            "archived": self.archived,
+            "last_errors": self.last_errors,
+        }
+
+
+# =========================
+# LECTURAS SOBRE LAS DOS
+# =========================
+
+def order_join(orders, child):
+    """Condición orden-hija; en el archivo incluye la fecha para podar particiones."""
+    condition = orders.id == child.order_id
+    if orders is OrderArchive:
+        condition = and_(condition, orders.created_at == child.order_created_at)
+    return condition
+
+
+def latest_orders(db: Session, restaurant_id: int, limit: int = 100, **filters) -> list:
+    """
+    Las últimas `limit` órdenes por id entre calientes y archivo. Cada tabla
+    aporta su propio top por índice y se mezclan en memoria.
+    """
+    rows = []
+    for orders, _, _ in SOURCES:
+        query = db.query(orders).filter(orders.restaurant_id == restaurant_id)
+        for name, value in filters.items():
+            query = query.filter(getattr(orders, name) == value)
+        rows.extend(query.order_by(orders.id.desc()).limit(limit).all())
+    rows.sort(key=lambda o: o.id, reverse=True)
+    return rows[:limit]
+
+
+def count_orders(db: Session, restaurant_id: int) -> int:
+    return sum(
+        db.query(func.count(orders.id)).filter(orders.restaurant_id == restaurant_id).scalar() or 0
+        for orders, _, _ in SOURCES
+    )
+
+
+def find_order(db: Session, restaurant_id: int, order_id: int):
+    """Order o OrderArchive (mismos atributos), o None."""
+    for orders, _, _ in SOURCES:
+        order = (
+            db.query(orders)
+            .filter(orders.id == order_id, orders.restaurant_id == restaurant_id)
+            .first()
+        )
+        if order is not None:
+            return order
+    return None
+
+
+def _source_of(order):
+    return ARCHIVED if isinstance(order, OrderArchive) else HOT
+
+
+def items_for_order(db: Session, order) -> list:
+    orders, items, _ = _source_of(order)
+    query = db.query(items).filter(items.order_id == order.id)
+    if orders is OrderArchive:
+        query = query.filter(items.order_created_at == order.created_at)
+    return query.order_by(items.id.asc()).all()
+
+
+def payments_for_order(db: Session, order) -> list:
+    orders, _, payments = _source_of(order)
+    query = db.query(payments).filter(payments.order_id == order.id)
+    if orders is OrderArchive:
+        query = query.filter(payments.order_created_at == order.created_at)
+    return query.order_by(payments.id.asc()).all()
+
+
+def main(argv=None) -> int:
+    from db import Base, engine
+    import models  # noqa: F401  registra todas las tablas
+
+    parser = argparse.ArgumentParser(description="Archiva órdenes cerradas.")
+    parser.add_argument("--days", type=int, default=settings.order_archive_days)
+    parser.add_argument("--restaurant", default="", help="slug; sin esto, todos los restaurantes de todos los shards")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    Base.metadata.create_all(bind=engine)
+    ensure_schema(engine)
+    sharding.ensure_shard_schemas(ensure_schema)
+
+    if args.restaurant:
+        db = sharding.tenant_session(args.restaurant)
+        try:
+            rest = db.query(Restaurant).filter(Restaurant.slug == args.restaurant).first()
+            if not rest:
+                print(f"Restaurante no encontrado: {args.restaurant}")
+                return 1
+            n = archive_closed_orders(db, args.days, restaurant_id=rest.id, batch_size=args.batch_size)
+        finally:
+            db.close()
+        print({"restaurant": args.restaurant, "archived": n})
+        return 0
+
+    archiver = OrderArchiver(older_than_days=args.days, batch_size=args.batch_size)
+    n = archiver.run_once()
+    print({"archived": n, "errors": archiver.last_errors})
+    return 1 if archiver.last_errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
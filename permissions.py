@@ -0,0 +1,344 @@
+"""
+Resolución de permisos por usuario.
+
+Los permisos de un usuario (grants de su role_code más overrides en
+user_permissions) se compilan a un bitset: un int de Python con un bit
+encendido por cada permiso concedido. Cada código tiene una posición
+compacta (0..N-1, en orden de Permission.id), así la máscara no crece con
+los ids que dejan permisos borrados. Chequear un permiso es un AND contra la
+máscara cacheada en memoria, sin joins por request.
+
+- El rol owner (settings.owner_role_code) tiene todos los permisos.
+- Un override con is_allowed=False quita el permiso aunque el rol lo tenga.
+- Cualquier commit que toque permissions, role_permissions,
+  user_permissions o restaurant_users invalida la caché del proceso. Los
+  cambios hechos por otros procesos se ven al vencer
+  PERMISSION_MAX_AGE_SECONDS.
+- La caché es por shard: ids de permisos y de usuarios son de cada base.
+
+require_permission("orders.pay") devuelve una dependencia de FastAPI que
+identifica al usuario por su sesión de PIN (header X-Session-Id, la que
+devuelve /v2/api/sessions/start) y exige ?restaurant= con el slug del
+restaurante de esa sesión: el handler recibe ese mismo restaurante. En las
+rutas de operación, sin sesión la petición pasa salvo que
+PERMISSIONS_ENFORCED=1: es la transición para los POS que todavía no
+mandan sesión, y en producción conviene encenderlo. Las rutas de admin
+(require_permission(..., strict=True)) y las que usan current_user piden
+sesión siempre. Los cambios globales (grants por rol) piden además el token
+de plataforma (require_platform_admin).
+"""
+import hmac
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Depends, HTTPException, Query, Request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from audit_log import set_request_user
+from config import settings
+from db import get_db
+from models.core_models import Restaurant
+from models.security_models import Permission, RestaurantUser, RolePermission, UserPermission, UserSession
+from sharding import session_shard
+
+PERMISSION_MAX_AGE_SECONDS = 60.0
+SESSION_HEADER = "x-session-id"
+ADMIN_TOKEN_HEADER = "x-admin-token"
+
+_SESSION_KEY = "permissions_changed"
+_WATCHED = (Permission, RolePermission, UserPermission, RestaurantUser)
+
+_lock = threading.Lock()
+# por shard
+_bits: Dict[str, Dict[str, int]] = {}  # code -> posición del bit
+_id_bits: Dict[str, Dict[int, int]] = {}  # Permission.id -> posición del bit
+_bits_built_at: Dict[str, float] = {}
+_users: Dict[Tuple[str, int], "CompiledPermissions"] = {}  # (shard, user_id)
+
+
+class CompiledPermissions:
+    __slots__ = ("user_id", "restaurant_id", "restaurant_slug", "role_code", "is_active", "mask", "built_at")
+
+    def __init__(self, user_id: int, restaurant_id: int, restaurant_slug: str, role_code: str, is_active: bool, mask: int):
+        self.user_id = user_id
+        self.restaurant_id = restaurant_id
+        self.restaurant_slug = restaurant_slug
+        self.role_code = role_code
+        self.is_active = is_active
+        self.mask = mask
+        self.built_at = time.monotonic()
+
+    def has(self, bit: int) -> bool:
+        return self.is_active and bool(self.mask >> bit & 1)
+
+
+# =========================
+# INVALIDACIÓN
+# =========================
+
+def invalidate(user_ids: Optional[Iterable[int]] = None) -> None:
+    with _lock:
+        if user_ids is None:
+            _users.clear()
+            _bits.clear()
+            _id_bits.clear()
+            _bits_built_at.clear()
+            return
+        user_ids = {int(u) for u in user_ids}
+        for key in [k for k in _users if k[1] in user_ids]:
+            del _users[key]
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, _WATCHED):
+            session.info[_SESSION_KEY] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.in_nested_transaction():
+        return
+    if session.info.pop(_SESSION_KEY, None):
+        invalidate()
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_SESSION_KEY, None)
+
+
+# =========================
+# COMPILACIÓN
+# =========================
+
+def _permission_bits(db: Session, refresh: bool = False) -> Dict[str, int]:
+    # cada shard tiene su tabla permissions: sus ids (y posiciones) pueden diferir
+    shard = session_shard(db)
+    with _lock:
+        bits = _bits.get(shard)
+        if not refresh and bits and time.monotonic() - _bits_built_at.get(shard, 0.0) <= PERMISSION_MAX_AGE_SECONDS:
+            return bits
+
+    rows = db.query(Permission.id, Permission.code).order_by(Permission.id).all()
+    bits = {code: bit for bit, (_, code) in enumerate(rows)}
+    with _lock:
+        if bits != _bits.get(shard):
+            # las máscaras compiladas usan las posiciones viejas
+            for key in [k for k in _users if k[0] == shard]:
+                del _users[key]
+        _bits[shard] = bits
+        _id_bits[shard] = {pid: bit for bit, (pid, _) in enumerate(rows)}
+        _bits_built_at[shard] = time.monotonic()
+    return bits
+
+
+def _permission_id_bits(db: Session) -> Dict[int, int]:
+    _permission_bits(db)
+    with _lock:
+        return dict(_id_bits[session_shard(db)])
+
+
+def permission_bit(db: Session, code: str) -> Optional[int]:
+    bit = _permission_bits(db).get(code)
+    if bit is None:
+        # permiso creado después del último refresh
+        bit = _permission_bits(db, refresh=True).get(code)
+    return bit
+
+
+def compile_user(db: Session, user_id: int) -> Optional[CompiledPermissions]:
+    row = (
+        db.query(RestaurantUser.restaurant_id, Restaurant.slug, RestaurantUser.role_code, RestaurantUser.is_active)
+        .join(Restaurant, Restaurant.id == RestaurantUser.restaurant_id)
+        .filter(RestaurantUser.id == user_id)
+        .first()
+    )
+    if not row:
+        return None
+    restaurant_id, slug, role_code, is_active = row
+    id_bits = _permission_id_bits(db)
+
+    if role_code == settings.owner_role_code:
+        mask = (1 << len(id_bits)) - 1
+    else:
+        mask = 0
+        for (pid,) in db.query(RolePermission.permission_id).filter(RolePermission.role_code == role_code).all():
+            if pid in id_bits:
+                mask |= 1 << id_bits[pid]
+
+    for pid, allowed in (
+        db.query(UserPermission.permission_id, UserPermission.is_allowed)
+        .filter(UserPermission.user_id == user_id)
+        .all()
+    ):
+        if pid not in id_bits:
+            continue
+        if allowed:
+            mask |= 1 << id_bits[pid]
+        else:
+            mask &= ~(1 << id_bits[pid])
+
+    return CompiledPermissions(user_id, restaurant_id, slug, role_code or "", bool(is_active), mask)
+
+
+def resolve(db: Session, user_id: int) -> Optional[CompiledPermissions]:
+    # los ids de usuario son por shard: el mismo id en dos shards son dos usuarios
+    key = (session_shard(db), user_id)
+    with _lock:
+        compiled = _users.get(key)
+    if compiled is not None and time.monotonic() - compiled.built_at <= PERMISSION_MAX_AGE_SECONDS:
+        return compiled
+
+    compiled = compile_user(db, user_id)
+    if compiled is not None:
+        with _lock:
+            _users[key] = compiled
+    return compiled
+
+
+def has_permission(db: Session, user_id: int, code: str) -> bool:
+    bit = permission_bit(db, code)
+    compiled = resolve(db, user_id)
+    return bit is not None and compiled is not None and compiled.has(bit)
+
+
+def permission_codes(db: Session, user_id: int) -> List[str]:
+    compiled = resolve(db, user_id)
+    if compiled is None or not compiled.is_active:
+        return []
+    return sorted(code for code, bit in _permission_bits(db).items() if compiled.has(bit))
+
+
+# =========================
+# DEPENDENCIA FASTAPI
+# =========================
+
+def _header_session_id(request: Request) -> Optional[int]:
+    raw = (request.headers.get(SESSION_HEADER) or "").strip()
+    if not raw:
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        raise HTTPException(status_code=401, detail="X-Session-Id inválido")
+
+
+def _request_restaurant(db: Session, slug: str) -> Restaurant:
+    # mismo caché que main_v2.get_restaurant_or_404: el handler recibe este
+    # restaurante y no cae al default si el slug no existe
+    resolved = db.info.setdefault("restaurants_by_slug", {})
+    restaurant = resolved.get(slug)
+    if restaurant is None:
+        restaurant = (
+            db.query(Restaurant)
+            .filter(Restaurant.slug == slug, Restaurant.is_active == True)  # noqa: E712
+            .first()
+        )
+        if restaurant is None:
+            raise HTTPException(status_code=404, detail="Restaurante no encontrado")
+        resolved[slug] = restaurant
+    return restaurant
+
+
+def _session_user(db: Session, session_id: int) -> Optional[Tuple[int, int]]:
+    """(user_id, restaurant_id) de una sesión de PIN vigente."""
+    return (
+        db.query(UserSession.user_id, UserSession.restaurant_id)
+        .filter(
+            UserSession.id == session_id,
+            UserSession.is_active == True,  # noqa: E712
+            UserSession.is_locked == False,  # noqa: E712
+            UserSession.ended_at.is_(None),
+        )
+        .first()
+    )
+
+
+def _identify(request: Request, restaurant: Optional[str], db: Session, strict: bool) -> Optional[CompiledPermissions]:
+    session_id = _header_session_id(request)
+    if session_id is None:
+        if strict or settings.permissions_enforced:
+            raise HTTPException(status_code=401, detail="Sesión requerida")
+        return None
+    if not restaurant:
+        raise HTTPException(status_code=400, detail="Falta el restaurante (?restaurant=)")
+
+    rest = _request_restaurant(db, restaurant)
+    found = _session_user(db, session_id)
+    if found is None:
+        raise HTTPException(status_code=401, detail="Sesión no válida")
+    user_id, session_restaurant_id = found
+
+    compiled = resolve(db, user_id)
+    if compiled is None or not compiled.is_active:
+        raise HTTPException(status_code=401, detail="Usuario no válido")
+    if session_restaurant_id != rest.id or compiled.restaurant_id != rest.id:
+        raise HTTPException(status_code=403, detail="El usuario no pertenece a este restaurante")
+    set_request_user(compiled.user_id)
+    return compiled
+
+
+def _end_read(db: Session) -> None:
+    # en SQLite cada transacción abre con BEGIN IMMEDIATE (db.install_sqlite_profile):
+    # si la lectura del usuario quedara abierta, un handler async que abre su
+    # propia sesión con run_db esperaría este lock hasta el timeout
+    if db.in_transaction():
+        db.rollback()
+
+
+def current_user(
+    request: Request,
+    restaurant: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+) -> CompiledPermissions:
+    """Usuario de la sesión X-Session-Id; sin sesión es 401 aunque PERMISSIONS_ENFORCED=0."""
+    try:
+        return _identify(request, restaurant, db, strict=True)
+    finally:
+        _end_read(db)
+
+
+def require_permission(code: str, strict: bool = False):
+    """strict=True pide sesión aunque PERMISSIONS_ENFORCED=0 (rutas de admin)."""
+    def dependency(
+        request: Request,
+        restaurant: Optional[str] = Query(None),
+        db: Session = Depends(get_db),
+    ) -> Optional[CompiledPermissions]:
+        try:
+            # la posición primero: si se refresca el mapa, la máscara se compila con el nuevo
+            bit = permission_bit(db, code)
+            compiled = _identify(request, restaurant, db, strict)
+        finally:
+            _end_read(db)
+        if compiled is None:
+            return None
+
+        if bit is None or not compiled.has(bit):
+            raise HTTPException(status_code=403, detail=f"Permiso requerido: {code}")
+        return compiled
+
+    dependency.__name__ = f"require_{code.replace('.', '_')}"
+    return dependency
+
+
+def require_platform_admin(request: Request) -> None:
+    """
+    Cambios que valen para todos los restaurantes (grants por rol): no
+    alcanza con admin.access de un restaurante, piden ADMIN_API_TOKEN en
+    X-Admin-Token. Sin token configurado la ruta queda cerrada.
+    """
+    token = (request.headers.get(ADMIN_TOKEN_HEADER) or "").strip()
+    expected = settings.admin_api_token
+    if not expected or not hmac.compare_digest(token.encode("utf-8"), expected.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Requiere token de plataforma")
+
+
+def reset() -> None:
+    invalidate()
@@ -0,0 +1,218 @@
+"""
+Disponibilidad automática de productos (lista 86) según inventario.
+
+Un producto con receta queda agotado cuando algún insumo tiene
+current_stock < quantity_required (no alcanza para una porción). Productos
+sin receta siempre están disponibles.
+
+Por restaurante se mantiene en memoria un bitmap de agotados indexado por
+product_id, así /v2/api/products, los catálogos de WhatsApp y la creación de
+órdenes consultan en O(1):
+
+- inventory_depletion llama a mark_stock_changed() al mover stock; al hacer
+  commit esos insumos quedan pendientes.
+- get_unavailable() recalcula solo los productos cuyas recetas usan insumos
+  pendientes. Un rebuild completo ocurre la primera vez y cada
+  AVAILABILITY_MAX_AGE_SECONDS, lo que cubre cambios hechos por otros
+  procesos o fuera de la app.
+"""
+import threading
+import time
+from typing import Dict, Iterable, Optional, Set
+
+from sqlalchemy import and_, case, func
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models.inventory_models import InventoryItem, Recipe
+
+AVAILABILITY_MAX_AGE_SECONDS = 30.0
+
+_SESSION_KEY = "availability_changed_items"
+
+_lock = threading.Lock()
+_tenants: Dict[int, "_TenantAvailability"] = {}
+_pending_items: Set[int] = set()
+
+
+class AvailabilityBitmap:
+    """
+    Bits encendidos = producto agotado. El bytearray arranca en el menor
+    product_id visto para no reservar espacio por ids de otros restaurantes.
+    """
+
+    __slots__ = ("base", "bits")
+
+    def __init__(self, product_ids: Iterable[int] = ()):
+        ids = sorted(set(int(x) for x in product_ids))
+        self.base = ids[0] if ids else 0
+        self.bits = bytearray(((ids[-1] - self.base) // 8 + 1) if ids else 0)
+        for pid in ids:
+            self.set(pid, True)
+
+    def _grow(self, pid: int) -> None:
+        if pid < self.base:
+            shift = (self.base - pid + 7) // 8
+            self.bits = bytearray(shift) + self.bits
+            self.base -= shift * 8
+        needed = (pid - self.base) // 8 + 1
+        if needed > len(self.bits):
+            self.bits.extend(bytearray(needed - len(self.bits)))
+
+    def set(self, pid: int, unavailable: bool) -> None:
+        if unavailable:
+            self._grow(pid)
+        idx = pid - self.base
+        if idx < 0 or idx // 8 >= len(self.bits):
+            return
+        if unavailable:
+            self.bits[idx >> 3] |= 1 << (idx & 7)
+        else:
+            self.bits[idx >> 3] &= ~(1 << (idx & 7)) & 0xFF
+
+    def is_unavailable(self, pid: int) -> bool:
+        idx = int(pid) - self.base
+        if idx < 0 or idx >> 3 >= len(self.bits):
+            return False
+        return bool(self.bits[idx >> 3] & (1 << (idx & 7)))
+
+    def is_available(self, pid: int) -> bool:
+        return not self.is_unavailable(pid)
+
+    def ids(self) -> list:
+        out = []
+        for byte_idx, byte in enumerate(self.bits):
+            if not byte:
+                continue
+            for bit in range(8):
+                if byte & (1 << bit):
+                    out.append(self.base + byte_idx * 8 + bit)
+        return out
+
+
+class _TenantAvailability:
+    __slots__ = ("bitmap", "built_at", "dirty_items")
+
+    def __init__(self, bitmap: AvailabilityBitmap):
+        self.bitmap = bitmap
+        self.built_at = time.monotonic()
+        self.dirty_items: Set[int] = set()
+
+
+# =========================
+# MARCAS DESDE EL KARDEX
+# =========================
+
+def mark_stock_changed(db: Session, item_ids: Iterable[int]) -> None:
+    db.info.setdefault(_SESSION_KEY, set()).update(int(x) for x in item_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.in_nested_transaction():
+        # liberar un SAVEPOINT no confirma nada todavía
+        return
+    changed = session.info.pop(_SESSION_KEY, None)
+    if changed:
+        with _lock:
+            _pending_items.update(changed)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _after_transaction_end(session, transaction):
+    # un SAVEPOINT revertido no descarta las marcas del resto de la transacción
+    if transaction.parent is None:
+        session.info.pop(_SESSION_KEY, None)
+
+
+# =========================
+# CÁLCULO
+# =========================
+
+def _short_expr():
+    return case(
+        (func.coalesce(InventoryItem.current_stock, 0) < Recipe.quantity_required, 1),
+        else_=0,
+    )
+
+
+def _compute_unavailable(db: Session, restaurant_id: int, product_ids: Optional[Iterable[int]] = None) -> Set[int]:
+    query = (
+        db.query(Recipe.product_id)
+        .join(
+            InventoryItem,
+            and_(
+                InventoryItem.id == Recipe.inventory_item_id,
+                InventoryItem.restaurant_id == restaurant_id,
+            ),
+        )
+        .filter(_short_expr() == 1)
+    )
+    if product_ids is not None:
+        query = query.filter(Recipe.product_id.in_(list(product_ids)))
+    return {row[0] for row in query.distinct().all()}
+
+
+def rebuild(db: Session, restaurant_id: int) -> AvailabilityBitmap:
+    bitmap = AvailabilityBitmap(_compute_unavailable(db, restaurant_id))
+    with _lock:
+        _tenants[restaurant_id] = _TenantAvailability(bitmap)
+    return bitmap
+
+
+def _drain_pending(db: Session) -> None:
+    with _lock:
+        if not _pending_items:
+            return
+        items = set(_pending_items)
+        _pending_items.clear()
+
+    owners = db.query(InventoryItem.id, InventoryItem.restaurant_id).filter(InventoryItem.id.in_(items)).all()
+    with _lock:
+        for item_id, restaurant_id in owners:
+            state = _tenants.get(restaurant_id)
+            if state is not None:
+                state.dirty_items.add(item_id)
+
+
+def _refresh_dirty(db: Session, restaurant_id: int, state: _TenantAvailability) -> None:
+    with _lock:
+        dirty = set(state.dirty_items)
+        state.dirty_items.clear()
+    if not dirty:
+        return
+
+    affected = {
+        row[0]
+        for row in db.query(Recipe.product_id).filter(Recipe.inventory_item_id.in_(dirty)).distinct().all()
+    }
+    if not affected:
+        return
+
+    unavailable = _compute_unavailable(db, restaurant_id, affected)
+    with _lock:
+        for pid in affected:
+            state.bitmap.set(pid, pid in unavailable)
+
+
+def get_unavailable(db: Session, restaurant_id: int) -> AvailabilityBitmap:
+    with _lock:
+        state = _tenants.get(restaurant_id)
+
+    if state is None or time.monotonic() - state.built_at > AVAILABILITY_MAX_AGE_SECONDS:
+        return rebuild(db, restaurant_id)
+
+    _drain_pending(db)
+    if state.dirty_items:
+        _refresh_dirty(db, restaurant_id, state)
+    return state.bitmap
+
+
+def is_product_available(db: Session, restaurant_id: int, product_id: int) -> bool:
+    return get_unavailable(db, restaurant_id).is_available(product_id)
+
+
+def reset() -> None:
+    with _lock:
+        _tenants.clear()
+        _pending_items.clear()
@@ -0,0 +1,298 @@
+"""
+Categorías de producto como tabla (product_categories) con llave foránea
+desde products.category_id.
+
+- La identidad de una categoría es su normalized_key (minúsculas, espacios
+  colapsados) por restaurante; "Bebidas " y "bebidas" son la misma.
+- products.category se mantiene como copia del nombre para las pantallas y
+  el WhatsApp que ya lo leen; renombrar y fusionar la actualizan en el mismo
+  UPDATE que mueve category_id.
+- Renombrar y fusionar son UPDATE por category_id, sin traer productos a
+  Python.
+- migrate_free_text_categories() recorre por lotes (keyset por id) los
+  productos sin category_id, crea las categorías que falten y los enlaza con
+  un UPDATE por categoría y lote. Corre en el arranque; con todo migrado es
+  una sola consulta vacía.
+
+Uso por consola:
+    python product_categories.py [--restaurant deaca] [--batch-size 1000]
+"""
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from catalog_versions import record_changes
+from models.inventory_models import Product, ProductCategory
+
+DEFAULT_CATEGORY_NAME = "General"
+MIGRATION_BATCH_SIZE = 1000
+
+
+def category_name(value: Optional[str]) -> str:
+    name = " ".join((value or "").split())
+    return name if name else DEFAULT_CATEGORY_NAME
+
+
+def category_key(value: Optional[str]) -> str:
+    return category_name(value).lower()
+
+
+# =========================
+# ESQUEMA
+# =========================
+
+def ensure_schema(engine) -> None:
+    """
+    create_all crea product_categories pero no agrega columnas a una tabla
+    products que ya existía.
+    """
+    columns = {c["name"] for c in inspect(engine).get_columns("products")}
+    if "category_id" not in columns:
+        with engine.begin() as conn:
+            conn.execute(text(
+                "ALTER TABLE products ADD COLUMN category_id INTEGER REFERENCES product_categories(id)"
+            ))
+    for index in Product.__table__.indexes:
+        if "category_id" in index.columns:
+            index.create(bind=engine, checkfirst=True)
+
+
+# =========================
+# LECTURA / ALTA
+# =========================
+
+def find_category(db: Session, restaurant_id: int, name: Optional[str]) -> Optional[ProductCategory]:
+    return (
+        db.query(ProductCategory)
+        .filter(
+            ProductCategory.restaurant_id == restaurant_id,
+            ProductCategory.normalized_key == category_key(name),
+        )
+        .first()
+    )
+
+
+def get_or_create_category(db: Session, restaurant_id: int, name: Optional[str]) -> ProductCategory:
+    category = find_category(db, restaurant_id, name)
+    if category is not None:
+        return category
+
+    next_order = (
+        db.query(func.coalesce(func.max(ProductCategory.sort_order), -1))
+        .filter(ProductCategory.restaurant_id == restaurant_id)
+        .scalar()
+    )
+    category = ProductCategory(
+        restaurant_id=restaurant_id,
+        name=category_name(name),
+        normalized_key=category_key(name),
+        sort_order=int(next_order) + 1,
+        whatsapp_visible=True,
+    )
+    try:
+        with db.begin_nested():
+            db.add(category)
+    except IntegrityError:
+        # otro request la creó entre el SELECT y el INSERT
+        return find_category(db, restaurant_id, name)
+
+    record_changes(db, restaurant_id, category_ids=[category.id])
+    return category
+
+
+def assign_category(db: Session, product: Product, name: Optional[str]) -> None:
+    category = get_or_create_category(db, product.restaurant_id, name)
+    product.category_id = category.id
+    product.category = category.name
+
+
+def list_categories(db: Session, restaurant_id: int) -> List[dict]:
+    counts = dict(
+        db.query(Product.category_id, func.count(Product.id))
+        .filter(Product.restaurant_id == restaurant_id, Product.category_id.isnot(None))
+        .group_by(Product.category_id)
+        .all()
+    )
+    rows = (
+        db.query(ProductCategory)
+        .filter(ProductCategory.restaurant_id == restaurant_id)
+        .order_by(ProductCategory.sort_order.asc(), ProductCategory.normalized_key.asc())
+        .all()
+    )
+    return [
+        {
+            "id": c.id,
+            "name": c.name,
+            "sort_order": int(c.sort_order or 0),
+            "whatsapp_visible": bool(c.whatsapp_visible),
+            "products": int(counts.get(c.id, 0)),
+        }
+        for c in rows
+    ]
+
+
+def hidden_whatsapp_category_ids(db: Session, restaurant_id: int) -> set:
+    return {
+        cid
+        for (cid,) in db.query(ProductCategory.id).filter(
+            ProductCategory.restaurant_id == restaurant_id,
+            ProductCategory.whatsapp_visible == False,  # noqa: E712
+        )
+    }
+
+
+# =========================
+# RENOMBRAR / FUSIONAR
+# =========================
+
+def merge_categories(db: Session, restaurant_id: int, source: ProductCategory, target: ProductCategory) -> int:
+    """
+    Mueve los productos de source a target y borra source. El commit queda
+    del lado del que llama.
+    """
+    if source.id == target.id:
+        return 0
+    match = (Product.restaurant_id == restaurant_id, Product.category_id == source.id)
+    moved_ids = [pid for (pid,) in db.query(Product.id).filter(*match)]
+    moved = (
+        db.query(Product)
+        .filter(*match)
+        .update({Product.category_id: target.id, Product.category: target.name}, synchronize_session=False)
+    )
+    db.query(ProductCategory).filter(ProductCategory.id == source.id).delete(synchronize_session=False)
+    record_changes(db, restaurant_id, product_ids=moved_ids, category_ids=[source.id])
+    db.expire_all()
+    return moved
+
+
+def rename_category(db: Session, restaurant_id: int, old_name: str, new_name: str) -> Tuple[int, bool]:
+    """
+    Devuelve (productos actualizados, fusionada). Si ya existe otra
+    categoría con el nombre nuevo, se fusiona con ella.
+    """
+    source = find_category(db, restaurant_id, old_name)
+    if source is None:
+        return 0, False
+
+    target = find_category(db, restaurant_id, new_name)
+    if target is not None and target.id != source.id:
+        return merge_categories(db, restaurant_id, source, target), True
+
+    name = category_name(new_name)
+    db.query(ProductCategory).filter(ProductCategory.id == source.id).update(
+        {ProductCategory.name: name, ProductCategory.normalized_key: category_key(name)},
+        synchronize_session=False,
+    )
+    updated = (
+        db.query(Product)
+        .filter(Product.restaurant_id == restaurant_id, Product.category_id == source.id)
+        .update({Product.category: name}, synchronize_session=False)
+    )
+    record_changes(db, restaurant_id, category_ids=[source.id])
+    db.expire_all()
+    return updated, False
+
+
+def delete_category(db: Session, restaurant_id: int, name: str, replacement: str) -> int:
+    source = find_category(db, restaurant_id, name)
+    if source is None:
+        return 0
+    target = get_or_create_category(db, restaurant_id, replacement)
+    return merge_categories(db, restaurant_id, source, target)
+
+
+# =========================
+# MIGRACIÓN DESDE TEXTO LIBRE
+# =========================
+
+def migrate_free_text_categories(
+    db: Session,
+    restaurant_id: Optional[int] = None,
+    batch_size: int = MIGRATION_BATCH_SIZE,
+) -> Dict[str, int]:
+    known: Dict[Tuple[int, str], Tuple[int, str]] = {}
+    loaded = set()
+    linked = 0
+    created = 0
+    last_id = 0
+
+    while True:
+        query = db.query(Product.id, Product.restaurant_id, Product.category).filter(
+            Product.category_id.is_(None),
+            Product.restaurant_id.isnot(None),
+            Product.id > last_id,
+        )
+        if restaurant_id is not None:
+            query = query.filter(Product.restaurant_id == restaurant_id)
+        rows = query.order_by(Product.id.asc()).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        for rid in {r.restaurant_id for r in rows} - loaded:
+            for cid, key, name in db.query(
+                ProductCategory.id, ProductCategory.normalized_key, ProductCategory.name
+            ).filter(ProductCategory.restaurant_id == rid):
+                known[(rid, key)] = (cid, name)
+            loaded.add(rid)
+
+        groups: Dict[int, List[int]] = {}
+        names: Dict[int, str] = {}
+        by_restaurant: Dict[int, List[int]] = {}
+        for product_id, rid, raw in rows:
+            by_restaurant.setdefault(rid, []).append(product_id)
+            key = (rid, category_key(raw))
+            if key not in known:
+                category = get_or_create_category(db, rid, raw)
+                known[key] = (category.id, category.name)
+                created += 1
+            category_id, name = known[key]
+            groups.setdefault(category_id, []).append(product_id)
+            names[category_id] = name
+
+        for category_id, product_ids in groups.items():
+            linked += (
+                db.query(Product)
+                .filter(Product.id.in_(product_ids), Product.category_id.is_(None))
+                .update({Product.category_id: category_id, Product.category: names[category_id]}, synchronize_session=False)
+            )
+        for rid, product_ids in by_restaurant.items():
+            record_changes(db, rid, product_ids=product_ids)
+        db.commit()
+
+    return {"linked": linked, "created": created}
+
+
+def main(argv=None) -> int:
+    from db import Base, SessionLocal, engine
+    import models  # noqa: F401  registra todas las tablas
+    from models.core_models import Restaurant
+
+    parser = argparse.ArgumentParser(description="Enlaza products.category (texto) con product_categories.")
+    parser.add_argument("--restaurant", default="", help="slug; vacío = todos")
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    Base.metadata.create_all(bind=engine)
+    ensure_schema(engine)
+
+    db = SessionLocal()
+    try:
+        restaurant_id = None
+        if args.restaurant:
+            restaurant_id = db.query(Restaurant.id).filter(Restaurant.slug == args.restaurant).scalar()
+            if restaurant_id is None:
+                print(f"Restaurante no encontrado: {args.restaurant}")
+                return 1
+        print(migrate_free_text_categories(db, restaurant_id, batch_size=args.batch_size))
+    finally:
+        db.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,336 @@
+"""
+Búsqueda de productos en memoria por restaurante.
+
+Cada restaurante tiene un índice con los productos activos:
+- nombre y categoría se normalizan (minúsculas, sin tildes, solo letras y
+  números) y se parten en tokens; "Gallo Pinto" -> ["gallo", "pinto"];
+- cada token de la consulta debe coincidir con algún token del producto,
+  exacto, por prefijo ("gal" -> "gallo") o, si tiene al menos
+  FUZZY_MIN_LENGTH letras, por trigramas (Jaccard >= FUZZY_MIN_SIMILARITY)
+  para tolerar errores de tipeo ("galo pinto");
+- el puntaje suma la mejor coincidencia de cada token (más si está en el
+  nombre que en la categoría) y se multiplica por la popularidad de los
+  últimos POPULARITY_WINDOW_DAYS en product_sales_metrics.
+
+Mantenimiento:
+- al hacer commit de cambios en products los ids quedan pendientes y el
+  próximo search() reindexa solo esos productos;
+- los UPDATE en bloque (renombrar categorías) llaman a invalidate();
+- un rebuild completo ocurre la primera vez y cada SEARCH_MAX_AGE_SECONDS,
+  lo que cubre cambios de otros procesos y refresca la popularidad.
+"""
+import math
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from models.analytics_models import ProductSalesMetric
+from models.inventory_models import Product
+
+SEARCH_MAX_AGE_SECONDS = 300.0
+POPULARITY_WINDOW_DAYS = 90
+POPULARITY_WEIGHT = 0.5
+FUZZY_MIN_LENGTH = 4
+FUZZY_MIN_SIMILARITY = 0.4
+
+SCORE_EXACT = 3.0
+SCORE_PREFIX = 2.0
+SCORE_FUZZY = 1.0
+CATEGORY_FACTOR = 0.5
+
+_SESSION_KEY = "search_changed_products"
+
+_lock = threading.Lock()
+_tenants: Dict[int, "_TenantIndex"] = {}
+_pending: Set[int] = set()
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(value: Optional[str]) -> str:
+    folded = unicodedata.normalize("NFKD", (value or "").lower())
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    return _NON_ALNUM.sub(" ", folded).strip()
+
+
+def tokenize(value: Optional[str]) -> List[str]:
+    return normalize(value).split()
+
+
+def trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _Doc:
+    __slots__ = ("product_id", "name", "category", "category_id", "price", "name_tokens", "category_tokens")
+
+    def __init__(self, product_id: int, name: str, category: str, category_id: Optional[int], price: float):
+        self.product_id = product_id
+        self.name = name
+        self.category = category
+        self.category_id = category_id
+        self.price = price
+        self.name_tokens = set(tokenize(name))
+        self.category_tokens = set(tokenize(category)) - self.name_tokens
+
+
+class _TenantIndex:
+    """
+    postings: token -> ids de productos; vocab: tokens ordenados para los
+    prefijos con bisect; grams: trigrama -> tokens del vocabulario.
+    """
+
+    __slots__ = ("docs", "postings", "vocab", "grams", "popularity", "built_at")
+
+    def __init__(self, popularity: Dict[int, float]):
+        self.docs: Dict[int, _Doc] = {}
+        self.postings: Dict[str, Set[int]] = {}
+        self.vocab: List[str] = []
+        self.grams: Dict[str, Set[str]] = {}
+        self.popularity = popularity
+        self.built_at = time.monotonic()
+
+    def add(self, doc: _Doc) -> None:
+        self.remove(doc.product_id)
+        self.docs[doc.product_id] = doc
+        for token in doc.name_tokens | doc.category_tokens:
+            ids = self.postings.get(token)
+            if ids is None:
+                self.postings[token] = ids = set()
+                idx = bisect_left(self.vocab, token)
+                self.vocab.insert(idx, token)
+                for gram in trigrams(token):
+                    self.grams.setdefault(gram, set()).add(token)
+            ids.add(doc.product_id)
+
+    def remove(self, product_id: int) -> None:
+        doc = self.docs.pop(product_id, None)
+        if doc is None:
+            return
+        for token in doc.name_tokens | doc.category_tokens:
+            ids = self.postings.get(token)
+            if ids is None:
+                continue
+            ids.discard(product_id)
+            if not ids:
+                del self.postings[token]
+                idx = bisect_left(self.vocab, token)
+                if idx < len(self.vocab) and self.vocab[idx] == token:
+                    del self.vocab[idx]
+                for gram in trigrams(token):
+                    tokens = self.grams.get(gram)
+                    if tokens is not None:
+                        tokens.discard(token)
+                        if not tokens:
+                            del self.grams[gram]
+
+    def _expand(self, term: str) -> Dict[str, float]:
+        """Tokens del vocabulario que calzan con term y su puntaje."""
+        matches: Dict[str, float] = {}
+        if term in self.postings:
+            matches[term] = SCORE_EXACT
+
+        idx = bisect_left(self.vocab, term)
+        while idx < len(self.vocab) and self.vocab[idx].startswith(term):
+            matches.setdefault(self.vocab[idx], SCORE_PREFIX)
+            idx += 1
+
+        if len(term) >= FUZZY_MIN_LENGTH:
+            term_grams = trigrams(term)
+            shared: Dict[str, int] = {}
+            for gram in term_grams:
+                for token in self.grams.get(gram, ()):
+                    shared[token] = shared.get(token, 0) + 1
+            for token, common in shared.items():
+                if token in matches:
+                    continue
+                similarity = common / (len(term_grams) + len(trigrams(token)) - common)
+                if similarity >= FUZZY_MIN_SIMILARITY:
+                    matches[token] = SCORE_FUZZY * similarity
+        return matches
+
+    def search(self, query: str, limit: int, category_id: Optional[int] = None) -> List[tuple]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        scores: Optional[Dict[int, float]] = None
+        for term in terms:
+            term_scores: Dict[int, float] = {}
+            for token, token_score in self._expand(term).items():
+                for pid in self.postings.get(token, ()):
+                    doc = self.docs[pid]
+                    score = token_score if token in doc.name_tokens else token_score * CATEGORY_FACTOR
+                    if score > term_scores.get(pid, 0.0):
+                        term_scores[pid] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {pid: s + term_scores[pid] for pid, s in scores.items() if pid in term_scores}
+            if not scores:
+                return []
+
+        ranked = []
+        for pid, score in scores.items():
+            doc = self.docs[pid]
+            if category_id is not None and doc.category_id != category_id:
+                continue
+            ranked.append((score * (1.0 + POPULARITY_WEIGHT * self.popularity.get(pid, 0.0)), doc))
+        ranked.sort(key=lambda x: (-x[0], x[1].name.lower()))
+        return ranked[:limit]
+
+
+# =========================
+# MARCAS DESDE LA SESIÓN
+# =========================
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Product) and obj.id is not None:
+            session.info.setdefault(_SESSION_KEY, set()).add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.in_nested_transaction():
+        # liberar un SAVEPOINT no confirma nada todavía
+        return
+    changed = session.info.pop(_SESSION_KEY, None)
+    if changed:
+        with _lock:
+            _pending.update(changed)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_SESSION_KEY, None)
+
+
+def invalidate(restaurant_id: Optional[int] = None) -> None:
+    with _lock:
+        if restaurant_id is None:
+            _tenants.clear()
+            _pending.clear()
+        else:
+            _tenants.pop(restaurant_id, None)
+
+
+# =========================
+# CONSTRUCCIÓN
+# =========================
+
+def _doc_columns():
+    return (Product.id, Product.restaurant_id, Product.name, Product.category, Product.category_id, Product.price, Product.is_active)
+
+
+def _load_popularity(db: Session, restaurant_id: int) -> Dict[int, float]:
+    since = datetime.utcnow() - timedelta(days=POPULARITY_WINDOW_DAYS)
+    rows = (
+        db.query(ProductSalesMetric.product_id, func.sum(ProductSalesMetric.quantity_sold))
+        .filter(
+            ProductSalesMetric.restaurant_id == restaurant_id,
+            ProductSalesMetric.metric_date >= since,
+        )
+        .group_by(ProductSalesMetric.product_id)
+        .all()
+    )
+    sold = {pid: float(qty or 0) for pid, qty in rows if pid is not None}
+    top = max(sold.values(), default=0.0)
+    if top <= 0:
+        return {}
+    # escala logarítmica 0..1: un plato que vende 10x no debe tapar todo
+    return {pid: math.log1p(qty) / math.log1p(top) for pid, qty in sold.items() if qty > 0}
+
+
+def rebuild(db: Session, restaurant_id: int) -> _TenantIndex:
+    index = _TenantIndex(_load_popularity(db, restaurant_id))
+    rows = (
+        db.query(*_doc_columns())
+        .filter(
+            Product.restaurant_id == restaurant_id,
+            Product.is_active == True,  # noqa: E712
+        )
+        .yield_per(1000)
+    )
+    for pid, _, name, category, category_id, price, _ in rows:
+        index.add(_Doc(pid, name or "", category or "", category_id, float(price or 0)))
+    with _lock:
+        _tenants[restaurant_id] = index
+    return index
+
+
+def _drain_pending(db: Session) -> None:
+    with _lock:
+        if not _pending:
+            return
+        ids = set(_pending)
+        _pending.clear()
+
+    found = set()
+    for pid, restaurant_id, name, category, category_id, price, is_active in (
+        db.query(*_doc_columns()).filter(Product.id.in_(ids)).all()
+    ):
+        found.add(pid)
+        with _lock:
+            index = _tenants.get(restaurant_id)
+            if index is None:
+                continue
+            if is_active:
+                index.add(_Doc(pid, name or "", category or "", category_id, float(price or 0)))
+            else:
+                index.remove(pid)
+
+    deleted = ids - found
+    if deleted:
+        with _lock:
+            for index in _tenants.values():
+                for pid in deleted:
+                    index.remove(pid)
+
+
+def get_index(db: Session, restaurant_id: int) -> _TenantIndex:
+    with _lock:
+        index = _tenants.get(restaurant_id)
+
+    if index is None or time.monotonic() - index.built_at > SEARCH_MAX_AGE_SECONDS:
+        return rebuild(db, restaurant_id)
+
+    _drain_pending(db)
+    return index
+
+
+def search(
+    db: Session,
+    restaurant_id: int,
+    query: str,
+    limit: int = 20,
+    category_id: Optional[int] = None,
+) -> List[dict]:
+    index = get_index(db, restaurant_id)
+    with _lock:
+        ranked = index.search(query, limit, category_id=category_id)
+    return [
+        {
+            "id": doc.product_id,
+            "name": doc.name,
+            "category": doc.category or "General",
+            "category_id": doc.category_id,
+            "price": doc.price,
+            "score": round(score, 4),
+        }
+        for score, doc in ranked
+    ]
+
+
+def reset() -> None:
+    invalidate()
@@ -0,0 +1,259 @@
+"""
+Coalescencia de lecturas calientes (pantallas de cocina y floor).
+
+Cuatro KDS y una docena de tablets refrescan casi al mismo tiempo y piden
+exactamente lo mismo. ReadCoalescer.get(key, compute):
+- si hay un resultado de hace menos de COALESCE_TTL_SECONDS para key, lo
+  devuelve;
+- si otro request con la misma key ya está calculando, espera ese cálculo y
+  devuelve el mismo resultado (single-flight);
+- si no, calcula, guarda y despierta a los que esperaban. Un error no se
+  guarda: lo reciben los que esperaban y el próximo request recalcula.
+
+Los endpoints async usan aget(key, compute) con compute async: el mismo
+caché y el mismo single-flight pero esperando con asyncio, sin bloquear el
+event loop.
+
+La key incluye la versión de datos del restaurante. Al hacer commit de
+cambios en órdenes, líneas, pagos, mesas o zonas la versión sube, así una
+lectura después de una escritura en este proceso nunca recibe el resultado
+anterior. Escrituras de otros procesos se ven a más tardar en
+COALESCE_TTL_SECONDS.
+"""
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.util import identity_key
+
+from models.sales_models import Order, OrderItem, OrderPayment, RestaurantTable, RestaurantZone
+
+COALESCE_TTL_SECONDS = 1.0
+COALESCE_WAIT_SECONDS = 30.0
+COALESCE_MAX_ENTRIES = 2000
+
+_SESSION_KEY = "coalescing_changed_restaurants"
+_ALL = 0  # no se pudo saber el restaurante: invalida todos
+
+
+# =========================
+# VERSIÓN POR RESTAURANTE
+# =========================
+
+_versions_lock = threading.Lock()
+_versions: Dict[int, int] = {}
+_global_version = 0
+
+
+def data_version(restaurant_id: int) -> Tuple[int, int]:
+    with _versions_lock:
+        return _global_version, _versions.get(restaurant_id, 0)
+
+
+def invalidate(restaurant_id: Optional[int] = None) -> None:
+    global _global_version
+    with _versions_lock:
+        if restaurant_id is None or restaurant_id == _ALL:
+            _global_version += 1
+        else:
+            _versions[restaurant_id] = _versions.get(restaurant_id, 0) + 1
+
+
+def _restaurant_of(session, obj) -> int:
+    restaurant_id = getattr(obj, "restaurant_id", None)
+    if restaurant_id is not None:
+        return restaurant_id
+    order_id = getattr(obj, "order_id", None)
+    if order_id is not None:
+        # la orden casi siempre está en la sesión; si no, se invalida todo
+        order = session.identity_map.get(identity_key(Order, order_id))
+        if order is not None and order.restaurant_id is not None:
+            return order.restaurant_id
+    return _ALL
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    changed: Optional[Set[int]] = None
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Order, OrderItem, OrderPayment, RestaurantTable, RestaurantZone)):
+            if changed is None:
+                changed = session.info.setdefault(_SESSION_KEY, set())
+            changed.add(_restaurant_of(session, obj))
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.in_nested_transaction():
+        return
+    for restaurant_id in session.info.pop(_SESSION_KEY, ()):
+        invalidate(restaurant_id)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_SESSION_KEY, None)
+
+
+# =========================
+# SINGLE-FLIGHT + MICRO-CACHÉ
+# =========================
+
+class _Flight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class ReadCoalescer:
+    def __init__(self, ttl_seconds: float = COALESCE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, _Flight] = {}
+        # un future solo se puede esperar desde su loop: la key lleva el loop
+        self._ainflight: Dict[Tuple[asyncio.AbstractEventLoop, Hashable], asyncio.Future] = {}
+        self._cache: Dict[Hashable, Tuple[float, Any]] = {}
+        self.requests = 0
+        self.computed = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+
+    def _prune(self, now: float) -> None:
+        if len(self._cache) <= COALESCE_MAX_ENTRIES:
+            return
+        for key in [k for k, (expires, _) in self._cache.items() if expires <= now]:
+            del self._cache[key]
+        while len(self._cache) > COALESCE_MAX_ENTRIES:
+            del self._cache[next(iter(self._cache))]
+
+    def get(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] > now:
+                self.cache_hits += 1
+                return cached[1]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not flight.done.wait(COALESCE_WAIT_SECONDS):
+                # el líder se colgó: este request calcula por su cuenta
+                return compute()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                self.computed += 1
+                if flight.error is None:
+                    self._store(key, flight.value)
+            flight.done.set()
+        return flight.value
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        now = time.monotonic()
+        self._cache[key] = (now + self.ttl_seconds, value)
+        self._prune(now)
+
+    async def aget(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] > now:
+                self.cache_hits += 1
+                return cached[1]
+            future = self._ainflight.get((loop, key))
+            leader = future is None
+            if leader:
+                future = self._ainflight[(loop, key)] = loop.create_future()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), COALESCE_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                return await compute()
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # cancelaron al líder, no a este request
+                return await compute()
+
+        try:
+            value = await compute()
+        except BaseException as e:
+            with self._lock:
+                self._ainflight.pop((loop, key), None)
+                self.computed += 1
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # sin seguidores no queda "never retrieved"
+            raise
+        with self._lock:
+            self._ainflight.pop((loop, key), None)
+            self.computed += 1
+            self._store(key, value)
+        future.set_result(value)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            served = self.coalesced + self.cache_hits
+            return {
+                "requests": self.requests,
+                "computed": self.computed,
+                "coalesced": self.coalesced,
+                "cache_hits": self.cache_hits,
+                "coalescing_ratio": round(served / self.requests, 4) if self.requests else 0.0,
+                "in_flight": len(self._inflight) + len(self._ainflight),
+                "cached": len(self._cache),
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+
+read_coalescer = ReadCoalescer()
+
+
+def _key(route: str, restaurant_id: int, params: tuple) -> tuple:
+    return (route, restaurant_id, params, data_version(restaurant_id))
+
+
+def coalesced_read(route: str, restaurant_id: int, params: tuple, compute: Callable[[], Any]) -> Any:
+    return read_coalescer.get(_key(route, restaurant_id, params), compute)
+
+
+async def coalesced_read_async(
+    route: str,
+    restaurant_id: int,
+    params: tuple,
+    compute: Callable[[], Awaitable[Any]],
+) -> Any:
+    return await read_coalescer.aget(_key(route, restaurant_id, params), compute)
@@ -0,0 +1,134 @@
+"""
+Ruteo de lecturas a la réplica (DATABASE_REPLICA_URL).
+
+- Los endpoints de reportes y listados (analytics, historial de órdenes,
+  auditoría, exportaciones, resumen) usan get_read_db: sus consultas van a
+  la réplica y no compiten con los cobros en el primario. Si algo llega a
+  escribir, el flush va al primario (db.RoutingSession).
+- Read-your-writes: ReadYourWritesMiddleware marca con la cookie
+  PRIMARY_COOKIE a todo cliente que hizo un POST/PUT/PATCH/DELETE exitoso.
+  Mientras dure (READ_YOUR_WRITES_SECONDS) sus lecturas van al primario, así
+  no ve un listado sin la orden que acaba de crear aunque la réplica venga
+  atrasada. El header X-Read-Primary: 1 fuerza lo mismo para clientes sin
+  cookies.
+- Sin réplica configurada todo va al primario y el middleware no agrega
+  nada.
+
+Para probar en local con dos SQLite, copiar el primario a la réplica (usa
+la API de backup de SQLite, sirve con la app corriendo):
+    DATABASE_REPLICA_URL=sqlite:///./replica.db python read_replica.py --copy
+"""
+import argparse
+import math
+import sqlite3
+import time
+from typing import Optional
+
+from fastapi import Query, Request
+from sqlalchemy.engine import make_url
+
+from config import settings
+from db import READ_ONLY_KEY, READ_REPLICA_KEY, replica_engine
+from sharding import tenant_session
+
+PRIMARY_COOKIE = "db_primary_until"
+PRIMARY_HEADER = "x-read-primary"
+_SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def _cookie_value(request: Request) -> Optional[float]:
+    raw = request.cookies.get(PRIMARY_COOKIE)
+    try:
+        return float(raw) if raw else None
+    except ValueError:
+        return None
+
+
+def wants_primary(request: Request) -> bool:
+    if request.headers.get(PRIMARY_HEADER, "").strip() == "1":
+        return True
+    until = _cookie_value(request)
+    return until is not None and until > time.time()
+
+
+def get_read_db(request: Request, restaurant: Optional[str] = Query(None)):
+    db = tenant_session(restaurant)
+    db.info[READ_REPLICA_KEY] = replica_engine is not None and not wants_primary(request)
+    db.info[READ_ONLY_KEY] = True
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+class ReadYourWritesMiddleware:
+    """ASGI puro: solo toca las respuestas exitosas de métodos que escriben."""
+
+    def __init__(self, app, window_seconds: float = settings.read_your_writes_seconds):
+        self.app = app
+        self.window_seconds = window_seconds
+
+    async def __call__(self, scope, receive, send):
+        if (
+            replica_engine is None
+            or scope["type"] != "http"
+            or scope.get("method", "GET").upper() in _SAFE_METHODS
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message.get("status", 500) < 400:
+                until = time.time() + self.window_seconds
+                cookie = (
+                    f"{PRIMARY_COOKIE}={until:.3f}; Max-Age={math.ceil(self.window_seconds)}; "
+                    f"Path=/; SameSite=Lax; HttpOnly"
+                )
+                message = dict(message)
+                message["headers"] = list(message.get("headers") or []) + [
+                    (b"set-cookie", cookie.encode("latin-1")),
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+# =========================
+# COPIA LOCAL (DOS SQLITE)
+# =========================
+
+def copy_sqlite_primary() -> str:
+    primary = make_url(settings.database_url)
+    replica = make_url(settings.replica_database_url)
+    if primary.get_backend_name() != "sqlite" or replica.get_backend_name() != "sqlite":
+        raise SystemExit("--copy solo sirve con DATABASE_URL y DATABASE_REPLICA_URL en SQLite")
+    if not primary.database or not replica.database:
+        raise SystemExit("--copy necesita archivos, no bases en memoria")
+
+    source = sqlite3.connect(primary.database)
+    target = sqlite3.connect(replica.database)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    return replica.database
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Réplica de lectura.")
+    parser.add_argument("--copy", action="store_true", help="copia el SQLite primario a la réplica")
+    args = parser.parse_args(argv)
+
+    if not settings.has_replica:
+        print("DATABASE_REPLICA_URL no está configurada")
+        return 1
+    if args.copy:
+        print(f"Réplica actualizada: {copy_sqlite_primary()}")
+        return 0
+    parser.print_help()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,366 @@
+"""
+Actividad de sesiones de usuario (user_sessions) con escritura diferida.
+
+Cada request con header X-Session-Id toca la sesión en memoria; un hilo
+escribe los toques pendientes cada FLUSH_INTERVAL_SECONDS con un UPDATE en
+lote. La expiración por inactividad se evalúa contra la vista en memoria.
+
+Con varios workers cada proceso tiene su propia vista:
+- el UPDATE solo avanza last_activity_at (WHERE last_activity_at < nuevo),
+  así un worker atrasado nunca pisa un toque más reciente de otro;
+- antes de expirar una sesión se relee la fila, por si otro worker la tocó;
+- la expiración se escribe con la misma guarda: si la fila avanzó en el
+  medio, la sesión sigue viva.
+El error máximo es FLUSH_INTERVAL_SECONDS de actividad aún no escrita por
+otro worker. Bloqueos y cierres hechos en otro proceso se ven al releer la
+fila, a más tardar cada REFRESH_INTERVAL_SECONDS.
+"""
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+import anyio
+from sqlalchemy import and_, bindparam
+from starlette.responses import JSONResponse
+
+from config import settings
+from models.core_models import RestaurantSetting
+from models.security_models import RestaurantUser, UserSession
+
+FLUSH_INTERVAL_SECONDS = 5.0
+REFRESH_INTERVAL_SECONDS = 15.0
+SESSION_HEADER = b"x-session-id"
+EXEMPT_PREFIX = "/v2/api/sessions"
+
+REASON_IDLE = "idle"
+REASON_LOCKED = "locked"
+REASON_ENDED = "ended"
+REASON_UNKNOWN = "unknown"
+
+REJECT_DETAILS = {
+    REASON_ENDED: "Sesión terminada o expirada por inactividad",
+    REASON_LOCKED: "Sesión bloqueada",
+    REASON_UNKNOWN: "Sesión no válida",
+}
+
+
+def _utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def idle_timeout_for(db, restaurant_id: int, user: RestaurantUser) -> Optional[int]:
+    if user.allow_infinite_session:
+        return None
+    if user.session_timeout_seconds:
+        return int(user.session_timeout_seconds)
+
+    raw = (
+        db.query(RestaurantSetting.setting_value)
+        .filter(
+            RestaurantSetting.restaurant_id == restaurant_id,
+            RestaurantSetting.setting_key == "default_idle_timeout_seconds",
+        )
+        .scalar()
+    )
+    try:
+        return int(json.loads(raw)) if raw else settings.default_idle_timeout_seconds
+    except (TypeError, ValueError):
+        return settings.default_idle_timeout_seconds
+
+
+class _Tracked:
+    __slots__ = ("session_id", "restaurant_id", "timeout", "last_activity", "is_active", "is_locked", "loaded_at")
+
+    def __init__(self, session_id: int, restaurant_id: int, timeout: Optional[int]):
+        self.session_id = session_id
+        self.restaurant_id = restaurant_id
+        self.timeout = timeout
+        self.last_activity: Optional[datetime] = None
+        self.is_active = True
+        self.is_locked = False
+        self.loaded_at = 0.0
+
+    def idle_seconds(self, now: datetime) -> float:
+        return (now - self.last_activity).total_seconds() if self.last_activity else 0.0
+
+    def is_idle(self, now: datetime) -> bool:
+        return self.timeout is not None and self.idle_seconds(now) > self.timeout
+
+
+class SessionActivityTracker:
+    def __init__(self, session_factory, flush_interval: float = FLUSH_INTERVAL_SECONDS):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._entries: Dict[int, _Tracked] = {}
+        self._dirty: set = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+        self.rows_flushed = 0
+
+    # =========================
+    # CARGA DESDE LA BASE
+    # =========================
+
+    def _load(self, session_id: int) -> Optional[_Tracked]:
+        db = self.session_factory()
+        try:
+            row = (
+                db.query(UserSession, RestaurantUser)
+                .join(RestaurantUser, RestaurantUser.id == UserSession.user_id)
+                .filter(UserSession.id == session_id)
+                .first()
+            )
+            if not row:
+                with self._lock:
+                    self._entries.pop(session_id, None)
+                return None
+            sess, user = row
+
+            with self._lock:
+                entry = self._entries.get(session_id)
+            if entry is None:
+                entry = _Tracked(session_id, sess.restaurant_id, idle_timeout_for(db, sess.restaurant_id, user))
+        finally:
+            db.close()
+
+        db_activity = _utc_naive(sess.last_activity_at)
+        with self._lock:
+            # lo más reciente entre lo visto aquí y lo que escribieron otros
+            if entry.last_activity is None or (db_activity and db_activity > entry.last_activity):
+                entry.last_activity = db_activity
+            entry.is_active = bool(sess.is_active) and sess.ended_at is None
+            entry.is_locked = bool(sess.is_locked)
+            entry.loaded_at = time.monotonic()
+            self._entries[session_id] = entry
+        return entry
+
+    def needs_load(self, session_id: int) -> bool:
+        with self._lock:
+            entry = self._entries.get(session_id)
+        return entry is None or time.monotonic() - entry.loaded_at > REFRESH_INTERVAL_SECONDS
+
+    # =========================
+    # CHEQUEO + TOQUE
+    # =========================
+
+    def _verdict(self, entry: _Tracked, now: datetime, touch: bool) -> dict:
+        if not entry.is_active:
+            return {"ok": False, "reason": REASON_ENDED}
+        if entry.is_locked:
+            return {"ok": False, "reason": REASON_LOCKED}
+
+        if touch:
+            with self._lock:
+                entry.last_activity = now
+                self._dirty.add(entry.session_id)
+        return {"ok": True, "reason": "", "entry": entry}
+
+    def check_cached(self, session_id: int, now: Optional[datetime] = None, touch: bool = True) -> Optional[dict]:
+        """
+        El mismo chequeo que check() pero solo en memoria, para el event
+        loop. None si hace falta la base: la sesión no está cargada, toca
+        releerla, o está inactiva y hay que confirmar antes de expirarla.
+        """
+        now = now or datetime.utcnow()
+        if self.needs_load(session_id):
+            return None
+        with self._lock:
+            entry = self._entries.get(session_id)
+        if entry is None or (entry.is_idle(now) and entry.is_active and not entry.is_locked):
+            return None
+        return self._verdict(entry, now, touch)
+
+    def check(self, session_id: int, now: Optional[datetime] = None, touch: bool = True) -> dict:
+        now = now or datetime.utcnow()
+        result = self.check_cached(session_id, now, touch)
+        if result is not None:
+            return result
+
+        entry = None if self.needs_load(session_id) else self._entries.get(session_id)
+        if entry is None:
+            entry = self._load(session_id)
+        if entry is None:
+            return {"ok": False, "reason": REASON_UNKNOWN}
+
+        if entry.is_idle(now) and time.monotonic() - entry.loaded_at > 0.5:
+            # otro worker pudo haberla tocado
+            entry = self._load(session_id) or entry
+        if entry.is_idle(now) and entry.is_active and not entry.is_locked:
+            self._expire(entry, now)
+        return self._verdict(entry, now, touch)
+
+    def _expire(self, entry: _Tracked, now: datetime) -> None:
+        db = self.session_factory()
+        try:
+            table = UserSession.__table__
+            result = db.execute(
+                table.update()
+                .where(and_(
+                    table.c.id == entry.session_id,
+                    table.c.is_active == True,  # noqa: E712
+                    table.c.last_activity_at <= entry.last_activity,
+                ))
+                .values(is_active=False, is_locked=True, locked_reason=REASON_IDLE, ended_at=now)
+            )
+            db.commit()
+        finally:
+            db.close()
+
+        if result.rowcount:
+            with self._lock:
+                entry.is_active = False
+                entry.is_locked = True
+                self._dirty.discard(entry.session_id)
+        else:
+            self._load(entry.session_id)
+
+    def status(self, session_id: int, now: Optional[datetime] = None) -> dict:
+        now = now or datetime.utcnow()
+        result = self.check(session_id, now=now, touch=False)
+        entry = result.get("entry") or self._entries.get(session_id)
+        remaining = None
+        if entry is not None and entry.timeout is not None and result["ok"]:
+            remaining = max(0, int(entry.timeout - entry.idle_seconds(now)))
+        return {
+            "active": result["ok"],
+            "reason": result["reason"],
+            "idle_timeout_seconds": entry.timeout if entry else None,
+            "remaining_seconds": remaining,
+            "last_activity_at": entry.last_activity.isoformat() if entry and entry.last_activity else None,
+        }
+
+    def forget(self, session_id: int) -> None:
+        with self._lock:
+            self._entries.pop(session_id, None)
+            self._dirty.discard(session_id)
+
+    # =========================
+    # ESCRITURA EN LOTE
+    # =========================
+
+    def flush(self) -> int:
+        with self._lock:
+            ids = list(self._dirty)
+            self._dirty.clear()
+            rows = []
+            for session_id in ids:
+                entry = self._entries.get(session_id)
+                if entry is None or entry.last_activity is None:
+                    continue
+                rows.append({
+                    "sid": session_id,
+                    "ts": entry.last_activity,
+                    "exp": entry.last_activity + timedelta(seconds=entry.timeout) if entry.timeout else None,
+                })
+            # sesiones terminadas o inactivas hace rato no se guardan más
+            now = datetime.utcnow()
+            stale = [
+                sid for sid, e in self._entries.items()
+                if sid not in self._dirty
+                and (not e.is_active or (e.last_activity and (now - e.last_activity).total_seconds() > max(e.timeout or 0, 3600) * 2))
+            ]
+            for sid in stale:
+                self._entries.pop(sid, None)
+
+        if not rows:
+            return 0
+
+        table = UserSession.__table__
+        stmt = (
+            table.update()
+            .where(and_(
+                table.c.id == bindparam("sid"),
+                table.c.is_active == True,  # noqa: E712
+                table.c.last_activity_at < bindparam("ts"),
+            ))
+            .values(last_activity_at=bindparam("ts"), expires_at=bindparam("exp"))
+        )
+        db = self.session_factory()
+        try:
+            db.execute(stmt, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                self._dirty.update(r["sid"] for r in rows)
+            raise
+        finally:
+            db.close()
+
+        self.flushes += 1
+        self.rows_flushed += len(rows)
+        return len(rows)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print("SESSION ACTIVITY FLUSH ERROR:", e)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="session-activity", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+            self._thread = None
+        self.flush()
+
+
+class SessionActivityMiddleware:
+    """
+    ASGI puro: sin header X-Session-Id no agrega nada al request (la sesión
+    es obligatoria solo donde lo pide permissions, ver PERMISSIONS_ENFORCED).
+    Solo va al hilo de la base cuando la sesión no está en memoria, toca
+    releerla o hay que expirarla.
+    """
+
+    def __init__(self, app, tracker: SessionActivityTracker):
+        self.app = app
+        self.tracker = tracker
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path", "").startswith(EXEMPT_PREFIX):
+            await self.app(scope, receive, send)
+            return
+
+        raw = None
+        for key, value in scope.get("headers") or ():
+            if key == SESSION_HEADER:
+                raw = value
+                break
+        if raw is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            session_id = int(raw)
+        except ValueError:
+            await JSONResponse({"detail": "X-Session-Id inválido"}, status_code=401)(scope, receive, send)
+            return
+
+        # en el loop solo lo que está en memoria; releer o expirar va al hilo
+        result = self.tracker.check_cached(session_id)
+        if result is None:
+            result = await anyio.to_thread.run_sync(self.tracker.check, session_id)
+
+        if not result["ok"]:
+            detail = REJECT_DETAILS.get(result["reason"], REJECT_DETAILS[REASON_UNKNOWN])
+            await JSONResponse({"detail": detail, "reason": result["reason"]}, status_code=401)(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
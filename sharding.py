@@ -0,0 +1,517 @@
+"""
+Una base por grupo de restaurantes (shards).
+
+- DATABASE_SHARDS agrega bases con nombre además de la default
+  (DATABASE_URL). La default es también el directorio: tenant_shards dice
+  en qué shard vive cada restaurante; un restaurante sin fila vive en la
+  default. Sin DATABASE_SHARDS no se lee el directorio y todo va a la
+  default como siempre.
+- tenant_session(slug) devuelve una sesión contra el shard del
+  restaurante. get_db / get_read_db la usan con el query param restaurant,
+  así que los endpoints no cambian. El directorio se lee completo y se
+  guarda SHARD_MAP_TTL_SECONDS en memoria.
+- for_each_shard(fn) corre fn(session, shard) en todos los shards en
+  paralelo, para las consultas de administración que cruzan tenants.
+- move_tenant() copia las filas de un restaurante a otro shard por lotes
+  (keyset por id, sin cargar la tabla en memoria) y conserva los ids:
+  * marca el tenant "moving" y espera SHARD_MAP_TTL_SECONDS, para que
+    todos los procesos lo vean. Mientras tanto se sigue leyendo del
+    origen, pero cualquier escritura responde 503;
+  * copia en una sola transacción del destino. Cada tabla con
+    restaurant_id va por esa columna; las hijas sin ella (order_items,
+    cash_movements, ...) van por su FK al padre. Las tablas globales
+    (permissions, ...) deben coincidir fila por fila y se completan las
+    que falten;
+  * si un id ya existe en el destino aborta sin tocar nada. En Postgres
+    conviene que cada shard use un rango de secuencias distinto;
+  * apunta el directorio al destino y, con delete_source, borra el origen.
+
+El seguimiento de X-Session-Id (session_activity) sigue leyendo la base
+default.
+
+Uso por consola:
+    python sharding.py --list
+    python sharding.py --move deaca --to grande [--batch-size 1000] [--delete-source]
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import DateTime, create_engine, event, func, select, text
+from sqlalchemy.orm import Session, sessionmaker
+
+import db_metrics
+from config import settings
+from db import Base, RoutingSession, SessionLocal, engine, engine_options, install_sqlite_profile
+from models.core_models import Restaurant, TenantShard
+
+DEFAULT_SHARD = "default"
+SHARD_MAP_TTL_SECONDS = 5.0
+CROSS_SHARD_WORKERS = 8
+MOVE_BATCH_SIZE = 1000
+
+STATUS_ACTIVE = "active"
+STATUS_MOVING = "moving"
+
+# tablas que no son de ningún tenant y no se copian
+SHARD_LOCAL_TABLES = {TenantShard.__tablename__}
+
+FROZEN_KEY = "tenant_frozen"
+
+
+class MoveError(Exception):
+    pass
+
+
+# =========================
+# ENGINES
+# =========================
+
+_engines_lock = threading.Lock()
+_engines = {DEFAULT_SHARD: engine}
+_factories = {DEFAULT_SHARD: SessionLocal}
+
+
+def shard_urls() -> Dict[str, str]:
+    urls = {DEFAULT_SHARD: settings.database_url}
+    urls.update(settings.shard_urls)
+    return urls
+
+
+def shard_names() -> List[str]:
+    return list(shard_urls())
+
+
+def is_sharded() -> bool:
+    return bool(settings.shard_urls)
+
+
+def shard_engine(name: str):
+    with _engines_lock:
+        eng = _engines.get(name)
+        if eng is not None:
+            return eng
+        url = shard_urls().get(name)
+        if url is None:
+            raise KeyError(f"Shard desconocido: {name}")
+        eng = create_engine(url, **engine_options(url))
+        if url.startswith("sqlite"):
+            install_sqlite_profile(eng)
+        db_metrics.install(eng)
+        _engines[name] = eng
+        _factories[name] = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=eng)
+        return eng
+
+
+def shard_sessionmaker(name: str):
+    shard_engine(name)
+    return _factories[name]
+
+
+def session_shard(db: Session) -> str:
+    """Nombre del shard de una sesión abierta con tenant_session o shard_sessionmaker."""
+    with _engines_lock:
+        for name, eng in _engines.items():
+            if eng is db.bind:
+                return name
+    return DEFAULT_SHARD
+
+
+# =========================
+# DIRECTORIO
+# =========================
+
+_map_lock = threading.Lock()
+_by_slug: Dict[str, Tuple[str, str]] = {}
+_by_id: Dict[int, Tuple[str, str]] = {}
+_by_phone: Dict[str, Tuple[str, str]] = {}
+_loaded_at = 0.0
+
+
+def _load_directory() -> None:
+    global _loaded_at
+    db = SessionLocal()
+    try:
+        rows = db.query(TenantShard).all()
+        by_slug, by_id, by_phone = {}, {}, {}
+        for row in rows:
+            entry = (row.shard_name or DEFAULT_SHARD, row.status or STATUS_ACTIVE)
+            by_slug[row.restaurant_slug] = entry
+            by_id[row.restaurant_id] = entry
+            if row.whatsapp_phone_number_id:
+                by_phone[row.whatsapp_phone_number_id] = entry
+    finally:
+        db.close()
+    with _map_lock:
+        _by_slug.clear()
+        _by_slug.update(by_slug)
+        _by_id.clear()
+        _by_id.update(by_id)
+        _by_phone.clear()
+        _by_phone.update(by_phone)
+        _loaded_at = time.monotonic()
+
+
+def invalidate() -> None:
+    global _loaded_at
+    with _map_lock:
+        _loaded_at = 0.0
+
+
+def is_fresh() -> bool:
+    return not is_sharded() or time.monotonic() - _loaded_at < SHARD_MAP_TTL_SECONDS
+
+
+def locate(
+    slug: Optional[str] = None,
+    restaurant_id: Optional[int] = None,
+    phone_number_id: Optional[str] = None,
+) -> Tuple[str, str]:
+    """(shard, status) del restaurante; sin fila en el directorio, la default."""
+    if not is_sharded():
+        return DEFAULT_SHARD, STATUS_ACTIVE
+    if not is_fresh():
+        _load_directory()
+    with _map_lock:
+        if slug:
+            entry = _by_slug.get(str(slug).strip())
+        elif restaurant_id is not None:
+            entry = _by_id.get(restaurant_id)
+        elif phone_number_id:
+            entry = _by_phone.get(str(phone_number_id).strip())
+        else:
+            entry = None
+    if entry is None or entry[0] not in shard_urls():
+        return DEFAULT_SHARD, STATUS_ACTIVE
+    return entry
+
+
+def _open(shard: str, status: str) -> Session:
+    db = shard_sessionmaker(shard)()
+    if status == STATUS_MOVING:
+        db.info[FROZEN_KEY] = True
+    return db
+
+
+def tenant_session(slug: Optional[str] = None) -> Session:
+    return _open(*locate(slug=slug))
+
+
+def restaurant_session(restaurant_id: Optional[int] = None) -> Session:
+    return _open(*locate(restaurant_id=restaurant_id))
+
+
+def whatsapp_session(phone_number_id: Optional[str]) -> Session:
+    return _open(*locate(phone_number_id=phone_number_id))
+
+
+def _frozen_error() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="El restaurante se está moviendo de base de datos. Reintentá en unos minutos.",
+    )
+
+
+@event.listens_for(Session, "before_flush")
+def _before_flush(session, flush_context, instances):
+    if session.info.get(FROZEN_KEY) and (session.new or session.dirty or session.deleted):
+        raise _frozen_error()
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _do_orm_execute(orm_execute_state):
+    # los inserts masivos usan session.execute(insert(Model), rows) para pasar
+    # por acá: bulk_insert_mappings no dispara before_flush ni este evento
+    state = orm_execute_state
+    if state.session.info.get(FROZEN_KEY) and (state.is_insert or state.is_update or state.is_delete):
+        raise _frozen_error()
+
+
+# =========================
+# CONSULTAS ENTRE SHARDS
+# =========================
+
+def for_each_shard(fn: Callable[[Session, str], Any]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    fn(session, shard) en cada shard, en paralelo. Devuelve (resultados,
+    errores) por nombre de shard: un shard caído no tumba la consulta.
+    """
+    names = shard_names()
+
+    def run(name: str):
+        db = shard_sessionmaker(name)()
+        try:
+            return fn(db, name)
+        finally:
+            db.close()
+
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=min(CROSS_SHARD_WORKERS, len(names))) as pool:
+        futures = {name: pool.submit(run, name) for name in names}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                errors[name] = str(e)
+    return results, errors
+
+
+def owns(shard: str, restaurant_id: int) -> bool:
+    """Después de mover sin borrar, el origen todavía tiene una copia vieja."""
+    return locate(restaurant_id=restaurant_id)[0] == shard
+
+
+def ensure_shard_schemas(ensure_schema: Optional[Callable] = None) -> None:
+    for name in shard_names():
+        if name == DEFAULT_SHARD:
+            continue
+        eng = shard_engine(name)
+        Base.metadata.create_all(bind=eng)
+        if ensure_schema is not None:
+            ensure_schema(eng)
+
+
+# =========================
+# MOVER UN TENANT
+# =========================
+
+def _scope(table, restaurant_id: int, seen: Optional[set] = None):
+    """Filtro de las filas del tenant en table, o None si es global."""
+    if table.name == Restaurant.__tablename__:
+        return table.c.id == restaurant_id
+    if "restaurant_id" in table.c:
+        return table.c.restaurant_id == restaurant_id
+    seen = (seen or set()) | {table.name}
+    for fk in table.foreign_keys:
+        parent = fk.column.table
+        if parent.name in seen:
+            continue
+        parent_scope = _scope(parent, restaurant_id, seen)
+        if parent_scope is not None:
+            return fk.parent.in_(select(fk.column).where(parent_scope))
+    return None
+
+
+def _pk(table):
+    columns = list(table.primary_key.columns)
+    if len(columns) == 1:
+        return columns[0]
+    # el archivo particionado lleva la fecha en la llave; el id sigue siendo único
+    if "id" in table.primary_key.columns:
+        return table.c.id
+    raise MoveError(f"{table.name}: se necesita una llave primaria simple")
+
+
+def _copy_table(src, dst, table, scope, batch_size: int, target: str) -> int:
+    pk = _pk(table)
+    copied = 0
+    last = None
+    while True:
+        query = select(table).where(scope)
+        if last is not None:
+            query = query.where(pk > last)
+        rows = [dict(r._mapping) for r in src.execute(query.order_by(pk).limit(batch_size))]
+        if not rows:
+            return copied
+        ids = [r[pk.name] for r in rows]
+        taken = dst.execute(select(pk).where(pk.in_(ids)).limit(5)).scalars().all()
+        if taken:
+            raise MoveError(f"{table.name}: ids {taken} ya existen en el shard {target}")
+        dst.execute(table.insert(), rows)
+        copied += len(rows)
+        last = ids[-1]
+
+
+def _sync_global(src, dst, table, batch_size: int) -> int:
+    pk = _pk(table)
+    # las fechas cambian de zona/precisión entre motores: no cuentan
+    compare = [c.name for c in table.columns if not isinstance(c.type, DateTime)]
+    added = 0
+    last = None
+    while True:
+        query = select(table)
+        if last is not None:
+            query = query.where(pk > last)
+        rows = [dict(r._mapping) for r in src.execute(query.order_by(pk).limit(batch_size))]
+        if not rows:
+            return added
+        existing = {
+            r[pk.name]: dict(r._mapping)
+            for r in dst.execute(select(table).where(pk.in_([r[pk.name] for r in rows])))
+        }
+        missing = []
+        for row in rows:
+            other = existing.get(row[pk.name])
+            if other is None:
+                missing.append(row)
+            elif any(other[c] != row[c] for c in compare):
+                raise MoveError(f"{table.name}: la fila {row[pk.name]} es distinta en el destino")
+        if missing:
+            dst.execute(table.insert(), missing)
+            added += len(missing)
+        last = rows[-1][pk.name]
+
+
+def _advance_sequences(dst, tables) -> None:
+    if dst.dialect.name != "postgresql":
+        # SQLite sigue desde max(id) + 1 solo
+        return
+    for table in tables:
+        pk = _pk(table)
+        seq = dst.execute(text("SELECT pg_get_serial_sequence(:t, :c)"), {"t": table.name, "c": pk.name}).scalar()
+        if not seq:
+            continue
+        top = dst.execute(select(func.max(pk))).scalar()
+        if top:
+            dst.execute(text("SELECT setval(:s, GREATEST(:v, (SELECT last_value FROM " + seq + ")))"), {"s": seq, "v": top})
+
+
+def _delete_tenant(eng, restaurant_id: int, batch_size: int) -> Dict[str, int]:
+    deleted = {}
+    for table in reversed(Base.metadata.sorted_tables):
+        if table.name in SHARD_LOCAL_TABLES:
+            continue
+        scope = _scope(table, restaurant_id)
+        if scope is None:
+            continue
+        pk = _pk(table)
+        total = 0
+        while True:
+            with eng.begin() as conn:
+                ids = conn.execute(select(pk).where(scope).limit(batch_size)).scalars().all()
+                if not ids:
+                    break
+                total += conn.execute(table.delete().where(pk.in_(ids))).rowcount
+        if total:
+            deleted[table.name] = total
+    return deleted
+
+
+def _set_directory(restaurant: dict, shard: str, status: str) -> None:
+    db = SessionLocal()
+    try:
+        row = db.query(TenantShard).filter(TenantShard.restaurant_id == restaurant["id"]).first()
+        if row is None:
+            row = TenantShard(restaurant_id=restaurant["id"])
+            db.add(row)
+        row.restaurant_slug = restaurant["slug"]
+        row.whatsapp_phone_number_id = restaurant["whatsapp_phone_number_id"]
+        row.shard_name = shard
+        row.status = status
+        db.commit()
+    finally:
+        db.close()
+    invalidate()
+
+
+def move_tenant(
+    slug: str,
+    target: str,
+    batch_size: int = MOVE_BATCH_SIZE,
+    delete_source: bool = False,
+    freeze_wait: float = SHARD_MAP_TTL_SECONDS,
+    log: Callable[[str], None] = print,
+) -> dict:
+    if target not in shard_urls():
+        raise MoveError(f"Shard desconocido: {target}")
+    invalidate()
+    source, status = locate(slug=slug)
+    if status == STATUS_MOVING:
+        raise MoveError(f"{slug} ya se está moviendo")
+    if source == target:
+        raise MoveError(f"{slug} ya está en el shard {target}")
+
+    src_engine, dst_engine = shard_engine(source), shard_engine(target)
+    with src_engine.connect() as src:
+        row = src.execute(
+            select(Restaurant.id, Restaurant.slug, Restaurant.whatsapp_phone_number_id)
+            .where(Restaurant.slug == slug)
+        ).first()
+    if row is None:
+        raise MoveError(f"Restaurante no encontrado en el shard {source}: {slug}")
+    restaurant = dict(row._mapping)
+
+    Base.metadata.create_all(bind=dst_engine)
+
+    _set_directory(restaurant, source, STATUS_MOVING)
+    log(f"{slug}: escrituras congeladas en {source}, esperando {freeze_wait:.0f}s")
+    time.sleep(freeze_wait)
+
+    copied: Dict[str, int] = {}
+    try:
+        with src_engine.connect() as src, dst_engine.begin() as dst:
+            tenant_tables = []
+            for table in Base.metadata.sorted_tables:
+                if table.name in SHARD_LOCAL_TABLES:
+                    continue
+                scope = _scope(table, restaurant["id"])
+                if scope is None:
+                    added = _sync_global(src, dst, table, batch_size)
+                    if added:
+                        log(f"  {table.name}: {added} filas globales agregadas")
+                    continue
+                n = _copy_table(src, dst, table, scope, batch_size, target)
+                tenant_tables.append(table)
+                if n:
+                    copied[table.name] = n
+                    log(f"  {table.name}: {n}")
+            _advance_sequences(dst, tenant_tables)
+    except Exception:
+        _set_directory(restaurant, source, STATUS_ACTIVE)
+        raise
+
+    _set_directory(restaurant, target, STATUS_ACTIVE)
+    log(f"{slug}: ahora en {target}")
+
+    deleted = _delete_tenant(src_engine, restaurant["id"], batch_size) if delete_source else {}
+    return {"restaurant": slug, "from": source, "to": target, "copied": copied, "deleted": deleted}
+
+
+def directory() -> List[dict]:
+    db = SessionLocal()
+    try:
+        return [
+            {
+                "restaurant_id": r.restaurant_id,
+                "restaurant": r.restaurant_slug,
+                "shard": r.shard_name,
+                "status": r.status,
+            }
+            for r in db.query(TenantShard).order_by(TenantShard.restaurant_id.asc()).all()
+        ]
+    finally:
+        db.close()
+
+
+def main(argv=None) -> int:
+    import models  # noqa: F401  registra todas las tablas
+
+    parser = argparse.ArgumentParser(description="Shards por restaurante.")
+    parser.add_argument("--list", action="store_true", help="muestra el directorio y los shards")
+    parser.add_argument("--move", default="", help="slug del restaurante a mover")
+    parser.add_argument("--to", default="", help="shard destino")
+    parser.add_argument("--batch-size", type=int, default=MOVE_BATCH_SIZE)
+    parser.add_argument("--delete-source", action="store_true")
+    args = parser.parse_args(argv)
+
+    Base.metadata.create_all(bind=engine)
+
+    if args.move:
+        if not args.to:
+            parser.error("--move necesita --to")
+        try:
+            print(move_tenant(args.move, args.to, batch_size=args.batch_size, delete_source=args.delete_source))
+        except MoveError as e:
+            print(f"No se movió: {e}")
+            return 1
+        return 0
+
+    print({"shards": shard_names(), "directory": directory()})
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
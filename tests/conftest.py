@@ -0,0 +1,36 @@
+"""
+La app se importa una sola vez contra una SQLite temporal: config.settings
+lee DATABASE_URL al importar.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+_TMP = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{_TMP.name}/test.db"
+os.environ["WHATSAPP_TOKEN"] = ""
+os.environ["PHONE_NUMBER_ID"] = ""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.asgi_client import AsgiClient  # noqa: E402
+import main_v2  # noqa: E402
+
+RESTAURANT = {"restaurant": "deaca"}
+
+
+@pytest.fixture(scope="session")
+def client():
+    c = AsgiClient(main_v2.app)
+    c.startup()
+    yield c
+    c.shutdown()
+    _TMP.cleanup()
+
+
+@pytest.fixture(scope="session")
+def product_id(client):
+    status, data = client.get("/v2/api/products", params=RESTAURANT)
+    assert status == 200
+    return data["items"][0]["id"]
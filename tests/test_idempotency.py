@@ -0,0 +1,55 @@
+import uuid
+
+from sqlalchemy import text
+
+import main_v2
+from db import engine
+from tests.conftest import RESTAURANT
+
+
+def _stored_keys(key):
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT response_json FROM idempotency_keys WHERE idempotency_key = :k"), {"k": key}
+        ).all()
+
+
+def _order_body(product_id):
+    return {
+        "channel": "pickup",
+        "customer_name": "Test",
+        "customer_phone": "50588888888",
+        "items": [{"product_id": product_id, "quantity": 1}],
+    }
+
+
+def test_retry_after_4xx_runs_again(client):
+    key = str(uuid.uuid4())
+    body = {"method": "cash", "amount": 1}
+    for _ in range(2):
+        status, _ = client.post("/v2/api/orders/999999/pay", params=RESTAURANT, json_body=body, headers={"Idempotency-Key": key})
+        assert status == 404
+    assert _stored_keys(key) == []
+
+
+def test_retry_after_5xx_runs_again(client, product_id, monkeypatch):
+    key = str(uuid.uuid4())
+    headers = {"Idempotency-Key": key}
+
+    def boom(*args, **kwargs):
+        raise RuntimeError("falla a mitad del request")
+
+    with monkeypatch.context() as m:
+        m.setattr(main_v2, "create_order_from_input", boom)
+        try:
+            status, _ = client.post("/v2/api/orders/create", params=RESTAURANT, json_body=_order_body(product_id), headers=headers)
+        except RuntimeError:
+            status = 500
+        assert status == 500
+    assert _stored_keys(key) == []
+
+    status, data = client.post("/v2/api/orders/create", params=RESTAURANT, json_body=_order_body(product_id), headers=headers)
+    assert status == 200 and data["ok"]
+    status, again = client.post("/v2/api/orders/create", params=RESTAURANT, json_body=_order_body(product_id), headers=headers)
+    assert status == 200 and again["order"]["id"] == data["order"]["id"]
+    assert len(_stored_keys(key)) == 1
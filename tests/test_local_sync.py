@@ -0,0 +1,82 @@
+import uuid
+
+from sqlalchemy import func
+
+import main_v2
+from db import SessionLocal
+from models import Order, OrderItem, PosSyncOperation
+from tests.conftest import RESTAURANT
+
+
+def _batch(device_id, product_id, bad_product_id=None):
+    return {
+        "device_id": device_id,
+        "operations": [
+            {"client_op_id": "op-1", "type": "open_ticket", "payload": {"service_mode": "quick"}},
+            {"client_op_id": "op-2", "type": "add_items", "client_ticket_id": "op-1",
+             "payload": {"items": [{"product_id": product_id, "quantity": 1}]}},
+            {"client_op_id": "op-3", "type": "add_items", "client_ticket_id": "op-1",
+             "payload": {"items": [{"product_id": bad_product_id or product_id, "quantity": 1}]}},
+            {"client_op_id": "op-4", "type": "send_to_kitchen", "client_ticket_id": "op-1", "payload": {}},
+        ],
+    }
+
+
+def _recorded(device_id):
+    db = SessionLocal()
+    try:
+        return sorted(
+            row.client_op_id
+            for row in db.query(PosSyncOperation).filter(PosSyncOperation.device_id == device_id)
+        )
+    finally:
+        db.close()
+
+
+def _counts():
+    db = SessionLocal()
+    try:
+        return db.query(func.count(Order.id)).scalar(), db.query(func.count(OrderItem.id)).scalar()
+    finally:
+        db.close()
+
+
+def test_conflict_reverts_only_that_operation(client, product_id):
+    device_id = f"dev-{uuid.uuid4()}"
+    status, data = client.post("/v2/api/local/sync", params=RESTAURANT, json_body=_batch(device_id, product_id, bad_product_id=999999))
+    assert status == 200
+    statuses = [r["status"] for r in data["results"]]
+    assert statuses == ["applied", "applied", "conflict", "applied"]
+
+    assert _recorded(device_id) == ["op-1", "op-2", "op-4"]
+    order_id = data["ticket_ids"]["op-1"]
+    db = SessionLocal()
+    try:
+        assert db.query(OrderItem).filter(OrderItem.order_id == order_id).count() == 1
+    finally:
+        db.close()
+
+
+def test_unexpected_failure_rolls_back_the_whole_batch(client, product_id, monkeypatch):
+    device_id = f"dev-{uuid.uuid4()}"
+    before = _counts()
+
+    def boom(*args, **kwargs):
+        raise RuntimeError("falla a mitad del envío")
+
+    with monkeypatch.context() as m:
+        m.setattr(main_v2, "send_new_items_to_kitchen", boom)
+        try:
+            status, _ = client.post("/v2/api/local/sync", params=RESTAURANT, json_body=_batch(device_id, product_id))
+        except RuntimeError:
+            status = 500
+        assert status == 500
+
+    assert _recorded(device_id) == []
+    assert _counts() == before
+
+    # el POS reenvía el mismo lote y se aplica completo, sin duplicados
+    status, data = client.post("/v2/api/local/sync", params=RESTAURANT, json_body=_batch(device_id, product_id))
+    assert status == 200
+    assert [r["status"] for r in data["results"]] == ["applied"] * 4
+    assert _recorded(device_id) == ["op-1", "op-2", "op-3", "op-4"]
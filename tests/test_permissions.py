@@ -0,0 +1,58 @@
+import uuid
+
+from db import SessionLocal
+from models import Restaurant, RestaurantUser
+from tests.conftest import RESTAURANT
+
+
+def _user(slug, role_code, pin):
+    db = SessionLocal()
+    try:
+        rest = db.query(Restaurant).filter(Restaurant.slug == slug).first()
+        if rest is None:
+            rest = Restaurant(name=slug, slug=slug, is_active=True)
+            db.add(rest)
+            db.flush()
+        user = RestaurantUser(restaurant_id=rest.id, name=f"{role_code}-{uuid.uuid4().hex[:6]}", pin_code=pin, role_code=role_code)
+        db.add(user)
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+
+
+def _login(client, slug, user_id, pin):
+    status, data = client.post("/v2/api/sessions/start", params={"restaurant": slug}, json_body={"user_id": user_id, "pin_code": pin})
+    assert status == 200
+    return {"X-Session-Id": str(data["session_id"])}
+
+
+def test_admin_routes_take_the_user_from_the_session(client):
+    owner_id = _user("deaca", "owner", "1111")
+    owner = _login(client, "deaca", owner_id, "1111")
+
+    assert client.get("/v2/api/audit", params=RESTAURANT, headers={"X-User-Id": str(owner_id)})[0] == 401
+    assert client.get("/v2/api/audit", params=RESTAURANT, headers=owner)[0] == 200
+    # sin slug el handler caería al restaurante default
+    assert client.get("/v2/api/audit", headers=owner)[0] == 400
+
+
+def test_admin_of_another_restaurant_is_rejected(client):
+    other_id = _user("otro", "admin", "2222")
+    other = _login(client, "otro", other_id, "2222")
+
+    assert client.get("/v2/api/audit", params={"restaurant": "otro"}, headers=other)[0] == 200
+    assert client.get("/v2/api/audit", params=RESTAURANT, headers=other)[0] == 403
+    assert client.get("/v2/api/exports", params=RESTAURANT, headers=other)[0] == 403
+    # los grants por rol son globales: no alcanza con admin.access
+    status, _ = client.post("/v2/api/roles/staff/permissions", params={"restaurant": "otro"}, json_body={"permissions": []}, headers=other)
+    assert status == 403
+
+
+def test_ended_session_is_rejected(client):
+    staff_id = _user("deaca", "staff", "3333")
+    staff = _login(client, "deaca", staff_id, "3333")
+    assert client.get(f"/v2/api/users/{staff_id}/permissions", params=RESTAURANT, headers=staff)[0] == 200
+
+    client.post(f"/v2/api/sessions/{staff['X-Session-Id']}/end", params=RESTAURANT)
+    assert client.get(f"/v2/api/users/{staff_id}/permissions", params=RESTAURANT, headers=staff)[0] == 401